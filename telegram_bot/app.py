@@ -1,49 +1,43 @@
-import logging
-import sqlite3
-
 import telebot
 from apscheduler.schedulers.background import BackgroundScheduler
-from decouple import Config, RepositoryEnv
 
+from database import init_database
+from metrics import instrument_bot
 from repository import *
+from settings import *
+from state_store import StateStore
+from user_cache import UserCache
 
 # ==============================
-# Настройка логирования
+# Объекты синхронного варианта бота
 # ==============================
-logging.basicConfig(
-        level=logging.INFO,  # Можно изменить на DEBUG для более подробного логирования
-        format='%(asctime)s %(levelname)s %(message)s',
-        handlers=[
-            logging.FileHandler("bot.log", encoding='utf-8'),
-            logging.StreamHandler()
-        ]
-    )
+# Настройки читаются в settings.py; здесь создаются бот, подключение к базе данных,
+# кэши и планировщик, общие для main.py, utilities.py и supervisor.py. Асинхронный
+# вариант (async_main.py) этот модуль не импортирует.
 
+setup_logging()
 
+if TELEGRAM_API_URL:
+    telebot.apihelper.API_URL = TELEGRAM_API_URL.rstrip('/') + "/bot{0}/{1}"
 
-# Доступ к переменным
-config = Config(RepositoryEnv(".env"))
-API_TOKEN = config("API_TOKEN") # Замените на токен вашего бота
-bot = telebot.TeleBot(API_TOKEN, parse_mode=None)  # parse_mode будет устанавливаться в каждом методе отдельно
+# В режиме webhook и в процессе-обработчике supervisor.py обработчики вызываются рабочими
+# потоками UpdateQueues (webhook.py), поэтому собственный пул потоков telebot не нужен
+bot = telebot.TeleBot(API_TOKEN, parse_mode=None,  # parse_mode будет устанавливаться в каждом методе отдельно
+                      threaded=BOT_MODE != BOT_MODE_WEBHOOK and WORKER_INDEX < 0)
+# Время и результат каждого вызова bot.send_message попадают в метрики (metrics.py)
+instrument_bot(bot)
 
-conn = sqlite3.connect('bot_database.db', check_same_thread=False)
-cursor = conn.cursor()
+init_database(DATABASE_PATH)
 
-init_tables(conn, cursor)
+init_tables()
 
-scheduler = BackgroundScheduler(timezone="Europe/Moscow")
-scheduler.start()
+# Кэш имён пользователей для сообщений и напоминаний (user_cache.py)
+user_cache = UserCache(select_users_fnu, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
 
-# ==============================
-# Хранение состояний пользователей
-# ==============================
-user_states = {}
-
-# Определение различных состояний
-STATE_MAIN_MENU = 'MAIN_MENU'
-STATE_CREATE_EVENT_SELECT_USER = 'CREATE_EVENT_SELECT_USER'
-STATE_CREATE_EVENT_DESCRIPTION = 'CREATE_EVENT_DESCRIPTION'
-STATE_CREATE_EVENT_DATETIME = 'CREATE_EVENT_DATETIME'
-STATE_ADD_CUSTOM_REMINDER = 'ADD_CUSTOM_REMINDER'
-STATE_EDIT_EVENT_DESCRIPTION = 'EDIT_EVENT_DESCRIPTION'
-STATE_EDIT_EVENT_DATETIME = 'EDIT_EVENT_DATETIME'
+# Планировщик запускается в main.py после восстановления задач из базы данных
+# Моменты срабатывания передаются задачам в UTC, поэтому от пояса планировщика ничего не зависит
+scheduler = BackgroundScheduler(timezone="UTC")
+
+# Незавершённые диалоги пользователей (state_store.py)
+user_states = StateStore(STATE_MAIN_MENU, ttl=USER_STATE_TTL_SECONDS, max_size=USER_STATE_MAX_SIZE,
+                         persist=PERSIST_USER_STATES)
@@ -0,0 +1,943 @@
+import asyncio
+import logging
+
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+import async_repository as db
+from async_outbound import AsyncOutboundQueue
+from callbacks import *
+from database import init_database
+from deliveries import MAX_DELIVERY_ATTEMPTS, DeliveryLedger
+from dispatcher import ReminderDispatcher
+from lease import Lease
+from metrics import MetricsServer, instrument_bot, observe_handler, set_queue_depth_function
+from outbound import PRIORITY_REMINDER
+from rendering import *
+from repository import DEFAULT_EVENT_DURATION_MINUTES, MAX_EVENT_PARTICIPANTS, init_tables, standard_reminder_times
+from settings import *
+from timezones import format_ts, is_valid_timezone, now_ts
+
+# ==============================
+# Асинхронный вариант бота
+# ==============================
+# Альтернативная точка входа: python async_main.py
+# Обработчики выполняются как задачи asyncio, запросы к Telegram не занимают поток,
+# а запросы к базе данных уходят в пул потоков async_repository. Напоминания
+# рассылает ReminderDispatcher, отправка выполняется в цикле событий. Объекты
+# синхронного варианта (app.py, utilities.py) здесь не создаются: общие настройки
+# берутся из settings.py, формирование сообщений — из rendering.py.
+
+if TELEGRAM_API_URL:
+    asyncio_helper.API_URL = TELEGRAM_API_URL.rstrip('/') + "/bot{0}/{1}"
+async_bot = instrument_bot(AsyncTeleBot(API_TOKEN, parse_mode=None))
+# Все исходящие сообщения проходят через асинхронную очередь с учётом лимитов Telegram
+async_outbound_queue = AsyncOutboundQueue(async_bot, global_rate=OUTBOUND_GLOBAL_RATE, chat_rate=OUTBOUND_CHAT_RATE)
+set_queue_depth_function('outbound', async_outbound_queue.depth)
+
+# Незавершённые диалоги пользователей (state_store.py)
+user_states = db.AsyncStateStore(STATE_MAIN_MENU, ttl=USER_STATE_TTL_SECONDS, max_size=USER_STATE_MAX_SIZE,
+                                 persist=PERSIST_USER_STATES)
+
+reminder_dispatcher_async = None
+reminder_lease_async = None
+delivery_ledger = None
+# Выполняющиеся рассылки напоминаний (concurrent.futures.Future задач цикла событий);
+# при потере аренды они отменяются, и неотправленные напоминания достаются новому владельцу
+reminder_tasks = set()
+
+
+async def send_error(chat_id, text, reply_markup=None):
+    """Отправляет сообщение об ошибке, не поднимая исключение при сбое отправки."""
+    try:
+        return await async_outbound_queue.send_message(chat_id, text, reply_markup=reply_markup, parse_mode="HTML")
+    except asyncio_helper.ApiException as api_e:
+        logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+
+
+async def user_search_prefix(user_id, screen_state):
+    """Возвращает поисковый запрос, введённый пользователем на экране screen_state, или None."""
+    return search_prefix(await user_states.get(user_id, {}), screen_state)
+
+
+async def get_user_timezone(user_id):
+    """Возвращает часовой пояс пользователя; при промахе кэша запрос уходит в пул потоков."""
+    profiles = await db.get_user_profiles([user_id])
+    return profile_timezone(profiles.get(user_id))
+
+
+# ==============================
+# Обработчики команд и сообщений
+# ==============================
+@async_bot.message_handler(commands=['start'])
+@observe_handler
+async def start(message):
+    try:
+        user_id = message.from_user.id
+        first_name = escape_html_text(message.from_user.first_name)
+        last_name = escape_html_text(message.from_user.last_name or "")
+        username = escape_html_text(message.from_user.username or "No Username")
+        telegram_profile = f"https://t.me/{username}" if message.from_user.username else "No Username"
+
+        logging.debug(f"/start: user_id = {user_id}")
+
+        # Проверка, зарегистрирован ли пользователь
+        if await db.select_user_data(user_id):
+            # Повторный /start обновляет профиль: имя или username в Telegram могли измениться
+            await db.update_user(user_id, first_name, last_name, username, telegram_profile)
+            db.user_cache.invalidate(user_id)
+            await async_outbound_queue.send_message(
+                user_id,
+                "✅ Вы уже зарегистрированы.",
+                reply_markup=main_menu_keyboard(),
+                parse_mode="HTML"
+            )
+            await user_states.set(user_id, {'state': STATE_MAIN_MENU})
+            logging.info(f"Пользователь {user_id} уже зарегистрирован.")
+            return
+
+        # Регистрация пользователя
+        await db.add_user(user_id, first_name, last_name, username, telegram_profile)
+        db.user_cache.invalidate(user_id)
+
+        await async_outbound_queue.send_message(
+            user_id,
+            f"👋 Привет, {first_name} {last_name}! Вы успешно зарегистрированы.",
+            reply_markup=main_menu_keyboard(),
+            parse_mode="HTML"
+        )
+        await user_states.set(user_id, {'state': STATE_MAIN_MENU})
+        logging.info(f"Пользователь {user_id} зарегистрирован.")
+    except Exception as e:
+        logging.error("Ошибка в /start: %s", e)
+        await send_error(message.chat.id, "❌ Произошла ошибка при регистрации. Пожалуйста, попробуйте позже.")
+
+
+@async_bot.message_handler(commands=['timezone'])
+@observe_handler
+async def set_timezone(message):
+    """Показывает часовой пояс пользователя или изменяет его: /timezone Europe/Berlin."""
+    user_id = message.from_user.id
+    try:
+        parts = message.text.split(maxsplit=1)
+        if len(parts) == 1:
+            await async_outbound_queue.send_message(
+                user_id,
+                f"🌍 Ваш часовой пояс: <b>{await get_user_timezone(user_id)}</b>.\n"
+                "Чтобы изменить его, отправьте /timezone и название пояса, например: /timezone Europe/Berlin",
+                parse_mode="HTML"
+            )
+            return
+
+        timezone_name = parts[1].strip()
+        if not is_valid_timezone(timezone_name):
+            await send_error(user_id, "❌ Неизвестный часовой пояс. Укажите название из базы IANA, "
+                                      "например Europe/Moscow или Asia/Yekaterinburg.")
+            return
+
+        await db.update_user_timezone(user_id, timezone_name)
+        db.user_cache.invalidate(user_id)
+        await async_outbound_queue.send_message(
+            user_id,
+            f"✅ Часовой пояс изменён на <b>{escape_html_text(timezone_name)}</b>.",
+            reply_markup=main_menu_keyboard(),
+            parse_mode="HTML"
+        )
+        logging.info(f"Пользователь {user_id} выбрал часовой пояс {timezone_name}.")
+    except Exception as e:
+        logging.error(f"Ошибка в /timezone для пользователя {user_id}: {e}")
+
+
+# Обработчики нажатий кнопок регистрируются по действию (см. callbacks.py)
+callback_router = CallbackRouter()
+
+
+@callback_router.route(ACTION_MAIN_MENU)
+async def handle_main_menu(call):
+    user_id = call.from_user.id
+    await async_outbound_queue.send_message(
+        user_id,
+        "🏠 Главное меню:",
+        reply_markup=main_menu_keyboard(),
+        parse_mode="HTML"
+    )
+    await user_states.set(user_id, {'state': STATE_MAIN_MENU})
+
+
+@callback_router.route(ACTION_CREATE_EVENT)
+async def handle_create_event(call):
+    await initiate_create_event(call.from_user.id)
+
+
+@callback_router.route(ACTION_SELECT_USER)
+async def handle_select_user(call, participant_id):
+    user_id = call.from_user.id
+    state = await user_states.get(user_id, {})
+    if state.get('state') != STATE_CREATE_EVENT_SELECT_USER:
+        # Кнопка со старой страницы выбора: начинаем выбор заново с этого участника
+        state = {}
+    # Нажатие отмечает участника или снимает отметку; страница показывается заново с отметками
+    participant_ids = selected_participants(state)
+    if participant_id in participant_ids:
+        participant_ids.remove(participant_id)
+    elif len(participant_ids) >= MAX_EVENT_PARTICIPANTS:
+        await async_outbound_queue.send_message(
+            user_id,
+            f"❌ У события может быть не больше {MAX_EVENT_PARTICIPANTS} участников.",
+            parse_mode="HTML"
+        )
+        return
+    else:
+        participant_ids.append(participant_id)
+    await initiate_create_event(user_id, state.get('page_cursor'), state.get('page_backward', False),
+                                prefix=state.get('search_prefix'), participant_ids=participant_ids)
+    logging.info(f"Пользователь {user_id} выбрал участников {participant_ids} для события.")
+
+
+@callback_router.route(ACTION_PARTICIPANTS_DONE)
+async def handle_participants_done(call):
+    user_id = call.from_user.id
+    participant_ids = selected_participants(await user_states.get(user_id, {}))
+    if not participant_ids:
+        await initiate_create_event(user_id)
+        return
+    # Переходим к вводу описания события
+    await user_states.set(user_id, {
+        'state': STATE_CREATE_EVENT_DESCRIPTION,
+        'participant_ids': participant_ids
+    })
+    await async_outbound_queue.send_message(
+        user_id,
+        "✍️ Введите описание события:",
+        reply_markup=back_to_main_menu_keyboard(),
+        parse_mode="HTML"
+    )
+    logging.info(f"Пользователь {user_id} завершил выбор участников события: {participant_ids}.")
+
+
+@callback_router.route(ACTION_PARTICIPANTS_PAGE_PREV)
+async def handle_participants_page_prev(call, user_id_cursor):
+    user_id = call.from_user.id
+    await initiate_create_event(user_id, user_id_cursor, backward=True,
+                                prefix=await user_search_prefix(user_id, STATE_CREATE_EVENT_SELECT_USER),
+                                participant_ids=selected_participants(await user_states.get(user_id, {})))
+
+
+@callback_router.route(ACTION_PARTICIPANTS_PAGE_NEXT)
+async def handle_participants_page_next(call, user_id_cursor):
+    user_id = call.from_user.id
+    await initiate_create_event(user_id, user_id_cursor,
+                                prefix=await user_search_prefix(user_id, STATE_CREATE_EVENT_SELECT_USER),
+                                participant_ids=selected_participants(await user_states.get(user_id, {})))
+
+
+@callback_router.route(ACTION_LIST_USERS)
+async def handle_list_users(call):
+    await list_users(call.from_user.id)
+
+
+@callback_router.route(ACTION_USERS_PAGE_PREV)
+async def handle_users_page_prev(call, user_id_cursor):
+    user_id = call.from_user.id
+    await list_users(user_id, user_id_cursor, backward=True,
+                     prefix=await user_search_prefix(user_id, STATE_USER_DIRECTORY))
+
+
+@callback_router.route(ACTION_USERS_PAGE_NEXT)
+async def handle_users_page_next(call, user_id_cursor):
+    user_id = call.from_user.id
+    await list_users(user_id, user_id_cursor, prefix=await user_search_prefix(user_id, STATE_USER_DIRECTORY))
+
+
+@callback_router.route(ACTION_MY_EVENTS)
+async def handle_my_events(call):
+    await show_my_events(call.from_user.id)
+
+
+@callback_router.route(ACTION_EVENTS_PAGE_PREV)
+async def handle_events_page_prev(call, starts_at, event_id):
+    await show_my_events(call.from_user.id, (starts_at, event_id), backward=True)
+
+
+@callback_router.route(ACTION_EVENTS_PAGE_NEXT)
+async def handle_events_page_next(call, starts_at, event_id):
+    await show_my_events(call.from_user.id, (starts_at, event_id))
+
+
+@callback_router.route(ACTION_EDIT_EVENT)
+async def handle_edit_event(call, event_id):
+    await initiate_edit_event(call.from_user.id, event_id)
+
+
+@callback_router.route(ACTION_DELETE_EVENT)
+async def handle_delete_event(call, event_id):
+    await initiate_delete_event(call.from_user.id, event_id)
+
+
+@callback_router.route(ACTION_CONFIRM_DELETE_EVENT)
+async def handle_confirm_delete_event(call, event_id):
+    await confirm_delete_event(call.from_user.id, event_id)
+
+
+@callback_router.route(ACTION_CONFIRM_DELETE_SERIES)
+async def handle_confirm_delete_series(call, event_id):
+    await confirm_delete_event(call.from_user.id, event_id, series=True)
+
+
+@callback_router.route(ACTION_CANCEL_DELETE_EVENT)
+async def handle_cancel_delete_event(call):
+    user_id = call.from_user.id
+    await async_outbound_queue.send_message(
+        user_id,
+        "❌ Удаление события отменено. Главное меню.",
+        reply_markup=main_menu_keyboard(),
+        parse_mode="HTML"
+    )
+    await user_states.set(user_id, {'state': STATE_MAIN_MENU})
+    logging.info(f"Пользователь {user_id} отменил удаление события.")
+
+
+@callback_router.route(ACTION_CUSTOM_REMINDER_YES)
+async def handle_custom_reminder_yes(call):
+    user_id = call.from_user.id
+    event_id = (await user_states.get(user_id, {})).get('event_id')
+    await user_states.set(user_id, {'state': STATE_ADD_CUSTOM_REMINDER, 'event_id': event_id})
+    await async_outbound_queue.send_message(
+        user_id,
+        "🕒 Введите количество минут до события, за которое вы хотите получить напоминание (1-60):",
+        reply_markup=back_to_main_menu_keyboard(),
+        parse_mode="HTML"
+    )
+    logging.info(f"Пользователь {user_id} выбрал добавить дополнительное напоминание.")
+
+
+@callback_router.route(ACTION_CUSTOM_REMINDER_NO)
+async def handle_custom_reminder_no(call):
+    user_id = call.from_user.id
+    await async_outbound_queue.send_message(
+        user_id,
+        "✅ Ваше событие успешно создано. Главное меню.",
+        reply_markup=main_menu_keyboard(),
+        parse_mode="HTML"
+    )
+    await user_states.set(user_id, {'state': STATE_MAIN_MENU})
+    logging.info(f"Пользователь {user_id} отказался от добавления дополнительного напоминания.")
+
+
+@async_bot.callback_query_handler(func=lambda call: True)
+async def callback_query_handler(call):
+    try:
+        logging.debug(f"callback_query: user_id = {call.from_user.id}, data = {call.data}")
+        handler_result = callback_router.dispatch(call)
+        if handler_result is not None:
+            await handler_result
+    except Exception as e:
+        logging.error("Ошибка в callback_query_handler: %s", e)
+        await send_error(call.message.chat.id, "❌ Произошла ошибка при обработке действия.",
+                         back_to_main_menu_keyboard())
+
+
+@async_bot.message_handler(content_types=['text'])
+async def text_handler(message):
+    """Передаёт текстовое сообщение обработчику шага, соответствующего состоянию пользователя."""
+    state = (await user_states.get(message.from_user.id, {})).get('state')
+    handler = TEXT_STEP_HANDLERS.get(state)
+    if handler:
+        await handler(message)
+
+
+async def initiate_create_event(user_id, cursor=None, backward=False, prefix=None, participant_ids=()):
+    """
+    Инициирует процесс создания нового события: показывает страницу выбора участников,
+    отмечая уже выбранных participant_ids.
+    """
+    try:
+        users = await db.select_users_page(USERS_PAGE_SIZE + 1, cursor, backward, prefix, exclude_user_id=user_id)
+        users, has_prev, has_next = split_page(users, cursor, backward, USERS_PAGE_SIZE)
+        if not users and prefix is None and cursor is None:
+            await async_outbound_queue.send_message(
+                user_id,
+                "❌ Нет доступных пользователей для выбора участника.",
+                reply_markup=back_to_main_menu_keyboard(),
+                parse_mode="HTML"
+            )
+            logging.info(f"Пользователь {user_id} попытался создать событие, но нет доступных участников.")
+            return
+
+        # Страница запоминается, чтобы после отметки участника показать её же
+        await user_states.set(user_id, {
+            'state': STATE_CREATE_EVENT_SELECT_USER,
+            'search_prefix': prefix,
+            'page_cursor': cursor,
+            'page_backward': backward,
+            'participant_ids': list(participant_ids)
+        })
+        db.user_cache.put_many(users)
+        if users and participant_ids:
+            response = (f"📋 Выбрано участников: {len(participant_ids)}. Отметьте ещё участников "
+                        f"или нажмите «Готово»:")
+        elif users:
+            response = "📋 Выберите участников для события или отправьте начало имени или @username для поиска:"
+        elif prefix is not None:
+            response = f"🔎 По запросу <b>{prefix}</b> никого не найдено. Отправьте другое начало имени или @username."
+        else:
+            response = "📭 Больше пользователей нет."
+        await async_outbound_queue.send_message(
+            user_id,
+            response,
+            reply_markup=participants_keyboard(users, has_prev, has_next, prefix, set(participant_ids)),
+            parse_mode="HTML"
+        )
+        logging.info(f"Пользователь {user_id} инициировал создание нового события.")
+    except Exception as e:
+        logging.error(f"Ошибка в initiate_create_event для пользователя {user_id}: {e}")
+        await send_error(user_id, "❌ Произошла ошибка при инициации создания события.", back_to_main_menu_keyboard())
+
+
+@observe_handler
+async def search_participants(message):
+    """Показывает участников, имя или username которых начинается с присланного текста."""
+    user_id = message.from_user.id
+    await initiate_create_event(user_id, prefix=normalize_user_search(message.text),
+                                participant_ids=selected_participants(await user_states.get(user_id, {})))
+
+
+async def list_users(user_id, cursor=None, backward=False, prefix=None):
+    """Отображает страницу списка зарегистрированных пользователей."""
+    try:
+        users = await db.select_users_page(USERS_PAGE_SIZE + 1, cursor, backward, prefix)
+        users, has_prev, has_next = split_page(users, cursor, backward, USERS_PAGE_SIZE)
+        if not users and prefix is None and cursor is None:
+            await async_outbound_queue.send_message(
+                user_id,
+                "❌ Нет зарегистрированных пользователей.",
+                reply_markup=back_to_main_menu_keyboard(),
+                parse_mode="HTML"
+            )
+            return
+
+        await user_states.set(user_id, {'state': STATE_USER_DIRECTORY, 'search_prefix': prefix})
+        db.user_cache.put_many(users)
+        response, markup = render_users_page(users, has_prev, has_next, prefix)
+        await async_outbound_queue.send_message(
+            user_id,
+            response,
+            reply_markup=markup,
+            parse_mode="HTML",
+            disable_web_page_preview=True
+        )
+        logging.info(f"Пользователю {user_id} показана страница из {len(users)} пользователей.")
+    except Exception as e:
+        logging.error(f"Ошибка в list_users для пользователя {user_id}: {e}")
+        await send_error(user_id, "❌ Произошла ошибка при получении списка пользователей.",
+                         back_to_main_menu_keyboard())
+
+
+@observe_handler
+async def search_users(message):
+    """Показывает пользователей, имя или username которых начинается с присланного текста."""
+    await list_users(message.from_user.id, prefix=normalize_user_search(message.text))
+
+
+async def show_my_events(user_id, cursor=None, backward=False):
+    """Отображает страницу событий, связанных с пользователем."""
+    try:
+        events = await db.select_events_page(user_id, EVENTS_PAGE_SIZE + 1, cursor, backward)
+        events, has_prev, has_next = split_page(events, cursor, backward, EVENTS_PAGE_SIZE)
+        if not events:
+            await async_outbound_queue.send_message(
+                user_id,
+                "📭 У вас нет запланированных событий." if cursor is None else "📭 Больше событий нет.",
+                reply_markup=back_to_main_menu_keyboard(),
+                parse_mode="HTML"
+            )
+            return
+
+        response, markup = render_events_page(user_id, events, has_prev, has_next, await get_user_timezone(user_id))
+        await async_outbound_queue.send_message(
+            user_id,
+            response,
+            reply_markup=markup,
+            parse_mode="HTML",
+            disable_web_page_preview=True
+        )
+        logging.info(f"Отправлен список событий пользователю {user_id}.")
+    except Exception as e:
+        logging.error(f"Ошибка в show_my_events для пользователя {user_id}: {e}")
+        await send_error(user_id, "❌ Произошла ошибка при просмотре событий.", back_to_main_menu_keyboard())
+
+
+async def check_event_creator(user_id, event_id):
+    """Возвращает (creator_id, участник, ...) события, если пользователь — его создатель, иначе None."""
+    result = await db.select_event_members(event_id)
+    if not result:
+        await async_outbound_queue.send_message(
+            user_id,
+            "❌ Событие не найдено.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
+        logging.warning(f"Пользователь {user_id} обратился к несуществующему событию {event_id}.")
+        return None
+    if result[0] != user_id:
+        await async_outbound_queue.send_message(
+            user_id,
+            "❌ Вы не являетесь создателем этого события.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
+        logging.warning(f"Пользователь {user_id} обратился к чужому событию {event_id}.")
+        return None
+    return result
+
+
+async def initiate_edit_event(user_id, event_id):
+    """Инициирует процесс редактирования события."""
+    try:
+        if not await check_event_creator(user_id, event_id):
+            return
+
+        await user_states.set(user_id, {
+            'state': STATE_EDIT_EVENT_DESCRIPTION,
+            'event_id': event_id
+        })
+        await async_outbound_queue.send_message(
+            user_id,
+            "✍️ Введите новое описание события:",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
+        logging.info(f"Пользователь {user_id} начал редактирование события {event_id}.")
+    except Exception as e:
+        logging.error(f"Ошибка в initiate_edit_event для пользователя {user_id}, события {event_id}: {e}")
+        await send_error(user_id, "❌ Произошла ошибка при инициации редактирования события.",
+                         back_to_main_menu_keyboard())
+
+
+async def initiate_delete_event(user_id, event_id):
+    """Инициирует процесс удаления события."""
+    try:
+        if not await check_event_creator(user_id, event_id):
+            return
+
+        await async_outbound_queue.send_message(
+            user_id,
+            f"🗑️ Вы уверены, что хотите удалить событие ID:{event_id}?",
+            reply_markup=delete_confirmation_keyboard(
+                event_id, series=await db.select_event_series_id(event_id) is not None),
+            parse_mode="HTML"
+        )
+        logging.info(f"Пользователь {user_id} инициировал удаление события {event_id}.")
+    except Exception as e:
+        logging.error(f"Ошибка в initiate_delete_event для пользователя {user_id}, события {event_id}: {e}")
+        await send_error(user_id, "❌ Произошла ошибка при инициации удаления события.",
+                         back_to_main_menu_keyboard())
+
+
+async def confirm_delete_event(user_id, event_id, series=False):
+    """Подтверждает удаление события, а при series=True — и всех последующих вхождений его серии."""
+    try:
+        result = await check_event_creator(user_id, event_id)
+        if not result:
+            return
+        creator_id, *participant_ids = result
+
+        # Напоминания рассылает диспетчер по данным из базы, отменять задачи не нужно
+        if series:
+            deleted = await db.delete_event_series(event_id)
+            logging.info(f"Серия события {event_id} ({len(deleted)} вхождений) удалена пользователем {user_id}.")
+        else:
+            await db.delete_event_with_reminders(event_id)
+            logging.info(f"Событие {event_id} успешно удалено пользователем {user_id}.")
+
+        notification_text = render_event_deleted_notification(event_id, series)
+        await async_outbound_queue.send_messages(
+            [(chat_id, notification_text) for chat_id in (*participant_ids, creator_id)],
+            parse_mode="HTML", disable_web_page_preview=True
+        )
+
+        await async_outbound_queue.send_message(
+            user_id,
+            "✅ Событие успешно удалено. Главное меню.",
+            reply_markup=main_menu_keyboard(),
+            parse_mode="HTML"
+        )
+        await user_states.set(user_id, {'state': STATE_MAIN_MENU})
+    except Exception as e:
+        logging.error(f"Ошибка в confirm_delete_event для пользователя {user_id}, события {event_id}: {e}")
+        await send_error(user_id, "❌ Произошла ошибка при удалении события.")
+
+
+# ==============================
+# Обработчики для ввода данных пользователем
+# ==============================
+
+@observe_handler
+async def get_event_description(message):
+    """Получает описание события от пользователя."""
+    user_id = message.from_user.id
+    description = escape_html_text(message.text.strip())
+    if not description:
+        await send_error(user_id, "❌ Описание не может быть пустым. Пожалуйста, введите описание события:",
+                         back_to_main_menu_keyboard())
+        return
+
+    await user_states.update(user_id, description=description, state=STATE_CREATE_EVENT_DATETIME)
+    await async_outbound_queue.send_message(
+        user_id,
+        "🕒 Введите дату и время события в формате DD.MM.YYYY HH:MM"
+        f" (через пробел можно указать длительность в минутах, по умолчанию {DEFAULT_EVENT_DURATION_MINUTES})."
+        f" {RECURRENCE_HINT}"
+        f" Часовой пояс: {await get_user_timezone(user_id)}, изменить — /timezone.",
+        reply_markup=back_to_main_menu_keyboard(),
+        parse_mode="HTML"
+    )
+    logging.info(f"Пользователь {user_id} ввёл описание события: {description}")
+
+
+@observe_handler
+async def get_event_datetime(message):
+    """Получает дату и время события от пользователя."""
+    user_id = message.from_user.id
+    state = await user_states.get(user_id, {})
+    datetime_text = message.text.strip()
+    timezone_name = await get_user_timezone(user_id)
+    try:
+        starts_at, duration_minutes, recurrence = parse_event_schedule(datetime_text, timezone_name)
+    except ValueError:
+        await send_error(user_id,
+                         "❌ Неверный формат даты и времени. Пожалуйста, введите в формате DD.MM.YYYY HH:MM [минуты] [повтор]:",
+                         back_to_main_menu_keyboard())
+        return
+
+    try:
+        if starts_at < now_ts():
+            await send_error(user_id, "❌ Введите дату и время начиная с сегодняшнего дня и текущего времени:",
+                             back_to_main_menu_keyboard())
+            return
+
+        participant_ids = selected_participants(state)
+        if not participant_ids:
+            logging.error(f"Нет участников для пользователя {user_id} при создании события.")
+            await send_error(user_id, "❌ Произошла ошибка при создании события. Пожалуйста, попробуйте снова.",
+                             back_to_main_menu_keyboard())
+            return
+
+        # Событие и стандартные напоминания (за 24 часа и за 2 часа) записываются одной транзакцией,
+        # для повторяющегося события — серия и её вхождения на ближайший горизонт
+        description = state.get('description', 'No Description')
+        if recurrence:
+            event_id = await db.create_event_series(user_id, participant_ids, description, starts_at,
+                                                    duration_minutes, timezone_name, recurrence, series_horizon())
+        else:
+            event_id = await db.create_event_with_reminders(user_id, participant_ids, description, starts_at,
+                                                            duration_minutes, standard_reminder_times(starts_at))
+        if event_id is None:
+            await send_error(user_id, "❌ Выбранное время занято. Пожалуйста, выберите другое время:",
+                             back_to_main_menu_keyboard())
+            return
+        logging.info(
+            f"Создано новое событие от пользователя {user_id}: ID={event_id}, Описание='{description}', Начало={starts_at}, Участники={participant_ids}")
+        await schedule_notifications_async(event_id)
+
+        await send_event_notifications(user_id, event_id, "📅 Новое событие создано:", "📅 Вы создали новое событие:")
+
+        await user_states.set(user_id, {'state': STATE_ADD_CUSTOM_REMINDER, 'event_id': event_id})
+        await async_outbound_queue.send_message(
+            user_id,
+            "🎯 Хотите добавить дополнительное напоминание за определённое количество минут до события?",
+            reply_markup=custom_reminder_keyboard(),
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logging.error(f"Ошибка в get_event_datetime для пользователя {user_id}: {e}")
+        await send_error(user_id, "❌ Произошла ошибка при обработке даты и времени.", back_to_main_menu_keyboard())
+
+
+@observe_handler
+async def edit_event_description(message):
+    """Редактирует описание события."""
+    user_id = message.from_user.id
+    new_description = escape_html_text(message.text.strip())
+    if not new_description:
+        await send_error(user_id, "❌ Описание не может быть пустым. Пожалуйста, введите новое описание события:",
+                         back_to_main_menu_keyboard())
+        return
+
+    await user_states.update(user_id, new_description=new_description, state=STATE_EDIT_EVENT_DATETIME)
+    await async_outbound_queue.send_message(
+        user_id,
+        "🕒 Введите новую дату и время события в формате DD.MM.YYYY HH:MM"
+        f" (через пробел можно указать длительность в минутах, по умолчанию {DEFAULT_EVENT_DURATION_MINUTES})."
+        f" Часовой пояс: {await get_user_timezone(user_id)}, изменить — /timezone.",
+        reply_markup=back_to_main_menu_keyboard(),
+        parse_mode="HTML"
+    )
+
+
+@observe_handler
+async def edit_event_datetime(message):
+    """Редактирует дату и время события."""
+    user_id = message.from_user.id
+    state = await user_states.get(user_id, {})
+    datetime_text = message.text.strip()
+    try:
+        new_starts_at, duration_minutes = parse_event_datetime(datetime_text, await get_user_timezone(user_id))
+    except ValueError:
+        await send_error(user_id,
+                         "❌ Неверный формат даты и времени. Пожалуйста, введите в формате DD.MM.YYYY HH:MM [минуты]:",
+                         back_to_main_menu_keyboard())
+        return
+
+    try:
+        if new_starts_at < now_ts():
+            await send_error(user_id, "❌ Введите дату и время начиная с сегодняшнего дня и текущего времени:",
+                             back_to_main_menu_keyboard())
+            return
+
+        event_id = state.get('event_id')
+        new_description = state.get('new_description')
+        members = await db.select_event_members(event_id) if event_id else None
+        if not members:
+            logging.error(f"Нет события для пользователя {user_id} при редактировании даты и времени.")
+            await user_states.set(user_id, {'state': STATE_MAIN_MENU})
+            await send_error(user_id, "❌ Произошла ошибка при редактировании события. Пожалуйста, попробуйте снова.",
+                             back_to_main_menu_keyboard())
+            return
+
+        # Событие и его новые стандартные напоминания записываются одной транзакцией
+        if not await db.update_event_with_reminders(members, new_description, new_starts_at, event_id,
+                                                    duration_minutes, standard_reminder_times(new_starts_at)):
+            await send_error(user_id, "❌ Выбранное время занято. Пожалуйста, выберите другое время:",
+                             back_to_main_menu_keyboard())
+            return
+        await schedule_notifications_async(event_id)
+        logging.info(f"Событие {event_id} обновлено пользователем {user_id}.")
+
+        await user_states.set(user_id, {'state': STATE_MAIN_MENU})
+        await send_event_notifications(user_id, event_id, "📅 Событие обновлено:", "📅 Вы обновили событие:")
+        await async_outbound_queue.send_message(
+            user_id,
+            "✅ Ваше событие успешно отредактировано. Главное меню.",
+            reply_markup=main_menu_keyboard(),
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        logging.error(f"Ошибка в edit_event_datetime для пользователя {user_id}: {e}")
+        await send_error(user_id, "❌ Произошла ошибка при редактировании даты и времени.",
+                         back_to_main_menu_keyboard())
+
+
+@observe_handler
+async def get_custom_reminder_time(message):
+    """Получает время для дополнительного напоминания от пользователя."""
+    user_id = message.from_user.id
+    minutes_text = message.text.strip()
+    try:
+        minutes = int(minutes_text)
+        if not (1 <= minutes <= 60):
+            raise ValueError("Минуты вне допустимого диапазона.")
+    except ValueError:
+        await send_error(user_id, "❌ Неверный ввод. Пожалуйста, введите целое число от 1 до 60:",
+                         back_to_main_menu_keyboard())
+        return
+
+    try:
+        # Напоминание относится к событию, созданному в этом диалоге (для серии — к первому повтору)
+        event_id = (await user_states.get(user_id, {})).get('event_id')
+        event = await db.get_event(event_id) if event_id else None
+        if not event:
+            await send_error(user_id, "❌ Не удалось найти созданное событие.", back_to_main_menu_keyboard())
+            return
+
+        starts_at = event.starts_at
+        remind_at = starts_at - minutes * 60
+        if remind_at < now_ts():
+            await send_error(user_id, "❌ Время напоминания уже прошло. Пожалуйста, выберите другое время.",
+                             back_to_main_menu_keyboard())
+            return
+
+        await db.create_reminders(event_id, remind_at)
+        await schedule_notifications_async(event_id)
+
+        timezone_name = await get_user_timezone(user_id)
+        await async_outbound_queue.send_message(
+            user_id,
+            f"✅ Событие создано на {format_ts(starts_at, timezone_name)}.\n"
+            f"Напоминание установлено за {minutes} минут до события на {format_ts(remind_at, timezone_name)}.",
+            reply_markup=main_menu_keyboard(),
+            parse_mode="HTML"
+        )
+        await user_states.set(user_id, {'state': STATE_MAIN_MENU})
+    except Exception as e:
+        logging.error(f"Ошибка в get_custom_reminder_time для пользователя {user_id}: {e}")
+        await send_error(user_id, "❌ Произошла ошибка при добавлении напоминания.", back_to_main_menu_keyboard())
+
+
+# Обработчик текстового ввода для каждого состояния диалога
+TEXT_STEP_HANDLERS = {
+    STATE_CREATE_EVENT_SELECT_USER: search_participants,
+    STATE_USER_DIRECTORY: search_users,
+    STATE_CREATE_EVENT_DESCRIPTION: get_event_description,
+    STATE_CREATE_EVENT_DATETIME: get_event_datetime,
+    STATE_ADD_CUSTOM_REMINDER: get_custom_reminder_time,
+    STATE_EDIT_EVENT_DESCRIPTION: edit_event_description,
+    STATE_EDIT_EVENT_DATETIME: edit_event_datetime,
+}
+
+
+# ==============================
+# Уведомления и напоминания
+# ==============================
+
+async def send_event_notifications(creator_id, event_id, participant_title, creator_title):
+    """Отправляет уведомления о создании или изменении события создателю и всем участникам одновременно."""
+    try:
+        event = await db.get_event(event_id)
+        if not event:
+            logging.error(f"Не удалось найти событие с ID {event_id}.")
+            return
+        participants = await db.get_participants([event_id])
+        participant_ids = participants.get(event_id, [event.participant_id])
+
+        profiles = await db.get_user_profiles([*participant_ids, creator_id])
+        messages = render_event_notifications(participant_title, creator_title, event.description, event.starts_at,
+                                              creator_id, participant_ids, profiles)
+        await async_outbound_queue.send_messages(messages, parse_mode="HTML", disable_web_page_preview=True)
+        logging.info(f"Отправлены уведомления о событии {event_id} создателю {creator_id} "
+                     f"и участникам {participant_ids}.")
+    except Exception as e:
+        logging.error(f"Ошибка при отправке уведомлений о событии {event_id}: {e}")
+
+
+async def schedule_notifications_async(event_id):
+    """Сообщает диспетчеру о будущих напоминаниях события."""
+    reminders = await db.get_reminders([event_id])
+    for reminder in reminders.get(event_id, []):
+        if reminder.remind_at > now_ts():
+            reminder_dispatcher_async.notify(reminder.remind_at)
+
+
+async def send_reminders_async(reminders, retry_pending=False):
+    """
+    Отправляет напоминания пачки DueReminder создателям и участникам, каждому во времени его
+    часового пояса. Как и send_reminders, отправляет только доставки, захваченные в журнале.
+    """
+    if not reminders:
+        return
+    if not reminder_lease_async.is_held():
+        # Аренда истекла во время выборки: напоминания разошлёт новый владелец
+        logging.warning(f"Аренда рассылки потеряна, {len(reminders)} напоминаний оставлены новому владельцу.")
+        return
+    try:
+        messages = render_reminder_messages(reminders)
+        now = now_ts()
+        claimed = await db.claim_reminder_deliveries([(reminder_id, chat_id) for reminder_id, chat_id, _ in messages],
+                                                     now, MAX_DELIVERY_ATTEMPTS,
+                                                     now - REMINDER_PENDING_RETRY_SECONDS if retry_pending else None)
+        messages = claimed_reminder_messages(messages, claimed)
+        # Напоминания уступают общий лимит ответам пользователям, как и в очереди outbound.py
+        results = await async_outbound_queue.send_messages([(chat_id, text) for _, chat_id, text in messages],
+                                                            PRIORITY_REMINDER, parse_mode="HTML",
+                                                            disable_web_page_preview=True)
+        failed = 0
+        for (reminder_id, chat_id, _), result in zip(messages, results):
+            sent = not isinstance(result, Exception)
+            delivery_ledger.record(reminder_id, chat_id, sent)
+            failed += not sent
+        logging.info(f"Отправлено {len(messages) - failed} из {len(messages)} сообщений по {len(reminders)} напоминаниям.")
+    except Exception as e:
+        logging.error(f"Ошибка при отправке {len(reminders)} напоминаний: {e}")
+
+
+async def catch_up_reminders_async(until, delay=0):
+    """
+    Асинхронный вариант catch_up_reminders: части интервала обрабатываются конкурентно.
+    Повторный проход (см. start_reminder_delivery в utilities.py) запускается с задержкой delay.
+    """
+    if REMINDER_CATCHUP_SECONDS <= 0:
+        return
+    await asyncio.sleep(delay)
+    since = until - REMINDER_CATCHUP_SECONDS
+    step = -(-REMINDER_CATCHUP_SECONDS // REMINDER_CATCHUP_WORKERS)
+
+    async def catch_up_window(start, end):
+        reminders = await db.select_due_reminders(start, end)
+        now = now_ts()
+        await send_reminders_async([r for r in reminders if r.starts_at > now], retry_pending=True)
+
+    try:
+        await asyncio.gather(*(catch_up_window(start, min(start + step, until)) for start in range(since, until, step)))
+    except Exception as e:
+        logging.error(f"Ошибка догоняющей рассылки напоминаний: {e}")
+
+
+async def expand_series_loop(lease):
+    """Пока процесс владеет арендой рассылки, создаёт вхождения повторяющихся событий до горизонта."""
+    while True:
+        if lease.is_held():
+            try:
+                event_ids = await db.expand_event_series(series_horizon())
+                for event_id in event_ids:
+                    await schedule_notifications_async(event_id)
+                if event_ids:
+                    logging.info(f"Создано {len(event_ids)} вхождений повторяющихся событий.")
+            except Exception as e:
+                logging.error(f"Ошибка при создании вхождений повторяющихся событий: {e}")
+        await asyncio.sleep(SERIES_EXPANSION_SECONDS)
+
+
+# ==============================
+# Основной цикл запуска бота
+# ==============================
+
+async def main():
+    global reminder_dispatcher_async, reminder_lease_async, delivery_ledger
+    loop = asyncio.get_running_loop()
+    delivery_ledger = DeliveryLedger()
+
+    def run_reminder_task(coroutine):
+        """Запускает рассылку в цикле событий из потока диспетчера или аренды."""
+        future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+        reminder_tasks.add(future)
+        future.add_done_callback(reminder_tasks.discard)
+
+    # Поток диспетчера только выбирает наступившие напоминания, отправка идёт в цикле событий
+    reminder_dispatcher_async = ReminderDispatcher(lambda reminders: run_reminder_task(send_reminders_async(reminders)))
+
+    def start_reminder_delivery_async():
+        now = now_ts()
+        reminder_dispatcher_async.start(now)
+        run_reminder_task(catch_up_reminders_async(now))
+        run_reminder_task(catch_up_reminders_async(now, delay=REMINDER_PENDING_RETRY_SECONDS))
+
+    def stop_reminder_delivery_async():
+        reminder_dispatcher_async.stop()
+        # Отменённая рассылка не записывает результатов: её доставки остаются незавершёнными
+        for future in list(reminder_tasks):
+            future.cancel()
+
+    # Диспетчер работает, пока у процесса есть аренда рассылки напоминаний (lease.py)
+    reminder_lease_async = Lease(REMINDER_LEASE_NAME, start_reminder_delivery_async, stop_reminder_delivery_async,
+                                 ttl=REMINDER_LEASE_TTL_SECONDS, renew_interval=REMINDER_LEASE_RENEW_SECONDS)
+    # Захват и освобождение аренды — запросы к базе данных, они не должны занимать цикл событий
+    await asyncio.to_thread(reminder_lease_async.start)
+    series_task = asyncio.create_task(expand_series_loop(reminder_lease_async))
+    if METRICS_PORT:
+        MetricsServer(METRICS_HOST, METRICS_PORT).start()
+    try:
+        logging.info("Асинхронный бот запущен и начал polling.")
+        await async_bot.infinity_polling(timeout=60)
+    finally:
+        series_task.cancel()
+        await asyncio.to_thread(reminder_lease_async.stop)
+        await asyncio.to_thread(delivery_ledger.close)
+        await async_bot.close_session()
+        db.shutdown()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    init_database(DATABASE_PATH)
+    init_tables()
+    asyncio.run(main())
@@ -0,0 +1,160 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from aiohttp import ClientConnectionError
+from telebot.asyncio_helper import ApiTelegramException, RequestTimeout
+
+from outbound import (GLOBAL_MESSAGES_PER_SECOND, CHAT_MESSAGES_PER_SECOND, CHAT_BURST, PRIORITY_INTERACTIVE,
+                      MAX_ATTEMPTS, RETRY_BACKOFF_SECONDS, BUCKET_PRUNE_INTERVAL, TokenBucket)
+
+# ==============================
+# Асинхронная очередь исходящих сообщений
+# ==============================
+# Вариант OutboundQueue для async_main.py: те же лимиты Telegram, вёдра токенов, приоритеты,
+# повтор после 429 и сетевых ошибок, но ожидание выполняется в цикле событий, а не в потоках.
+
+# Сколько запросов к Telegram может выполняться одновременно (аналог SENDER_THREADS)
+MAX_CONCURRENT_REQUESTS = 8
+# Сетевые ошибки и таймауты AsyncTeleBot, после которых отправку стоит повторить
+NETWORK_ERRORS = (RequestTimeout, ClientConnectionError, ConnectionError, TimeoutError)
+
+
+class AsyncOutboundQueue:
+    """
+    Отправляет сообщения AsyncTeleBot с учётом лимитов Telegram: общее ведро токенов на бота,
+    отдельное ведро на каждый чат и повтор после ответа 429 через retry_after.
+
+    В чат одновременно отправляется не более одного сообщения (сообщения чата ждут своей
+    очереди на блокировке в порядке вызова), поэтому порядок сообщений в чате сохраняется.
+    Общий токен выдаётся ожидающим сообщениям в порядке приоритета.
+    """
+
+    def __init__(self, bot, global_rate=GLOBAL_MESSAGES_PER_SECOND, chat_rate=CHAT_MESSAGES_PER_SECOND,
+                 chat_burst=CHAT_BURST, max_concurrent_requests=MAX_CONCURRENT_REQUESTS):
+        self._bot = bot
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        # Общее ведро не накапливает запас, как и в OutboundQueue
+        self._global = TokenBucket(global_rate, 1, time.monotonic())
+        self._buckets = {}
+        self._chats = {}  # chat_id -> [блокировка чата, число ожидающих и отправляемых сообщений]
+        self._waiters = []  # Куча (приоритет, порядковый номер, Future) ожидающих общий токен
+        self._seq = itertools.count()
+        self._dispatcher = None
+        self._requests = asyncio.Semaphore(max_concurrent_requests)
+        self._last_prune = time.monotonic()
+
+    async def send_message(self, chat_id, text, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Отправляет сообщение и возвращает сообщение Telegram (или поднимает исключение)."""
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = [asyncio.Lock(), 0]
+        chat[1] += 1
+        try:
+            async with chat[0]:
+                return await self._send(chat_id, text, priority, kwargs)
+        finally:
+            chat[1] -= 1
+            if not chat[1]:
+                del self._chats[chat_id]
+
+    async def send_messages(self, messages, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """
+        Отправляет пачку сообщений [(chat_id, text), ...] с общими параметрами и возвращает
+        список результатов в том же порядке; неотправленному сообщению соответствует исключение.
+        """
+        messages = list(messages)
+        results = await asyncio.gather(*(self.send_message(chat_id, text, priority, **kwargs)
+                                         for chat_id, text in messages), return_exceptions=True)
+        for (chat_id, _), result in zip(messages, results):
+            if isinstance(result, Exception):
+                logging.error(f"Не удалось отправить сообщение в чат {chat_id}: {result}")
+        return results
+
+    def depth(self):
+        """Возвращает количество сообщений, ожидающих или выполняющих отправку."""
+        return sum(count for _, count in self._chats.values())
+
+    async def _send(self, chat_id, text, priority, kwargs):
+        attempts = 0
+        while True:
+            await self._acquire(chat_id, priority)
+            try:
+                async with self._requests:
+                    return await self._bot.send_message(chat_id, text, **kwargs)
+            except Exception as error:
+                retry_after = self._retry_after(error)
+                if retry_after is not None:
+                    # Лимит превышен: чат блокируется на retry_after, попытка не засчитывается
+                    logging.warning(f"Telegram ограничил отправку в чат {chat_id} на {retry_after} с.")
+                    now = time.monotonic()
+                    self._bucket(chat_id, now).block(retry_after, now)
+                    continue
+                if not self._is_retryable(error) or attempts + 1 >= MAX_ATTEMPTS:
+                    if not isinstance(error, (ApiTelegramException, *NETWORK_ERRORS)):
+                        logging.error(f"Сообщение в чат {chat_id} не отправлено из-за ошибки: {error!r}",
+                                      exc_info=error)
+                    raise
+                attempts += 1
+                logging.warning(f"Повтор отправки в чат {chat_id} (попытка {attempts + 1}): {error}")
+                await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempts)
+
+    async def _acquire(self, chat_id, priority):
+        """Дожидается токена чата, затем общего токена в порядке приоритета."""
+        while True:
+            now = time.monotonic()
+            chat_wait = self._bucket(chat_id, now).wait_time(now)
+            if chat_wait == 0:
+                break
+            await asyncio.sleep(chat_wait)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+        self._bucket(chat_id, time.monotonic()).consume()
+
+    async def _dispatch(self):
+        """Выдаёт общие токены ожидающим сообщениям, пока очередь ожидания не опустеет."""
+        while self._waiters:
+            now = time.monotonic()
+            if now - self._last_prune > BUCKET_PRUNE_INTERVAL:
+                self._prune(now)
+            global_wait = self._global.wait_time(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._global.consume()
+                future.set_result(None)
+
+    def _bucket(self, chat_id, now):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst, now)
+        return bucket
+
+    def _prune(self, now):
+        """Удаляет вёдра неактивных чатов: полное ведро создастся заново при необходимости."""
+        self._last_prune = now
+        idle = [chat_id for chat_id, bucket in self._buckets.items()
+                if chat_id not in self._chats and bucket.wait_time(now) == 0 and bucket.tokens >= bucket.capacity]
+        for chat_id in idle:
+            del self._buckets[chat_id]
+
+    @staticmethod
+    def _retry_after(error):
+        if isinstance(error, ApiTelegramException) and error.error_code == 429:
+            return error.result_json.get('parameters', {}).get('retry_after', 1)
+        return None
+
+    @staticmethod
+    def _is_retryable(error):
+        if isinstance(error, ApiTelegramException):
+            return error.error_code >= 500
+        return isinstance(error, NETWORK_ERRORS)
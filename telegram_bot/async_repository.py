@@ -0,0 +1,195 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import repository
+from settings import USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS
+from state_store import StateStore, STATE_TTL_SECONDS, STATE_MAX_SIZE
+from user_cache import UserCache
+
+# ==============================
+# Асинхронные обёртки над repository.py
+# ==============================
+# sqlite3 не умеет работать асинхронно, поэтому запросы выполняются в отдельном пуле
+# потоков. Каждый поток пула получает собственное подключение в режиме WAL
+# (см. database.py), так что чтения выполняются параллельно с записью, а цикл событий
+# не блокируется ожиданием базы данных.
+
+# Количество потоков для запросов к базе данных
+DB_THREADS = 8
+
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+
+# Кэш имён пользователей асинхронного варианта бота; промахи догружает get_user_profiles
+user_cache = UserCache(repository.select_users_fnu, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+
+async def _run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown():
+    """Останавливает пул потоков базы данных."""
+    _executor.shutdown(wait=True)
+
+
+async def select_event_data(event_id):
+    return await _run(repository.select_event_data, event_id)
+
+async def select_reminder_time(event_id):
+    return await _run(repository.select_reminder_time, event_id)
+
+async def select_user_name(creator_id):
+    return await _run(repository.select_user_name, creator_id)
+
+async def select_user_data(user_id):
+    return await _run(repository.select_user_data, user_id)
+
+async def add_user(user_id, first_name, last_name, username, telegram_profile):
+    return await _run(repository.add_user, user_id, first_name, last_name, username, telegram_profile)
+
+async def select_user_by_id(user_id):
+    return await _run(repository.select_user_by_id, user_id)
+
+async def select_users():
+    return await _run(repository.select_users)
+
+async def get_event(event_id):
+    return await _run(repository.repo.get_event, event_id)
+
+async def get_reminders(event_ids):
+    return await _run(repository.repo.get_reminders, event_ids)
+
+async def select_users_page(limit, cursor=None, backward=False, prefix=None, exclude_user_id=None):
+    return await _run(repository.select_users_page, limit, cursor, backward, prefix, exclude_user_id)
+
+async def select_event_by_user(user_id):
+    return await _run(repository.select_event_by_user, user_id)
+
+async def select_fnu(_id):
+    return await _run(repository.select_fnu, _id)
+
+async def get_creator_from_event(event_id):
+    return await _run(repository.get_creator_from_event, event_id)
+
+async def select_creator_participant(event_id):
+    return await _run(repository.select_creator_participant, event_id)
+
+async def select_event_members(event_id):
+    return await _run(repository.select_event_members, event_id)
+
+async def get_participants(event_ids):
+    return await _run(repository.repo.get_participants, event_ids)
+
+async def delete_reminders(event_id):
+    return await _run(repository.delete_reminders, event_id)
+
+async def delete_event(event_id):
+    return await _run(repository.delete_event, event_id)
+
+async def create_event(user_id, participant_ids, description, starts_at,
+                       duration_minutes=repository.DEFAULT_EVENT_DURATION_MINUTES):
+    return await _run(repository.create_event, user_id, participant_ids, description, starts_at,
+                      duration_minutes)
+
+async def create_reminders(event_id, remind_at):
+    return await _run(repository.create_reminders, event_id, remind_at)
+
+async def get_event_data(event_id):
+    return await _run(repository.get_event_data, event_id)
+
+async def select_conflicting_event(user_ids, starts_at, duration_minutes, exclude_event_id=None):
+    return await _run(repository.select_conflicting_event, user_ids, starts_at, duration_minutes,
+                      exclude_event_id)
+
+async def update_event(new_description, new_starts_at, event_id,
+                       duration_minutes=repository.DEFAULT_EVENT_DURATION_MINUTES):
+    return await _run(repository.update_event, new_description, new_starts_at, event_id, duration_minutes)
+
+async def select_events_page(user_id, limit, cursor=None, backward=False):
+    return await _run(repository.select_events_page, user_id, limit, cursor, backward)
+
+async def select_next_reminder_time(after):
+    return await _run(repository.select_next_reminder_time, after)
+
+async def select_due_reminders(after, until):
+    return await _run(repository.select_due_reminders, after, until)
+
+async def claim_reminder_deliveries(pairs, now, max_attempts, pending_before=None):
+    return await _run(repository.claim_reminder_deliveries, pairs, now, max_attempts, pending_before)
+
+async def select_users_fnu(user_ids):
+    return await _run(repository.select_users_fnu, user_ids)
+
+async def update_user(user_id, first_name, last_name, username, telegram_profile):
+    return await _run(repository.update_user, user_id, first_name, last_name, username, telegram_profile)
+
+async def update_user_timezone(user_id, timezone_name):
+    return await _run(repository.update_user_timezone, user_id, timezone_name)
+
+async def get_user_profiles(user_ids):
+    """Возвращает данные пользователей из кэша; в пул потоков уходит только запрос на промахи."""
+    found, missing = user_cache.lookup(user_ids)
+    if missing:
+        rows = await select_users_fnu(missing)
+        user_cache.put_many(rows)
+        for user_id, *profile in rows:
+            found[user_id] = tuple(profile)
+    return found
+
+async def create_event_with_reminders(user_id, participant_ids, description, starts_at, duration_minutes,
+                                      remind_ats):
+    return await _run(repository.create_event_with_reminders, user_id, participant_ids, description, starts_at,
+                      duration_minutes, remind_ats)
+
+async def update_event_with_reminders(members, new_description, new_starts_at, event_id, duration_minutes,
+                                      remind_ats):
+    return await _run(repository.update_event_with_reminders, members, new_description, new_starts_at,
+                      event_id, duration_minutes, remind_ats)
+
+async def delete_event_with_reminders(event_id):
+    return await _run(repository.delete_event_with_reminders, event_id)
+
+async def create_event_series(user_id, participant_ids, description, starts_at, duration_minutes, timezone,
+                              recurrence, horizon):
+    return await _run(repository.create_event_series, user_id, participant_ids, description, starts_at,
+                      duration_minutes, timezone, recurrence, horizon)
+
+async def expand_event_series(horizon):
+    return await _run(repository.expand_event_series, horizon)
+
+async def select_event_series_id(event_id):
+    return await _run(repository.select_event_series_id, event_id)
+
+async def delete_event_series(event_id):
+    return await _run(repository.delete_event_series, event_id)
+
+
+class AsyncStateStore:
+    """
+    Состояния диалогов (StateStore) для цикла событий. При persist=True чтение и запись
+    состояния обращаются к базе данных, поэтому выполняются в пуле потоков; без persist
+    состояния хранятся только в памяти и читаются сразу.
+    """
+
+    def __init__(self, idle_state, ttl=STATE_TTL_SECONDS, max_size=STATE_MAX_SIZE, persist=False):
+        self._store = StateStore(idle_state, ttl=ttl, max_size=max_size, persist=persist)
+        self._persist = persist
+
+    async def _call(self, method, *args, **kwargs):
+        if self._persist:
+            return await _run(method, *args, **kwargs)
+        return method(*args, **kwargs)
+
+    async def get(self, user_id, default=None):
+        return await self._call(self._store.get, user_id, default)
+
+    async def set(self, user_id, state):
+        return await self._call(self._store.set, user_id, state)
+
+    async def update(self, user_id, **fields):
+        return await self._call(self._store.update, user_id, **fields)
+
+    async def clear(self, user_id):
+        return await self._call(self._store.clear, user_id)
@@ -0,0 +1,183 @@
+import logging
+from datetime import datetime, timedelta
+
+from metrics import timed_handler_call
+
+# ==============================
+# Кодирование callback_data и маршрутизация нажатий кнопок
+# ==============================
+# Формат: "<версия><код действия>[:<аргумент>...]", например "1e:5" — редактировать событие 5.
+# Целые числа (в том числе моменты времени в секундах UTC) записываются в base36, дата и время —
+# числом секунд от 1970-01-01 в base36, поэтому даже кнопка страницы с курсором (время, ID)
+# занимает около 15 байт из 64 допустимых.
+# При несовместимом изменении формата увеличивается CALLBACK_VERSION.
+
+CALLBACK_VERSION = '1'
+ARG_SEPARATOR = ':'
+# Ограничение Telegram на длину callback_data
+MAX_CALLBACK_DATA_BYTES = 64
+
+_EPOCH = datetime(1970, 1, 1)
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def _encode_int(value):
+    if value < 0:
+        return '-' + _encode_int(-value)
+    encoded = ''
+    while True:
+        value, digit = divmod(value, 36)
+        encoded = _DIGITS[digit] + encoded
+        if not value:
+            return encoded
+
+
+def _decode_int(text):
+    return int(text, 36)
+
+
+def _encode_str(value):
+    if ARG_SEPARATOR in value:
+        raise ValueError(f"Строковый аргумент callback_data не может содержать '{ARG_SEPARATOR}': {value!r}")
+    return value
+
+
+def _encode_datetime(value):
+    # Точность — секунда: время событий вводится с точностью до минуты
+    return _encode_int(int((value - _EPOCH).total_seconds()))
+
+
+def _decode_datetime(text):
+    return _EPOCH + timedelta(seconds=_decode_int(text))
+
+
+# Тип аргумента -> (кодирование, декодирование, разбор из старого формата "action_arg1_arg2")
+ARG_TYPES = {
+    int: (_encode_int, _decode_int, int),
+    str: (_encode_str, str, str),
+    datetime: (_encode_datetime, _decode_datetime, datetime.fromisoformat),
+}
+
+
+class CallbackAction:
+    """Действие кнопки: имя (оно же префикс старого формата), короткий код и типы аргументов."""
+
+    __slots__ = ('name', 'code', 'arg_types')
+
+    def __init__(self, name, code, arg_types):
+        self.name = name
+        self.code = code
+        self.arg_types = arg_types
+
+    def __repr__(self):
+        return f"CallbackAction({self.name!r})"
+
+
+ACTIONS = {}  # Код -> действие
+_ACTIONS_BY_NAME = {}
+_LEGACY_ARG_COUNTS = set()
+
+
+def callback_action(name, code, *arg_types):
+    """Регистрирует действие кнопки; коды и имена действий должны быть уникальны."""
+    if code in ACTIONS or name in _ACTIONS_BY_NAME:
+        raise ValueError(f"Действие {name} ({code}) уже зарегистрировано")
+    if ARG_SEPARATOR in code:
+        raise ValueError(f"Код действия не может содержать '{ARG_SEPARATOR}': {code!r}")
+    for arg_type in arg_types:
+        if arg_type not in ARG_TYPES:
+            raise ValueError(f"Неподдерживаемый тип аргумента {arg_type} в действии {name}")
+    action = CallbackAction(name, code, arg_types)
+    ACTIONS[code] = _ACTIONS_BY_NAME[name] = action
+    _LEGACY_ARG_COUNTS.add(len(arg_types))
+    return action
+
+
+# Действия бота
+ACTION_MAIN_MENU = callback_action('main_menu', 'm')
+ACTION_CREATE_EVENT = callback_action('create_event', 'c')
+ACTION_SELECT_USER = callback_action('select_user', 'u', int)
+ACTION_PARTICIPANTS_DONE = callback_action('participants_done', 'ud')
+ACTION_LIST_USERS = callback_action('list_users', 'l')
+ACTION_USERS_PAGE_PREV = callback_action('users_page_prev', 'up', int)
+ACTION_USERS_PAGE_NEXT = callback_action('users_page_next', 'un', int)
+ACTION_PARTICIPANTS_PAGE_PREV = callback_action('participants_page_prev', 'sp', int)
+ACTION_PARTICIPANTS_PAGE_NEXT = callback_action('participants_page_next', 'sn', int)
+ACTION_MY_EVENTS = callback_action('my_events', 'v')
+ACTION_EVENTS_PAGE_PREV = callback_action('events_page_prev', 'p', int, int)
+ACTION_EVENTS_PAGE_NEXT = callback_action('events_page_next', 'n', int, int)
+ACTION_EDIT_EVENT = callback_action('edit_event', 'e', int)
+ACTION_DELETE_EVENT = callback_action('delete_event', 'd', int)
+ACTION_CONFIRM_DELETE_EVENT = callback_action('confirm_delete_event', 'D', int)
+ACTION_CANCEL_DELETE_EVENT = callback_action('cancel_delete_event', 'x')
+ACTION_CONFIRM_DELETE_SERIES = callback_action('confirm_delete_series', 'DS', int)
+ACTION_CUSTOM_REMINDER_YES = callback_action('add_custom_reminder_yes', 'ry')
+ACTION_CUSTOM_REMINDER_NO = callback_action('add_custom_reminder_no', 'rn')
+
+
+def encode_callback(action, *args):
+    """Кодирует действие и его аргументы в строку callback_data."""
+    if len(args) != len(action.arg_types):
+        raise ValueError(f"Действие {action.name} ожидает {len(action.arg_types)} аргументов, получено {len(args)}")
+    parts = [CALLBACK_VERSION + action.code]
+    parts.extend(ARG_TYPES[arg_type][0](arg) for arg_type, arg in zip(action.arg_types, args))
+    data = ARG_SEPARATOR.join(parts)
+    if len(data.encode('utf-8')) > MAX_CALLBACK_DATA_BYTES:
+        raise ValueError(f"callback_data длиннее {MAX_CALLBACK_DATA_BYTES} байт: {data!r}")
+    return data
+
+
+def decode_callback(data):
+    """Возвращает (действие, кортеж аргументов) по callback_data; ValueError, если строка не распознана."""
+    if data.startswith(CALLBACK_VERSION):
+        code, *raw_args = data[len(CALLBACK_VERSION):].split(ARG_SEPARATOR)
+        action = ACTIONS.get(code)
+        if action is None or len(raw_args) != len(action.arg_types):
+            raise ValueError(f"Неизвестный callback_data: {data!r}")
+        return action, tuple(ARG_TYPES[t][1](arg) for t, arg in zip(action.arg_types, raw_args))
+    return _decode_legacy(data)
+
+
+def _decode_legacy(data):
+    """Разбирает callback_data старого формата "action_arg1_arg2" (кнопки в ранее отправленных сообщениях)."""
+    for arg_count in sorted(_LEGACY_ARG_COUNTS):
+        parts = data.rsplit('_', arg_count) if arg_count else [data]
+        action = _ACTIONS_BY_NAME.get(parts[0])
+        if action is None or len(action.arg_types) != arg_count or len(parts) != arg_count + 1:
+            continue
+        return action, tuple(ARG_TYPES[t][2](arg) for t, arg in zip(action.arg_types, parts[1:]))
+    raise ValueError(f"Неизвестный callback_data: {data!r}")
+
+
+class CallbackRouter:
+    """
+    Сопоставляет действиям кнопок их обработчики. Обработчик вызывается как
+    handler(call, *args) с уже декодированными аргументами; поиск — по словарю, поэтому
+    время выбора обработчика не зависит от количества действий. Время работы обработчика
+    записывается в метрики под его именем.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+
+    def route(self, action):
+        """Декоратор, регистрирующий обработчик действия."""
+        def decorator(handler):
+            if action.code in self._handlers:
+                raise ValueError(f"Обработчик действия {action.name} уже зарегистрирован")
+            self._handlers[action.code] = handler
+            return handler
+        return decorator
+
+    def dispatch(self, call):
+        """Вызывает обработчик нажатой кнопки и возвращает его результат (None для неизвестных кнопок)."""
+        try:
+            action, args = decode_callback(call.data)
+        except ValueError as e:
+            logging.warning(str(e))
+            return None
+        handler = self._handlers.get(action.code)
+        if handler is None:
+            logging.warning(f"Нет обработчика для действия {action.name}")
+            return None
+        return timed_handler_call(handler.__name__, handler, call, *args)
@@ -0,0 +1,116 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from timezones import iso_local_to_ts
+
+# ==============================
+# Управление подключениями к базе данных
+# ==============================
+
+# Настройки, применяемые к каждому новому подключению
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",  # Чтения не блокируются записью
+    "PRAGMA synchronous=NORMAL",  # В режиме WAL это безопасно и заметно быстрее FULL
+    "PRAGMA busy_timeout=5000",  # Ждём освобождения блокировки вместо "database is locked"
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",  # ~16 МБ страничного кэша на подключение
+    "PRAGMA mmap_size=134217728",
+)
+
+
+def _casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+# Функции Python, доступные в SQL каждого подключения: (имя, число аргументов, функция).
+# Встроенная lower() SQLite меняет регистр только латиницы, а поиск пользователей идёт и по кириллице.
+SQL_FUNCTIONS = (
+    ("casefold", 1, _casefold),
+    ("iso_local_to_ts", 2, iso_local_to_ts),
+)
+
+
+class ConnectionManager:
+    """Выдаёт каждому потоку собственное подключение к базе данных в режиме WAL."""
+
+    def __init__(self, path, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connection(self):
+        """Возвращает подключение текущего потока, создавая его при первом обращении."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # check_same_thread=False нужен только для close_all из другого потока:
+            # само подключение используется исключительно потоком-владельцем.
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            for name, arg_count, function in SQL_FUNCTIONS:
+                conn.create_function(name, arg_count, function, deterministic=True)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close_all(self):
+        """Закрывает все выданные подключения."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+_manager = None
+
+
+def init_database(path):
+    """Инициализирует менеджер подключений для указанного файла базы данных."""
+    global _manager
+    if _manager is not None:
+        _manager.close_all()
+    _manager = ConnectionManager(path)
+    return _manager
+
+
+def get_connection():
+    """Возвращает подключение к базе данных для текущего потока."""
+    if _manager is None:
+        raise RuntimeError("База данных не инициализирована: вызовите init_database().")
+    return _manager.connection()
+
+
+def in_transaction():
+    """Возвращает True, если текущий поток выполняет блок transaction()."""
+    return _manager is not None and getattr(_manager._local, 'depth', 0) > 0
+
+
+@contextmanager
+def transaction():
+    """
+    Единица работы: все изменения внутри блока фиксируются одним коммитом или целиком
+    откатываются при исключении. Блок начинается с BEGIN IMMEDIATE, поэтому проверки,
+    выполненные внутри него, остаются верными до коммита. Вложенные блоки становятся
+    частью внешнего.
+    """
+    conn = get_connection()
+    local = _manager._local
+    depth = getattr(local, 'depth', 0)
+    if depth == 0:
+        conn.execute("BEGIN IMMEDIATE")
+    local.depth = depth + 1
+    try:
+        yield conn
+    except BaseException:
+        local.depth = depth
+        if depth == 0:
+            conn.rollback()
+        raise
+    local.depth = depth
+    if depth == 0:
+        conn.commit()
@@ -0,0 +1,110 @@
+import logging
+import threading
+
+from lease import LEASE_TTL_SECONDS
+from repository import claim_reminder_deliveries, delete_old_reminder_deliveries, update_reminder_deliveries
+from timezones import now_ts
+
+# ==============================
+# Журнал доставки напоминаний
+# ==============================
+# Каждое сообщение напоминания получателю — строка (reminder_id, user_id) в таблице
+# reminder_deliveries. Перед отправкой строка захватывается (pending), после ответа Telegram
+# получает статус sent или failed. Доставленные напоминания не отправляются повторно, даже
+# если их срок попал в выборку ещё раз: после смены владельца аренды, перезапуска или при
+# догоняющей рассылке (catch_up_reminders в utilities.py).
+
+DELIVERY_PENDING = 'pending'
+DELIVERY_SENT = 'sent'
+DELIVERY_FAILED = 'failed'
+
+# Сколько раз пытаться доставить напоминание получателю
+MAX_DELIVERY_ATTEMPTS = 3
+# Как часто результаты доставок записываются в базу данных одной пачкой
+FLUSH_INTERVAL_SECONDS = 1
+# Сколько секунд может завершаться отправка, начатая прежним владельцем аренды до её потери
+# (запрос к Telegram с повторами после сетевых ошибок)
+SEND_DRAIN_SECONDS = 60
+# Через сколько секунд после захвата незавершённая доставка считается брошенной и повторяется
+# догоняющей рассылкой: за это время аренда прежнего отправителя истекает, а его отправки завершаются
+PENDING_RETRY_SECONDS = LEASE_TTL_SECONDS + SEND_DRAIN_SECONDS
+# Сколько хранятся записи о доставках и как часто удаляются устаревшие
+DELIVERY_RETENTION_SECONDS = 7 * 24 * 3600
+PURGE_INTERVAL_SECONDS = 3600
+
+
+class DeliveryLedger:
+    """
+    Захватывает доставки перед отправкой и записывает их результаты.
+
+    Результаты приходят из потоков отправки по одному; они накапливаются в памяти
+    и записываются фоновым потоком одним executemany раз в FLUSH_INTERVAL_SECONDS,
+    чтобы рассылка тысяч напоминаний не занимала базу тысячами транзакций.
+    Доставка, результат которой не успел записаться (процесс упал или аренда перешла
+    к другой реплике до отправки), остаётся pending и повторяется догоняющей рассылкой
+    не раньше чем через pending_retry секунд после захвата.
+    """
+
+    def __init__(self, max_attempts=MAX_DELIVERY_ATTEMPTS, flush_interval=FLUSH_INTERVAL_SECONDS,
+                 pending_retry=PENDING_RETRY_SECONDS):
+        self._max_attempts = max_attempts
+        self._flush_interval = flush_interval
+        self.pending_retry = pending_retry
+        self._results = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._last_purge = 0
+        self._thread = threading.Thread(target=self._run, name="delivery-ledger", daemon=True)
+        self._thread.start()
+
+    def claim(self, pairs, retry_pending=False):
+        """
+        Захватывает доставки [(reminder_id, user_id), ...] и возвращает множество тех,
+        которые нужно отправить. retry_pending повторяет и незавершённые доставки, захваченные
+        раньше чем pending_retry секунд назад, — только для догоняющей рассылки: их прежний
+        отправитель к этому времени заведомо остановлен.
+        """
+        now = now_ts()
+        pending_before = now - self.pending_retry if retry_pending else None
+        return set(claim_reminder_deliveries(pairs, now, self._max_attempts, pending_before))
+
+    def record(self, reminder_id, user_id, sent):
+        """Запоминает результат доставки; в базу он записывается фоновым потоком."""
+        now = now_ts()
+        status = DELIVERY_SENT if sent else DELIVERY_FAILED
+        with self._lock:
+            self._results.append((status, now if sent else None, now, reminder_id, user_id))
+
+    def close(self):
+        """Останавливает фоновый поток, записав накопленные результаты."""
+        self._stopping.set()
+        self._thread.join()
+        self._flush()
+
+    def _run(self):
+        while not self._stopping.wait(self._flush_interval):
+            self._flush()
+            if now_ts() - self._last_purge >= PURGE_INTERVAL_SECONDS:
+                self._purge()
+
+    def _flush(self):
+        with self._lock:
+            results, self._results = self._results, []
+        if not results:
+            return
+        try:
+            update_reminder_deliveries(results)
+        except Exception as e:
+            logging.error(f"Ошибка при записи {len(results)} результатов доставки напоминаний: {e}")
+            with self._lock:
+                self._results[:0] = results
+
+    def _purge(self):
+        self._last_purge = now_ts()
+        try:
+            deleted = delete_old_reminder_deliveries(self._last_purge - DELIVERY_RETENTION_SECONDS)
+        except Exception as e:
+            logging.error(f"Ошибка при удалении старых записей о доставке напоминаний: {e}")
+            return
+        if deleted:
+            logging.info(f"Удалено {deleted} старых записей о доставке напоминаний.")
@@ -0,0 +1,126 @@
+import heapq
+import logging
+import threading
+from datetime import datetime, timezone
+
+from metrics import observe_reminder_lateness
+from repository import select_due_reminders, select_next_reminder_time
+from timezones import now_ts
+
+# ==============================
+# Диспетчер напоминаний
+# ==============================
+
+# Максимальное время сна диспетчера. Страховка на случай напоминаний,
+# записанных в базу в обход notify() (например, другим процессом).
+MAX_IDLE_SECONDS = 60
+# Пауза перед повторной попыткой, если выборка напоминаний из базы не удалась
+RETRY_DELAY_SECONDS = 5
+
+
+def _format_utc(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+class ReminderDispatcher:
+    """
+    Рассылает напоминания из таблицы reminders одним фоновым потоком.
+
+    В памяти хранится только куча ближайших сроков срабатывания, а не задача на каждое
+    напоминание. При пробуждении все напоминания, срок которых наступил с прошлого прохода,
+    выбираются одним запросом по индексу remind_at вместе с событиями и пользователями
+    и передаются send_reminders(список DueReminder) одной пачкой.
+    Сроки — секунды UTC, поэтому часовой пояс сервера на срабатывание не влияет.
+    Удалённые и изменённые напоминания не требуют отмены: они просто не попадут в выборку.
+    """
+
+    def __init__(self, send_reminders, shard=None):
+        self._send_reminders = send_reminders
+        # Часть напоминаний (номер, количество частей) для процесса-обработчика supervisor.py
+        self._shard = shard
+        self._heap = []
+        self._condition = threading.Condition()
+        self._watermark = None  # Все напоминания не позже этого момента уже обработаны
+        self._running = False
+        self._thread = None
+
+    def start(self, since=None):
+        """
+        Запускает поток диспетчера. Напоминания со сроком позже since (секунды UTC) ещё будут
+        отправлены; без since пропускаются все, срок которых уже прошёл.
+        """
+        with self._condition:
+            self._watermark = int(since) if since is not None else now_ts()
+            self._running = True
+            self._load_next()
+        self._thread = threading.Thread(target=self._run, name="reminder-dispatcher", daemon=True)
+        self._thread.start()
+        logging.info("Диспетчер напоминаний запущен.")
+
+    def stop(self):
+        """Останавливает поток диспетчера."""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+
+    def notify(self, remind_at):
+        """Сообщает диспетчеру о новом напоминании (срок в секундах UTC), чтобы он проснулся к его сроку."""
+        with self._condition:
+            if self._watermark is not None and remind_at <= self._watermark:
+                return
+            heapq.heappush(self._heap, remind_at)
+            if self._heap[0] == remind_at:
+                self._condition.notify()
+
+    def _load_next(self):
+        """Добавляет в кучу срок ближайшего ещё не обработанного напоминания из базы данных."""
+        next_time = select_next_reminder_time(self._watermark, shard=self._shard)
+        if next_time is not None:
+            if not self._heap or next_time < self._heap[0]:
+                heapq.heappush(self._heap, next_time)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._running:
+                    return
+                now = now_ts()
+                if not self._heap or self._heap[0] > now:
+                    if self._heap:
+                        timeout = min(self._heap[0] - now, MAX_IDLE_SECONDS)
+                    else:
+                        timeout = MAX_IDLE_SECONDS
+                    if not self._condition.wait(timeout):
+                        self._load_next()
+                    continue
+                window_start, window_end = self._watermark, now
+                while self._heap and self._heap[0] <= window_end:
+                    heapq.heappop(self._heap)
+
+            if not self._dispatch(window_start, window_end):
+                # Окно не обработано: повторяем его с той же нижней границы чуть позже
+                with self._condition:
+                    heapq.heappush(self._heap, window_end)
+                    self._condition.wait(RETRY_DELAY_SECONDS)
+                continue
+
+            with self._condition:
+                self._watermark = window_end
+                self._load_next()
+
+    def _dispatch(self, window_start, window_end):
+        """Отправляет все напоминания со сроком в интервале (window_start, window_end]; False при ошибке выборки."""
+        try:
+            reminders = select_due_reminders(window_start, window_end, shard=self._shard)
+        except Exception as e:
+            logging.error(f"Ошибка при выборке напоминаний за {_format_utc(window_start)}–{_format_utc(window_end)}: {e}")
+            return False
+        if not reminders:
+            return True
+        self._send_reminders(reminders)
+        for reminder in reminders:
+            observe_reminder_lateness(reminder.remind_at)
+        logging.info(f"Диспетчер отправил {len(reminders)} напоминаний за один проход.")
+        return True
@@ -0,0 +1,198 @@
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# ==============================
+# Локальная замена Telegram Bot API
+# ==============================
+# HTTP-сервер, отвечающий на запросы бота так же, как api.telegram.org: бот получает
+# обновления через getUpdates, а его ответы (sendMessage, editMessageText) складываются
+# в очереди чатов, откуда их читает нагрузочный тест (loadtest.py). Бот направляется
+# на сервер переменной TELEGRAM_API_URL.
+
+# Сколько секунд getUpdates ждёт новых обновлений, если бот не указал timeout
+DEFAULT_POLL_TIMEOUT = 10
+# Максимальное количество обновлений в одном ответе getUpdates
+MAX_UPDATES_PER_POLL = 100
+
+# Сообщение, отправленное ботом: чат, текст, callback_data кнопок, момент получения (time.monotonic)
+SentMessage = namedtuple('SentMessage', 'chat_id text buttons received_at')
+
+
+def _buttons(reply_markup):
+    """Возвращает callback_data всех inline-кнопок из reply_markup (строка JSON или словарь)."""
+    if not reply_markup:
+        return []
+    if isinstance(reply_markup, str):
+        reply_markup = json.loads(reply_markup)
+    return [button['callback_data'] for row in reply_markup.get('inline_keyboard', [])
+            for button in row if 'callback_data' in button]
+
+
+class FakeBotApi:
+    """
+    Минимальный Bot API для нагрузочного теста: очередь входящих обновлений для getUpdates
+    и очереди отправленных ботом сообщений по чатам. on_message(SentMessage), если задан,
+    вызывается для каждого сообщения бота до постановки его в очередь чата.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, on_message=None):
+        self._on_message = on_message
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self._chats = {}
+        self._chats_lock = threading.Lock()
+        self.polling_started = threading.Event()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-bot-api", daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        logging.info(f"Локальный Bot API слушает {self.url}")
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    # ---------- Обновления от имени пользователей ----------
+
+    @staticmethod
+    def _user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'last_name': "Load",
+                'username': f"load{user_id}"}
+
+    def _message(self, user_id, text):
+        return {'message_id': next(self._message_ids), 'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'}, 'from': self._user(user_id), 'text': text}
+
+    def _push(self, field, payload):
+        with self._condition:
+            update_id = next(self._update_ids)
+            self._updates.append({'update_id': update_id, field: payload})
+            self._condition.notify_all()
+        return update_id
+
+    def send_text(self, user_id, text):
+        """Ставит в очередь сообщение пользователя user_id боту."""
+        return self._push('message', self._message(user_id, text))
+
+    def press_button(self, user_id, callback_data):
+        """Ставит в очередь нажатие пользователем inline-кнопки с callback_data."""
+        return self._push('callback_query', {
+            'id': str(next(self._message_ids)), 'from': self._user(user_id), 'chat_instance': str(user_id),
+            'data': callback_data, 'message': self._message(user_id, ""),
+        })
+
+    def pending_updates(self):
+        with self._condition:
+            return len(self._updates)
+
+    # ---------- Сообщения бота ----------
+
+    def _chat_queue(self, chat_id):
+        with self._chats_lock:
+            return self._chats.setdefault(chat_id, queue.Queue())
+
+    def next_message(self, chat_id, timeout):
+        """Возвращает следующее сообщение бота в чат chat_id или None по истечении timeout секунд."""
+        try:
+            return self._chat_queue(chat_id).get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _record(self, chat_id, text, reply_markup):
+        message = SentMessage(chat_id, text, _buttons(reply_markup), time.monotonic())
+        if self._on_message:
+            self._on_message(message)
+        self._chat_queue(chat_id).put(message)
+        return {'message_id': next(self._message_ids), 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'}, 'text': text,
+                'from': {'id': 0, 'is_bot': True, 'first_name': "LoadTestBot", 'username': "load_test_bot"}}
+
+    # ---------- Методы Bot API ----------
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = min(int(params.get('limit') or MAX_UPDATES_PER_POLL), MAX_UPDATES_PER_POLL)
+        timeout = float(params.get('timeout') or DEFAULT_POLL_TIMEOUT)
+        self.polling_started.set()
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            # Обновления с update_id меньше offset бот подтвердил
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return self._updates[:limit]
+
+    def call(self, method, params):
+        """Выполняет метод Bot API и возвращает поле result ответа."""
+        method = method.lower()
+        if method == 'getupdates':
+            return self._get_updates(params)
+        if method in ('sendmessage', 'editmessagetext'):
+            return self._record(int(params['chat_id']), params.get('text', ''), params.get('reply_markup'))
+        if method == 'getme':
+            return {'id': 0, 'is_bot': True, 'first_name': "LoadTestBot", 'username': "load_test_bot"}
+        # Остальные методы (answerCallbackQuery, deleteMessage, setWebhook...) просто подтверждаются
+        return True
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _handle(self):
+                url = urlsplit(self.path)
+                # Путь вида /bot<токен>/<метод>
+                parts = url.path.strip('/').split('/')
+                if len(parts) != 2 or not parts[0].startswith('bot'):
+                    self._reply(404, {'ok': False, 'error_code': 404, 'description': "Not Found"})
+                    return
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length)
+                    if 'json' in (self.headers.get('Content-Type') or ''):
+                        params.update(json.loads(body))
+                    else:
+                        params.update(parse_qsl(body.decode('utf-8')))
+                try:
+                    result = api.call(parts[1], params)
+                except (KeyError, ValueError) as e:
+                    self._reply(400, {'ok': False, 'error_code': 400, 'description': f"Bad Request: {e}"})
+                    return
+                self._reply(200, {'ok': True, 'result': result})
+
+            do_GET = do_POST = _handle
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
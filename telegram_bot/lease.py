@@ -0,0 +1,98 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+from repository import acquire_lease, release_lease
+
+# ==============================
+# Аренда (выбор ведущей реплики)
+# ==============================
+# Несколько копий бота с общей базой данных договариваются через таблицу leases, кто из
+# них выполняет работу, которую нельзя выполнять дважды (рассылку напоминаний). Владелец
+# продлевает аренду каждые LEASE_RENEW_SECONDS; если он перестал это делать, через
+# LEASE_TTL_SECONDS аренду захватывает другая копия. Реплики работают на одной машине
+# (SQLite не рассчитан на сетевые файловые системы), поэтому часы у них общие.
+
+# На сколько секунд продлевается аренда
+LEASE_TTL_SECONDS = 15
+# Как часто владелец продлевает аренду, а остальные пытаются её захватить
+LEASE_RENEW_SECONDS = 5
+
+
+class Lease:
+    """
+    Аренда name в таблице leases, которую этот процесс пытается получить и удерживать.
+
+    on_acquired() вызывается при получении аренды, on_lost() — при потере аренды и при stop().
+    Оба вызываются из потока аренды (первый захват — из start()) и не должны надолго его
+    занимать, иначе аренда не будет вовремя продлена.
+    """
+
+    def __init__(self, name, on_acquired, on_lost, ttl=LEASE_TTL_SECONDS, renew_interval=LEASE_RENEW_SECONDS):
+        self.name = name
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._on_acquired = on_acquired
+        self._on_lost = on_lost
+        self._ttl = ttl
+        self._renew_interval = renew_interval
+        self._held = False
+        self._held_until = 0.0
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Пытается получить аренду сразу, затем продлевает или захватывает её в фоновом потоке."""
+        self._renew()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Останавливает поток аренды и освобождает её, чтобы другая реплика получила аренду сразу."""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+        if self._held:
+            self._held = False
+            self._on_lost()
+            try:
+                release_lease(self.name, self.owner)
+                logging.info(f"Аренда {self.name} освобождена ({self.owner}).")
+            except Exception as e:
+                logging.error(f"Ошибка при освобождении аренды {self.name}: {e}")
+
+    def is_held(self):
+        """True, пока аренда заведомо принадлежит этому процессу: до истечения её последнего продления."""
+        return self._held and time.time() < self._held_until
+
+    def _run(self):
+        while not self._stopping.wait(self._renew_interval):
+            self._renew()
+
+    def _renew(self):
+        now = time.time()
+        try:
+            acquired = acquire_lease(self.name, self.owner, now, self._ttl)
+        except Exception as e:
+            # Аренда остаётся за процессом до истечения последнего продления
+            logging.error(f"Ошибка при продлении аренды {self.name}: {e}")
+            if self._held and time.time() >= self._held_until:
+                self._lose()
+            return
+        if not acquired:
+            if self._held:
+                self._lose()
+            return
+        self._held_until = now + self._ttl
+        if self._held:
+            return
+        self._held = True
+        logging.info(f"Получена аренда {self.name} ({self.owner}).")
+        self._on_acquired()
+
+    def _lose(self):
+        self._held = False
+        logging.warning(f"Аренда {self.name} потеряна ({self.owner}).")
+        self._on_lost()
@@ -0,0 +1,307 @@
+import argparse
+import logging
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from callbacks import (ACTION_CONFIRM_DELETE_EVENT, ACTION_CREATE_EVENT, ACTION_CUSTOM_REMINDER_NO,
+                       ACTION_CUSTOM_REMINDER_YES, ACTION_DELETE_EVENT, ACTION_EDIT_EVENT, ACTION_MY_EVENTS,
+                       ACTION_PARTICIPANTS_DONE, ACTION_SELECT_USER, CallbackAction, decode_callback,
+                       encode_callback)
+from fake_bot_api import FakeBotApi
+from timezones import DEFAULT_TIMEZONE, format_ts, now_ts
+
+# ==============================
+# Нагрузочный тест бота
+# ==============================
+# Запускает бота (main.py, async_main.py или supervisor.py) отдельным процессом против локальной замены
+# Bot API (fake_bot_api.py) и прогоняет через него смоделированных пользователей:
+#
+#   python loadtest.py --users 2000 --concurrency 200
+#   python loadtest.py --bot async_main.py --reminder-mode dispatcher
+#   WORKERS=4 python loadtest.py --bot supervisor.py
+#
+# Пользователи регистрируются (/start). Затем нечётные пользователи создают с соседним чётным
+# пользователем событие с дополнительным напоминанием на один и тот же момент — через
+# --burst-after секунд после начала этого этапа, — поэтому бот рассылает все эти напоминания
+# разом. После этого создатели создают второе событие, открывают "Мои события", редактируют и
+# удаляют его, а чётные пользователи смотрят свои события; рассылка идёт во время этих сценариев.
+# Для каждого шага измеряется время от отправки обновления до ответа бота. Код возврата
+# ненулевой, если доля ошибок превышает --max-error-rate, p99 — --max-p99-ms или доставлены
+# не все напоминания.
+
+# Сколько секунд ждать ответа бота на один шаг
+STEP_TIMEOUT_SECONDS = 30
+# Сколько секунд ждать, пока бот начнёт запрашивать обновления
+STARTUP_TIMEOUT_SECONDS = 30
+# Сколько секунд после срока ждать доставки всех напоминаний
+REMINDER_GRACE_SECONDS = 90
+# За сколько минут до начала первого события срабатывает его дополнительное напоминание
+BURST_REMINDER_MINUTES = 30
+# Лимит отправки, которым заменяются лимиты Telegram (сообщений в секунду)
+UNLIMITED_RATE = 1000000
+# Признак напоминания в тексте сообщения бота
+REMINDER_MARKER = "Напоминание о событии"
+# Признак сообщения об ошибке
+ERROR_MARKER = "❌"
+
+
+class StepFailed(Exception):
+    """Бот не ответил на шаг или ответил сообщением об ошибке."""
+
+
+class LoadTest:
+    """Отправляет обновления от имени пользователей и собирает время ответов бота."""
+
+    def __init__(self, step_timeout=STEP_TIMEOUT_SECONDS):
+        self.api = FakeBotApi(on_message=self._on_message)
+        self._step_timeout = step_timeout
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)  # Шаг -> время ответа, секунды
+        self.errors = defaultdict(int)  # Шаг -> количество ошибок
+        self.reminders = []  # Моменты получения напоминаний (time.time())
+
+    def _on_message(self, message):
+        if REMINDER_MARKER in message.text:
+            with self._lock:
+                self.reminders.append(time.time())
+
+    def step(self, name, user_id, expected, text=None, callback_data=None):
+        """
+        Отправляет сообщение text или нажатие callback_data и ждёт ответа бота, содержащего
+        expected: строку в тексте или кнопку действия CallbackAction (или одно из них, если
+        передан кортеж). Прочие сообщения в чат (уведомления, напоминания) пропускаются.
+        Возвращает ответ; StepFailed, если ответа нет или бот сообщил об ошибке.
+        """
+        if not isinstance(expected, tuple):
+            expected = (expected,)
+        started = time.monotonic()
+        if text is not None:
+            self.api.send_text(user_id, text)
+        else:
+            self.api.press_button(user_id, callback_data)
+        deadline = started + self._step_timeout
+        while True:
+            message = self.api.next_message(user_id, max(deadline - time.monotonic(), 0))
+            if message is None:
+                self._fail(name)
+                raise StepFailed(f"{name}: нет ответа за {self._step_timeout} с")
+            if message.text.startswith(ERROR_MARKER):
+                self._fail(name)
+                raise StepFailed(f"{name}: {message.text}")
+            if any(self._matches(message, part) for part in expected):
+                with self._lock:
+                    self.latencies[name].append(message.received_at - started)
+                return message
+
+    @staticmethod
+    def _matches(message, expected):
+        if isinstance(expected, CallbackAction):
+            return any(decode_callback(data)[0] is expected for data in message.buttons)
+        return expected in message.text
+
+    def _fail(self, name):
+        with self._lock:
+            self.errors[name] += 1
+
+    # ---------- Сценарии пользователей ----------
+
+    def register(self, user_id):
+        self.step('start', user_id, "зарегистрированы", text='/start')
+
+    def create_event(self, user_id, participant_id, starts_at, reminder_minutes=None):
+        # Страницы выбора участников узнаются по кнопкам, а не по тексту подсказки
+        self.step('create_event', user_id, ACTION_SELECT_USER,
+                  callback_data=encode_callback(ACTION_CREATE_EVENT))
+        self.step('select_participant', user_id, ACTION_PARTICIPANTS_DONE,
+                  callback_data=encode_callback(ACTION_SELECT_USER, participant_id))
+        self.step('participants_done', user_id, "Введите описание",
+                  callback_data=encode_callback(ACTION_PARTICIPANTS_DONE))
+        self.step('event_description', user_id, "Введите дату", text=f"Нагрузочный тест {user_id}")
+        self.step('event_datetime', user_id, "дополнительное напоминание",
+                  text=format_ts(starts_at, DEFAULT_TIMEZONE))
+        if reminder_minutes is None:
+            self.step('custom_reminder_no', user_id, "успешно создано",
+                      callback_data=encode_callback(ACTION_CUSTOM_REMINDER_NO))
+            return
+        self.step('custom_reminder_yes', user_id, "Введите количество минут",
+                  callback_data=encode_callback(ACTION_CUSTOM_REMINDER_YES))
+        self.step('custom_reminder_minutes', user_id, "Напоминание установлено", text=str(reminder_minutes))
+
+    def my_event_ids(self, user_id):
+        """Открывает "Мои события" и возвращает ID событий, которые пользователь может редактировать."""
+        reply = self.step('my_events', user_id, ("Ваши события", "нет запланированных событий"),
+                          callback_data=encode_callback(ACTION_MY_EVENTS))
+        event_ids = []
+        for data in reply.buttons:
+            action, args = decode_callback(data)
+            if action is ACTION_EDIT_EVENT:
+                event_ids.append(args[0])
+        return event_ids
+
+    def edit_event(self, user_id, event_id, starts_at):
+        self.step('edit_event', user_id, "Введите новое описание",
+                  callback_data=encode_callback(ACTION_EDIT_EVENT, event_id))
+        self.step('edit_description', user_id, "Введите новую дату", text=f"Изменено {user_id}")
+        self.step('edit_datetime', user_id, "успешно отредактировано", text=format_ts(starts_at, DEFAULT_TIMEZONE))
+
+    def delete_event(self, user_id, event_id):
+        self.step('delete_event', user_id, "удалить событие",
+                  callback_data=encode_callback(ACTION_DELETE_EVENT, event_id))
+        self.step('confirm_delete', user_id, "успешно удалено",
+                  callback_data=encode_callback(ACTION_CONFIRM_DELETE_EVENT, event_id))
+
+    def burst_flow(self, user_id, burst_at):
+        # Пары пользователей не пересекаются, поэтому одинаковое время событий не даёт конфликтов
+        self.create_event(user_id, user_id + 1, burst_at + BURST_REMINDER_MINUTES * 60, BURST_REMINDER_MINUTES)
+
+    def creator_flow(self, user_id):
+        participant_id = user_id + 1
+        starts_at = (now_ts() // 60 + 3 * 24 * 60) * 60
+        self.create_event(user_id, participant_id, starts_at)
+        event_id = max(self.my_event_ids(user_id))
+        self.edit_event(user_id, event_id, starts_at + 24 * 60 * 60)
+        self.delete_event(user_id, event_id)
+
+    def participant_flow(self, user_id):
+        self.my_event_ids(user_id)
+
+    def run_users(self, function, user_ids, concurrency):
+        """Выполняет function(user_id) для всех пользователей в concurrency потоков; возвращает число сбоев."""
+        def run(user_id):
+            try:
+                function(user_id)
+            except StepFailed as e:
+                logging.debug(f"Пользователь {user_id}: {e}")
+                return False
+            return True
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return sum(1 for ok in executor.map(run, user_ids) if not ok)
+
+
+def percentile(values, fraction):
+    """Процентиль по методу ближайшего ранга; None для пустого списка."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:9.1f}" if seconds is not None else f"{'—':>9}"
+
+
+def report(test, elapsed, expected_reminders, burst_at):
+    """Печатает сводку и возвращает (долю ошибок, p99 всех шагов в секундах)."""
+    print(f"{'Шаг':<24}{'ответов':>9}{'ошибок':>8}{'p50, мс':>10}{'p99, мс':>10}")
+    for name in sorted(set(test.latencies) | set(test.errors), key=lambda n: -len(test.latencies[n])):
+        values = test.latencies[name]
+        print(f"{name:<24}{len(values):>9}{test.errors[name]:>8} {_ms(percentile(values, 0.5))} "
+              f"{_ms(percentile(values, 0.99))}")
+
+    all_values = [value for values in test.latencies.values() for value in values]
+    errors = sum(test.errors.values())
+    total = len(all_values) + errors
+    error_rate = errors / total if total else 0.0
+    p99 = percentile(all_values, 0.99)
+    print(f"\nВсего шагов: {total} за {elapsed:.1f} с — {len(all_values) / elapsed:.1f} ответов/с, "
+          f"p50 {_ms(percentile(all_values, 0.5)).strip()} мс, p99 {_ms(p99).strip()} мс, "
+          f"ошибок {error_rate:.2%}")
+    if burst_at is not None:
+        lateness = [received - burst_at for received in test.reminders]
+        print(f"Напоминания: ожидалось {expected_reminders}, доставлено {len(test.reminders)}, "
+              f"опоздание p50 {_ms(percentile(lateness, 0.5)).strip()} мс, "
+              f"p99 {_ms(percentile(lateness, 0.99)).strip()} мс")
+    return error_rate, p99
+
+
+def start_bot(script, api_url, workdir, reminder_mode, telegram_limits):
+    """Запускает бота отдельным процессом с базой данных и журналом в каталоге workdir."""
+    # decouple читает .env из текущего каталога, переменные окружения имеют приоритет
+    open(os.path.join(workdir, '.env'), 'a').close()
+    env = dict(os.environ, API_TOKEN="000000:LOADTEST", TELEGRAM_API_URL=api_url, BOT_MODE='polling',
+               DATABASE_PATH=os.path.join(workdir, 'bot_database.db'), REMINDER_MODE=reminder_mode,
+               METRICS_PORT='0')
+    if not telegram_limits:
+        # Иначе время ответа определялось бы лимитами Telegram в очереди исходящих сообщений, а не кодом бота
+        env.update(OUTBOUND_GLOBAL_RATE=str(UNLIMITED_RATE), OUTBOUND_CHAT_RATE=str(UNLIMITED_RATE))
+    stderr = open(os.path.join(workdir, 'bot.stderr'), 'w', encoding='utf-8')
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    return subprocess.Popen([sys.executable, script], cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+                            stderr=stderr)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с локальной заменой Telegram Bot API.")
+    parser.add_argument("--users", type=int, default=1000, help="Количество пользователей (чётное)")
+    parser.add_argument("--concurrency", type=int, default=100, help="Сколько пользователей действуют одновременно")
+    parser.add_argument("--bot", default="main.py", choices=["main.py", "async_main.py", "supervisor.py"], help="Точка входа бота")
+    parser.add_argument("--reminder-mode", default="dispatcher", choices=["dispatcher", "scheduler"])
+    parser.add_argument("--burst-after", type=int, default=120,
+                        help="Через сколько секунд после регистрации пользователей разослать напоминания разом "
+                             "(0 — не рассылать)")
+    parser.add_argument("--telegram-limits", action="store_true",
+                        help="Соблюдать лимиты Telegram на отправку (по умолчанию сняты)")
+    parser.add_argument("--workdir", help="Каталог для базы данных и журнала бота (по умолчанию временный)")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Допустимая доля ошибок")
+    parser.add_argument("--max-p99-ms", type=float, help="Допустимый p99 времени ответа, мс")
+    args = parser.parse_args()
+    if args.users < 2 or args.users % 2:
+        parser.error("--users должно быть чётным числом не меньше 2")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="loadtest-")
+    burst_at = None
+
+    test = LoadTest()
+    test.api.start()
+    bot = start_bot(args.bot, test.api.url, workdir, args.reminder_mode, args.telegram_limits)
+    try:
+        if not test.api.polling_started.wait(STARTUP_TIMEOUT_SECONDS):
+            sys.exit(f"Бот не начал запрашивать обновления за {STARTUP_TIMEOUT_SECONDS} с, см. {workdir}")
+        logging.info(f"Бот запущен, каталог {workdir}")
+
+        started = time.monotonic()
+        user_ids = range(1, args.users + 1)
+        failed = test.run_users(test.register, user_ids, args.concurrency)
+        logging.info(f"Регистрация завершена, сбоев: {failed}")
+        if args.burst_after:
+            # Напоминания срабатывают в начале минуты, поэтому момент рассылки округляется вверх
+            burst_at = math.ceil((now_ts() + args.burst_after) / 60) * 60
+            failed = test.run_users(lambda user_id: test.burst_flow(user_id, burst_at), user_ids[::2],
+                                    args.concurrency)
+            logging.info(f"События с общим напоминанием созданы, сбоев: {failed}")
+            if now_ts() >= burst_at:
+                logging.warning("События создавались дольше --burst-after: часть напоминаний отклонена как прошедшие.")
+        failed = test.run_users(
+            lambda user_id: test.creator_flow(user_id) if user_id % 2 else test.participant_flow(user_id),
+            user_ids, args.concurrency)
+        elapsed = time.monotonic() - started
+        logging.info(f"Сценарии завершены за {elapsed:.1f} с, сбоев: {failed}")
+
+        # Напоминание получают и создатель, и участник
+        expected_reminders = args.users if burst_at is not None else 0
+        if burst_at is not None:
+            deadline = burst_at + REMINDER_GRACE_SECONDS
+            while len(test.reminders) < expected_reminders and time.time() < deadline:
+                time.sleep(0.5)
+
+        error_rate, p99 = report(test, elapsed, expected_reminders, burst_at)
+    finally:
+        bot.terminate()
+        try:
+            bot.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        test.api.shutdown()
+
+    too_slow = args.max_p99_ms is not None and p99 is not None and p99 * 1000 > args.max_p99_ms
+    if error_rate > args.max_error_rate or too_slow or len(test.reminders) < expected_reminders:
+        sys.exit(1)
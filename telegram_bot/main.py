@@ -1,12 +1,15 @@
 from telebot import types
 import time
+from metrics import MetricsServer, observe_handler, set_queue_depth_function
 from utilities import *
+from webhook import UpdateQueues, WebhookServer, register_webhook
 
 
 # ==============================
 # Обработчики команд и сообщений
 # ==============================
 @bot.message_handler(commands=['start'])
+@observe_handler
 def start(message):
     try:
         user_id = message.from_user.id
@@ -18,148 +21,275 @@ def start(message):
         logging.debug(f"/start: user_id = {user_id}")
 
         # Проверка, зарегистрирован ли пользователь
-        select_user_data(cursor, user_id)
-        if cursor.fetchone():
+        if select_user_data(user_id):
+            # Повторный /start обновляет профиль: имя или username в Telegram могли измениться
+            update_user(user_id, first_name, last_name, username, telegram_profile)
+            user_cache.invalidate(user_id)
             # Отправляем главное меню
-            bot.send_message(
+            send_message(
                 user_id,
                 "✅ Вы уже зарегистрированы.",
                 reply_markup=main_menu_keyboard(),
                 parse_mode="HTML"
             )
-            user_states[user_id] = {'state': STATE_MAIN_MENU}
+            user_states.set(user_id, {'state': STATE_MAIN_MENU})
             logging.info(f"Пользователь {user_id} уже зарегистрирован.")
             return
 
         # Регистрация пользователя
-        add_user(conn, cursor, user_id, first_name, last_name, username, telegram_profile)
+        add_user(user_id, first_name, last_name, username, telegram_profile)
+        user_cache.invalidate(user_id)
 
         # Отправляем главное меню
-        bot.send_message(
+        send_message(
             user_id,
             f"👋 Привет, {first_name} {last_name}! Вы успешно зарегистрированы.",
             reply_markup=main_menu_keyboard(),
             parse_mode="HTML"
         )
-        user_states[user_id] = {'state': STATE_MAIN_MENU}
+        user_states.set(user_id, {'state': STATE_MAIN_MENU})
         logging.info(f"Пользователь {user_id} зарегистрирован.")
     except Exception as e:
         logging.error("Ошибка в /start: %s", e)
-        try:
-            bot.send_message(
-                message.chat.id,
-                "❌ Произошла ошибка при регистрации. Пожалуйста, попробуйте позже.",
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            message.chat.id,
+            "❌ Произошла ошибка при регистрации. Пожалуйста, попробуйте позже.",
+            parse_mode="HTML"
+        )
 
 
-@bot.callback_query_handler(func=lambda call: True)
-def callback_query_handler(call):
+@bot.message_handler(commands=['timezone'])
+@observe_handler
+def set_timezone(message):
+    """Показывает часовой пояс пользователя или изменяет его: /timezone Europe/Berlin."""
+    user_id = message.from_user.id
     try:
-        user_id = call.from_user.id
-        data = call.data
-        logging.debug(f"callback_query: user_id = {user_id}, data = {data}")
-
-        user_state = user_states.get(user_id, {'state': STATE_MAIN_MENU})
-
-        if data == "main_menu":
-            # Отправляем главное меню
-            bot.send_message(
+        parts = message.text.split(maxsplit=1)
+        if len(parts) == 1:
+            send_message(
                 user_id,
-                "🏠 Главное меню:",
-                reply_markup=main_menu_keyboard(),
+                f"🌍 Ваш часовой пояс: <b>{user_timezone(user_id)}</b>.\n"
+                "Чтобы изменить его, отправьте /timezone и название пояса, например: /timezone Europe/Berlin",
                 parse_mode="HTML"
             )
-            user_states[user_id]['state'] = STATE_MAIN_MENU
             return
 
-        if data == "create_event":
-            initiate_create_event(user_id, call.message)
-        elif data.startswith("select_user_"):
-            participant_id = int(data.split("_")[-1])
-            # Переходим к вводу описания события
-            user_states[user_id] = {
-                'state': STATE_CREATE_EVENT_DESCRIPTION,
-                'participant_id': participant_id
-            }
-            bot.send_message(
+        timezone_name = parts[1].strip()
+        if not is_valid_timezone(timezone_name):
+            send_message(
                 user_id,
-                "✍️ Введите описание события:",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-            bot.register_next_step_handler(call.message, get_event_description)
-            logging.info(f"Пользователь {user_id} выбрал пользователя {participant_id} для события.")
-        elif data == "list_users":
-            list_users(user_id)
-        elif data == "my_events":
-            show_my_events(user_id)
-        elif data.startswith("edit_event_"):
-            event_id = int(data.split("_")[-1])
-            initiate_edit_event(user_id, event_id, call.message)
-        elif data.startswith("delete_event_"):
-            event_id = int(data.split("_")[-1])
-            initiate_delete_event(user_id, event_id, call.message)
-        elif data.startswith("confirm_delete_event_"):
-            event_id = int(data.split("_")[-1])
-            confirm_delete_event(user_id, event_id)
-        elif data == "cancel_delete_event":
-            cancel_delete_event(user_id)
-        elif data == "add_custom_reminder_yes":
-            user_states[user_id] = {'state': STATE_ADD_CUSTOM_REMINDER}
-            bot.send_message(
-                user_id,
-                "🕒 Введите количество минут до события, за которое вы хотите получить напоминание (1-60):",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-            bot.register_next_step_handler(call.message, get_custom_reminder_time)
-            logging.info(f"Пользователь {user_id} выбрал добавить дополнительное напоминание.")
-        elif data == "add_custom_reminder_no":
-            bot.send_message(
-                user_id,
-                "✅ Ваше событие успешно создано. Главное меню.",
-                reply_markup=main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-            user_states[user_id] = {'state': STATE_MAIN_MENU}
-            logging.info(f"Пользователь {user_id} отказался от добавления дополнительного напоминания.")
-        else:
-            logging.warning(f"Неизвестный callback_data: {data}")
-    except ApiException as api_e:
-        logging.error("APIException в callback_query_handler: %s", api_e)
-        try:
-            bot.send_message(
-                call.message.chat.id,
-                "❌ Произошла ошибка при обработке действия.",
-                reply_markup=back_to_main_menu_keyboard(),
+                "❌ Неизвестный часовой пояс. Укажите название из базы IANA, например Europe/Moscow или Asia/Yekaterinburg.",
                 parse_mode="HTML"
             )
-        except ApiException as api_e2:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e2}")
+            return
+
+        update_user_timezone(user_id, timezone_name)
+        user_cache.invalidate(user_id)
+        send_message(
+            user_id,
+            f"✅ Часовой пояс изменён на <b>{escape_html_text(timezone_name)}</b>.",
+            reply_markup=main_menu_keyboard(),
+            parse_mode="HTML"
+        )
+        logging.info(f"Пользователь {user_id} выбрал часовой пояс {timezone_name}.")
+    except Exception as e:
+        logging.error(f"Ошибка в /timezone для пользователя {user_id}: {e}")
+
+
+# Обработчики нажатий кнопок регистрируются по действию (см. callbacks.py)
+callback_router = CallbackRouter()
+
+
+@callback_router.route(ACTION_MAIN_MENU)
+def handle_main_menu(call):
+    user_id = call.from_user.id
+    # Отправляем главное меню
+    send_message(
+        user_id,
+        "🏠 Главное меню:",
+        reply_markup=main_menu_keyboard(),
+        parse_mode="HTML"
+    )
+    user_states.set(user_id, {'state': STATE_MAIN_MENU})
+
+
+@callback_router.route(ACTION_CREATE_EVENT)
+def handle_create_event(call):
+    initiate_create_event(call.from_user.id, call.message)
+
+
+@callback_router.route(ACTION_SELECT_USER)
+def handle_select_user(call, participant_id):
+    user_id = call.from_user.id
+    state = user_states.get(user_id, {})
+    if state.get('state') != STATE_CREATE_EVENT_SELECT_USER:
+        # Кнопка со старой страницы выбора: начинаем выбор заново с этого участника
+        state = {}
+    # Нажатие отмечает участника или снимает отметку; страница показывается заново с отметками
+    participant_ids = selected_participants(state)
+    if participant_id in participant_ids:
+        participant_ids.remove(participant_id)
+    elif len(participant_ids) >= MAX_EVENT_PARTICIPANTS:
+        send_message(
+            user_id,
+            f"❌ У события может быть не больше {MAX_EVENT_PARTICIPANTS} участников.",
+            parse_mode="HTML"
+        )
+        return
+    else:
+        participant_ids.append(participant_id)
+    initiate_create_event(user_id, call.message, state.get('page_cursor'), state.get('page_backward', False),
+                          prefix=state.get('search_prefix'), participant_ids=participant_ids)
+    logging.info(f"Пользователь {user_id} выбрал участников {participant_ids} для события.")
+
+
+@callback_router.route(ACTION_PARTICIPANTS_DONE)
+def handle_participants_done(call):
+    user_id = call.from_user.id
+    participant_ids = selected_participants(user_states.get(user_id, {}))
+    if not participant_ids:
+        initiate_create_event(user_id, call.message)
+        return
+    # Переходим к вводу описания события
+    user_states.set(user_id, {
+        'state': STATE_CREATE_EVENT_DESCRIPTION,
+        'participant_ids': participant_ids
+    })
+    send_message(
+        user_id,
+        "✍️ Введите описание события:",
+        reply_markup=back_to_main_menu_keyboard(),
+        parse_mode="HTML"
+    )
+    logging.info(f"Пользователь {user_id} завершил выбор участников события: {participant_ids}.")
+
+
+@callback_router.route(ACTION_PARTICIPANTS_PAGE_PREV)
+def handle_participants_page_prev(call, user_id_cursor):
+    user_id = call.from_user.id
+    initiate_create_event(user_id, call.message, user_id_cursor, backward=True,
+                          prefix=user_search_prefix(user_id, STATE_CREATE_EVENT_SELECT_USER),
+                          participant_ids=selected_participants(user_states.get(user_id, {})))
+
+
+@callback_router.route(ACTION_PARTICIPANTS_PAGE_NEXT)
+def handle_participants_page_next(call, user_id_cursor):
+    user_id = call.from_user.id
+    initiate_create_event(user_id, call.message, user_id_cursor,
+                          prefix=user_search_prefix(user_id, STATE_CREATE_EVENT_SELECT_USER),
+                          participant_ids=selected_participants(user_states.get(user_id, {})))
+
+
+@callback_router.route(ACTION_LIST_USERS)
+def handle_list_users(call):
+    list_users(call.from_user.id)
+
+
+@callback_router.route(ACTION_USERS_PAGE_PREV)
+def handle_users_page_prev(call, user_id_cursor):
+    user_id = call.from_user.id
+    list_users(user_id, user_id_cursor, backward=True, prefix=user_search_prefix(user_id, STATE_USER_DIRECTORY))
+
+
+@callback_router.route(ACTION_USERS_PAGE_NEXT)
+def handle_users_page_next(call, user_id_cursor):
+    user_id = call.from_user.id
+    list_users(user_id, user_id_cursor, prefix=user_search_prefix(user_id, STATE_USER_DIRECTORY))
+
+
+@callback_router.route(ACTION_MY_EVENTS)
+def handle_my_events(call):
+    show_my_events(call.from_user.id)
+
+
+@callback_router.route(ACTION_EVENTS_PAGE_PREV)
+def handle_events_page_prev(call, starts_at, event_id):
+    show_my_events(call.from_user.id, (starts_at, event_id), backward=True)
+
+
+@callback_router.route(ACTION_EVENTS_PAGE_NEXT)
+def handle_events_page_next(call, starts_at, event_id):
+    show_my_events(call.from_user.id, (starts_at, event_id))
+
+
+@callback_router.route(ACTION_EDIT_EVENT)
+def handle_edit_event(call, event_id):
+    initiate_edit_event(call.from_user.id, event_id, call.message)
+
+
+@callback_router.route(ACTION_DELETE_EVENT)
+def handle_delete_event(call, event_id):
+    initiate_delete_event(call.from_user.id, event_id, call.message)
+
+
+@callback_router.route(ACTION_CONFIRM_DELETE_EVENT)
+def handle_confirm_delete_event(call, event_id):
+    confirm_delete_event(call.from_user.id, event_id)
+
+
+@callback_router.route(ACTION_CONFIRM_DELETE_SERIES)
+def handle_confirm_delete_series(call, event_id):
+    confirm_delete_event(call.from_user.id, event_id, series=True)
+
+
+@callback_router.route(ACTION_CANCEL_DELETE_EVENT)
+def handle_cancel_delete_event(call):
+    cancel_delete_event(call.from_user.id)
+
+
+@callback_router.route(ACTION_CUSTOM_REMINDER_YES)
+def handle_custom_reminder_yes(call):
+    user_id = call.from_user.id
+    event_id = user_states.get(user_id, {}).get('event_id')
+    user_states.set(user_id, {'state': STATE_ADD_CUSTOM_REMINDER, 'event_id': event_id})
+    send_message(
+        user_id,
+        "🕒 Введите количество минут до события, за которое вы хотите получить напоминание (1-60):",
+        reply_markup=back_to_main_menu_keyboard(),
+        parse_mode="HTML"
+    )
+    logging.info(f"Пользователь {user_id} выбрал добавить дополнительное напоминание.")
+
+
+@callback_router.route(ACTION_CUSTOM_REMINDER_NO)
+def handle_custom_reminder_no(call):
+    user_id = call.from_user.id
+    send_message(
+        user_id,
+        "✅ Ваше событие успешно создано. Главное меню.",
+        reply_markup=main_menu_keyboard(),
+        parse_mode="HTML"
+    )
+    user_states.set(user_id, {'state': STATE_MAIN_MENU})
+    logging.info(f"Пользователь {user_id} отказался от добавления дополнительного напоминания.")
+
+
+@bot.callback_query_handler(func=lambda call: True)
+def callback_query_handler(call):
+    try:
+        logging.debug(f"callback_query: user_id = {call.from_user.id}, data = {call.data}")
+        callback_router.dispatch(call)
     except Exception as e:
         logging.error("Ошибка в callback_query_handler: %s", e)
-        try:
-            bot.send_message(
-                call.message.chat.id,
-                "❌ Произошла ошибка при обработке действия.",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            call.message.chat.id,
+            "❌ Произошла ошибка при обработке действия.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
 
 
-def initiate_create_event(user_id, message):
-    """Инициирует процесс создания нового события."""
+def initiate_create_event(user_id, message, cursor=None, backward=False, prefix=None, participant_ids=()):
+    """
+    Инициирует процесс создания нового события: показывает страницу выбора участников,
+    отмечая уже выбранных participant_ids.
+    """
     try:
-        # Получение списка пользователей для выбора участника
-        select_user_by_id(cursor, user_id)
-        users = cursor.fetchall()
-        if not users:
-            bot.send_message(
+        # Запрашиваем на одного пользователя больше, чтобы узнать, есть ли ещё страница в этом направлении
+        users = select_users_page(USERS_PAGE_SIZE + 1, cursor, backward, prefix, exclude_user_id=user_id)
+        users, has_prev, has_next = split_page(users, cursor, backward, USERS_PAGE_SIZE)
+        if not users and prefix is None and cursor is None:
+            send_message(
                 user_id,
                 "❌ Нет доступных пользователей для выбора участника.",
                 reply_markup=back_to_main_menu_keyboard(),
@@ -168,48 +298,57 @@ def initiate_create_event(user_id, message):
             logging.info(f"Пользователь {user_id} попытался создать событие, но нет доступных участников.")
             return
 
-        # Создание клавиатуры для выбора участника
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        for user in users:
-            uid, first, last, username = user
-            if username != "No Username":
-                display_username = f"@{escape_html_text(username)}"
-            else:
-                display_username = "No Username"
-            user_display = f"{escape_html_text(first)} {escape_html_text(last)} ({display_username})"
-            btn = types.InlineKeyboardButton(user_display, callback_data=f"select_user_{uid}")
-            markup.add(btn)
-
-        # Кнопка для возврата в главное меню
-        markup.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu"))
-
-        bot.send_message(
+        # Текст, отправленный на этом экране, считается поиском участника (см. search_participants).
+        # Страница запоминается, чтобы после отметки участника показать её же.
+        user_states.set(user_id, {
+            'state': STATE_CREATE_EVENT_SELECT_USER,
+            'search_prefix': prefix,
+            'page_cursor': cursor,
+            'page_backward': backward,
+            'participant_ids': list(participant_ids)
+        })
+        user_cache.put_many(users)
+        if users and participant_ids:
+            response = (f"📋 Выбрано участников: {len(participant_ids)}. Отметьте ещё участников "
+                        f"или нажмите «Готово»:")
+        elif users:
+            response = "📋 Выберите участников для события или отправьте начало имени или @username для поиска:"
+        elif prefix is not None:
+            response = f"🔎 По запросу <b>{prefix}</b> никого не найдено. Отправьте другое начало имени или @username."
+        else:
+            response = "📭 Больше пользователей нет."
+        send_message(
             user_id,
-            "📋 Выберите участника для события:",
-            reply_markup=markup,
+            response,
+            reply_markup=participants_keyboard(users, has_prev, has_next, prefix, set(participant_ids)),
             parse_mode="HTML"
         )
         logging.info(f"Пользователь {user_id} инициировал создание нового события.")
     except Exception as e:
         logging.error(f"Ошибка в initiate_create_event для пользователя {user_id}: {e}")
-        try:
-            bot.send_message(
-                user_id,
-                "❌ Произошла ошибка при инициации создания события.",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Произошла ошибка при инициации создания события.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
+
+
+@observe_handler
+def search_participants(message):
+    """Показывает участников, имя или username которых начинается с присланного текста."""
+    user_id = message.from_user.id
+    initiate_create_event(user_id, message, prefix=normalize_user_search(message.text),
+                          participant_ids=selected_participants(user_states.get(user_id, {})))
 
 
-def list_users(user_id):
-    """Отображает список всех зарегистрированных пользователей."""
+def list_users(user_id, cursor=None, backward=False, prefix=None):
+    """Отображает страницу списка зарегистрированных пользователей."""
     try:
-        select_users(cursor)
-        users = cursor.fetchall()
-        if not users:
-            bot.send_message(
+        users = select_users_page(USERS_PAGE_SIZE + 1, cursor, backward, prefix)
+        users, has_prev, has_next = split_page(users, cursor, backward, USERS_PAGE_SIZE)
+        if not users and prefix is None and cursor is None:
+            send_message(
                 user_id,
                 "❌ Нет зарегистрированных пользователей.",
                 reply_markup=back_to_main_menu_keyboard(),
@@ -218,106 +357,52 @@ def list_users(user_id):
             logging.info(f"Пользователь {user_id} запросил список пользователей, но он пуст.")
             return
 
-        user_list = ""
-        for user in users:
-            uid, first, last, username = user
-            if username != "No Username":
-                display_username = f"@{escape_html_text(username)}"
-            else:
-                display_username = "No Username"
-            user_list += f"👤 {escape_html_text(first)} {escape_html_text(last)} ({display_username})\n"
-
-        response = f"📋 <b>Список пользователей:</b>\n{user_list}"
-        bot.send_message(
+        # Текст, отправленный на этом экране, считается поиском пользователя (см. search_users)
+        user_states.set(user_id, {'state': STATE_USER_DIRECTORY, 'search_prefix': prefix})
+        user_cache.put_many(users)
+        response, markup = render_users_page(users, has_prev, has_next, prefix)
+        send_message(
             user_id,
             response,
-            reply_markup=back_to_main_menu_keyboard(),
+            reply_markup=markup,
             parse_mode="HTML",
             disable_web_page_preview=True
         )
-        logging.info(f"Пользователь {user_id} запросил список всех пользователей.")
+        logging.info(f"Пользователю {user_id} показана страница из {len(users)} пользователей.")
     except Exception as e:
         logging.error(f"Ошибка в list_users для пользователя {user_id}: {e}")
-        try:
-            bot.send_message(
-                user_id,
-                "❌ Произошла ошибка при получении списка пользователей.",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Произошла ошибка при получении списка пользователей.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
 
 
-def show_my_events(user_id):
-    """Отображает события, связанные с пользователем."""
+@observe_handler
+def search_users(message):
+    """Показывает пользователей, имя или username которых начинается с присланного текста."""
+    list_users(message.from_user.id, prefix=normalize_user_search(message.text))
+
+
+def show_my_events(user_id, cursor=None, backward=False):
+    """Отображает страницу событий, связанных с пользователем."""
     try:
-        select_event_by_user(cursor, user_id)
-        events = cursor.fetchall()
-        logging.info(f"Пользователь {user_id} имеет {len(events)} событий.")
+        # Запрашиваем на одно событие больше, чтобы узнать, есть ли ещё страница в этом направлении
+        events = select_events_page(user_id, EVENTS_PAGE_SIZE + 1, cursor, backward)
+        events, has_prev, has_next = split_page(events, cursor, backward, EVENTS_PAGE_SIZE)
+        logging.info(f"Пользователю {user_id} показана страница из {len(events)} событий.")
         if not events:
-            bot.send_message(
+            send_message(
                 user_id,
-                "📭 У вас нет запланированных событий.",
+                "📭 У вас нет запланированных событий." if cursor is None else "📭 Больше событий нет.",
                 reply_markup=back_to_main_menu_keyboard(),
                 parse_mode="HTML"
             )
             return
 
-        response = "📅 <b>Ваши события:</b>\n\n"
-        markup = types.InlineKeyboardMarkup(row_width=1)
-        for event in events:
-            event_id, description, event_datetime, participant_id, creator_id = event
-            try:
-                event_dt_obj = datetime.fromisoformat(event_datetime)
-                event_dt = event_dt_obj.strftime('%d.%m.%Y %H:%M')
-            except ValueError:
-                logging.error(f"Некорректный формат event_datetime для события {event_id}: {event_datetime}")
-                event_dt = event_datetime  # Используем исходную строку, если парсинг не удался
-
-            # Получение информации о участнике
-            select_fnu(cursor, participant_id)
-            participant = cursor.fetchone()
-            if participant:
-                participant_first, participant_last, participant_username = participant
-                if participant_username != "No Username":
-                    participant_display = f"@{escape_html_text(participant_username)}"
-                else:
-                    participant_display = "No Username"
-                participant_full = f"{escape_html_text(participant_first)} {escape_html_text(participant_last)} ({participant_display})"
-            else:
-                participant_full = "Unknown User"
-
-            # Получение информации о создателе
-            select_fnu(cursor, creator_id)
-            creator = cursor.fetchone()
-            if creator:
-                creator_first, creator_last, creator_username = creator
-                if creator_username != "No Username":
-                    creator_display = f"@{escape_html_text(creator_username)}"
-                else:
-                    creator_display = "No Username"
-                creator_full = f"{escape_html_text(creator_first)} {escape_html_text(creator_last)} ({creator_display})"
-            else:
-                creator_full = "Unknown User"
-
-            if user_id == creator_id:
-                # Добавление кнопок "Редактировать" и "Удалить" для создателя
-                edit_btn = types.InlineKeyboardButton("✏️ Редактировать", callback_data=f"edit_event_{event_id}")
-                delete_btn = types.InlineKeyboardButton("🗑️ Удалить", callback_data=f"delete_event_{event_id}")
-                markup.add(edit_btn, delete_btn)
-            response += (
-                f"• <b>ID:</b> {event_id}\n"
-                f"  <b>Описание:</b> {description}\n"
-                f"  <b>Дата и время:</b> {event_dt}\n"
-                f"  <b>Участник:</b> {participant_full}\n"
-                f"  <b>Создатель:</b> {creator_full}\n\n"
-            )
-
-        # Добавление кнопки "Вернуться в главное меню"
-        markup.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu"))
-
-        bot.send_message(
+        response, markup = render_events_page(user_id, events, has_prev, has_next, user_timezone(user_id))
+        send_message(
             user_id,
             response,
             reply_markup=markup,
@@ -327,25 +412,21 @@ def show_my_events(user_id):
         logging.info(f"Отправлен список событий пользователю {user_id}.")
     except Exception as e:
         logging.error(f"Ошибка в show_my_events для пользователя {user_id}: {e}")
-        try:
-            bot.send_message(
-                user_id,
-                "❌ Произошла ошибка при просмотре событий.",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Произошла ошибка при просмотре событий.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
 
 
 def initiate_edit_event(user_id, event_id, message):
     """Инициирует процесс редактирования события."""
     try:
         # Проверка, является ли пользователь создателем события
-        get_creator_from_event(cursor, event_id)
-        result = cursor.fetchone()
+        result = get_creator_from_event(event_id)
         if not result:
-            bot.send_message(
+            send_message(
                 user_id,
                 "❌ Событие не найдено.",
                 reply_markup=back_to_main_menu_keyboard(),
@@ -356,7 +437,7 @@ def initiate_edit_event(user_id, event_id, message):
 
         creator_id = result[0]
         if user_id != creator_id:
-            bot.send_message(
+            send_message(
                 user_id,
                 "❌ Вы не являетесь создателем этого события.",
                 reply_markup=back_to_main_menu_keyboard(),
@@ -367,39 +448,34 @@ def initiate_edit_event(user_id, event_id, message):
             return
 
         # Переходим к вводу нового описания
-        user_states[user_id] = {
+        user_states.set(user_id, {
             'state': STATE_EDIT_EVENT_DESCRIPTION,
             'event_id': event_id
-        }
-        bot.send_message(
+        })
+        send_message(
             user_id,
             "✍️ Введите новое описание события:",
             reply_markup=back_to_main_menu_keyboard(),
             parse_mode="HTML"
         )
-        bot.register_next_step_handler(message, edit_event_description)
         logging.info(f"Пользователь {user_id} начал редактирование события {event_id}.")
     except Exception as e:
         logging.error(f"Ошибка в initiate_edit_event для пользователя {user_id}, события {event_id}: {e}")
-        try:
-            bot.send_message(
-                user_id,
-                "❌ Произошла ошибка при инициации редактирования события.",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Произошла ошибка при инициации редактирования события.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
 
 
 def initiate_delete_event(user_id, event_id, message):
     """Инициирует процесс удаления события."""
     try:
         # Проверка, является ли пользователь создателем события
-        select_creator_participant(cursor, event_id)
-        result = cursor.fetchone()
+        result = select_creator_participant(event_id)
         if not result:
-            bot.send_message(
+            send_message(
                 user_id,
                 "❌ Событие не найдено.",
                 reply_markup=back_to_main_menu_keyboard(),
@@ -410,7 +486,7 @@ def initiate_delete_event(user_id, event_id, message):
 
         creator_id, participant_id = result
         if user_id != creator_id:
-            bot.send_message(
+            send_message(
                 user_id,
                 "❌ Вы не являетесь создателем этого события.",
                 reply_markup=back_to_main_menu_keyboard(),
@@ -420,13 +496,10 @@ def initiate_delete_event(user_id, event_id, message):
                 f"Пользователь {user_id} попытался удалить событие {event_id}, которое создал пользователь {creator_id}.")
             return
 
-        # Подтверждение удаления события
-        markup = types.InlineKeyboardMarkup(row_width=2)
-        confirm_btn = types.InlineKeyboardButton("✅ Подтвердить", callback_data=f"confirm_delete_event_{event_id}")
-        cancel_btn = types.InlineKeyboardButton("❌ Отмена", callback_data="cancel_delete_event")
-        markup.add(confirm_btn, cancel_btn)
+        # Подтверждение удаления события; для вхождения серии можно удалить и всю серию
+        markup = delete_confirmation_keyboard(event_id, series=select_event_series_id(event_id) is not None)
         new_text = f"🗑️ Вы уверены, что хотите удалить событие ID:{event_id}?"
-        bot.send_message(
+        send_message(
             user_id,
             new_text,
             reply_markup=markup,
@@ -435,25 +508,21 @@ def initiate_delete_event(user_id, event_id, message):
         logging.info(f"Пользователь {user_id} инициировал удаление события {event_id}.")
     except Exception as e:
         logging.error(f"Ошибка в initiate_delete_event для пользователя {user_id}, события {event_id}: {e}")
-        try:
-            bot.send_message(
-                user_id,
-                "❌ Произошла ошибка при инициации удаления события.",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Произошла ошибка при инициации удаления события.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
 
 
-def confirm_delete_event(user_id, event_id):
-    """Подтверждает удаление события."""
+def confirm_delete_event(user_id, event_id, series=False):
+    """Подтверждает удаление события, а при series=True — и всех последующих вхождений его серии."""
     try:
         # Проверка, является ли пользователь создателем события
-        select_creator_participant(cursor, event_id)
-        result = cursor.fetchone()
-        if not result:
-            bot.send_message(
+        members = select_event_members(event_id)
+        if not members:
+            send_message(
                 user_id,
                 "❌ Событие не найдено или уже было удалено.",
                 parse_mode="HTML"
@@ -461,9 +530,9 @@ def confirm_delete_event(user_id, event_id):
             logging.warning(f"Событие {event_id} не найдено при попытке удаления.")
             return
 
-        creator_id, participant_id = result
+        creator_id, *participant_ids = members
         if user_id != creator_id:
-            bot.send_message(
+            send_message(
                 user_id,
                 "❌ Вы не являетесь создателем этого события.",
                 parse_mode="HTML"
@@ -471,90 +540,68 @@ def confirm_delete_event(user_id, event_id):
             logging.warning(f"Пользователь {user_id} попытался удалить чужое событие {event_id}.")
             return
 
-        # Удаление напоминаний из базы данных
-        delete_reminders(conn, cursor, event_id)
-
-        # Удаление события из базы данных
-        delete_event(conn, cursor, event_id)
-        logging.info(f"Событие {event_id} успешно удалено пользователем {user_id}.")
+        # Удаление события (или вхождений серии) и напоминаний из базы данных одной транзакцией
+        if series:
+            deleted = delete_event_series(event_id)
+            logging.info(f"Серия события {event_id} ({len(deleted)} вхождений) удалена пользователем {user_id}.")
+        else:
+            delete_event_with_reminders(event_id)
+            logging.info(f"Событие {event_id} успешно удалено пользователем {user_id}.")
 
-        # Отмена запланированных напоминаний в планировщике
-        job_prefix = f"reminder_{event_id}_"
-        jobs = scheduler.get_jobs()
-        for job in jobs:
-            if job.id.startswith(job_prefix):
-                scheduler.remove_job(job.id)
-                logging.info(f"Удалена запланированная задача {job.id} для события {event_id}.")
+        # Отменять напоминания не нужно: и задачи планировщика, и диспетчер читают их из базы при срабатывании
 
-        # Отправка уведомлений обоим участникам о удалении события
-        send_event_deleted_notifications(event_id, creator_id, participant_id)
+        # Отправка уведомлений создателю и всем участникам об удалении события
+        send_event_deleted_notifications(event_id, creator_id, participant_ids, series)
 
         # Отправка подтверждения удаления события и главного меню
-        bot.send_message(
+        send_message(
             user_id,
             "✅ Событие успешно удалено. Главное меню.",
             reply_markup=main_menu_keyboard(),
             parse_mode="HTML"
         )
-        user_states[user_id] = {'state': STATE_MAIN_MENU}
+        user_states.set(user_id, {'state': STATE_MAIN_MENU})
         logging.info(f"Отправлено подтверждение удаления события пользователю {user_id}.")
     except Exception as e:
         logging.error(f"Ошибка в confirm_delete_event для пользователя {user_id}, события {event_id}: {e}")
-        try:
-            bot.send_message(
-                user_id,
-                "❌ Произошла ошибка при удалении события.",
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Произошла ошибка при удалении события.",
+            parse_mode="HTML"
+        )
 
 
 def cancel_delete_event(user_id):
     """Отменяет процесс удаления события."""
     try:
-        bot.send_message(
+        send_message(
             user_id,
             "❌ Удаление события отменено. Главное меню.",
             reply_markup=main_menu_keyboard(),
             parse_mode="HTML"
         )
-        user_states[user_id] = {'state': STATE_MAIN_MENU}
+        user_states.set(user_id, {'state': STATE_MAIN_MENU})
         logging.info(f"Пользователь {user_id} отменил удаление события.")
     except Exception as e:
         logging.error(f"Ошибка в cancel_delete_event для пользователя {user_id}: {e}")
-        try:
-            bot.send_message(
-                user_id,
-                "❌ Произошла ошибка при отмене удаления события.",
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Произошла ошибка при отмене удаления события.",
+            parse_mode="HTML"
+        )
 
 
-def send_event_deleted_notifications(event_id, creator_id, participant_id):
-    """Отправляет уведомления о том, что событие было удалено."""
+def send_event_deleted_notifications(event_id, creator_id, participant_ids, series=False):
+    """Отправляет уведомления о том, что событие (или серия событий) было удалено, одной пачкой."""
     try:
-        notification_text = f"🗑️ Событие ID:{event_id} было удалено его создателем."
-
-        # Отправка уведомления участнику
-        bot.send_message(
-            participant_id,
-            notification_text,
-            parse_mode="HTML",
-            disable_web_page_preview=True
-        )
-        logging.info(f"Участнику {participant_id} отправлено уведомление об удалении события {event_id}.")
-
-        # Отправка уведомления создателю
-        bot.send_message(
-            creator_id,
-            notification_text,
+        notification_text = render_event_deleted_notification(event_id, series)
+        outbound_queue.send_messages(
+            [(chat_id, notification_text) for chat_id in (*participant_ids, creator_id)],
             parse_mode="HTML",
             disable_web_page_preview=True
         )
-        logging.info(f"Создателю {creator_id} отправлено уведомление об удалении события {event_id}.")
+        logging.info(f"Поставлены уведомления об удалении события {event_id} создателю {creator_id} "
+                     f"и участникам {participant_ids}.")
     except Exception as e:
         logging.error(f"Ошибка при отправке уведомлений об удалении события {event_id}: {e}")
 
@@ -565,333 +612,244 @@ def send_event_deleted_notifications(event_id, creator_id, participant_id):
 # Обработчики для ввода данных пользователем
 # ==============================
 
+@observe_handler
 def get_event_description(message):
     """Получает описание события от пользователя."""
     user_id = message.from_user.id
     state = user_states.get(user_id, {})
     if state.get('state') != STATE_CREATE_EVENT_DESCRIPTION:
-        try:
-            bot.send_message(
-                user_id,
-                "❌ Некорректное состояние для ввода описания.",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Некорректное состояние для ввода описания.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
         logging.warning(f"Пользователь {user_id} находится в неверном состоянии для ввода описания.")
         return
 
     description = escape_html_text(message.text.strip())
     if not description:
-        try:
-            msg = bot.send_message(
-                user_id,
-                "❌ Описание не может быть пустым. Пожалуйста, введите описание события:",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-            logging.warning(f"Пользователь {user_id} ввёл пустое описание события.")
-            bot.register_next_step_handler(msg, get_event_description)
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
-        return
-
-    user_states[user_id]['description'] = description
-    user_states[user_id]['state'] = STATE_CREATE_EVENT_DATETIME
-
-    # Запрашиваем дату и время события
-    try:
-        bot.send_message(
+        send_message(
             user_id,
-            "🕒 Введите дату и время события в формате DD.MM.YYYY HH:MM:",
+            "❌ Описание не может быть пустым. Пожалуйста, введите описание события:",
             reply_markup=back_to_main_menu_keyboard(),
             parse_mode="HTML"
         )
-        bot.register_next_step_handler(message, get_event_datetime)
-        logging.info(f"Пользователь {user_id} ввёл описание события: {description}")
-    except ApiException as api_e:
-        logging.error(f"Ошибка при отправке запроса на дату и время: {api_e}")
+        logging.warning(f"Пользователь {user_id} ввёл пустое описание события.")
+        return
 
+    user_states.update(user_id, description=description, state=STATE_CREATE_EVENT_DATETIME)
 
+    # Запрашиваем дату и время события
+    send_message(
+        user_id,
+        "🕒 Введите дату и время события в формате DD.MM.YYYY HH:MM"
+        f" (через пробел можно указать длительность в минутах, по умолчанию {DEFAULT_EVENT_DURATION_MINUTES})."
+        f" {RECURRENCE_HINT}"
+        f" Часовой пояс: {user_timezone(user_id)}, изменить — /timezone.",
+        reply_markup=back_to_main_menu_keyboard(),
+        parse_mode="HTML"
+    )
+    logging.info(f"Пользователь {user_id} ввёл описание события: {description}")
+
+
+@observe_handler
 def get_event_datetime(message):
     """Получает дату и время события от пользователя."""
     user_id = message.from_user.id
     state = user_states.get(user_id, {})
     if state.get('state') != STATE_CREATE_EVENT_DATETIME:
-        try:
-            bot.send_message(
-                user_id,
-                "❌ Некорректное состояние для ввода даты и времени.",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Некорректное состояние для ввода даты и времени.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
         logging.warning(f"Пользователь {user_id} находится в неверном состоянии для ввода даты и времени.")
         return
 
     datetime_text = message.text.strip()
     try:
-        event_datetime = datetime.strptime(datetime_text, "%d.%m.%Y %H:%M")
-        if event_datetime < datetime.now():
-            try:
-                msg = bot.send_message(
-                    user_id,
-                    "❌ Введите дату и время начиная с сегодняшнего дня и текущего времени:",
-                    reply_markup=back_to_main_menu_keyboard(),
-                    parse_mode="HTML"
-                )
-                logging.warning(f"Пользователь {user_id} ввёл дату из прошлого: {datetime_text}")
-                bot.register_next_step_handler(msg, get_event_datetime)
-            except ApiException as api_e:
-                logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        timezone_name = user_timezone(user_id)
+        starts_at, duration_minutes, recurrence = parse_event_schedule(datetime_text, timezone_name)
+        if starts_at < now_ts():
+            send_message(
+                user_id,
+                "❌ Введите дату и время начиная с сегодняшнего дня и текущего времени:",
+                reply_markup=back_to_main_menu_keyboard(),
+                parse_mode="HTML"
+            )
+            logging.warning(f"Пользователь {user_id} ввёл дату из прошлого: {datetime_text}")
             return
 
         # Проверка на пересечение событий
-        participant_id = state.get('participant_id')
-        if not participant_id:
-            logging.error(f"Нет participant_id для пользователя {user_id} при создании события.")
-            try:
-                bot.send_message(
-                    user_id,
-                    "❌ Произошла ошибка при создании события. Пожалуйста, попробуйте снова.",
-                    reply_markup=back_to_main_menu_keyboard(),
-                    parse_mode="HTML"
-                )
-            except ApiException as api_e:
-                logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
-            return
-
-        select_event_by_participant_date(cursor, participant_id, user_id, event_datetime)
-        if cursor.fetchone():
-            try:
-                msg = bot.send_message(
-                    user_id,
-                    "❌ Выбранное время занято. Пожалуйста, выберите другое время:",
-                    reply_markup=back_to_main_menu_keyboard(),
-                    parse_mode="HTML"
-                )
-                logging.info(
-                    f"Пользователь {user_id} попытался создать пересекающееся событие на {event_datetime.isoformat()}.")
-                bot.register_next_step_handler(msg, get_event_datetime)
-            except ApiException as api_e:
-                logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        participant_ids = selected_participants(state)
+        if not participant_ids:
+            logging.error(f"Нет участников для пользователя {user_id} при создании события.")
+            send_message(
+                user_id,
+                "❌ Произошла ошибка при создании события. Пожалуйста, попробуйте снова.",
+                reply_markup=back_to_main_menu_keyboard(),
+                parse_mode="HTML"
+            )
             return
 
         # Получение описания события
         description = state.get('description', 'No Description')
 
-        # Создание события в базе данных
-        create_event(conn, cursor, user_id, participant_id, description, event_datetime)
-        event_id = cursor.lastrowid
+        # Событие и стандартные напоминания (за 24 часа и за 2 часа) записываются одной транзакцией;
+        # пересечение интервалов проверяется внутри неё сразу для создателя и всех участников.
+        # Для повторяющегося события создаётся серия и её вхождения на ближайший горизонт.
+        if recurrence:
+            event_id = create_event_series(user_id, participant_ids, description, starts_at, duration_minutes,
+                                           timezone_name, recurrence, series_horizon())
+        else:
+            event_id = create_event_with_reminders(user_id, participant_ids, description, starts_at,
+                                                   duration_minutes, standard_reminder_times(starts_at))
+        if event_id is None:
+            send_message(
+                user_id,
+                "❌ Выбранное время занято. Пожалуйста, выберите другое время:",
+                reply_markup=back_to_main_menu_keyboard(),
+                parse_mode="HTML"
+            )
+            logging.info(
+                f"Пользователь {user_id} попытался создать пересекающееся событие на {starts_at}.")
+            return
+
         logging.info(
-            f"Создано новое событие от пользователя {user_id}: ID={event_id}, Описание='{description}', Дата и время={event_datetime.isoformat()}, Участник={participant_id}")
-
-        # Планирование стандартных уведомлений (24 часа и 2 часа)
-        standard_reminders = [timedelta(days=1), timedelta(hours=2)]
-        for delta in standard_reminders:
-            reminder_time = event_datetime - delta
-            if reminder_time > datetime.now():
-                create_reminders(conn, cursor, event_id, reminder_time)
-        # Планирование уведомлений
+            f"Создано новое событие от пользователя {user_id}: ID={event_id}, Описание='{description}', Начало={starts_at}, Участники={participant_ids}, Повтор={recurrence}")
+
+        # Планирование уведомлений. Напоминания следующих вхождений серии наступят не раньше чем
+        # через сутки, их подхватит синхронизация владельца аренды (sync_reminder_jobs) или диспетчер
         schedule_notifications(event_id)
 
-        # Отправка уведомлений обоим участникам о создании события
+        # Отправка уведомлений создателю и всем участникам о создании события
         send_event_created_notifications(user_id, event_id)
 
         # Предложение добавить дополнительное напоминание
-        user_states[user_id] = {'state': STATE_ADD_CUSTOM_REMINDER}
-        bot.send_message(
+        user_states.set(user_id, {'state': STATE_ADD_CUSTOM_REMINDER, 'event_id': event_id})
+        send_message(
             user_id,
             "🎯 Хотите добавить дополнительное напоминание за определённое количество минут до события?",
-            reply_markup=types.InlineKeyboardMarkup(row_width=2).add(
-                types.InlineKeyboardButton("Да", callback_data="add_custom_reminder_yes"),
-                types.InlineKeyboardButton("Нет", callback_data="add_custom_reminder_no")
-            ),
+            reply_markup=custom_reminder_keyboard(),
             parse_mode="HTML"
         )
         logging.info(f"Пользователь {user_id} создал событие {event_id} и предложил добавить напоминание.")
 
     except ValueError:
-        try:
-            msg = bot.send_message(
-                user_id,
-                "❌ Неверный формат даты и времени. Пожалуйста, введите в формате DD.MM.YYYY HH:MM:",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-            logging.warning(
-                f"Пользователь {user_id} ввёл неверный формат даты и времени: {datetime_text}")
-            bot.register_next_step_handler(msg, get_event_datetime)
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Неверный формат даты и времени. Пожалуйста, введите в формате DD.MM.YYYY HH:MM [минуты] [повтор]:",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
+        logging.warning(
+            f"Пользователь {user_id} ввёл неверный формат даты и времени: {datetime_text}")
     except Exception as e:
         logging.error(f"Ошибка в get_event_datetime для пользователя {user_id}: {e}")
-        try:
-            bot.send_message(
-                user_id,
-                "❌ Произошла ошибка при обработке даты и времени.",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Произошла ошибка при обработке даты и времени.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
 
 
-def send_event_created_notifications(creator_id, event_id):
-    """Отправляет уведомления о создании события создателю и участнику."""
+def send_event_notifications(creator_id, event_id, participant_title, creator_title):
+    """
+    Отправляет уведомления о создании или изменении события создателю и всем участникам:
+    участники загружаются одним запросом, профили — одним обращением к кэшу пользователей,
+    а сообщения ставятся в очередь одной пачкой.
+    """
     try:
-        # Получение информации о событии
-        get_event_data(cursor, event_id)
-        event = cursor.fetchone()
+        event = repo.get_event(event_id)
         if not event:
             logging.error(f"Не удалось найти событие с ID {event_id}.")
             return
-
-        event_id, participant_id, description, event_datetime_str = event
-        event_datetime = datetime.fromisoformat(event_datetime_str).strftime('%d.%m.%Y %H:%M')
-
-        # Получение информации о участнике
-        select_fnu(cursor, participant_id)
-        participant = cursor.fetchone()
-        if participant:
-            participant_first, participant_last, participant_username = participant
-            if participant_username != "No Username":
-                participant_display = f"@{escape_html_text(participant_username)}"
-            else:
-                participant_display = "No Username"
-            participant_full = f"{escape_html_text(participant_first)} {escape_html_text(participant_last)} ({participant_display})"
-        else:
-            participant_full = "Unknown User"
-
-        # Получение информации о создателе
-        select_fnu(cursor, creator_id)
-        creator = cursor.fetchone()
-        if creator:
-            creator_first, creator_last, creator_username = creator
-            if creator_username != "No Username":
-                creator_display = f"@{escape_html_text(creator_username)}"
-            else:
-                creator_display = "No Username"
-            creator_full = f"{escape_html_text(creator_first)} {escape_html_text(creator_last)} ({creator_display})"
-        else:
-            creator_full = "Unknown User"
-
-        # Сообщение для участника
-        notification_message_participant = (
-            f"📅 Новое событие создано:\n\n"
-            f"<b>Описание:</b> {description}\n"
-            f"<b>Дата и время:</b> {event_datetime}\n"
-            f"<b>Создатель:</b> {creator_full}"
-        )
-        bot.send_message(
-            participant_id,
-            notification_message_participant,
-            parse_mode="HTML",
-            disable_web_page_preview=True
-        )
-        logging.info(f"Участнику {participant_id} отправлено уведомление о создании события {event_id}.")
-
-        # Сообщение для создателя
-        notification_message_creator = (
-            f"📅 Вы создали новое событие:\n\n"
-            f"<b>Описание:</b> {description}\n"
-            f"<b>Дата и время:</b> {event_datetime}\n"
-            f"<b>Участник:</b> {participant_full}"
-        )
-        bot.send_message(
-            creator_id,
-            notification_message_creator,
-            parse_mode="HTML",
-            disable_web_page_preview=True
-        )
-        logging.info(f"Создателю {creator_id} отправлено уведомление о создании события {event_id}.")
+        participant_ids = repo.get_participants([event_id]).get(event_id, [event.participant_id])
+
+        profiles = user_cache.get_many([*participant_ids, creator_id])
+        messages = render_event_notifications(participant_title, creator_title, event.description, event.starts_at,
+                                              creator_id, participant_ids, profiles)
+        outbound_queue.send_messages(messages, parse_mode="HTML", disable_web_page_preview=True)
+        logging.info(f"Поставлены уведомления о событии {event_id} создателю {creator_id} "
+                     f"и участникам {participant_ids}.")
     except Exception as e:
-        logging.error(f"Ошибка при отправке уведомлений о создании события {event_id}: {e}")
+        logging.error(f"Ошибка при отправке уведомлений о событии {event_id}: {e}")
+
+
+def send_event_created_notifications(creator_id, event_id):
+    """Отправляет уведомления о создании события создателю и всем участникам."""
+    send_event_notifications(creator_id, event_id, "📅 Новое событие создано:", "📅 Вы создали новое событие:")
 
 
+@observe_handler
 def edit_event_description(message):
     """Редактирует описание события."""
     user_id = message.from_user.id
     state = user_states.get(user_id, {})
     if state.get('state') != STATE_EDIT_EVENT_DESCRIPTION:
-        try:
-            bot.send_message(
-                user_id,
-                "❌ Некорректное состояние для редактирования описания.",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Некорректное состояние для редактирования описания.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
         logging.warning(f"Пользователь {user_id} находится в неверном состоянии для редактирования описания.")
         return
 
     new_description = escape_html_text(message.text.strip())
     if not new_description:
-        try:
-            msg = bot.send_message(
-                user_id,
-                "❌ Описание не может быть пустым. Пожалуйста, введите новое описание события:",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-            logging.warning(f"Пользователь {user_id} ввёл пустое описание при редактировании события.")
-            bot.register_next_step_handler(msg, edit_event_description)
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
-        return
-
-    user_states[user_id]['new_description'] = new_description
-    user_states[user_id]['state'] = STATE_EDIT_EVENT_DATETIME
-
-    # Запрашиваем новую дату и время события
-    try:
-        bot.send_message(
+        send_message(
             user_id,
-            "🕒 Введите новую дату и время события в формате DD.MM.YYYY HH:MM:",
+            "❌ Описание не может быть пустым. Пожалуйста, введите новое описание события:",
             reply_markup=back_to_main_menu_keyboard(),
             parse_mode="HTML"
         )
-        bot.register_next_step_handler(message, edit_event_datetime)
-        logging.info(f"Пользователь {user_id} ввёл новое описание события: {new_description}")
-    except ApiException as api_e:
-        logging.error(f"Ошибка при отправке запроса на новую дату и время: {api_e}")
+        logging.warning(f"Пользователь {user_id} ввёл пустое описание при редактировании события.")
+        return
 
+    user_states.update(user_id, new_description=new_description, state=STATE_EDIT_EVENT_DATETIME)
 
+    # Запрашиваем новую дату и время события
+    send_message(
+        user_id,
+        "🕒 Введите новую дату и время события в формате DD.MM.YYYY HH:MM"
+        f" (через пробел можно указать длительность в минутах, по умолчанию {DEFAULT_EVENT_DURATION_MINUTES})."
+        f" Часовой пояс: {user_timezone(user_id)}, изменить — /timezone.",
+        reply_markup=back_to_main_menu_keyboard(),
+        parse_mode="HTML"
+    )
+    logging.info(f"Пользователь {user_id} ввёл новое описание события: {new_description}")
+
+
+@observe_handler
 def edit_event_datetime(message):
     """Редактирует дату и время события."""
     user_id = message.from_user.id
     state = user_states.get(user_id, {})
     if state.get('state') != STATE_EDIT_EVENT_DATETIME:
-        try:
-            bot.send_message(
-                user_id,
-                "❌ Некорректное состояние для редактирования даты и времени.",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Некорректное состояние для редактирования даты и времени.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
         logging.warning(f"Пользователь {user_id} находится в неверном состоянии для редактирования даты и времени.")
         return
 
     datetime_text = message.text.strip()
     try:
-        new_event_datetime = datetime.strptime(datetime_text, "%d.%m.%Y %H:%M")
-        if new_event_datetime < datetime.now():
-            try:
-                msg = bot.send_message(
-                    user_id,
-                    "❌ Введите дату и время начиная с сегодняшнего дня и текущего времени:",
-                    reply_markup=back_to_main_menu_keyboard(),
-                    parse_mode="HTML"
-                )
-                logging.warning(f"Пользователь {user_id} ввёл дату из прошлого при редактировании: {datetime_text}")
-                bot.register_next_step_handler(msg, edit_event_datetime)
-            except ApiException as api_e:
-                logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        new_starts_at, duration_minutes = parse_event_datetime(datetime_text, user_timezone(user_id))
+        if new_starts_at < now_ts():
+            send_message(
+                user_id,
+                "❌ Введите дату и время начиная с сегодняшнего дня и текущего времени:",
+                reply_markup=back_to_main_menu_keyboard(),
+                parse_mode="HTML"
+            )
+            logging.warning(f"Пользователь {user_id} ввёл дату из прошлого при редактировании: {datetime_text}")
             return
 
         event_id = state.get('event_id')
@@ -899,59 +857,53 @@ def edit_event_datetime(message):
 
         if not event_id:
             logging.error(f"Нет event_id для пользователя {user_id} при редактировании даты и времени.")
-            try:
-                bot.send_message(
-                    user_id,
-                    "❌ Произошла ошибка при редактировании события. Пожалуйста, попробуйте снова.",
-                    reply_markup=back_to_main_menu_keyboard(),
-                    parse_mode="HTML"
-                )
-            except ApiException as api_e:
-                logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+            send_message(
+                user_id,
+                "❌ Произошла ошибка при редактировании события. Пожалуйста, попробуйте снова.",
+                reply_markup=back_to_main_menu_keyboard(),
+                parse_mode="HTML"
+            )
             return
 
-        # Проверка на пересечение событий
-        select_for_check_intersection(cursor, event_id, new_event_datetime)
-        if cursor.fetchone():
-            try:
-                msg = bot.send_message(
-                    user_id,
-                    "❌ Выбранное время занято. Пожалуйста, выберите другое время:",
-                    reply_markup=back_to_main_menu_keyboard(),
-                    parse_mode="HTML"
-                )
-                logging.info(
-                    f"Пользователь {user_id} попытался редактировать событие {event_id} на занятое время {new_event_datetime.isoformat()}.")
-                bot.register_next_step_handler(msg, edit_event_datetime)
-            except ApiException as api_e:
-                logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        # Проверка на пересечение событий создателя и участников, не считая само редактируемое событие
+        members = select_event_members(event_id)
+        if not members:
+            logging.warning(f"Событие {event_id} не найдено при редактировании пользователем {user_id}.")
+            send_message(
+                user_id,
+                "❌ Событие не найдено.",
+                reply_markup=back_to_main_menu_keyboard(),
+                parse_mode="HTML"
+            )
+            user_states.set(user_id, {'state': STATE_MAIN_MENU})
+            return
+        # Событие и его новые стандартные напоминания (за 24 часа и за 2 часа) записываются одной транзакцией
+        if not update_event_with_reminders(members, new_description, new_starts_at, event_id, duration_minutes,
+                                           standard_reminder_times(new_starts_at)):
+            send_message(
+                user_id,
+                "❌ Выбранное время занято. Пожалуйста, выберите другое время:",
+                reply_markup=back_to_main_menu_keyboard(),
+                parse_mode="HTML"
+            )
+            logging.info(
+                f"Пользователь {user_id} попытался редактировать событие {event_id} на занятое время {new_starts_at}.")
             return
 
-        # Обновление события в базе данных
-        update_event(conn, cursor, new_description, new_event_datetime, event_id)
         logging.info(
-            f"Событие {event_id} обновлено: Описание='{new_description}', Дата и время='{new_event_datetime.isoformat()}'.")
+            f"Событие {event_id} обновлено: Описание='{new_description}', Начало={new_starts_at}.")
 
-        # Удаление старых напоминаний
-        delete_reminders(conn, cursor, event_id)
-
-        # Планирование стандартных уведомлений (24 часа и 2 часа)
-        standard_reminders = [timedelta(days=1), timedelta(hours=2)]
-        for delta in standard_reminders:
-            reminder_time = new_event_datetime - delta
-            if reminder_time > datetime.now():
-                create_reminders(conn, cursor, event_id, reminder_time)
         # Планирование уведомлений
         schedule_notifications(event_id)
 
         # Очистка состояния
-        user_states[user_id] = {'state': STATE_MAIN_MENU}
+        user_states.set(user_id, {'state': STATE_MAIN_MENU})
 
         # Отправка уведомлений обоим участникам об обновлении события
         send_event_updated_notifications(user_id, event_id)
 
         # Отправка подтверждения редактирования события и главного меню
-        bot.send_message(
+        send_message(
             user_id,
             "✅ Ваше событие успешно отредактировано. Главное меню.",
             reply_markup=main_menu_keyboard(),
@@ -959,117 +911,41 @@ def edit_event_datetime(message):
         )
         logging.info(f"Отправлено подтверждение редактирования события пользователю {user_id}.")
     except ValueError:
-        try:
-            msg = bot.send_message(
-                user_id,
-                "❌ Неверный формат даты и времени. Пожалуйста, введите в формате DD.MM.YYYY HH:MM:",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-            logging.warning(
-                f"Пользователь {user_id} ввёл неверный формат даты и времени при редактировании: {datetime_text}")
-            bot.register_next_step_handler(msg, edit_event_datetime)
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Неверный формат даты и времени. Пожалуйста, введите в формате DD.MM.YYYY HH:MM [минуты]:",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
+        logging.warning(
+            f"Пользователь {user_id} ввёл неверный формат даты и времени при редактировании: {datetime_text}")
     except Exception as e:
         logging.error(f"Ошибка в edit_event_datetime для пользователя {user_id}: {e}")
-        try:
-            bot.send_message(
-                user_id,
-                "❌ Произошла ошибка при редактировании даты и времени.",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Произошла ошибка при редактировании даты и времени.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
 
 
 def send_event_updated_notifications(creator_id, event_id):
-    """Отправляет уведомления об обновлении события создателю и участнику."""
-    try:
-        # Получение информации о событии
-        get_event_data(cursor, event_id)
-        event = cursor.fetchone()
-        if not event:
-            logging.error(f"Не удалось найти событие с ID {event_id}.")
-            return
-
-        event_id, participant_id, description, event_datetime_str = event
-        event_datetime = datetime.fromisoformat(event_datetime_str).strftime('%d.%m.%Y %H:%M')
-
-        # Получение информации о участнике
-        select_fnu(cursor,participant_id)
-        participant = cursor.fetchone()
-        if participant:
-            participant_first, participant_last, participant_username = participant
-            if participant_username != "No Username":
-                participant_display = f"@{escape_html_text(participant_username)}"
-            else:
-                participant_display = "No Username"
-            participant_full = f"{escape_html_text(participant_first)} {escape_html_text(participant_last)} ({participant_display})"
-        else:
-            participant_full = "Unknown User"
-
-        # Получение информации о создателе
-        select_fnu(cursor,creator_id)
-        creator = cursor.fetchone()
-        if creator:
-            creator_first, creator_last, creator_username = creator
-            if creator_username != "No Username":
-                creator_display = f"@{escape_html_text(creator_username)}"
-            else:
-                creator_display = "No Username"
-            creator_full = f"{escape_html_text(creator_first)} {escape_html_text(creator_last)} ({creator_display})"
-        else:
-            creator_full = "Unknown User"
-
-        # Сообщение для участника
-        notification_message_participant = (
-            f"📅 Событие обновлено:\n\n"
-            f"<b>Описание:</b> {description}\n"
-            f"<b>Дата и время:</b> {event_datetime}\n"
-            f"<b>Создатель:</b> {creator_full}"
-        )
-        bot.send_message(
-            participant_id,
-            notification_message_participant,
-            parse_mode="HTML",
-            disable_web_page_preview=True
-        )
-        logging.info(f"Участнику {participant_id} отправлено уведомление об обновлении события {event_id}.")
-
-        # Сообщение для создателя
-        notification_message_creator = (
-            f"📅 Вы обновили событие:\n\n"
-            f"<b>Описание:</b> {description}\n"
-            f"<b>Дата и время:</b> {event_datetime}\n"
-            f"<b>Участник:</b> {participant_full}"
-        )
-        bot.send_message(
-            creator_id,
-            notification_message_creator,
-            parse_mode="HTML",
-            disable_web_page_preview=True
-        )
-        logging.info(f"Создателю {creator_id} отправлено уведомление об обновлении события {event_id}.")
-    except Exception as e:
-        logging.error(f"Ошибка при отправке уведомлений об обновлении события {event_id}: {e}")
+    """Отправляет уведомления о обновлении события создателю и всем участникам."""
+    send_event_notifications(creator_id, event_id, "📅 Событие обновлено:", "📅 Вы обновили событие:")
 
 
+@observe_handler
 def get_custom_reminder_time(message):
     """Получает время для дополнительного напоминания от пользователя."""
     user_id = message.from_user.id
     state = user_states.get(user_id, {})
     if state.get('state') != STATE_ADD_CUSTOM_REMINDER:
-        try:
-            bot.send_message(
-                user_id,
-                "❌ Некорректное состояние для добавления напоминания.",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Некорректное состояние для добавления напоминания.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
         logging.warning(f"Пользователь {user_id} находится в неверном состоянии для добавления напоминания.")
         return
 
@@ -1079,95 +955,166 @@ def get_custom_reminder_time(message):
         if not (1 <= minutes <= 60):
             raise ValueError("Минуты вне допустимого диапазона.")
 
-        # Получение последнего созданного события
-        select_last_event(cursor, user_id)
-        event = cursor.fetchone()
+        # Напоминание относится к событию, созданному в этом диалоге (для серии — к первому повтору)
+        event_id = state.get('event_id')
+        event = repo.get_event(event_id) if event_id else None
         if not event:
-            try:
-                bot.send_message(
-                    user_id,
-                    "❌ Не удалось найти созданное событие.",
-                    reply_markup=back_to_main_menu_keyboard(),
-                    parse_mode="HTML"
-                )
-            except ApiException as api_e:
-                logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+            send_message(
+                user_id,
+                "❌ Не удалось найти созданное событие.",
+                reply_markup=back_to_main_menu_keyboard(),
+                parse_mode="HTML"
+            )
             logging.error(f"Не удалось найти созданное событие для пользователя {user_id}.")
             return
 
-        event_id, event_datetime_str = event
-        event_datetime = datetime.fromisoformat(event_datetime_str)
-        reminder_time = event_datetime - timedelta(minutes=minutes)
+        starts_at = event.starts_at
+        remind_at = starts_at - minutes * 60
 
-        if reminder_time < datetime.now():
-            try:
-                bot.send_message(
-                    user_id,
-                    "❌ Время напоминания уже прошло. Пожалуйста, выберите другое время.",
-                    reply_markup=back_to_main_menu_keyboard(),
-                    parse_mode="HTML"
-                )
-            except ApiException as api_e:
-                logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        if remind_at < now_ts():
+            send_message(
+                user_id,
+                "❌ Время напоминания уже прошло. Пожалуйста, выберите другое время.",
+                reply_markup=back_to_main_menu_keyboard(),
+                parse_mode="HTML"
+            )
             logging.warning(f"Пользователь {user_id} попытался установить прошедшее напоминание.")
             return
 
         # Добавление напоминания в базу данных
-        create_reminders(conn, cursor, event_id, reminder_time)
+        create_reminders(event_id, remind_at)
 
         # Планирование напоминания
         schedule_notifications(event_id)
 
         # Подтверждение
+        timezone_name = user_timezone(user_id)
         confirmation_text = (
-            f"✅ Событие создано на {event_datetime.strftime('%d.%m.%Y %H:%M')}.\n"
-            f"Напоминание установлено за {minutes} минут до события на {reminder_time.strftime('%d.%m.%Y %H:%M')}."
+            f"✅ Событие создано на {format_ts(starts_at, timezone_name)}.\n"
+            f"Напоминание установлено за {minutes} минут до события на {format_ts(remind_at, timezone_name)}."
         )
-        bot.send_message(
+        send_message(
             user_id,
             confirmation_text,
             reply_markup=main_menu_keyboard(),
             parse_mode="HTML"
         )
         # Очистка состояния
-        user_states[user_id] = {'state': STATE_MAIN_MENU}
+        user_states.set(user_id, {'state': STATE_MAIN_MENU})
         logging.info(
             f"Пользователь {user_id} добавил дополнительное напоминание за {minutes} минут до события {event_id}.")
     except ValueError:
-        try:
-            msg = bot.send_message(
-                user_id,
-                "❌ Неверный ввод. Пожалуйста, введите целое число от 1 до 60:",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-            logging.warning(f"Пользователь {user_id} ввёл некорректное количество минут: {minutes_text}")
-            bot.register_next_step_handler(msg, get_custom_reminder_time)
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Неверный ввод. Пожалуйста, введите целое число от 1 до 60:",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
+        logging.warning(f"Пользователь {user_id} ввёл некорректное количество минут: {minutes_text}")
     except Exception as e:
         logging.error(f"Ошибка в get_custom_reminder_time для пользователя {user_id}: {e}")
-        try:
-            bot.send_message(
-                user_id,
-                "❌ Произошла ошибка при добавлении напоминания.",
-                reply_markup=back_to_main_menu_keyboard(),
-                parse_mode="HTML"
-            )
-        except ApiException as api_e:
-            logging.error(f"Ошибка при отправке сообщения об ошибке: {api_e}")
+        send_message(
+            user_id,
+            "❌ Произошла ошибка при добавлении напоминания.",
+            reply_markup=back_to_main_menu_keyboard(),
+            parse_mode="HTML"
+        )
 
 
 # ==============================
 # Основной цикл запуска бота
 # ==============================
 
-if __name__ == "__main__":
+# Обработчики текстовых шагов по состоянию диалога
+TEXT_STEP_HANDLERS = {
+    STATE_CREATE_EVENT_SELECT_USER: search_participants,
+    STATE_USER_DIRECTORY: search_users,
+    STATE_CREATE_EVENT_DESCRIPTION: get_event_description,
+    STATE_CREATE_EVENT_DATETIME: get_event_datetime,
+    STATE_ADD_CUSTOM_REMINDER: get_custom_reminder_time,
+    STATE_EDIT_EVENT_DESCRIPTION: edit_event_description,
+    STATE_EDIT_EVENT_DATETIME: edit_event_datetime,
+}
+
+
+@bot.message_handler(content_types=['text'])
+def text_handler(message):
+    """
+    Передаёт текст обработчику шага по сохранённому состоянию диалога. Это единственный путь
+    текстового ввода: состояние записывается до отправки подсказки, поэтому даже мгновенный
+    ответ пользователя попадает в нужный шаг, в том числе после перезапуска бота или на другой реплике.
+    """
+    state = user_states.get(message.from_user.id, {}).get('state')
+    handler = TEXT_STEP_HANDLERS.get(state)
+    if handler:
+        handler(message)
+
+
+def run_webhook():
+    """Регистрирует webhook в Telegram и принимает обновления встроенным HTTP-сервером."""
+    if WEBHOOK_URL:
+        # Регистрацию выполняет каждая реплика
+        register_webhook(bot, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET or None, WEBHOOK_WORKERS * 5)
+    updates = UpdateQueues(bot, workers=WEBHOOK_WORKERS)
+    server = WebhookServer(updates.enqueue, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET or None)
+    set_queue_depth_function('webhook', updates.depth)
+    updates.start()
+    try:
+        server.serve_forever()
+    finally:
+        server.shutdown()
+        updates.stop()
+
+
+def start_services():
+    """Запускает сервер метрик и рассылку напоминаний (своей части при запуске через supervisor.py)."""
+    if METRICS_PORT:
+        MetricsServer(METRICS_HOST, METRICS_PORT).start()
+    # Первая попытка получить аренду выполняется сразу: в режиме scheduler задачи напоминаний
+    # восстанавливаются из таблицы reminders до запуска планировщика. Если аренда у другой
+    # реплики, рассылка начнётся, когда эта реплика её получит.
+    reminder_lease.start()
+    scheduler.start()
+
+
+def run_worker(updates):
+    """
+    Процесс-обработчик supervisor.py: обрабатывает обновления из очереди updates, пока не
+    получит None, затем дожидается обработки принятых обновлений и отправки сообщений.
+    """
+    start_services()
+    queues = UpdateQueues(bot, workers=WORKER_THREADS, name=f"worker-{WORKER_INDEX}")
+    set_queue_depth_function('updates', queues.depth)
+    queues.start()
+    logging.info(f"Процесс-обработчик {WORKER_INDEX + 1} из {WORKERS} запущен.")
     while True:
-        try:
-            logging.info("Бот запущен и начал polling.")
-            bot.infinity_polling(timeout=60, long_polling_timeout=60)
-        except Exception as e:
-            logging.error(f"Polling failed: {e}")
-            logging.info("Перезапуск бота через 5 секунд...")
-            time.sleep(5)  # Пауза перед повторным запуском
\ No newline at end of file
+        update = updates.get()
+        if update is None:
+            break
+        queues.enqueue(update, block=True)
+    queues.stop()
+    # Новые напоминания в очередь больше не ставятся, а уже поставленные отправляются и
+    # записываются в журнал доставки, пока аренда у процесса. Аренда освобождается последней:
+    # иначе новый владелец разослал бы те же напоминания, пока этот процесс их ещё отправляет.
+    scheduler.shutdown(wait=True)
+    reminder_dispatcher.stop()
+    outbound_queue.close()
+    delivery_ledger.close()
+    reminder_lease.stop()
+    logging.info(f"Процесс-обработчик {WORKER_INDEX + 1} из {WORKERS} остановлен.")
+
+
+if __name__ == "__main__":
+    start_services()
+
+    if BOT_MODE == BOT_MODE_WEBHOOK:
+        run_webhook()
+    else:
+        while True:
+            try:
+                logging.info("Бот запущен и начал polling.")
+                bot.infinity_polling(timeout=60, long_polling_timeout=60)
+            except Exception as e:
+                logging.error(f"Polling failed: {e}")
+                logging.info("Перезапуск бота через 5 секунд...")
+                time.sleep(5)  # Пауза перед повторным запуском
\ No newline at end of file
@@ -0,0 +1,384 @@
+import bisect
+import functools
+import inspect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ==============================
+# Метрики в формате Prometheus
+# ==============================
+# Счётчики и гистограммы хранятся в памяти процесса и отдаются по HTTP (GET /metrics)
+# в текстовом формате Prometheus 0.0.4. Запись значения — одно обновление словаря под
+# блокировкой, поэтому метрики можно обновлять из любого потока и из цикла событий.
+
+# Границы корзин гистограмм длительности, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Границы корзин опоздания напоминаний, секунды
+LATENESS_BUCKETS = (0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.label_names}, получено {tuple(labels)}")
+        return tuple(labels[name] for name in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик."""
+
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                                for key, value in values]
+
+
+class Gauge(_Metric):
+    """Текущее значение, вычисляемое функцией в момент запроса метрик."""
+
+    metric_type = 'gauge'
+
+    def set_function(self, function, **labels):
+        """Задаёт функцию без аргументов, возвращающую значение для этого набора меток."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = function
+
+    def collect(self):
+        with self._lock:
+            functions = sorted(self._values.items(), key=lambda item: item[0])
+        lines = self.header()
+        for key, function in functions:
+            try:
+                value = function()
+            except Exception as e:
+                logging.error(f"Ошибка при вычислении метрики {self.name}: {e}")
+                continue
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам с накопленными суммой и количеством."""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Счётчики по корзинам (последняя — +Inf), сумма, количество
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def collect(self):
+        with self._lock:
+            values = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, [('le', _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса; render() формирует ответ для GET /metrics."""
+
+    def __init__(self):
+        self._metrics = []
+        self._names = set()
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._names:
+                raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+            self._names.add(metric.name)
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_DURATION = REGISTRY.register(Histogram(
+    'bot_handler_duration_seconds', "Время работы обработчика обновления Telegram.", ('handler',)))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    'bot_handler_errors_total', "Исключения, вышедшие из обработчика обновления.", ('handler',)))
+DB_QUERY_DURATION = REGISTRY.register(Histogram(
+    'bot_db_query_duration_seconds', "Время выполнения функции репозитория.", ('query',)))
+DB_QUERY_ERRORS = REGISTRY.register(Counter(
+    'bot_db_query_errors_total', "Функции репозитория, завершившиеся исключением.", ('query',)))
+API_REQUEST_DURATION = REGISTRY.register(Histogram(
+    'bot_api_request_duration_seconds', "Время запроса к Bot API.", ('method',)))
+API_REQUESTS = REGISTRY.register(Counter(
+    'bot_api_requests_total', "Запросы к Bot API по результату (ok или код ошибки).", ('method', 'outcome')))
+REMINDER_LATENESS = REGISTRY.register(Histogram(
+    'bot_reminder_lateness_seconds', "Опоздание отправки напоминания относительно его срока.", (),
+    buckets=LATENESS_BUCKETS))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'bot_queue_depth', "Количество элементов, ожидающих обработки, по очередям.", ('queue',)))
+USER_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'bot_user_cache_lookups_total', "Поиски пользователей в кэше по результату (hit или miss).", ('result',)))
+
+
+# ==============================
+# Инструментирование
+# ==============================
+
+def _observe(histogram, errors, started, failed, labels):
+    histogram.observe(time.perf_counter() - started, **labels)
+    if failed:
+        errors.inc(**labels)
+
+
+def _timed(histogram, errors, labels, function):
+    """Оборачивает синхронную или асинхронную функцию замером времени и подсчётом исключений."""
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            started, failed = time.perf_counter(), True
+            try:
+                result = await function(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                _observe(histogram, errors, started, failed, labels)
+        return async_wrapper
+
+    if inspect.isgeneratorfunction(function):
+        # Время генератора — время его полного прочтения
+        @functools.wraps(function)
+        def generator_wrapper(*args, **kwargs):
+            started, failed = time.perf_counter(), True
+            try:
+                yield from function(*args, **kwargs)
+                failed = False
+            finally:
+                _observe(histogram, errors, started, failed, labels)
+        return generator_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        started, failed = time.perf_counter(), True
+        try:
+            result = function(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            _observe(histogram, errors, started, failed, labels)
+    return wrapper
+
+
+def observe_handler(function):
+    """Декоратор обработчика обновления: время работы и исключения под именем функции."""
+    return _timed(HANDLER_DURATION, HANDLER_ERRORS, {'handler': function.__name__}, function)
+
+
+def timed_handler_call(name, handler, *args):
+    """Вызывает handler(*args) с замером под именем name; корутина замеряется до её завершения."""
+    started = time.perf_counter()
+    try:
+        result = handler(*args)
+    except BaseException:
+        _observe(HANDLER_DURATION, HANDLER_ERRORS, started, True, {'handler': name})
+        raise
+    if inspect.isawaitable(result):
+        return _await_observed(name, started, result)
+    _observe(HANDLER_DURATION, HANDLER_ERRORS, started, False, {'handler': name})
+    return result
+
+
+async def _await_observed(name, started, awaitable):
+    failed = True
+    try:
+        result = await awaitable
+        failed = False
+        return result
+    finally:
+        _observe(HANDLER_DURATION, HANDLER_ERRORS, started, failed, {'handler': name})
+
+
+# Имена (__qualname__) всех функций, обёрнутых timed_query: query_plans.py требует пробу для каждой
+TIMED_QUERIES = set()
+
+
+def timed_query(function):
+    """Декоратор функции репозитория: время выполнения и исключения под её именем."""
+    TIMED_QUERIES.add(function.__qualname__)
+    return _timed(DB_QUERY_DURATION, DB_QUERY_ERRORS, {'query': function.__qualname__}, function)
+
+
+# Методы Bot API, вызовы которых замеряются
+API_METHODS = ('send_message', 'edit_message_text', 'delete_message', 'answer_callback_query')
+
+
+def _api_outcome(error):
+    return str(getattr(error, 'error_code', None) or type(error).__name__)
+
+
+def instrument_bot(bot, methods=API_METHODS):
+    """Заменяет методы Bot API экземпляра bot (TeleBot или AsyncTeleBot) обёртками с замером времени."""
+    for method_name in methods:
+        method = getattr(bot, method_name, None)
+        if method is not None:
+            setattr(bot, method_name, _timed_api_method(method_name, method))
+    return bot
+
+
+def _timed_api_method(method_name, method):
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await method(*args, **kwargs)
+            except Exception as e:
+                _observe_api(method_name, started, _api_outcome(e))
+                raise
+            _observe_api(method_name, started, 'ok')
+            return result
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        except Exception as e:
+            _observe_api(method_name, started, _api_outcome(e))
+            raise
+        _observe_api(method_name, started, 'ok')
+        return result
+    return wrapper
+
+
+def _observe_api(method_name, started, outcome):
+    API_REQUEST_DURATION.observe(time.perf_counter() - started, method=method_name)
+    API_REQUESTS.inc(method=method_name, outcome=outcome)
+
+
+def observe_reminder_lateness(remind_at, sent_at=None):
+    """Записывает опоздание отправки напоминания со сроком remind_at (секунды UTC)."""
+    sent_at = time.time() if sent_at is None else sent_at
+    REMINDER_LATENESS.observe(max(sent_at - remind_at, 0.0))
+
+
+def observe_user_cache_lookups(hits, misses):
+    """Записывает попадания и промахи одного поиска в кэше пользователей."""
+    if hits:
+        USER_CACHE_LOOKUPS.inc(hits, result='hit')
+    if misses:
+        USER_CACHE_LOOKUPS.inc(misses, result='miss')
+
+
+def set_queue_depth_function(queue_name, function):
+    """Регистрирует функцию, возвращающую текущую длину очереди queue_name."""
+    QUEUE_DEPTH.set_function(function, queue=queue_name)
+
+
+# ==============================
+# HTTP-сервер метрик
+# ==============================
+
+class MetricsServer:
+    """Отдаёт метрики REGISTRY по GET /metrics из фонового потока."""
+
+    def __init__(self, host, port, registry=REGISTRY):
+        self._registry = registry
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        host, port = self._server.server_address[:2]
+        logging.info(f"Метрики доступны по адресу http://{host}:{port}/metrics")
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def _handler_class(self):
+        registry = self._registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,262 @@
+import argparse
+import logging
+from datetime import datetime
+
+from database import init_database, get_connection
+
+# ==============================
+# Версионированные миграции схемы
+# ==============================
+# Каждая миграция — (версия, описание, список SQL-команд). Миграции применяются
+# строго по возрастанию версии, каждая в отдельной транзакции. Уже выпущенные
+# миграции не редактируются: изменения схемы добавляются новой записью в конец.
+
+MIGRATIONS = [
+    (1, "Базовая схема: пользователи, события, напоминания", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            first_name TEXT NOT NULL,
+            last_name TEXT,
+            username TEXT,
+            telegram_profile TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            creator_id INTEGER NOT NULL,
+            participant_id INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            event_datetime TEXT NOT NULL,
+            FOREIGN KEY (creator_id) REFERENCES users(user_id),
+            FOREIGN KEY (participant_id) REFERENCES users(user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS reminders (
+            reminder_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            reminder_time TEXT NOT NULL,
+            FOREIGN KEY (event_id) REFERENCES events(event_id)
+        )
+        ''',
+    ]),
+    (2, "Индексы для выборок событий и напоминаний", [
+        "CREATE INDEX IF NOT EXISTS idx_events_creator_datetime ON events (creator_id, event_datetime)",
+        "CREATE INDEX IF NOT EXISTS idx_events_participant_datetime ON events (participant_id, event_datetime)",
+        "CREATE INDEX IF NOT EXISTS idx_reminders_event ON reminders (event_id)",
+    ]),
+    (3, "Длительность событий для проверки пересечений интервалов", [
+        "ALTER TABLE events ADD COLUMN duration_minutes INTEGER NOT NULL DEFAULT 60",
+        "ALTER TABLE events ADD COLUMN event_end TEXT",
+        "UPDATE events SET event_end = strftime('%Y-%m-%dT%H:%M:%S', event_datetime, '+60 minutes')",
+    ]),
+    (4, "Индекс напоминаний по времени срабатывания", [
+        "CREATE INDEX IF NOT EXISTS idx_reminders_time ON reminders (reminder_time)",
+    ]),
+    (5, "Состояния незавершённых диалогов", [
+        '''
+        CREATE TABLE IF NOT EXISTS conversation_states (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_conversation_states_updated ON conversation_states (updated_at)",
+    ]),
+    (6, "Ключи поиска пользователей по началу имени и username", [
+        "ALTER TABLE users ADD COLUMN name_key TEXT",
+        "ALTER TABLE users ADD COLUMN username_key TEXT",
+        # Те же значения вычисляют name_search_key() и username_search_key() в repository.py
+        "UPDATE users SET name_key = casefold(trim(first_name || ' ' || coalesce(last_name, '')))",
+        "UPDATE users SET username_key = casefold(username) WHERE username IS NOT NULL AND username != 'No Username'",
+        "CREATE INDEX IF NOT EXISTS idx_users_name_key ON users (name_key)",
+        "CREATE INDEX IF NOT EXISTS idx_users_username_key ON users (username_key)",
+    ]),
+    (7, "Время событий и напоминаний в секундах UTC, часовой пояс пользователя", [
+        "ALTER TABLE users ADD COLUMN timezone TEXT NOT NULL DEFAULT 'Europe/Moscow'",
+        # SQLite не меняет тип столбца, поэтому таблицы пересоздаются. Прежние строки
+        # хранили местное время бота, который работал по московскому времени.
+        '''
+        CREATE TABLE events_new (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            creator_id INTEGER NOT NULL,
+            participant_id INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            starts_at INTEGER NOT NULL,
+            ends_at INTEGER NOT NULL,
+            duration_minutes INTEGER NOT NULL DEFAULT 60,
+            FOREIGN KEY (creator_id) REFERENCES users(user_id),
+            FOREIGN KEY (participant_id) REFERENCES users(user_id)
+        )
+        ''',
+        '''
+        INSERT INTO events_new (event_id, creator_id, participant_id, description, starts_at, ends_at,
+                                duration_minutes)
+        SELECT event_id, creator_id, participant_id, description,
+               iso_local_to_ts(event_datetime, 'Europe/Moscow'),
+               iso_local_to_ts(event_datetime, 'Europe/Moscow') + duration_minutes * 60,
+               duration_minutes
+        FROM events
+        ''',
+        '''
+        CREATE TABLE reminders_new (
+            reminder_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id INTEGER NOT NULL,
+            remind_at INTEGER NOT NULL,
+            FOREIGN KEY (event_id) REFERENCES events(event_id)
+        )
+        ''',
+        '''
+        INSERT INTO reminders_new (reminder_id, event_id, remind_at)
+        SELECT reminder_id, event_id, iso_local_to_ts(reminder_time, 'Europe/Moscow')
+        FROM reminders
+        ''',
+        # Счётчики AUTOINCREMENT переносятся, чтобы ID удалённых событий не выдавались повторно
+        "DELETE FROM sqlite_sequence WHERE name IN ('events_new', 'reminders_new')",
+        "INSERT INTO sqlite_sequence (name, seq) SELECT name || '_new', seq FROM sqlite_sequence "
+        "WHERE name IN ('events', 'reminders')",
+        "DROP TABLE reminders",
+        "DROP TABLE events",
+        "ALTER TABLE events_new RENAME TO events",
+        "ALTER TABLE reminders_new RENAME TO reminders",
+        "CREATE INDEX idx_events_creator_starts ON events (creator_id, starts_at)",
+        "CREATE INDEX idx_events_participant_starts ON events (participant_id, starts_at)",
+        "CREATE INDEX idx_reminders_event ON reminders (event_id)",
+        "CREATE INDEX idx_reminders_remind_at ON reminders (remind_at)",
+    ]),
+    (8, "Аренды для выбора реплики, рассылающей напоминания", [
+        '''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            heartbeat_at REAL NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        ''',
+    ]),
+    (9, "Журнал доставки напоминаний получателям", [
+        '''
+        CREATE TABLE IF NOT EXISTS reminder_deliveries (
+            reminder_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            sent_at INTEGER,
+            updated_at INTEGER NOT NULL,
+            PRIMARY KEY (reminder_id, user_id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_reminder_deliveries_updated ON reminder_deliveries (updated_at)",
+    ]),
+    (10, "Серии повторяющихся событий", [
+        '''
+        CREATE TABLE IF NOT EXISTS event_series (
+            series_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            creator_id INTEGER NOT NULL,
+            participant_id INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            starts_at INTEGER NOT NULL,
+            duration_minutes INTEGER NOT NULL,
+            timezone TEXT NOT NULL,
+            frequency TEXT NOT NULL,
+            until_at INTEGER,
+            occurrence_count INTEGER,
+            expanded_count INTEGER NOT NULL DEFAULT 0,
+            next_starts_at INTEGER,
+            FOREIGN KEY (creator_id) REFERENCES users(user_id),
+            FOREIGN KEY (participant_id) REFERENCES users(user_id)
+        )
+        ''',
+        # Серии, вхождения которых ещё не созданы до горизонта; у законченных серий next_starts_at — NULL
+        "CREATE INDEX IF NOT EXISTS idx_event_series_next ON event_series (next_starts_at)",
+        "ALTER TABLE events ADD COLUMN series_id INTEGER REFERENCES event_series(series_id)",
+        "CREATE INDEX IF NOT EXISTS idx_events_series ON events (series_id, starts_at)",
+    ]),
+    (11, "Несколько участников у события и серии", [
+        # Интервал события продублирован, чтобы пересечения и страницы событий участника
+        # выбирались по индексу (user_id, starts_at) без чтения всех его событий
+        '''
+        CREATE TABLE IF NOT EXISTS event_participants (
+            event_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            position INTEGER NOT NULL DEFAULT 0,
+            starts_at INTEGER NOT NULL,
+            ends_at INTEGER NOT NULL,
+            PRIMARY KEY (event_id, user_id),
+            FOREIGN KEY (event_id) REFERENCES events(event_id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        ''',
+        '''
+        INSERT OR IGNORE INTO event_participants (event_id, user_id, position, starts_at, ends_at)
+        SELECT event_id, participant_id, 0, starts_at, ends_at FROM events
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_event_participants_user_starts "
+        "ON event_participants (user_id, starts_at, event_id)",
+        '''
+        CREATE TABLE IF NOT EXISTS series_participants (
+            series_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            position INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (series_id, user_id),
+            FOREIGN KEY (series_id) REFERENCES event_series(series_id),
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        ''',
+        '''
+        INSERT OR IGNORE INTO series_participants (series_id, user_id, position)
+        SELECT series_id, participant_id, 0 FROM event_series
+        ''',
+    ]),
+]
+
+
+def get_schema_version(conn):
+    """Возвращает текущую версию схемы (0 для пустой базы)."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )
+    ''')
+    conn.commit()
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def apply_migrations(conn=None):
+    """Применяет все ещё не применённые миграции и возвращает итоговую версию схемы."""
+    conn = conn or get_connection()
+    current = get_schema_version(conn)
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now().isoformat())
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logging.error(f"Ошибка при применении миграции {version}: {description}")
+            raise
+        current = version
+        logging.info(f"Применена миграция {version}: {description}")
+    return current
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(description="Миграции схемы базы данных бота.")
+    parser.add_argument("--database", default="bot_database.db", help="Путь к файлу базы данных")
+    args = parser.parse_args()
+
+    init_database(args.database)
+    print(f"Версия схемы: {apply_migrations()}")
@@ -0,0 +1,331 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+from telebot.apihelper import ApiTelegramException
+
+# ==============================
+# Очередь исходящих сообщений
+# ==============================
+
+# Лимиты Telegram: около 30 сообщений в секунду на бота и около одного в секунду на чат
+# (короткие серии в один чат допускаются)
+GLOBAL_MESSAGES_PER_SECOND = 30
+CHAT_MESSAGES_PER_SECOND = 1
+CHAT_BURST = 3
+
+# Приоритеты: меньшее значение отправляется раньше
+PRIORITY_INTERACTIVE = 0  # Ответы на действия пользователя
+PRIORITY_REMINDER = 1  # Напоминания о событиях
+
+# Количество потоков, выполняющих HTTP-запросы к Telegram
+SENDER_THREADS = 8
+# Число попыток при сетевых ошибках и ошибках сервера Telegram (ответ 429 попыткой не считается)
+MAX_ATTEMPTS = 5
+# Сетевые ошибки и таймауты, после которых отправку стоит повторить. Остальные исключения
+# (ошибки в коде, неверные аргументы) не повторяются: сообщение сразу завершается ошибкой.
+NETWORK_ERRORS = (RequestsConnectionError, RequestsTimeout, ConnectionError, TimeoutError)
+RETRY_BACKOFF_SECONDS = 1.0
+# Как часто удалять из памяти вёдра давно неактивных чатов
+BUCKET_PRUNE_INTERVAL = 60
+
+
+class MessageCancelled(Exception):
+    """Сообщение снято с очереди до отправки (OutboundQueue.cancel)."""
+
+
+class TokenBucket:
+    """Ведро токенов: пополняется со скоростью rate токенов в секунду, вмещает не более capacity."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def wait_time(self, now):
+        """Возвращает, сколько секунд осталось до появления токена."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def block(self, seconds, now):
+        """Запрещает отправку на seconds секунд (ответ 429 с retry_after)."""
+        self.wait_time(now)
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class _OutboundMessage:
+    __slots__ = ('priority', 'seq', 'chat_id', 'text', 'kwargs', 'future', 'attempts', 'cancelled')
+
+    def __init__(self, priority, seq, chat_id, text, kwargs):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.future = Future()
+        self.attempts = 0
+        self.cancelled = False
+
+
+class OutboundQueue:
+    """
+    Отправляет сообщения с максимально допустимой скоростью: общее ведро токенов на бота,
+    отдельное ведро на каждый чат, приоритеты и повтор после ответа 429 через retry_after.
+
+    У каждого чата своя очередь FIFO, и в чат одновременно отправляется не более одного
+    сообщения, поэтому порядок сообщений в чате сохраняется. Планировщик выбирает среди
+    чатов, у которых есть свободный токен, чат с самым приоритетным первым сообщением.
+    Каждый непустой чат находится ровно в одном месте: в куче готовых, в куче отложенных
+    или в процессе отправки (_in_flight).
+    """
+
+    def __init__(self, bot, global_rate=GLOBAL_MESSAGES_PER_SECOND, chat_rate=CHAT_MESSAGES_PER_SECOND,
+                 chat_burst=CHAT_BURST, sender_threads=SENDER_THREADS):
+        self._bot = bot
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        # Общее ведро не накапливает запас: иначе после простоя в одну секунду уложилось бы вдвое больше сообщений
+        self._global = TokenBucket(global_rate, 1, time.monotonic())
+        self._buckets = {}
+        self._queues = {}  # chat_id -> deque сообщений, ожидающих отправки
+        self._ready = []  # Куча (приоритет, порядковый номер, chat_id) по первому сообщению чата
+        self._deferred = []  # Куча (момент готовности, chat_id) для чатов без свободных токенов
+        self._in_flight = set()  # Чаты, первое сообщение которых сейчас отправляется
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._running = True
+        self._last_prune = time.monotonic()
+        self._executor = ThreadPoolExecutor(max_workers=sender_threads, thread_name_prefix="outbound")
+        self._thread = threading.Thread(target=self._run, name="outbound-queue", daemon=True)
+        self._thread.start()
+
+    def submit(self, chat_id, text, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Ставит сообщение в очередь и возвращает Future с результатом bot.send_message."""
+        return self.submit_many([(chat_id, text)], priority, **kwargs)[0]
+
+    def submit_many(self, messages, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """
+        Ставит в очередь пачку сообщений [(chat_id, text), ...] с общими параметрами за один
+        захват блокировки и возвращает список Future в том же порядке.
+        """
+        messages = [_OutboundMessage(priority, next(self._seq), chat_id, text, kwargs) for chat_id, text in messages]
+        with self._condition:
+            for message in messages:
+                queue = self._queues.get(message.chat_id)
+                if queue is None:
+                    self._queues[message.chat_id] = deque([message])
+                    heapq.heappush(self._ready, (message.priority, message.seq, message.chat_id))
+                else:
+                    queue.append(message)
+            if messages:
+                self._condition.notify()
+        return [message.future for message in messages]
+
+    def send_message(self, chat_id, text, priority=PRIORITY_INTERACTIVE, wait=True, **kwargs):
+        """
+        Отправляет сообщение через очередь. При wait=True дожидается отправки и возвращает
+        сообщение Telegram (или поднимает исключение), иначе возвращает Future.
+        """
+        future = self.submit(chat_id, text, priority, **kwargs)
+        if wait:
+            return future.result()
+        future.add_done_callback(self._log_failure(chat_id))
+        return future
+
+    def send_messages(self, messages, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Ставит пачку сообщений [(chat_id, text), ...] в очередь без ожидания и возвращает список Future."""
+        messages = list(messages)
+        futures = self.submit_many(messages, priority, **kwargs)
+        for (chat_id, _), future in zip(messages, futures):
+            future.add_done_callback(self._log_failure(chat_id))
+        return futures
+
+    def depth(self):
+        """Возвращает количество сообщений, ожидающих отправки."""
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def cancel(self, priority):
+        """
+        Снимает с очереди ещё не отправленные сообщения с приоритетом priority; их Future
+        завершаются исключением MessageCancelled. Уже начатая отправка доводится до конца,
+        но после ответа 429 или сетевой ошибки не повторяется. Возвращает число снятых сообщений.
+        """
+        cancelled = []
+        with self._condition:
+            for chat_id, queue in list(self._queues.items()):
+                kept = deque()
+                for index, message in enumerate(queue):
+                    if message.priority != priority:
+                        kept.append(message)
+                    elif index == 0 and chat_id in self._in_flight:
+                        message.cancelled = True
+                        kept.append(message)
+                    else:
+                        cancelled.append(message)
+                if kept:
+                    self._queues[chat_id] = kept
+                else:
+                    del self._queues[chat_id]
+            # Первые сообщения чатов могли смениться: кучи строятся заново по оставшимся чатам
+            self._deferred = [(when, chat_id) for when, chat_id in self._deferred if chat_id in self._queues]
+            heapq.heapify(self._deferred)
+            deferred = {chat_id for _, chat_id in self._deferred}
+            self._ready = [(queue[0].priority, queue[0].seq, chat_id) for chat_id, queue in self._queues.items()
+                           if chat_id not in deferred and chat_id not in self._in_flight]
+            heapq.heapify(self._ready)
+            self._condition.notify()
+        for message in cancelled:
+            message.future.set_exception(MessageCancelled())
+        return len(cancelled)
+
+    def close(self):
+        """Останавливает очередь после отправки уже поставленных сообщений."""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    @staticmethod
+    def _log_failure(chat_id):
+        def callback(future):
+            if future.exception() and not isinstance(future.exception(), MessageCancelled):
+                logging.error(f"Не удалось отправить сообщение в чат {chat_id}: {future.exception()}")
+        return callback
+
+    def _bucket(self, chat_id, now):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst, now)
+        return bucket
+
+    def _prune(self, now):
+        """Удаляет вёдра неактивных чатов: полное ведро создастся заново при необходимости."""
+        self._last_prune = now
+        idle = [chat_id for chat_id, bucket in self._buckets.items()
+                if chat_id not in self._queues and bucket.wait_time(now) == 0 and bucket.tokens >= bucket.capacity]
+        for chat_id in idle:
+            del self._buckets[chat_id]
+
+    def _schedule(self, chat_id, not_before=None):
+        """Возвращает непустой чат в кучу готовых или отложенных."""
+        queue = self._queues[chat_id]
+        if not queue:
+            del self._queues[chat_id]
+        elif not_before is not None:
+            heapq.heappush(self._deferred, (not_before, chat_id))
+        else:
+            head = queue[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                while self._deferred and self._deferred[0][0] <= now:
+                    self._schedule(heapq.heappop(self._deferred)[1])
+                if now - self._last_prune > BUCKET_PRUNE_INTERVAL:
+                    self._prune(now)
+
+                if not self._running and not self._queues:
+                    return
+
+                message = None
+                global_wait = self._global.wait_time(now)
+                if global_wait == 0:
+                    message = self._next_ready(now)
+
+                if message is None:
+                    timeouts = [when - now for when, _ in self._deferred[:1]]
+                    if global_wait > 0 and self._ready:
+                        timeouts.append(global_wait)
+                    self._condition.wait(min(timeouts) if timeouts else None)
+                    continue
+
+                self._global.consume()
+                self._buckets[message.chat_id].consume()
+                self._in_flight.add(message.chat_id)
+            self._executor.submit(self._send, message)
+
+    def _next_ready(self, now):
+        """Извлекает первое сообщение чата, которому сейчас разрешена отправка."""
+        while self._ready:
+            _, _, chat_id = heapq.heappop(self._ready)
+            chat_wait = self._bucket(chat_id, now).wait_time(now)
+            if chat_wait > 0:
+                heapq.heappush(self._deferred, (now + chat_wait, chat_id))
+                continue
+            # Сообщение остаётся в очереди чата до завершения отправки: чат считается занятым
+            return self._queues[chat_id][0]
+        return None
+
+    def _send(self, message):
+        result, error = None, None
+        if message.cancelled:
+            # Сообщение снято с очереди, пока ждало свободного потока отправки
+            error = MessageCancelled()
+        else:
+            try:
+                result = self._bot.send_message(message.chat_id, message.text, **message.kwargs)
+            except Exception as e:
+                error = e
+
+        with self._condition:
+            now = time.monotonic()
+            chat_id = message.chat_id
+            self._in_flight.discard(chat_id)
+            retry_after = self._retry_after(error)
+            retrying = retry_after is not None or (
+                    error is not None and self._is_retryable(error) and message.attempts + 1 < MAX_ATTEMPTS)
+            if retry_after is not None:
+                # Лимит превышен: чат блокируется на retry_after
+                logging.warning(f"Telegram ограничил отправку в чат {chat_id} на {retry_after} с.")
+                self._bucket(chat_id, now).block(retry_after, now)
+            if retrying and message.cancelled:
+                # Сообщение снято с очереди во время отправки: вместо повтора оно завершается отменой
+                error, retrying = MessageCancelled(), False
+            if not retrying:
+                self._queues[chat_id].popleft()
+                self._schedule(chat_id)
+            elif retry_after is not None:
+                # Попытка не засчитывается, сообщение остаётся первым в очереди чата
+                self._schedule(chat_id)
+            else:
+                message.attempts += 1
+                logging.warning(f"Повтор отправки в чат {chat_id} (попытка {message.attempts + 1}): {error}")
+                self._schedule(chat_id, not_before=now + RETRY_BACKOFF_SECONDS * 2 ** message.attempts)
+            self._condition.notify()
+
+        if retrying:
+            return
+        if error is not None and not isinstance(error, (ApiTelegramException, MessageCancelled, *NETWORK_ERRORS)):
+            logging.error(f"Сообщение в чат {message.chat_id} не отправлено из-за ошибки: {error!r}", exc_info=error)
+        if error is not None:
+            message.future.set_exception(error)
+        else:
+            message.future.set_result(result)
+
+    @staticmethod
+    def _retry_after(error):
+        if isinstance(error, ApiTelegramException) and error.error_code == 429:
+            return error.result_json.get('parameters', {}).get('retry_after', 1)
+        return None
+
+    @staticmethod
+    def _is_retryable(error):
+        if isinstance(error, ApiTelegramException):
+            return error.error_code >= 500
+        return isinstance(error, NETWORK_ERRORS)
@@ -0,0 +1,147 @@
+import inspect
+
+import repository
+from database import init_database, get_connection
+from metrics import TIMED_QUERIES
+from migrations import apply_migrations
+
+# ==============================
+# Проверка использования индексов
+# ==============================
+# Каждая функция репозитория, обёрнутая timed_query, выполняется на пустой базе с
+# аргументами из QUERY_PROBES, а планы её запросов проверяются через EXPLAIN QUERY PLAN.
+# Функция без пробы считается нарушением: новый запрос не останется непроверенным.
+
+# 2030-01-01 12:00 UTC — момент времени для аргументов-проб
+_PROBE_TS = 1893499200
+
+# Аргументы для каждой функции репозитория по её __qualname__ ("Repository.<метод>" —
+# метод экземпляра repository.repo). Пробы выполняются по порядку: вставки идут первыми,
+# чтобы следующим запросам было что читать. Выборки напоминаний проверяются с частью
+# shard: их запрос сложнее запроса без неё
+QUERY_PROBES = {
+    'add_user': (1, "probe", "", "probe", "probe"),
+    'update_user_timezone': (1, 'Europe/Moscow'),
+    'create_event': (1, [2, 3], "probe", _PROBE_TS),
+    'create_reminders': (1, _PROBE_TS - 3600),
+    'create_reminders_many': (1, [_PROBE_TS - 7200]),
+    'insert_events_many': ([(10 ** 6, 1, (2, 3), "probe", _PROBE_TS + 86400, 60)],),
+    'insert_reminders_many': ([(10 ** 6, _PROBE_TS + 82800)],),
+    'select_event_data': (1,),
+    'select_reminder_time': (1,),
+    'select_user_name': (1,),
+    'select_user_data': (1,),
+    'select_user_by_id': (1,),
+    'update_user': (1, "probe", "", "No Username", "No Username"),
+    'select_users_fnu': ([1, 2, 3],),
+    'select_users': (),
+    'select_users_page': (20, 1, True, "ив", 1),
+    'select_event_by_user': (1,),
+    'select_fnu': (1,),
+    'get_creator_from_event': (1,),
+    'select_creator_participant': (1,),
+    'get_event_data': (1,),
+    'select_conflicting_event': ((1, 2, 3), _PROBE_TS, 60, 1),
+    'select_event_members': (1,),
+    'select_conversation_state': (1, 0.0),
+    'upsert_conversation_state': (1, '{}', 0.0),
+    'delete_conversation_state': (1,),
+    'delete_expired_conversation_states': (0.0,),
+    'select_events_page': (1, 5, (_PROBE_TS, 1)),
+    'select_pending_reminder_times': (_PROBE_TS, 1000, (0, 2)),
+    'select_next_reminder_time': (_PROBE_TS, (0, 2)),
+    'select_events_with_reminders': (),
+    'select_last_event_id_assigned': (),
+    'select_due_reminders': (_PROBE_TS, _PROBE_TS + 60, (0, 2)),
+    'acquire_lease': ("probe", "probe", 0.0, 15),
+    'release_lease': ("probe", "probe"),
+    'claim_reminder_deliveries': ([(1, 1), (1, 2)], _PROBE_TS, 3),
+    'update_reminder_deliveries': ([('sent', _PROBE_TS, _PROBE_TS, 1, 1)],),
+    'delete_old_reminder_deliveries': (_PROBE_TS,),
+    'Repository.get_user': (1,),
+    'Repository.get_users': ([1, 2, 3],),
+    'Repository.get_event': (1,),
+    'Repository.get_events': ([1, 2, 3],),
+    'Repository.get_reminders': ([1, 2, 3],),
+    'Repository.get_participants': ([1, 2, 3],),
+    'Repository.get_recipients': ([1, 2, 3],),
+    'Repository.get_deliveries': ([1, 2, 3],),
+    'update_event': ("probe", _PROBE_TS, 1),
+    'create_event_with_reminders': (1, [2, 3], "probe", _PROBE_TS, 60, [_PROBE_TS - 3600]),
+    'update_event_with_reminders': ((1, 2), "probe", _PROBE_TS + 86400, 1, 60, [_PROBE_TS + 82800]),
+    'create_event_series': (1, [2, 3], "probe", _PROBE_TS, 60, 'Europe/Moscow', ('weekly', None, 3), _PROBE_TS),
+    'expand_event_series': (_PROBE_TS,),
+    'select_event_series_id': (1,),
+    'delete_event_series': (1,),
+    'delete_reminders': (1,),
+    'delete_event': (1,),
+    'delete_event_with_reminders': (1,),
+}
+
+# Запросы, которым полный просмотр таблицы необходим по смыслу (вывод всего списка или
+# поиск в служебной таблице sqlite_sequence, где строк по одной на таблицу)
+FULL_SCAN_ALLOWED = {'select_users', 'select_user_by_id', 'select_events_with_reminders',
+                     'select_last_event_id_assigned'}
+
+
+def _probe_target(name):
+    """Возвращает функцию репозитория по её __qualname__."""
+    owner, _, attribute = name.rpartition('.')
+    return getattr(repository.repo if owner == 'Repository' else repository, attribute)
+
+
+def _plan_uses_full_scan(conn, statement):
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {statement}").fetchall()
+    details = [row[-1] for row in plan]
+    # Просмотр уже ограниченных подзапросов (CO-ROUTINE/MATERIALIZE) полным просмотром таблицы не является
+    subqueries = {detail.split()[-1] for detail in details if detail.startswith(("CO-ROUTINE", "MATERIALIZE"))}
+    for detail in details:
+        if not detail.startswith("SCAN") or "INDEX" in detail:
+            continue
+        source = detail.split()[1]
+        if source in subqueries or source.startswith("(subquery"):
+            continue
+        return True, details
+    return False, details
+
+
+def check_query_plans():
+    """
+    Выполняет все запросы репозитория на пустой базе и возвращает нарушения (имя, запрос, план):
+    запросы, читающие таблицу целиком, и функции timed_query без пробы (запрос и план — None).
+    """
+    violations = [(name, None, None) for name in sorted(TIMED_QUERIES - QUERY_PROBES.keys())]
+
+    init_database(":memory:")
+    conn = get_connection()
+    apply_migrations(conn)
+
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        for name, args in QUERY_PROBES.items():
+            statements.clear()
+            result = _probe_target(name)(*args)
+            if inspect.isgenerator(result):
+                list(result)
+            for statement in list(statements):
+                if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                    continue
+                full_scan, details = _plan_uses_full_scan(conn, statement)
+                if full_scan and name not in FULL_SCAN_ALLOWED:
+                    violations.append((name, " ".join(statement.split()), details))
+    finally:
+        conn.set_trace_callback(None)
+    return violations
+
+
+if __name__ == "__main__":
+    problems = check_query_plans()
+    for name, statement, details in problems:
+        if statement is None:
+            print(f"{name}: нет пробы в QUERY_PROBES")
+        else:
+            print(f"{name}: полный просмотр таблицы\n  {statement}\n  {details}")
+    if problems:
+        raise SystemExit(1)
+    print("Все запросы репозитория используют индексы.")
@@ -0,0 +1,105 @@
+import calendar
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from timezones import local_to_ts, ts_to_local
+
+# ==============================
+# Повторяющиеся события
+# ==============================
+# Серия хранится одной строкой в таблице event_series: первое вхождение, правило повторения
+# и часовой пояс создателя. Вхождения считаются в местном времени этого пояса, поэтому
+# еженедельная встреча в 10:00 остаётся в 10:00 и после перехода на летнее время.
+# Вхождения (строки events с напоминаниями) создаются не сразу, а только на ближайший
+# горизонт (см. expand_event_series в repository.py), который сдвигается периодической задачей.
+
+FREQUENCY_DAILY = 'daily'
+FREQUENCY_WEEKLY = 'weekly'
+FREQUENCY_MONTHLY = 'monthly'
+
+# Слова, которыми правило повторения задаётся при вводе даты и времени события
+FREQUENCY_NAMES = {
+    'ежедневно': FREQUENCY_DAILY,
+    'daily': FREQUENCY_DAILY,
+    'еженедельно': FREQUENCY_WEEKLY,
+    'weekly': FREQUENCY_WEEKLY,
+    'ежемесячно': FREQUENCY_MONTHLY,
+    'monthly': FREQUENCY_MONTHLY,
+}
+FREQUENCY_TITLES = {
+    FREQUENCY_DAILY: 'ежедневно',
+    FREQUENCY_WEEKLY: 'еженедельно',
+    FREQUENCY_MONTHLY: 'ежемесячно',
+}
+UNTIL_WORDS = ('до', 'until')
+DATE_FORMAT = '%d.%m.%Y'
+
+# Максимальное число вхождений, которое можно задать при создании серии
+MAX_OCCURRENCES = 1000
+# На сколько дней вперёд создаются вхождения серий. Горизонт должен быть больше самого
+# раннего стандартного напоминания (за сутки), иначе оно окажется в прошлом к моменту
+# создания вхождения.
+SERIES_HORIZON_DAYS = 14
+
+# Правило повторения: частота и необязательные граница (секунды UTC) и число вхождений
+Recurrence = namedtuple('Recurrence', 'frequency until_at count')
+
+
+def split_recurrence(text, timezone_name):
+    """
+    Отделяет от ввода "DD.MM.YYYY HH:MM [минуты] [частота [N | до DD.MM.YYYY]]" правило
+    повторения и возвращает (остаток ввода, Recurrence или None). Дата "до" включается
+    целиком и понимается в поясе timezone_name. ValueError, если правило не разобрано.
+    """
+    parts = text.split()
+    for index, part in enumerate(parts):
+        frequency = FREQUENCY_NAMES.get(part.casefold())
+        if frequency:
+            break
+    else:
+        return text, None
+
+    rest = parts[index + 1:]
+    until_at = count = None
+    if len(rest) == 1 and rest[0].isdigit():
+        count = int(rest[0])
+        if not (1 <= count <= MAX_OCCURRENCES):
+            raise ValueError("Число повторений вне допустимого диапазона.")
+    elif len(rest) == 2 and rest[0].casefold() in UNTIL_WORDS:
+        until_date = datetime.strptime(rest[1], DATE_FORMAT)
+        until_at = local_to_ts(until_date + timedelta(days=1), timezone_name) - 1
+    elif rest:
+        raise ValueError("Ожидается число повторений или \"до DD.MM.YYYY\".")
+    return " ".join(parts[:index]), Recurrence(frequency, until_at, count)
+
+
+def _add_months(local_datetime, months):
+    month_index = local_datetime.month - 1 + months
+    year, month = local_datetime.year + month_index // 12, month_index % 12 + 1
+    # 31-е число в коротком месяце переносится на последний день месяца
+    day = min(local_datetime.day, calendar.monthrange(year, month)[1])
+    return local_datetime.replace(year=year, month=month, day=day)
+
+
+def occurrence_start(first_starts_at, timezone_name, frequency, index):
+    """Возвращает начало вхождения номер index (с нуля) серии, первое вхождение которой начинается в first_starts_at."""
+    first = ts_to_local(first_starts_at, timezone_name).replace(tzinfo=None)
+    if frequency == FREQUENCY_DAILY:
+        local = first + timedelta(days=index)
+    elif frequency == FREQUENCY_WEEKLY:
+        local = first + timedelta(weeks=index)
+    elif frequency == FREQUENCY_MONTHLY:
+        local = _add_months(first, index)
+    else:
+        raise ValueError(f"Неизвестная частота повторения: {frequency}")
+    return local_to_ts(local, timezone_name)
+
+
+def next_occurrence(first_starts_at, timezone_name, frequency, until_at, count, index):
+    """Начало вхождения номер index или None, если серия к нему уже закончилась."""
+    if count is not None and index >= count:
+        return None
+    starts_at = occurrence_start(first_starts_at, timezone_name, frequency, index)
+    if until_at is not None and starts_at > until_at:
+        return None
+    return starts_at
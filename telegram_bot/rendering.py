@@ -0,0 +1,381 @@
+import html
+from datetime import datetime
+
+from telebot import types
+
+from callbacks import *
+from recurrence import FREQUENCY_TITLES, split_recurrence
+from repository import DEFAULT_EVENT_DURATION_MINUTES, MAX_EVENT_DURATION_MINUTES
+from timezones import DATETIME_FORMAT, DEFAULT_TIMEZONE, format_ts, local_to_ts
+
+# ==============================
+# Функции-утилиты
+# ==============================
+# Общие для синхронного (main.py) и асинхронного (async_main.py) вариантов бота: модуль
+# не обращается к базе данных и не создаёт объектов при импорте.
+
+# Максимальная длина текста сообщения в Telegram
+MESSAGE_MAX_LENGTH = 4096
+# Подсказка к вводу даты и времени нового события
+RECURRENCE_HINT = ("Для повторяющегося события добавьте «ежедневно», «еженедельно» или «ежемесячно»"
+                   " и, если нужно, число повторений или «до DD.MM.YYYY».")
+
+
+def escape_html_text(text):
+    """Экранирует специальные символы HTML."""
+    return html.escape(text)
+
+
+def parse_event_datetime(text, timezone_name):
+    """
+    Разбирает ввод "DD.MM.YYYY HH:MM [минуты]" в местном времени пояса timezone_name
+    и возвращает начало события в секундах UTC и его длительность.
+    """
+    parts = text.split()
+    if len(parts) not in (2, 3):
+        raise ValueError("Ожидается дата, время и необязательная длительность.")
+    event_datetime = datetime.strptime(" ".join(parts[:2]), DATETIME_FORMAT)
+    duration_minutes = int(parts[2]) if len(parts) == 3 else DEFAULT_EVENT_DURATION_MINUTES
+    if not (1 <= duration_minutes <= MAX_EVENT_DURATION_MINUTES):
+        raise ValueError("Длительность вне допустимого диапазона.")
+    return local_to_ts(event_datetime, timezone_name), duration_minutes
+
+
+def parse_event_schedule(text, timezone_name):
+    """
+    Разбирает ввод "DD.MM.YYYY HH:MM [минуты] [частота [N | до DD.MM.YYYY]]" и возвращает
+    начало события, длительность и правило повторения (Recurrence или None).
+    """
+    text, recurrence = split_recurrence(text, timezone_name)
+    starts_at, duration_minutes = parse_event_datetime(text, timezone_name)
+    if recurrence and recurrence.until_at is not None and recurrence.until_at < starts_at:
+        raise ValueError("Повторение заканчивается раньше первого события.")
+    return starts_at, duration_minutes, recurrence
+
+
+def profile_timezone(profile):
+    """Возвращает часовой пояс из данных пользователя (first_name, last_name, username, timezone)."""
+    return profile[3] if profile else DEFAULT_TIMEZONE
+
+
+def format_profile_full(profile):
+    """Формирует "Имя Фамилия (@username)" по данным пользователя из кэша."""
+    return format_user_full(*profile[:3]) if profile else format_user_full(None, None, None)
+
+
+def format_user_full(first_name, last_name, username):
+    """Формирует строку "Имя Фамилия (@username)" для отображения пользователя."""
+    if first_name is None:
+        return "Unknown User"
+    if username != "No Username":
+        display_username = f"@{escape_html_text(username)}"
+    else:
+        display_username = "No Username"
+    return f"{escape_html_text(first_name)} {escape_html_text(last_name or '')} ({display_username})"
+
+
+def format_username(profile):
+    """Формирует "@username" по данным пользователя (first_name, last_name, username)."""
+    return format_handle(profile[2] if profile else None)
+
+
+def format_handle(username):
+    """Формирует "@username" по имени пользователя в Telegram (None — пользователь не найден)."""
+    if username and username != "No Username":
+        return f"@{escape_html_text(username)}"
+    return "No Username"
+
+
+# ==============================
+# Формирование сообщений и клавиатур
+# ==============================
+
+def participants_label(count):
+    """Подпись к списку участников события: "Участник" для одного, "Участники" для нескольких."""
+    return "Участник" if count == 1 else "Участники"
+
+
+def reminder_template(description, creator_username, participant_usernames):
+    """Возвращает части текста напоминания до и после даты события: они одинаковы для всех получателей."""
+    head = (
+        f"⏰ Напоминание о событии:\n\n"
+        f"<b>Описание:</b> {escape_html_text(description)}\n"
+        f"<b>Дата и время:</b> "
+    )
+    tail = (
+        f"\n<b>Создатель:</b> {creator_username}\n"
+        f"<b>{participants_label(len(participant_usernames))}:</b> {', '.join(participant_usernames)}"
+    )
+    return head, tail
+
+
+def render_reminder_messages(reminders):
+    """
+    Формирует сообщения [(reminder_id, chat_id, текст), ...] создателям и всем участникам для пачки DueReminder.
+    Шаблон текста строится один раз на напоминание, а дата форматируется один раз
+    на пару (время события, часовой пояс получателя).
+    """
+    messages = []
+    dates = {}
+    for reminder in reminders:
+        head, tail = reminder_template(reminder.description, format_handle(reminder.creator_username),
+                                       [format_handle(recipient.username) for recipient in reminder.participants])
+        recipients = [(reminder.creator_id, reminder.creator_timezone)]
+        recipients += [(recipient.user_id, recipient.timezone) for recipient in reminder.participants]
+        for chat_id, timezone_name in recipients:
+            key = (reminder.starts_at, timezone_name or DEFAULT_TIMEZONE)
+            date = dates.get(key)
+            if date is None:
+                date = dates[key] = format_ts(*key)
+            messages.append((reminder.reminder_id, chat_id, head + date + tail))
+    return messages
+
+
+def claimed_reminder_messages(messages, claimed):
+    """
+    Оставляет из сообщений [(reminder_id, chat_id, текст), ...] по одному на каждую
+    захваченную доставку (reminder_id, chat_id) из множества claimed.
+    """
+    claimed = set(claimed)
+    selected = []
+    for reminder_id, chat_id, text in messages:
+        if (reminder_id, chat_id) in claimed:
+            claimed.discard((reminder_id, chat_id))
+            selected.append((reminder_id, chat_id, text))
+    return selected
+
+
+def render_event_notifications(participant_title, creator_title, description, starts_at,
+                               creator_id, participant_ids, profiles):
+    """
+    Формирует уведомления о событии [(chat_id, текст), ...] всем участникам и создателю, каждое
+    во времени получателя. profiles — словарь user_id -> данные пользователя (user_cache.get_many);
+    текст для участников строится один раз на часовой пояс.
+    """
+    creator_full = format_profile_full(profiles.get(creator_id))
+    participants_full = ", ".join(format_profile_full(profiles.get(participant_id)) for participant_id in participant_ids)
+    # Участникам общего события показывается и список остальных участников
+    others = f"\n<b>Участники:</b> {participants_full}" if len(participant_ids) > 1 else ""
+
+    messages = []
+    texts = {}
+    for participant_id in participant_ids:
+        timezone_name = profile_timezone(profiles.get(participant_id))
+        text = texts.get(timezone_name)
+        if text is None:
+            text = texts[timezone_name] = (
+                f"{participant_title}\n\n"
+                f"<b>Описание:</b> {description}\n"
+                f"<b>Дата и время:</b> {format_ts(starts_at, timezone_name)}\n"
+                f"<b>Создатель:</b> {creator_full}"
+                f"{others}"
+            )
+        messages.append((participant_id, text))
+    messages.append((creator_id, (
+        f"{creator_title}\n\n"
+        f"<b>Описание:</b> {description}\n"
+        f"<b>Дата и время:</b> {format_ts(starts_at, profile_timezone(profiles.get(creator_id)))}\n"
+        f"<b>{participants_label(len(participant_ids))}:</b> {participants_full}"
+    )))
+    return messages
+
+
+def normalize_user_search(text):
+    """
+    Приводит введённый текст поиска пользователя к виду, в котором хранятся имена
+    (без "@" и с экранированием HTML); None для пустого запроса.
+    """
+    text = text.strip().lstrip('@').strip()
+    return escape_html_text(text) if text else None
+
+
+def search_prefix(state, screen_state):
+    """Возвращает поисковый запрос из состояния диалога state, если оно относится к экрану screen_state."""
+    return state.get('search_prefix') if state.get('state') == screen_state else None
+
+
+def _users_navigation(users, has_prev, has_next, prev_action, next_action):
+    """Кнопки перехода между страницами пользователей; они несут user_id крайнего пользователя страницы."""
+    navigation = []
+    if not users:
+        return navigation
+    if has_prev:
+        navigation.append(types.InlineKeyboardButton("⬅️ Назад", callback_data=encode_callback(prev_action, users[0][0])))
+    if has_next:
+        navigation.append(types.InlineKeyboardButton("Вперёд ➡️", callback_data=encode_callback(next_action, users[-1][0])))
+    return navigation
+
+
+def render_users_page(users, has_prev, has_next, prefix=None):
+    """Формирует текст и клавиатуру страницы списка пользователей."""
+    response = "📋 <b>Список пользователей:</b>\n"
+    if prefix:
+        response += f"🔎 Поиск: <b>{prefix}</b>\n"
+    response += "\n"
+    for uid, first, last, username, _ in users:
+        response += f"👤 {format_user_full(first, last, username)}\n"
+    if not users:
+        response += "Никого не найдено.\n" if prefix else "Больше пользователей нет.\n"
+    response += "\nОтправьте начало имени или @username, чтобы найти пользователя."
+
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    navigation = _users_navigation(users, has_prev, has_next, ACTION_USERS_PAGE_PREV, ACTION_USERS_PAGE_NEXT)
+    if navigation:
+        markup.row(*navigation)
+    if prefix:
+        markup.add(types.InlineKeyboardButton("✖️ Сбросить поиск", callback_data=encode_callback(ACTION_LIST_USERS)))
+    markup.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data=encode_callback(ACTION_MAIN_MENU)))
+    return response, markup
+
+
+def selected_participants(state):
+    """Возвращает список выбранных участников создаваемого события из состояния диалога."""
+    if 'participant_ids' in state:
+        return list(state['participant_ids'])
+    # Состояние, сохранённое до появления нескольких участников
+    return [state['participant_id']] if state.get('participant_id') else []
+
+
+def participants_keyboard(users, has_prev=False, has_next=False, prefix=None, selected=()):
+    """
+    Создаёт клавиатуру выбора участников события для одной страницы пользователей.
+    Нажатие на пользователя добавляет его в выбранные selected или убирает из них.
+    """
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    for uid, first, last, username, _ in users:
+        label = format_user_full(first, last, username)
+        if uid in selected:
+            label = f"✅ {label}"
+        btn = types.InlineKeyboardButton(label, callback_data=encode_callback(ACTION_SELECT_USER, uid))
+        markup.add(btn)
+
+    navigation = _users_navigation(users, has_prev, has_next,
+                                   ACTION_PARTICIPANTS_PAGE_PREV, ACTION_PARTICIPANTS_PAGE_NEXT)
+    if navigation:
+        markup.row(*navigation)
+    if prefix:
+        markup.add(types.InlineKeyboardButton("✖️ Сбросить поиск", callback_data=encode_callback(ACTION_CREATE_EVENT)))
+    if selected:
+        markup.add(types.InlineKeyboardButton(f"➡️ Готово ({len(selected)})",
+                                              callback_data=encode_callback(ACTION_PARTICIPANTS_DONE)))
+
+    # Кнопка для возврата в главное меню
+    markup.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data=encode_callback(ACTION_MAIN_MENU)))
+    return markup
+
+
+def split_page(rows, cursor, backward, page_size):
+    """
+    Обрезает выборку страницы (запрошенную с лимитом page_size + 1) до page_size строк
+    и определяет, есть ли предыдущая и следующая страницы.
+    """
+    has_more = len(rows) > page_size
+    rows = rows[-page_size:] if backward else rows[:page_size]
+    has_prev = has_more if backward else cursor is not None
+    has_next = True if backward else has_more
+    return rows, has_prev, has_next
+
+
+def render_events_page(user_id, events, has_prev, has_next, timezone_name):
+    """Формирует текст и клавиатуру страницы событий пользователя со временем в его поясе timezone_name."""
+    response = "📅 <b>Ваши события:</b>\n\n"
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    shown = []
+    for event in events:
+        (event_id, description, starts_at, participant_id, creator_id,
+         participant_first, participant_last, participant_username,
+         creator_first, creator_last, creator_username, duration_minutes, frequency, participant_count) = event
+        event_dt = format_ts(starts_at, timezone_name)
+
+        participant_full = format_user_full(participant_first, participant_last, participant_username)
+        creator_full = format_user_full(creator_first, creator_last, creator_username)
+        repeat = f"  <b>Повтор:</b> 🔁 {FREQUENCY_TITLES[frequency]}\n" if frequency else ""
+        if participant_count > 1:
+            participant_full += f" и ещё {participant_count - 1}"
+
+        entry = (
+            f"• <b>ID:</b> {event_id}\n"
+            f"  <b>Описание:</b> {description}\n"
+            f"  <b>Дата и время:</b> {event_dt} ({duration_minutes} мин.)\n"
+            f"{repeat}"
+            f"  <b>{participants_label(participant_count)}:</b> {participant_full}\n"
+            f"  <b>Создатель:</b> {creator_full}\n\n"
+        )
+        # Остаток страницы переносится на следующую, если сообщение превысит лимит Telegram
+        if shown and len(response) + len(entry) > MESSAGE_MAX_LENGTH:
+            has_next = True
+            break
+        response += entry
+        shown.append(event)
+
+        if user_id == creator_id:
+            # Добавление кнопок "Редактировать" и "Удалить" для создателя
+            edit_btn = types.InlineKeyboardButton("✏️ Редактировать", callback_data=encode_callback(ACTION_EDIT_EVENT, event_id))
+            delete_btn = types.InlineKeyboardButton("🗑️ Удалить", callback_data=encode_callback(ACTION_DELETE_EVENT, event_id))
+            markup.add(edit_btn, delete_btn)
+
+    # Кнопки перехода между страницами несут ключ (starts_at, event_id) крайнего события
+    navigation = []
+    if has_prev:
+        first_event = shown[0]
+        navigation.append(types.InlineKeyboardButton(
+            "⬅️ Назад", callback_data=encode_callback(
+                ACTION_EVENTS_PAGE_PREV, first_event[2], first_event[0])))
+    if has_next:
+        last_event = shown[-1]
+        navigation.append(types.InlineKeyboardButton(
+            "Вперёд ➡️", callback_data=encode_callback(
+                ACTION_EVENTS_PAGE_NEXT, last_event[2], last_event[0])))
+    if navigation:
+        markup.row(*navigation)
+
+    # Добавление кнопки "Вернуться в главное меню"
+    markup.add(types.InlineKeyboardButton("🏠 Главное меню", callback_data=encode_callback(ACTION_MAIN_MENU)))
+    return response, markup
+
+
+def render_event_deleted_notification(event_id, series=False):
+    """Формирует уведомление об удалении события или, при series=True, его серии."""
+    if series:
+        return f"🗑️ Повторяющееся событие ID:{event_id} и все его следующие повторы удалены создателем."
+    return f"🗑️ Событие ID:{event_id} было удалено его создателем."
+
+
+def delete_confirmation_keyboard(event_id, series=False):
+    """
+    Создаёт клавиатуру подтверждения удаления события. Для вхождения серии (series=True)
+    добавляется кнопка удаления этого и всех последующих вхождений.
+    """
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    confirm_btn = types.InlineKeyboardButton("✅ Подтвердить", callback_data=encode_callback(ACTION_CONFIRM_DELETE_EVENT, event_id))
+    cancel_btn = types.InlineKeyboardButton("❌ Отмена", callback_data=encode_callback(ACTION_CANCEL_DELETE_EVENT))
+    markup.add(confirm_btn, cancel_btn)
+    if series:
+        markup.add(types.InlineKeyboardButton("🔁 Удалить серию", callback_data=encode_callback(ACTION_CONFIRM_DELETE_SERIES, event_id)))
+    return markup
+
+
+def custom_reminder_keyboard():
+    """Создаёт клавиатуру с предложением добавить дополнительное напоминание."""
+    return types.InlineKeyboardMarkup(row_width=2).add(
+        types.InlineKeyboardButton("Да", callback_data=encode_callback(ACTION_CUSTOM_REMINDER_YES)),
+        types.InlineKeyboardButton("Нет", callback_data=encode_callback(ACTION_CUSTOM_REMINDER_NO))
+    )
+
+
+def main_menu_keyboard():
+    """Создаёт главное меню с inline-кнопками."""
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    my_events_btn = types.InlineKeyboardButton("📅 Мои события", callback_data=encode_callback(ACTION_MY_EVENTS))
+    create_event_btn = types.InlineKeyboardButton("➕ Создать новое событие", callback_data=encode_callback(ACTION_CREATE_EVENT))
+    list_users_btn = types.InlineKeyboardButton("👥 Просмотреть пользователей", callback_data=encode_callback(ACTION_LIST_USERS))
+    markup.add(my_events_btn, create_event_btn, list_users_btn)
+    return markup
+
+
+def back_to_main_menu_keyboard():
+    """Создаёт кнопку для возврата в главное меню."""
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    main_menu_btn = types.InlineKeyboardButton("🏠 Главное меню", callback_data=encode_callback(ACTION_MAIN_MENU))
+    markup.add(main_menu_btn)
+    return markup
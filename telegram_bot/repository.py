@@ -1,128 +1,888 @@
-def init_tables(conn, cursor):
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        first_name TEXT NOT NULL,
-        last_name TEXT,
-        username TEXT,
-        telegram_profile TEXT
-    )
-    ''')
-
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS events (
-        event_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        creator_id INTEGER NOT NULL,
-        participant_id INTEGER NOT NULL,
-        description TEXT NOT NULL,
-        event_datetime TEXT NOT NULL,
-        FOREIGN KEY (creator_id) REFERENCES users(user_id),
-        FOREIGN KEY (participant_id) REFERENCES users(user_id)
-    )
-    ''')
-
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS reminders (
-        reminder_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        event_id INTEGER NOT NULL,
-        reminder_time TEXT NOT NULL,
-        FOREIGN KEY (event_id) REFERENCES events(event_id)
-    )
-    ''')
-    conn.commit()
-
-def select_event_data(cursor, event_id):
-    cursor.execute("SELECT creator_id, participant_id, description, event_datetime FROM events WHERE event_id=?", (event_id,))
-
-def select_reminder_time(cursor, event_id):
-    cursor.execute("SELECT reminder_time FROM reminders WHERE event_id=?", (event_id,))
-
-def select_user_name(cursor, creator_id):
-    cursor.execute("SELECT username FROM users WHERE user_id=?", (creator_id,))
-
-def select_user_data(cursor, user_id):
-    cursor.execute("SELECT * FROM users WHERE user_id=?", (user_id,))
-
-def add_user(conn, cursor, user_id, first_name, last_name, username, telegram_profile):
-    cursor.execute(
-            "INSERT INTO users (user_id, first_name, last_name, username, telegram_profile) VALUES (?, ?, ?, ?, ?)",
-            (user_id, first_name, last_name, username, telegram_profile)
-        )
-    conn.commit()
-
-def select_user_by_id(cursor, user_id):
-    cursor.execute("SELECT user_id, first_name, last_name, username FROM users WHERE user_id != ?", (user_id,))
-
-def select_users(cursor):
-    cursor.execute("SELECT user_id, first_name, last_name, username FROM users")
-
-def select_event_by_user(cursor, user_id):
-    cursor.execute("""
-            SELECT event_id, description, event_datetime, participant_id, creator_id
+from collections import namedtuple
+from datetime import timedelta
+
+from database import ConnectionManager, get_connection, in_transaction, transaction
+from metrics import timed_query
+from migrations import apply_migrations
+from recurrence import next_occurrence
+from timezones import now_ts
+
+# Моменты времени (starts_at, ends_at, remind_at) передаются и возвращаются целым числом
+# секунд UTC, см. timezones.py.
+# Функции, обращающиеся к базе данных, обёрнуты timed_query: время каждой попадает
+# в метрику bot_db_query_duration_seconds (см. metrics.py).
+
+# Длительность события по умолчанию и максимально допустимая длительность (в минутах).
+# Ограничение сверху позволяет искать пересечения по индексу в окне
+# [начало - MAX_EVENT_DURATION_MINUTES, конец), а не по всем событиям пользователя.
+DEFAULT_EVENT_DURATION_MINUTES = 60
+MAX_EVENT_DURATION_MINUTES = 24 * 60
+# Максимальное количество участников события (без создателя)
+MAX_EVENT_PARTICIPANTS = 50
+
+# Стандартные напоминания: за сутки и за два часа до события
+STANDARD_REMINDER_OFFSETS = (timedelta(days=1), timedelta(hours=2))
+
+# Сколько значений подставляется в один список IN (...): старые сборки SQLite допускают не более 999 параметров
+SQL_IN_BATCH_SIZE = 500
+
+
+def standard_reminder_times(starts_at):
+    """Возвращает ещё не наступившие моменты стандартных напоминаний о событии, начинающемся в starts_at."""
+    now = now_ts()
+    remind_ats = (starts_at - int(offset.total_seconds()) for offset in STANDARD_REMINDER_OFFSETS)
+    return [remind_at for remind_at in remind_ats if remind_at > now]
+
+def _commit(conn):
+    """Фиксирует изменение, если оно не входит в транзакцию transaction(): тогда коммит выполнит она."""
+    if not in_transaction():
+        conn.commit()
+
+def name_search_key(first_name, last_name):
+    """Ключ поиска и сортировки пользователя по имени: "имя фамилия" без учёта регистра."""
+    return f"{first_name} {last_name or ''}".strip(' ').casefold()
+
+def username_search_key(username):
+    """Ключ поиска пользователя по username без учёта регистра; None, если username не задан."""
+    if not username or username == "No Username":
+        return None
+    return username.casefold()
+
+def init_tables():
+    """Приводит схему базы данных к актуальной версии (см. migrations.py)."""
+    apply_migrations(get_connection())
+
+@timed_query
+def select_event_data(event_id):
+    return get_connection().execute(
+        "SELECT creator_id, participant_id, description, starts_at FROM events WHERE event_id=?",
+        (event_id,)).fetchone()
+
+@timed_query
+def select_reminder_time(event_id):
+    return get_connection().execute("SELECT remind_at FROM reminders WHERE event_id=?", (event_id,)).fetchall()
+
+@timed_query
+def select_user_name(creator_id):
+    return get_connection().execute("SELECT username FROM users WHERE user_id=?", (creator_id,)).fetchone()
+
+@timed_query
+def select_user_data(user_id):
+    return get_connection().execute("SELECT * FROM users WHERE user_id=?", (user_id,)).fetchone()
+
+@timed_query
+def update_user_timezone(user_id, timezone):
+    conn = get_connection()
+    conn.execute("UPDATE users SET timezone=? WHERE user_id=?", (timezone, user_id))
+    _commit(conn)
+
+@timed_query
+def add_user(user_id, first_name, last_name, username, telegram_profile):
+    conn = get_connection()
+    conn.execute("""
+            INSERT INTO users (user_id, first_name, last_name, username, telegram_profile, name_key, username_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, first_name, last_name, username, telegram_profile,
+              name_search_key(first_name, last_name), username_search_key(username)))
+    _commit(conn)
+
+@timed_query
+def update_user(user_id, first_name, last_name, username, telegram_profile):
+    conn = get_connection()
+    conn.execute("""
+            UPDATE users SET first_name=?, last_name=?, username=?, telegram_profile=?, name_key=?, username_key=?
+            WHERE user_id=?
+        """, (first_name, last_name, username, telegram_profile,
+              name_search_key(first_name, last_name), username_search_key(username), user_id))
+    _commit(conn)
+
+@timed_query
+def select_users_fnu(user_ids):
+    """Возвращает строки User для всех найденных пользователей из user_ids."""
+    return list(repo.get_users(user_ids).values())
+
+@timed_query
+def select_user_by_id(user_id):
+    return get_connection().execute(
+        "SELECT user_id, first_name, last_name, username FROM users WHERE user_id != ?", (user_id,)).fetchall()
+
+@timed_query
+def select_users():
+    return get_connection().execute("SELECT user_id, first_name, last_name, username FROM users").fetchall()
+
+def _users_page_cursor(conn, user_id, prefix):
+    """Возвращает ключ сортировки (ключ, user_id) пользователя на странице справочника или None."""
+    row = conn.execute("SELECT name_key, username_key FROM users WHERE user_id=?", (user_id,)).fetchone()
+    if row is None:
+        return None
+    name_key, username_key = row
+    # При поиске пользователь стоит на месте имени, если совпало оно, иначе — на месте username
+    if prefix is None or name_key.startswith(prefix):
+        return name_key, user_id
+    return username_key, user_id
+
+@timed_query
+def select_users_page(limit, cursor=None, backward=False, prefix=None, exclude_user_id=None):
+    """
+    Возвращает страницу справочника пользователей (строки User), упорядоченную по имени. prefix — начало имени или username (без учёта регистра);
+    exclude_user_id — пользователь, которого не нужно показывать (например, сам пользователь).
+    cursor — user_id последнего (или, при backward=True, первого) пользователя уже показанной
+    страницы; без cursor возвращается первая страница. Каждый запрос читает не более limit
+    строк индекса, поэтому стоимость не зависит от числа зарегистрированных пользователей.
+    """
+    conn = get_connection()
+    if prefix is not None:
+        prefix = prefix.casefold()
+    if cursor is not None:
+        cursor = _users_page_cursor(conn, cursor, prefix)
+    if cursor is None:
+        cursor, backward = ("", 0), False
+    comparison, order = ("<", "DESC") if backward else (">", "ASC")
+    if prefix is None:
+        rows = conn.execute(f"""
+                SELECT user_id, first_name, last_name, username, timezone
+                FROM users
+                WHERE (name_key, user_id) {comparison} (?, ?) AND user_id IS NOT ?
+                ORDER BY name_key {order}, user_id {order}
+                LIMIT ?
+            """, (*cursor, exclude_user_id, limit)).fetchall()
+    else:
+        # Верхняя граница диапазона строк, начинающихся с prefix
+        prefix_end = prefix + "\U0010ffff"
+        rows = conn.execute(f"""
+                SELECT user_id, first_name, last_name, username, timezone
+                FROM (
+                    SELECT * FROM (
+                        SELECT name_key AS sort_key, user_id, first_name, last_name, username, timezone
+                        FROM users
+                        WHERE name_key >= ? AND name_key < ? AND (name_key, user_id) {comparison} (?, ?)
+                              AND user_id IS NOT ?
+                        ORDER BY name_key {order}, user_id {order}
+                        LIMIT ?
+                    )
+                    UNION ALL
+                    SELECT * FROM (
+                        SELECT username_key AS sort_key, user_id, first_name, last_name, username, timezone
+                        FROM users
+                        WHERE username_key >= ? AND username_key < ? AND (username_key, user_id) {comparison} (?, ?)
+                              AND NOT (name_key >= ? AND name_key < ?) AND user_id IS NOT ?
+                        ORDER BY username_key {order}, user_id {order}
+                        LIMIT ?
+                    )
+                )
+                ORDER BY sort_key {order}, user_id {order}
+                LIMIT ?
+            """, (prefix, prefix_end, *cursor, exclude_user_id, limit,
+                  prefix, prefix_end, *cursor, prefix, prefix_end, exclude_user_id, limit, limit)).fetchall()
+    if backward:
+        rows.reverse()
+    return list(map(User._make, rows))
+
+@timed_query
+def select_event_by_user(user_id):
+    return get_connection().execute("""
+            SELECT event_id, description, starts_at, participant_id, creator_id
             FROM events
-            WHERE creator_id=? OR participant_id=?
-            ORDER BY event_datetime
-        """, (user_id, user_id))
-
-def select_fnu(cursor, _id):
-    cursor.execute("SELECT first_name, last_name, username FROM users WHERE user_id=?", (_id,))
-
-def get_creator_from_event(cursor, event_id):
-     cursor.execute("SELECT creator_id FROM events WHERE event_id=?", (event_id,))
-
-def select_creator_participant(cursor, event_id):
-    cursor.execute("SELECT creator_id, participant_id FROM events WHERE event_id=?", (event_id,))
-
-def delete_reminders(conn, cursor, event_id):
-    cursor.execute("DELETE FROM reminders WHERE event_id=?", (event_id,))
-    conn.commit()
-
-def delete_event(conn, cursor, event_id):
-    cursor.execute("DELETE FROM events WHERE event_id=?", (event_id,))
-    conn.commit()
-
-def select_event_by_participant_date(cursor, participant_id, user_id, event_datetime):
-    cursor.execute("""
-            SELECT * FROM events
-            WHERE participant_id=? OR creator_id=? AND event_datetime=?
-        """, (participant_id, user_id, event_datetime.isoformat()))
-
-def create_event(conn, cursor, user_id, participant_id, description, event_datetime):
-    cursor.execute("""
-            INSERT INTO events (creator_id, participant_id, description, event_datetime)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, participant_id, description, event_datetime.isoformat()))
-    conn.commit()
-
-def create_reminders(conn, cursor, event_id, reminder_time):
-    cursor.execute("""
-                    INSERT INTO reminders (event_id, reminder_time)
+            WHERE creator_id=?
+            UNION
+            SELECT e.event_id, e.description, e.starts_at, e.participant_id, e.creator_id
+            FROM event_participants AS ep
+            JOIN events AS e ON e.event_id = ep.event_id
+            WHERE ep.user_id=?
+            ORDER BY starts_at
+        """, (user_id, user_id)).fetchall()
+
+@timed_query
+def select_fnu(_id):
+    return get_connection().execute("SELECT first_name, last_name, username FROM users WHERE user_id=?", (_id,)).fetchone()
+
+@timed_query
+def get_creator_from_event(event_id):
+    return get_connection().execute("SELECT creator_id FROM events WHERE event_id=?", (event_id,)).fetchone()
+
+@timed_query
+def select_creator_participant(event_id):
+    return get_connection().execute(
+        "SELECT creator_id, participant_id FROM events WHERE event_id=?", (event_id,)).fetchone()
+
+@timed_query
+def select_event_members(event_id):
+    """Возвращает (creator_id, участник, ...) события одним запросом или None, если события нет."""
+    rows = get_connection().execute("""
+            SELECT e.creator_id, ep.user_id
+            FROM events AS e
+            LEFT JOIN event_participants AS ep ON ep.event_id = e.event_id
+            WHERE e.event_id=?
+            ORDER BY ep.position
+        """, (event_id,)).fetchall()
+    if not rows:
+        return None
+    return (rows[0][0], *(user_id for _, user_id in rows if user_id is not None))
+
+@timed_query
+def delete_reminders(event_id):
+    conn = get_connection()
+    conn.execute("""
+            DELETE FROM reminder_deliveries
+            WHERE reminder_id IN (SELECT reminder_id FROM reminders WHERE event_id=?)
+        """, (event_id,))
+    conn.execute("DELETE FROM reminders WHERE event_id=?", (event_id,))
+    _commit(conn)
+
+@timed_query
+def delete_event(event_id):
+    conn = get_connection()
+    conn.execute("DELETE FROM event_participants WHERE event_id=?", (event_id,))
+    conn.execute("DELETE FROM events WHERE event_id=?", (event_id,))
+    _commit(conn)
+
+@timed_query
+def create_event(user_id, participant_ids, description, starts_at,
+                 duration_minutes=DEFAULT_EVENT_DURATION_MINUTES, series_id=None):
+    """
+    Создаёт событие с участниками participant_ids (вхождение серии series_id, если она задана)
+    и возвращает его ID. В events.participant_id записывается первый участник.
+    """
+    ends_at = starts_at + duration_minutes * 60
+    conn = get_connection()
+    cursor = conn.execute("""
+            INSERT INTO events (creator_id, participant_id, description, starts_at, duration_minutes, ends_at,
+                                series_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, participant_ids[0], description, starts_at, duration_minutes, ends_at, series_id))
+    event_id = cursor.lastrowid
+    conn.executemany("""
+            INSERT INTO event_participants (event_id, user_id, position, starts_at, ends_at) VALUES (?, ?, ?, ?, ?)
+        """, [(event_id, participant_id, position, starts_at, ends_at)
+              for position, participant_id in enumerate(participant_ids)])
+    _commit(conn)
+    return event_id
+
+@timed_query
+def create_reminders(event_id, remind_at):
+    conn = get_connection()
+    conn.execute("""
+                    INSERT INTO reminders (event_id, remind_at)
                     VALUES (?, ?)
-                """, (event_id, reminder_time.isoformat()))
-    conn.commit()
+                """, (event_id, remind_at))
+    _commit(conn)
 
-def get_event_data(cursor, event_id):
-    cursor.execute("""
-            SELECT event_id, participant_id, description, event_datetime FROM events
+@timed_query
+def create_reminders_many(event_id, remind_ats):
+    conn = get_connection()
+    conn.executemany("INSERT INTO reminders (event_id, remind_at) VALUES (?, ?)",
+                     [(event_id, remind_at) for remind_at in remind_ats])
+    _commit(conn)
+
+@timed_query
+def create_event_with_reminders(user_id, participant_ids, description, starts_at, duration_minutes,
+                                remind_ats):
+    """
+    Создаёт событие с участниками participant_ids вместе с напоминаниями одной транзакцией
+    и возвращает его ID. Возвращает None, если интервал события пересекается с событием
+    создателя или любого из участников (проверяется одним запросом).
+    """
+    with transaction():
+        if select_conflicting_event((user_id, *participant_ids), starts_at, duration_minutes):
+            return None
+        event_id = create_event(user_id, participant_ids, description, starts_at, duration_minutes)
+        create_reminders_many(event_id, remind_ats)
+    return event_id
+
+@timed_query
+def update_event_with_reminders(members, new_description, new_starts_at, event_id, duration_minutes,
+                                remind_ats):
+    """
+    Изменяет событие и заменяет его напоминания одной транзакцией.
+    Возвращает False, если новый интервал пересекается с другим событием участников members.
+    """
+    with transaction():
+        if select_conflicting_event(members, new_starts_at, duration_minutes, exclude_event_id=event_id):
+            return False
+        update_event(new_description, new_starts_at, event_id, duration_minutes)
+        delete_reminders(event_id)
+        create_reminders_many(event_id, remind_ats)
+    return True
+
+@timed_query
+def delete_event_with_reminders(event_id):
+    """Удаляет событие и его напоминания одной транзакцией."""
+    with transaction():
+        delete_reminders(event_id)
+        delete_event(event_id)
+
+_SERIES_COLUMNS = """series_id, creator_id, participant_id, description, starts_at, duration_minutes, timezone,
+                     frequency, until_at, occurrence_count, expanded_count, next_starts_at"""
+
+def _expand_series(conn, series, horizon):
+    """
+    Создаёт вхождения серии со временем начала не позже horizon вместе со стандартными
+    напоминаниями и сдвигает её next_starts_at. Вхождение, пересекающееся с другим событием
+    создателя или участников, пропускается. Вызывается внутри transaction(); возвращает ID созданных событий.
+    """
+    index, starts_at = series.expanded_count, series.next_starts_at
+    event_ids = []
+    if starts_at is None or starts_at > horizon:
+        return event_ids
+    participant_ids = [user_id for (user_id,) in conn.execute(
+        "SELECT user_id FROM series_participants WHERE series_id=? ORDER BY position", (series.series_id,))]
+    while starts_at is not None and starts_at <= horizon:
+        if not select_conflicting_event((series.creator_id, *participant_ids), starts_at, series.duration_minutes):
+            event_id = create_event(series.creator_id, participant_ids, series.description, starts_at,
+                                    series.duration_minutes, series.series_id)
+            create_reminders_many(event_id, standard_reminder_times(starts_at))
+            event_ids.append(event_id)
+        index += 1
+        starts_at = next_occurrence(series.starts_at, series.timezone, series.frequency, series.until_at,
+                                    series.occurrence_count, index)
+    conn.execute("UPDATE event_series SET expanded_count=?, next_starts_at=? WHERE series_id=?",
+                 (index, starts_at, series.series_id))
+    return event_ids
+
+@timed_query
+def create_event_series(user_id, participant_ids, description, starts_at, duration_minutes, timezone,
+                        recurrence, horizon):
+    """
+    Создаёт серию повторяющихся событий с участниками participant_ids по правилу recurrence
+    (см. recurrence.py) и её вхождения до момента horizon одной транзакцией. Возвращает ID
+    первого события или None, если первое вхождение пересекается с событием создателя или участников.
+    """
+    frequency, until_at, count = recurrence
+    with transaction() as conn:
+        if select_conflicting_event((user_id, *participant_ids), starts_at, duration_minutes):
+            return None
+        cursor = conn.execute("""
+                INSERT INTO event_series (creator_id, participant_id, description, starts_at, duration_minutes,
+                                          timezone, frequency, until_at, occurrence_count, next_starts_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (user_id, participant_ids[0], description, starts_at, duration_minutes, timezone, frequency,
+                  until_at, count, starts_at))
+        series_id = cursor.lastrowid
+        conn.executemany("INSERT INTO series_participants (series_id, user_id, position) VALUES (?, ?, ?)",
+                         [(series_id, participant_id, position)
+                          for position, participant_id in enumerate(participant_ids)])
+        series = Series(series_id, user_id, participant_ids[0], description, starts_at, duration_minutes,
+                        timezone, frequency, until_at, count, 0, starts_at)
+        # Первое вхождение создаётся всегда, даже если оно дальше горизонта
+        event_ids = _expand_series(conn, series, max(horizon, starts_at))
+    return event_ids[0]
+
+@timed_query
+def expand_event_series(horizon, batch_size=100):
+    """
+    Создаёт вхождения всех серий до момента horizon и возвращает ID созданных событий.
+    Серии выбираются по индексу next_starts_at пачками по batch_size, каждая пачка
+    разворачивается в своей транзакции: серия, уже развёрнутая до горизонта, в выборку
+    не попадает, поэтому повторный или одновременный вызов не создаёт вхождения дважды.
+    """
+    event_ids = []
+    while True:
+        with transaction() as conn:
+            rows = conn.execute(f"""
+                    SELECT {_SERIES_COLUMNS} FROM event_series
+                    WHERE next_starts_at <= ?
+                    ORDER BY next_starts_at
+                    LIMIT ?
+                """, (horizon, batch_size)).fetchall()
+            for row in rows:
+                event_ids.extend(_expand_series(conn, Series(*row), horizon))
+        if len(rows) < batch_size:
+            return event_ids
+
+@timed_query
+def select_event_series_id(event_id):
+    """Возвращает ID серии, вхождением которой является событие, или None."""
+    row = get_connection().execute("SELECT series_id FROM events WHERE event_id=?", (event_id,)).fetchone()
+    return row[0] if row else None
+
+@timed_query
+def delete_event_series(event_id):
+    """
+    Удаляет это и все последующие вхождения серии события event_id с их напоминаниями одной
+    транзакцией. Прошедшие вхождения остаются вхождениями серии: она заканчивается перед
+    удалённым вхождением и больше не разворачивается. Серия без вхождений удаляется целиком.
+    Возвращает ID удалённых событий.
+    """
+    with transaction() as conn:
+        row = conn.execute("SELECT series_id, starts_at FROM events WHERE event_id=?", (event_id,)).fetchone()
+        if not row or row[0] is None:
+            return []
+        series_id, starts_at = row
+        event_ids = [series_event_id for (series_event_id,) in conn.execute(
+            "SELECT event_id FROM events WHERE series_id=? AND starts_at>=?", (series_id, starts_at))]
+        for series_event_id in event_ids:
+            delete_reminders(series_event_id)
+            delete_event(series_event_id)
+        if conn.execute("SELECT 1 FROM events WHERE series_id=? LIMIT 1", (series_id,)).fetchone():
+            conn.execute("UPDATE event_series SET until_at=?, next_starts_at=NULL WHERE series_id=?",
+                         (starts_at - 1, series_id))
+        else:
+            conn.execute("DELETE FROM series_participants WHERE series_id=?", (series_id,))
+            conn.execute("DELETE FROM event_series WHERE series_id=?", (series_id,))
+    return event_ids
+
+@timed_query
+def get_event_data(event_id):
+    return get_connection().execute("""
+            SELECT event_id, participant_id, description, starts_at FROM events
             WHERE event_id=?
-        """, (event_id,))
+        """, (event_id,)).fetchone()
 
-def select_for_check_intersection(cursor, event_id, new_event_datetime):
-    cursor.execute("""
-            SELECT * FROM events
-            WHERE participant_id=(SELECT participant_id FROM events WHERE event_id=?)
-            AND event_datetime=?
-            AND event_id != ?
-    """, (event_id, new_event_datetime.isoformat(), event_id))
+@timed_query
+def select_conflicting_event(user_ids, starts_at, duration_minutes, exclude_event_id=None):
+    """
+    Возвращает (event_id, starts_at, ends_at) первого события любого из пользователей
+    user_ids (как создателя или участника), интервал которого пересекается с
+    [starts_at, starts_at + duration_minutes). Все пользователи проверяются одним запросом
+    по индексам (creator_id, starts_at) и (user_id, starts_at) таблицы event_participants.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    # Список IN дополняется повтором последнего ID до стандартного размера, как в Repository._select_in
+    size = _in_list_size(len(user_ids))
+    user_ids.extend(user_ids[-1:] * (size - len(user_ids)))
+    placeholders = ", ".join("?" * size)
+    ends_at = starts_at + duration_minutes * 60
+    window = (ends_at, starts_at - MAX_EVENT_DURATION_MINUTES * 60, starts_at, exclude_event_id or 0)
+    return get_connection().execute(f"""
+            SELECT event_id, starts_at, ends_at
+            FROM events
+            WHERE creator_id IN ({placeholders})
+            AND starts_at < ? AND starts_at >= ? AND ends_at > ? AND event_id != ?
+            UNION ALL
+            SELECT event_id, starts_at, ends_at
+            FROM event_participants
+            WHERE user_id IN ({placeholders})
+            AND starts_at < ? AND starts_at >= ? AND ends_at > ? AND event_id != ?
+            LIMIT 1
+    """, (*user_ids, *window, *user_ids, *window)).fetchone()
 
-def update_event(conn, cursor, new_description, new_event_datetime, event_id):
-    cursor.execute("""
+@timed_query
+def update_event(new_description, new_starts_at, event_id, duration_minutes=DEFAULT_EVENT_DURATION_MINUTES):
+    conn = get_connection()
+    conn.execute("""
             UPDATE events
-            SET description=?, event_datetime=?
+            SET description=?, starts_at=?, duration_minutes=?, ends_at=?
             WHERE event_id=?
-        """, (new_description, new_event_datetime.isoformat(), event_id))
-    conn.commit()
+        """, (new_description, new_starts_at, duration_minutes, new_starts_at + duration_minutes * 60, event_id))
+    # Интервал события продублирован у участников для проверки пересечений по индексу
+    conn.execute("UPDATE event_participants SET starts_at=?, ends_at=? WHERE event_id=?",
+                 (new_starts_at, new_starts_at + duration_minutes * 60, event_id))
+    _commit(conn)
+
+@timed_query
+def select_events_page(user_id, limit, cursor=None, backward=False):
+    """
+    Возвращает страницу событий пользователя вместе с именами первого участника и создателя,
+    числом участников и частотой повторения серии (None для одиночных событий).
+    cursor — пара (starts_at, event_id) последнего (или, при backward=True, первого) события
+    уже показанной страницы; без cursor возвращается первая страница. Каждая половина UNION
+    читает не более limit строк из своего индекса, поэтому стоимость не зависит от числа событий.
+    """
+    if cursor is None:
+        cursor, backward = (0, 0), False
+    comparison, order = ("<", "DESC") if backward else (">", "ASC")
+    rows = get_connection().execute(f"""
+            SELECT e.event_id, e.description, e.starts_at, e.participant_id, e.creator_id,
+                   p.first_name, p.last_name, p.username,
+                   c.first_name, c.last_name, c.username, e.duration_minutes, s.frequency,
+                   (SELECT COUNT(*) FROM event_participants AS ep WHERE ep.event_id = e.event_id)
+            FROM (
+                SELECT * FROM (
+                    SELECT event_id, description, starts_at, participant_id, creator_id, duration_minutes, series_id
+                    FROM events
+                    WHERE creator_id=? AND (starts_at, event_id) {comparison} (?, ?)
+                    ORDER BY starts_at {order}, event_id {order}
+                    LIMIT ?
+                )
+                UNION
+                SELECT * FROM (
+                    SELECT e.event_id, e.description, e.starts_at, e.participant_id, e.creator_id, e.duration_minutes,
+                           e.series_id
+                    FROM event_participants AS ep
+                    JOIN events AS e ON e.event_id = ep.event_id
+                    WHERE ep.user_id=? AND (ep.starts_at, ep.event_id) {comparison} (?, ?)
+                    ORDER BY ep.starts_at {order}, ep.event_id {order}
+                    LIMIT ?
+                )
+            ) AS e
+            LEFT JOIN users AS p ON p.user_id = e.participant_id
+            LEFT JOIN users AS c ON c.user_id = e.creator_id
+            LEFT JOIN event_series AS s ON s.series_id = e.series_id
+            ORDER BY e.starts_at {order}, e.event_id {order}
+            LIMIT ?
+        """, (user_id, *cursor, limit, user_id, *cursor, limit, limit)).fetchall()
+    if backward:
+        rows.reverse()
+    return rows
+
+def _shard_condition(shard):
+    """
+    Условие отбора напоминаний части shard = (номер, количество частей) для supervisor.py:
+    событие относится к части по user_id создателя, как и его обновления. Без shard — все напоминания.
+    """
+    if shard is None:
+        return "", ()
+    index, count = shard
+    return " AND e.creator_id % ? = ?", (count, index)
+
+@timed_query
+def select_pending_reminder_times(after, batch_size=1000, shard=None):
+    """Выдаёт различные моменты срабатывания напоминаний позже after по возрастанию, читая их пачками по batch_size."""
+    if shard is None:
+        cursor = get_connection().execute(
+            "SELECT DISTINCT remind_at FROM reminders WHERE remind_at > ? ORDER BY remind_at", (after,))
+    else:
+        condition, params = _shard_condition(shard)
+        cursor = get_connection().execute(f"""
+                SELECT DISTINCT r.remind_at
+                FROM reminders AS r
+                JOIN events AS e ON e.event_id = r.event_id
+                WHERE r.remind_at > ?{condition}
+                ORDER BY r.remind_at
+            """, (after, *params))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for (remind_at,) in rows:
+            yield remind_at
+
+@timed_query
+def select_next_reminder_time(after, shard=None):
+    """Возвращает время ближайшего напоминания позже момента after или None."""
+    if shard is None:
+        row = get_connection().execute(
+            "SELECT MIN(remind_at) FROM reminders WHERE remind_at > ?", (after,)).fetchone()
+        return row[0]
+    # Просмотр индекса remind_at по возрастанию до первого напоминания своей части
+    condition, params = _shard_condition(shard)
+    row = get_connection().execute(f"""
+            SELECT r.remind_at
+            FROM reminders AS r
+            JOIN events AS e ON e.event_id = r.event_id
+            WHERE r.remind_at > ?{condition}
+            ORDER BY r.remind_at
+            LIMIT 1
+        """, (after, *params)).fetchone()
+    return row[0] if row else None
+
+@timed_query
+def select_due_reminders(after, until, shard=None):
+    """
+    Возвращает строки DueReminder для напоминаний со временем в интервале (after, until]:
+    событие и создатель выбираются тем же запросом, а участники всех событий пачки — одним
+    вторым запросом, поэтому пачка напоминаний любого размера обходится двумя запросами.
+    """
+    condition, params = _shard_condition(shard)
+    rows = get_connection().execute(f"""
+            SELECT r.reminder_id, r.event_id, r.remind_at, e.creator_id, e.description,
+                   e.starts_at, c.username, c.timezone
+            FROM reminders AS r
+            JOIN events AS e ON e.event_id = r.event_id
+            LEFT JOIN users AS c ON c.user_id = e.creator_id
+            WHERE r.remind_at > ? AND r.remind_at <= ?{condition}
+            ORDER BY r.remind_at, r.event_id
+        """, (after, until, *params)).fetchall()
+    if not rows:
+        return []
+    recipients = repo.get_recipients(row[1] for row in rows)
+    return [DueReminder(*row, tuple(recipients.get(row[1], ()))) for row in rows]
+
+@timed_query
+def claim_reminder_deliveries(pairs, now, max_attempts, pending_before=None):
+    """
+    Отмечает доставки (reminder_id, user_id) как начатые (pending) перед отправкой и
+    возвращает те, что можно отправлять: новые, а также неудачные (failed) и, если задан
+    pending_before, начатые раньше этого момента, но незавершённые — если попыток было
+    меньше max_attempts. Доставленные (sent) не возвращаются никогда, поэтому повторная
+    выборка тех же напоминаний не приводит к повторной отправке.
+    """
+    def retryable(delivery):
+        if delivery.status == 'failed':
+            return True
+        return delivery.status == 'pending' and pending_before is not None and delivery.updated_at < pending_before
+
+    with transaction() as conn:
+        deliveries = repo.get_deliveries({reminder_id for reminder_id, _ in pairs})
+        new, retried = [], []
+        for pair in dict.fromkeys(pairs):
+            delivery = deliveries.get(pair)
+            if delivery is None:
+                new.append(pair)
+            elif retryable(delivery) and delivery.attempts < max_attempts:
+                retried.append(pair)
+        conn.executemany("""
+                INSERT INTO reminder_deliveries (reminder_id, user_id, status, attempts, updated_at)
+                VALUES (?, ?, 'pending', 1, ?)
+            """, [(reminder_id, user_id, now) for reminder_id, user_id in new])
+        conn.executemany("""
+                UPDATE reminder_deliveries SET status = 'pending', attempts = attempts + 1, updated_at = ?
+                WHERE reminder_id = ? AND user_id = ?
+            """, [(now, reminder_id, user_id) for reminder_id, user_id in retried])
+    return new + retried
+
+@timed_query
+def update_reminder_deliveries(results):
+    """Записывает результаты доставок: строки (status, sent_at, updated_at, reminder_id, user_id)."""
+    conn = get_connection()
+    conn.executemany("""
+            UPDATE reminder_deliveries SET status = ?, sent_at = ?, updated_at = ?
+            WHERE reminder_id = ? AND user_id = ?
+        """, results)
+    _commit(conn)
+
+@timed_query
+def delete_old_reminder_deliveries(updated_before):
+    """Удаляет записи о доставках, не изменявшиеся с момента updated_before; возвращает их количество."""
+    conn = get_connection()
+    deleted = conn.execute("DELETE FROM reminder_deliveries WHERE updated_at < ?", (updated_before,)).rowcount
+    _commit(conn)
+    return deleted
+
+@timed_query
+def acquire_lease(name, owner, now, ttl):
+    """
+    Захватывает или продлевает до now + ttl аренду name для owner, если она свободна, истекла
+    или уже принадлежит owner. Возвращает True, если аренда принадлежит owner.
+    """
+    with transaction() as conn:
+        row = conn.execute("SELECT owner, expires_at FROM leases WHERE name=?", (name,)).fetchone()
+        if row and row[0] != owner and row[1] > now:
+            return False
+        conn.execute("""
+                INSERT INTO leases (name, owner, heartbeat_at, expires_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, heartbeat_at = excluded.heartbeat_at,
+                                                 expires_at = excluded.expires_at
+            """, (name, owner, now, now + ttl))
+    return True
+
+@timed_query
+def release_lease(name, owner):
+    """Освобождает аренду name, если она принадлежит owner."""
+    conn = get_connection()
+    conn.execute("DELETE FROM leases WHERE name=? AND owner=?", (name, owner))
+    _commit(conn)
+
+@timed_query
+def select_conversation_state(user_id, updated_after):
+    return get_connection().execute(
+        "SELECT data FROM conversation_states WHERE user_id=? AND updated_at > ?",
+        (user_id, updated_after)).fetchone()
+
+@timed_query
+def upsert_conversation_state(user_id, data, updated_at):
+    conn = get_connection()
+    conn.execute("""
+            INSERT INTO conversation_states (user_id, data, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at
+        """, (user_id, data, updated_at))
+    _commit(conn)
+
+@timed_query
+def delete_conversation_state(user_id):
+    conn = get_connection()
+    conn.execute("DELETE FROM conversation_states WHERE user_id=?", (user_id,))
+    _commit(conn)
+
+@timed_query
+def delete_expired_conversation_states(updated_before):
+    """Удаляет состояния диалогов, не изменявшиеся с момента updated_before; возвращает их количество."""
+    conn = get_connection()
+    deleted = conn.execute("DELETE FROM conversation_states WHERE updated_at < ?", (updated_before,)).rowcount
+    _commit(conn)
+    return deleted
+
+@timed_query
+def select_events_with_reminders(batch_size=1000):
+    """
+    Выдаёт все события по возрастанию event_id, по строке на каждое напоминание (remind_at
+    равно None у событий без напоминаний), читая их пачками по batch_size.
+    """
+    cursor = get_connection().execute("""
+            SELECT e.event_id, e.creator_id, e.participant_id, e.description, e.starts_at,
+                   e.duration_minutes, r.remind_at
+            FROM events AS e
+            LEFT JOIN reminders AS r ON r.event_id = e.event_id
+            ORDER BY e.event_id, r.remind_at
+        """)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
+
+@timed_query
+def select_last_event_id_assigned():
+    """
+    Последний ID, выданный событию счётчиком AUTOINCREMENT (в том числе уже удалённому), или 0.
+    Явные ID больше него не совпадут с ID удалённых событий, а их вставка сдвигает счётчик.
+    """
+    row = get_connection().execute("SELECT seq FROM sqlite_sequence WHERE name='events'").fetchone()
+    return row[0] if row else 0
+
+@timed_query
+def insert_events_many(events):
+    """Вставляет события (event_id, creator_id, (участники), description, starts_at, duration_minutes)."""
+    conn = get_connection()
+    conn.executemany("""
+            INSERT INTO events (event_id, creator_id, participant_id, description, starts_at, duration_minutes, ends_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [(event_id, creator_id, participant_ids[0], description, starts_at, duration_minutes,
+               starts_at + duration_minutes * 60)
+              for event_id, creator_id, participant_ids, description, starts_at, duration_minutes in events])
+    conn.executemany("""
+            INSERT INTO event_participants (event_id, user_id, position, starts_at, ends_at) VALUES (?, ?, ?, ?, ?)
+        """, [(event_id, participant_id, position, starts_at, starts_at + duration_minutes * 60)
+              for event_id, _, participant_ids, _, starts_at, duration_minutes in events
+              for position, participant_id in enumerate(participant_ids)])
+    _commit(conn)
+
+@timed_query
+def insert_reminders_many(reminders):
+    """Вставляет напоминания (event_id, remind_at)."""
+    conn = get_connection()
+    conn.executemany("INSERT INTO reminders (event_id, remind_at) VALUES (?, ?)", reminders)
+    _commit(conn)
+
+
+# ==============================
+# Репозиторий с именованными строками
+# ==============================
+# Строки — именованные кортежи: поля доступны по имени, а распаковка по позиции,
+# как у результатов функций выше, продолжает работать. Экземпляр не хранит словарь
+# атрибутов, поэтому занимает столько же памяти, сколько обычный кортеж.
+
+User = namedtuple('User', 'user_id first_name last_name username timezone')
+Event = namedtuple('Event', 'event_id creator_id participant_id description starts_at duration_minutes')
+Reminder = namedtuple('Reminder', 'reminder_id event_id remind_at')
+# Доставка напоминания одному получателю (reminder_deliveries): статус pending, sent или failed
+Delivery = namedtuple('Delivery', 'reminder_id user_id status attempts sent_at updated_at')
+# Серия повторяющихся событий (event_series); вхождения с номера expanded_count ещё не созданы
+Series = namedtuple('Series', 'series_id creator_id participant_id description starts_at duration_minutes timezone '
+                              'frequency until_at occurrence_count expanded_count next_starts_at')
+# Участник события с данными для текста сообщения; username и timezone равны None, если пользователь не найден
+Recipient = namedtuple('Recipient', 'event_id user_id username timezone')
+# Наступившее напоминание со всем, что нужно для его текста (select_due_reminders): participants —
+# кортеж Recipient в порядке выбора участников
+DueReminder = namedtuple('DueReminder', 'reminder_id event_id remind_at creator_id description starts_at '
+                                        'creator_username creator_timezone participants')
+
+# Размеры списков IN (...): неполная часть дополняется до ближайшего размера, поэтому
+# у каждого запроса не больше десятка разных текстов и все они остаются в кэше
+# подготовленных выражений sqlite3 (он ищет выражение по тексту запроса).
+IN_LIST_SIZES = (1, 2, 4, 8, 16, 32, 64, 128, 256, SQL_IN_BATCH_SIZE)
+
+
+def _in_list_size(count):
+    for size in IN_LIST_SIZES:
+        if size >= count:
+            return size
+    return SQL_IN_BATCH_SIZE
+
+
+class Repository:
+    """
+    Доступ к пользователям, событиям и напоминаниям, возвращающий строки User, Event и Reminder.
+
+    Без path используются подключения, настроенные init_database(); с path репозиторий
+    открывает собственные подключения (по одному на поток) и закрывает их в close().
+    Тексты запросов постоянны, поэтому каждое подключение подготавливает их один раз.
+    """
+
+    _USER_COLUMNS = "user_id, first_name, last_name, username, timezone"
+    _EVENT_COLUMNS = "event_id, creator_id, participant_id, description, starts_at, duration_minutes"
+    _REMINDER_COLUMNS = "reminder_id, event_id, remind_at"
+    _DELIVERY_COLUMNS = "reminder_id, user_id, status, attempts, sent_at, updated_at"
+
+    def __init__(self, path=None):
+        self._manager = ConnectionManager(path) if path is not None else None
+        self._statements = {}  # (шаблон, размер списка IN) -> текст запроса
+
+    def connection(self):
+        """Возвращает подключение текущего потока."""
+        return self._manager.connection() if self._manager is not None else get_connection()
+
+    def close(self):
+        """Закрывает собственные подключения репозитория."""
+        if self._manager is not None:
+            self._manager.close_all()
+
+    @timed_query
+    def get_user(self, user_id):
+        """Возвращает User или None."""
+        return self.get_users([user_id]).get(user_id)
+
+    @timed_query
+    def get_users(self, user_ids):
+        """Возвращает словарь user_id -> User для найденных пользователей."""
+        rows = self._select_in(f"SELECT {self._USER_COLUMNS} FROM users WHERE user_id IN ({{}})", user_ids, User)
+        return {user.user_id: user for user in rows}
+
+    @timed_query
+    def get_event(self, event_id):
+        """Возвращает Event или None."""
+        return self.get_events([event_id]).get(event_id)
+
+    @timed_query
+    def get_events(self, event_ids):
+        """Возвращает словарь event_id -> Event для найденных событий."""
+        rows = self._select_in(f"SELECT {self._EVENT_COLUMNS} FROM events WHERE event_id IN ({{}})", event_ids, Event)
+        return {event.event_id: event for event in rows}
+
+    @timed_query
+    def get_reminders(self, event_ids):
+        """Возвращает словарь event_id -> список Reminder по возрастанию времени (только события с напоминаниями)."""
+        rows = self._select_in(f"SELECT {self._REMINDER_COLUMNS} FROM reminders WHERE event_id IN ({{}})",
+                               event_ids, Reminder)
+        reminders = {}
+        for reminder in sorted(rows, key=lambda r: (r.event_id, r.remind_at)):
+            reminders.setdefault(reminder.event_id, []).append(reminder)
+        return reminders
+
+    @timed_query
+    def get_participants(self, event_ids):
+        """Возвращает словарь event_id -> список ID участников в порядке их выбора (только найденные события)."""
+        return {event_id: [recipient.user_id for recipient in recipients]
+                for event_id, recipients in self.get_recipients(event_ids).items()}
+
+    @timed_query
+    def get_recipients(self, event_ids):
+        """Возвращает словарь event_id -> список Recipient участников событий event_ids одним запросом на пачку."""
+        rows = self._select_in("""
+                SELECT ep.event_id, ep.user_id, u.username, u.timezone
+                FROM event_participants AS ep
+                LEFT JOIN users AS u ON u.user_id = ep.user_id
+                WHERE ep.event_id IN ({})
+                ORDER BY ep.event_id, ep.position
+            """, event_ids, Recipient)
+        recipients = {}
+        for recipient in rows:
+            recipients.setdefault(recipient.event_id, []).append(recipient)
+        return recipients
+
+    @timed_query
+    def get_deliveries(self, reminder_ids):
+        """Возвращает словарь (reminder_id, user_id) -> Delivery для всех получателей напоминаний reminder_ids."""
+        rows = self._select_in(f"SELECT {self._DELIVERY_COLUMNS} FROM reminder_deliveries WHERE reminder_id IN ({{}})",
+                               reminder_ids, Delivery)
+        return {(delivery.reminder_id, delivery.user_id): delivery for delivery in rows}
+
+    def _select_in(self, template, ids, row_type):
+        """Выполняет запрос со списком IN частями по SQL_IN_BATCH_SIZE и возвращает строки row_type."""
+        ids = list(dict.fromkeys(ids))
+        conn = self.connection()
+        rows = []
+        for start in range(0, len(ids), SQL_IN_BATCH_SIZE):
+            batch = ids[start:start + SQL_IN_BATCH_SIZE]
+            size = _in_list_size(len(batch))
+            statement = self._statements.get((template, size))
+            if statement is None:
+                statement = self._statements[(template, size)] = template.format(", ".join("?" * size))
+            # Повтор последнего идентификатора не меняет результат IN, но сохраняет текст запроса
+            batch.extend(batch[-1:] * (size - len(batch)))
+            rows.extend(map(row_type._make, conn.execute(statement, batch)))
+        return rows
+
 
-def select_last_event(cursor, user_id):
-    cursor.execute("SELECT event_id, event_datetime FROM events WHERE creator_id=? ORDER BY event_id DESC LIMIT 1",
-                       (user_id,))
+# Репозиторий поверх подключений init_database()
+repo = Repository()
@@ -0,0 +1,133 @@
+import logging
+import os
+
+from decouple import Config, RepositoryEnv
+
+from deliveries import SEND_DRAIN_SECONDS
+from lease import LEASE_RENEW_SECONDS, LEASE_TTL_SECONDS
+from outbound import GLOBAL_MESSAGES_PER_SECOND, CHAT_MESSAGES_PER_SECOND
+from recurrence import SERIES_HORIZON_DAYS
+from state_store import STATE_TTL_SECONDS, STATE_MAX_SIZE
+from timezones import now_ts
+from user_cache import USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS
+
+# ==============================
+# Настройки бота
+# ==============================
+# Только значения из .env и константы: модуль ничего не создаёт при импорте, поэтому его
+# используют и синхронный (app.py), и асинхронный (async_main.py) варианты бота.
+
+
+def setup_logging():
+    """Настраивает логирование в файл bot.log и в консоль."""
+    logging.basicConfig(
+            level=logging.INFO,  # Можно изменить на DEBUG для более подробного логирования
+            format='%(asctime)s %(levelname)s %(message)s',
+            handlers=[
+                logging.FileHandler("bot.log", encoding='utf-8'),
+                logging.StreamHandler()
+            ]
+        )
+
+
+# Доступ к переменным
+config = Config(RepositoryEnv(".env"))
+API_TOKEN = config("API_TOKEN") # Замените на токен вашего бота
+
+# Адрес Bot API, если это не api.telegram.org: локальный сервер Bot API или замена для
+# нагрузочного теста (loadtest.py)
+TELEGRAM_API_URL = config("TELEGRAM_API_URL", default="")
+
+# Способ получения обновлений:
+#   polling — бот сам запрашивает обновления у Telegram (infinity_polling);
+#   webhook — Telegram присылает обновления на HTTP-сервер бота (webhook.py)
+BOT_MODE_POLLING = 'polling'
+BOT_MODE_WEBHOOK = 'webhook'
+BOT_MODE = config("BOT_MODE", default=BOT_MODE_POLLING)
+
+# Многопроцессный запуск (supervisor.py): количество процессов-обработчиков и их рабочих потоков.
+# Номер процесса WORKER_INDEX supervisor.py передаёт каждому обработчику сам, -1 — запуск одним процессом.
+WORKERS = config("WORKERS", default=os.cpu_count() or 1, cast=int)
+WORKER_INDEX = config("WORKER_INDEX", default=-1, cast=int)
+WORKER_THREADS = config("WORKER_THREADS", default=8, cast=int)
+# Часть напоминаний, которую рассылает этот процесс: события, создатель которых относится
+# к процессу (user_id % WORKERS), или все напоминания при запуске одним процессом
+REMINDER_SHARD = (WORKER_INDEX, WORKERS) if WORKER_INDEX >= 0 else None
+
+# Параметры режима webhook
+WEBHOOK_URL = config("WEBHOOK_URL", default="")  # Внешний адрес, например https://bot.example.com
+WEBHOOK_PATH = config("WEBHOOK_PATH", default="/webhook")
+WEBHOOK_HOST = config("WEBHOOK_HOST", default="0.0.0.0")
+WEBHOOK_PORT = config("WEBHOOK_PORT", default=8443, cast=int)
+WEBHOOK_SECRET = config("WEBHOOK_SECRET", default="")
+WEBHOOK_WORKERS = config("WEBHOOK_WORKERS", default=8, cast=int)
+
+# Лимиты очереди исходящих сообщений (outbound.py), сообщений в секунду: на бота и на чат
+OUTBOUND_GLOBAL_RATE = config("OUTBOUND_GLOBAL_RATE", default=GLOBAL_MESSAGES_PER_SECOND, cast=float)
+OUTBOUND_CHAT_RATE = config("OUTBOUND_CHAT_RATE", default=CHAT_MESSAGES_PER_SECOND, cast=float)
+
+# Адрес HTTP-сервера метрик Prometheus (GET /metrics); METRICS_PORT=0 отключает сервер
+METRICS_HOST = config("METRICS_HOST", default="127.0.0.1")
+METRICS_PORT = config("METRICS_PORT", default=9100, cast=int)
+
+# Каждый поток (обработчики telebot, планировщик) получает собственное подключение
+DATABASE_PATH = config("DATABASE_PATH", default="bot_database.db")
+
+# Количество событий на одной странице раздела "Мои события"
+EVENTS_PAGE_SIZE = config("EVENTS_PAGE_SIZE", default=5, cast=int)
+# Количество пользователей на странице списка пользователей и выбора участника
+USERS_PAGE_SIZE = config("USERS_PAGE_SIZE", default=20, cast=int)
+
+# Кэш имён пользователей для сообщений и напоминаний (user_cache.py)
+USER_CACHE_SIZE = config("USER_CACHE_SIZE", default=USER_CACHE_SIZE, cast=int)
+USER_CACHE_TTL_SECONDS = config("USER_CACHE_TTL_SECONDS", default=USER_CACHE_TTL_SECONDS, cast=int)
+
+# Способ рассылки напоминаний:
+#   scheduler  — задача APScheduler на каждый момент срабатывания напоминаний;
+#   dispatcher — один поток, выбирающий наступившие напоминания из таблицы reminders (dispatcher.py)
+REMINDER_MODE_SCHEDULER = 'scheduler'
+REMINDER_MODE_DISPATCHER = 'dispatcher'
+REMINDER_MODE = config("REMINDER_MODE", default=REMINDER_MODE_SCHEDULER)
+
+# Напоминания рассылает только владелец аренды (lease.py), поэтому несколько реплик бота
+# с общей базой данных не отправляют их дважды. У каждой части напоминаний supervisor.py своя аренда.
+REMINDER_LEASE_NAME = f"reminders:{WORKER_INDEX}/{WORKERS}" if REMINDER_SHARD else "reminders"
+REMINDER_LEASE_TTL_SECONDS = config("REMINDER_LEASE_TTL_SECONDS", default=LEASE_TTL_SECONDS, cast=float)
+REMINDER_LEASE_RENEW_SECONDS = config("REMINDER_LEASE_RENEW_SECONDS", default=LEASE_RENEW_SECONDS, cast=float)
+# Незавершённую доставку догоняющая рассылка повторяет не раньше чем через столько секунд после
+# захвата (deliveries.py): прежний владелец аренды к этому времени заведомо закончил отправку
+REMINDER_PENDING_RETRY_SECONDS = REMINDER_LEASE_TTL_SECONDS + SEND_DRAIN_SECONDS
+# При получении аренды рассылаются недоставленные напоминания за последние REMINDER_CATCHUP_SECONDS
+# (0 — не рассылать) в REMINDER_CATCHUP_WORKERS потоков
+REMINDER_CATCHUP_SECONDS = config("REMINDER_CATCHUP_SECONDS", default=3600, cast=int)
+REMINDER_CATCHUP_WORKERS = config("REMINDER_CATCHUP_WORKERS", default=4, cast=int)
+# На сколько дней вперёд создаются вхождения повторяющихся событий (recurrence.py)
+SERIES_HORIZON_DAYS = config("SERIES_HORIZON_DAYS", default=SERIES_HORIZON_DAYS, cast=int)
+# Задача владельца аренды, создающая вхождения повторяющихся событий до горизонта SERIES_HORIZON_DAYS
+SERIES_EXPANSION_JOB_ID = 'series_expansion'
+SERIES_EXPANSION_SECONDS = 3600
+
+
+def series_horizon():
+    """Момент, до которого создаются вхождения повторяющихся событий."""
+    return now_ts() + SERIES_HORIZON_DAYS * 24 * 3600
+
+
+# ==============================
+# Состояния пользователей
+# ==============================
+# Определение различных состояний
+STATE_MAIN_MENU = 'MAIN_MENU'
+STATE_CREATE_EVENT_SELECT_USER = 'CREATE_EVENT_SELECT_USER'
+STATE_USER_DIRECTORY = 'USER_DIRECTORY'
+STATE_CREATE_EVENT_DESCRIPTION = 'CREATE_EVENT_DESCRIPTION'
+STATE_CREATE_EVENT_DATETIME = 'CREATE_EVENT_DATETIME'
+STATE_ADD_CUSTOM_REMINDER = 'ADD_CUSTOM_REMINDER'
+STATE_EDIT_EVENT_DESCRIPTION = 'EDIT_EVENT_DESCRIPTION'
+STATE_EDIT_EVENT_DATETIME = 'EDIT_EVENT_DATETIME'
+
+# Незавершённые диалоги (см. state_store.py). При PERSIST_USER_STATES=True они сохраняются
+# в базе данных и продолжаются после перезапуска бота.
+USER_STATE_TTL_SECONDS = config("USER_STATE_TTL_SECONDS", default=STATE_TTL_SECONDS, cast=int)
+USER_STATE_MAX_SIZE = config("USER_STATE_MAX_SIZE", default=STATE_MAX_SIZE, cast=int)
+PERSIST_USER_STATES = config("PERSIST_USER_STATES", default=False, cast=bool)
@@ -0,0 +1,138 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from repository import (select_conversation_state, upsert_conversation_state, delete_conversation_state,
+                        delete_expired_conversation_states)
+
+# ==============================
+# Хранилище состояний диалогов
+# ==============================
+
+# Через сколько секунд бездействия незавершённый диалог забывается
+STATE_TTL_SECONDS = 24 * 60 * 60
+# Максимальное количество диалогов в памяти (самые давние вытесняются первыми)
+STATE_MAX_SIZE = 100000
+# Количество блокировок, между которыми распределяются пользователи
+LOCK_STRIPES = 64
+# Как часто удалять из базы данных устаревшие состояния
+PURGE_INTERVAL_SECONDS = 10 * 60
+
+
+class StateStore:
+    """
+    Состояния диалогов пользователей: {'state': ..., прочие поля шага}.
+
+    Хранятся только незавершённые диалоги: состояние idle_state (главное меню) равносильно
+    отсутствию записи. Записи вытесняются после ttl секунд бездействия и при превышении
+    max_size. При persist=True каждое изменение сразу записывается в таблицу
+    conversation_states, поэтому диалог продолжается после перезапуска бота, а вытесненная
+    из памяти запись загружается из базы при следующем обращении.
+
+    Значения полей должны сериализоваться в JSON. get() возвращает копию, поэтому
+    изменение состояния выполняется только через set() и update().
+    """
+
+    def __init__(self, idle_state, ttl=STATE_TTL_SECONDS, max_size=STATE_MAX_SIZE, persist=False):
+        self._idle_state = idle_state
+        self._ttl = ttl
+        self._max_size = max_size
+        self._persist = persist
+        self._entries = OrderedDict()  # user_id -> (момент последнего обращения, состояние)
+        self._lock = threading.Lock()
+        # Блокировки по пользователям: изменения одного пользователя попадают в базу в том же порядке, что и в память
+        self._user_locks = [threading.RLock() for _ in range(LOCK_STRIPES)]
+        self._last_purge = time.time()
+
+    @contextmanager
+    def locked(self, user_id):
+        """Блокирует состояние пользователя на время последовательности чтений и изменений."""
+        with self._user_locks[hash(user_id) % LOCK_STRIPES]:
+            yield
+
+    def get(self, user_id, default=None):
+        """Возвращает копию состояния пользователя или default."""
+        state = self._get(user_id)
+        return dict(state) if state is not None else default
+
+    def set(self, user_id, state):
+        """Заменяет состояние пользователя целиком."""
+        with self.locked(user_id):
+            self._store(user_id, dict(state))
+
+    def update(self, user_id, **fields):
+        """Изменяет отдельные поля состояния пользователя."""
+        with self.locked(user_id):
+            state = dict(self._get(user_id) or {})
+            state.update(fields)
+            self._store(user_id, state)
+
+    def clear(self, user_id):
+        """Удаляет состояние пользователя (возврат в главное меню)."""
+        with self.locked(user_id):
+            self._store(user_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _get(self, user_id):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                if now - entry[0] <= self._ttl:
+                    # Обращение продлевает жизнь диалога, поэтому записи упорядочены по времени активности
+                    self._entries[user_id] = (now, entry[1])
+                    self._entries.move_to_end(user_id)
+                    return entry[1]
+                del self._entries[user_id]
+        if not self._persist:
+            return None
+        row = select_conversation_state(user_id, now - self._ttl)
+        if row is None:
+            return None
+        state = json.loads(row[0])
+        with self._lock:
+            # Пока шло чтение из базы, состояние могло быть изменено: запись в памяти главнее
+            entry = self._entries.setdefault(user_id, (now, state))
+            self._evict()
+            return entry[1]
+
+    def _store(self, user_id, state):
+        now = time.time()
+        if state is not None and state == {'state': self._idle_state}:
+            state = None
+        with self._lock:
+            if state is None:
+                self._entries.pop(user_id, None)
+            else:
+                self._entries[user_id] = (now, state)
+                self._entries.move_to_end(user_id)
+                self._evict()
+        if not self._persist:
+            return
+        if state is None:
+            delete_conversation_state(user_id)
+        else:
+            upsert_conversation_state(user_id, json.dumps(state, ensure_ascii=False), now)
+        if now - self._last_purge > PURGE_INTERVAL_SECONDS:
+            self._last_purge = now
+            try:
+                deleted = delete_expired_conversation_states(now - self._ttl)
+                if deleted:
+                    logging.info(f"Удалено устаревших состояний диалогов: {deleted}")
+            except Exception as e:
+                logging.error(f"Ошибка при удалении устаревших состояний диалогов: {e}")
+
+    def _evict(self):
+        """Вытесняет устаревшие записи и самые давние записи сверх max_size."""
+        now = time.time()
+        while self._entries:
+            user_id, (updated_at, _) = next(iter(self._entries.items()))
+            if len(self._entries) <= self._max_size and now - updated_at <= self._ttl:
+                return
+            del self._entries[user_id]
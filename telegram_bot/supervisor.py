@@ -0,0 +1,179 @@
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+
+from telebot import apihelper
+
+from app import *
+from metrics import MetricsServer, set_queue_depth_function
+from webhook import WebhookServer, register_webhook
+
+# ==============================
+# Многопроцессный запуск бота
+# ==============================
+# Вместо main.py запускается
+#
+#   python supervisor.py
+#
+# Процесс-супервизор получает обновления (polling или webhook, BOT_MODE) и передаёт каждое
+# одному из WORKERS процессов-обработчиков по user_id отправителя. Все обновления
+# пользователя попадают в один процесс, поэтому порядок его обновлений и состояние диалога
+# (user_states) остаются в одном месте. Каждый обработчик рассылает
+# напоминания событий своих создателей (REMINDER_SHARD в settings.py), поэтому каждое
+# напоминание отправляет ровно один процесс. Погибший обработчик перезапускается.
+#
+# Процессы запускаются методом spawn: обработчик импортирует main.py заново и не наследует
+# потоки супервизора. Миграции базы данных применяет супервизор при импорте app.py до
+# запуска обработчиков.
+
+# Сколько обновлений может ждать в очереди одного процесса-обработчика
+WORKER_QUEUE_SIZE = 1000
+# Как часто проверять, что процессы-обработчики живы
+WORKER_CHECK_INTERVAL_SECONDS = 5
+# Максимальное количество обновлений в одном ответе getUpdates
+POLL_LIMIT = 100
+# Сколько секунд Telegram держит запрос getUpdates, если обновлений нет
+POLL_TIMEOUT_SECONDS = 60
+# Пауза перед повтором после ошибки getUpdates
+POLL_RETRY_DELAY_SECONDS = 5
+
+_UPDATE_FIELDS = ('message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+                  'my_chat_member', 'pre_checkout_query', 'shipping_query')
+
+
+def shard_of(user_id, shard_count):
+    """Номер процесса-обработчика пользователя; то же выражение отбирает напоминания в repository.py."""
+    return user_id % shard_count
+
+
+def update_user_id(update):
+    """Возвращает user_id отправителя обновления или 0, если отправителя нет (например, пост канала)."""
+    for field in _UPDATE_FIELDS:
+        payload = update.get(field)
+        if payload and payload.get('from'):
+            return payload['from']['id']
+    return 0
+
+
+def _worker_main(updates):
+    # Ctrl+C получает вся группа процессов: обработчик завершается по сигналу None от супервизора
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import main
+    main.run_worker(updates)
+
+
+class Supervisor:
+    """Запускает процессы-обработчики, раздаёт им обновления и перезапускает погибшие процессы."""
+
+    def __init__(self, worker_count, queue_size=WORKER_QUEUE_SIZE):
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = [self._context.Queue(maxsize=queue_size) for _ in range(worker_count)]
+        self._processes = [None] * worker_count
+        self._stopping = threading.Event()
+        self._monitor = threading.Thread(target=self._watch, name="supervisor-monitor", daemon=True)
+
+    def start(self):
+        for index, updates in enumerate(self._queues):
+            self._spawn(index)
+            set_queue_depth_function(f'worker_{index}', updates.qsize)
+        self._monitor.start()
+        logging.info(f"Запущено {len(self._queues)} процессов-обработчиков.")
+
+    def stop(self):
+        """Дожидается, пока обработчики обработают уже переданные обновления, и останавливает их."""
+        self._stopping.set()
+        self._monitor.join()
+        for updates in self._queues:
+            updates.put(None)
+        for process in self._processes:
+            process.join()
+
+    def route(self, update, block=True):
+        """
+        Передаёт обновление процессу его пользователя. Без block возвращает False, если
+        очередь процесса переполнена; с block ждёт свободного места.
+        """
+        updates = self._queues[shard_of(update_user_id(update), len(self._queues))]
+        try:
+            updates.put(update, block=block)
+        except queue.Full:
+            logging.warning(f"Очередь обработчика переполнена, обновление {update.get('update_id')} отклонено.")
+            return False
+        return True
+
+    def _spawn(self, index):
+        # Номер процесса и порт его метрик передаются через окружение: settings.py читает их при импорте
+        overrides = {
+            'WORKER_INDEX': str(index),
+            'WORKERS': str(len(self._queues)),
+            'METRICS_PORT': str(METRICS_PORT + 1 + index if METRICS_PORT else 0),
+        }
+        saved = {key: os.environ.get(key) for key in overrides}
+        os.environ.update(overrides)
+        try:
+            process = self._context.Process(target=_worker_main, args=(self._queues[index],),
+                                            name=f"worker-{index}", daemon=True)
+            process.start()
+        finally:
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+        self._processes[index] = process
+
+    def _watch(self):
+        while not self._stopping.wait(WORKER_CHECK_INTERVAL_SECONDS):
+            for index, process in enumerate(self._processes):
+                if not process.is_alive():
+                    logging.error(f"Процесс-обработчик {index} завершился с кодом {process.exitcode}, перезапуск.")
+                    self._spawn(index)
+
+
+def poll(supervisor):
+    """Получает обновления через getUpdates и передаёт их обработчикам."""
+    offset = None
+    logging.info("Супервизор запущен и начал polling.")
+    while True:
+        try:
+            updates = apihelper.get_updates(API_TOKEN, offset=offset, limit=POLL_LIMIT, timeout=POLL_TIMEOUT_SECONDS,
+                                            long_polling_timeout=POLL_TIMEOUT_SECONDS)
+        except Exception as e:
+            logging.error(f"Polling failed: {e}")
+            time.sleep(POLL_RETRY_DELAY_SECONDS)
+            continue
+        for update in updates:
+            # Обновление подтверждается следующим запросом getUpdates после передачи обработчику
+            supervisor.route(update)
+            offset = update['update_id'] + 1
+
+
+def serve_webhook(supervisor):
+    """Принимает обновления webhook-сервером и передаёт их обработчикам."""
+    if WEBHOOK_URL:
+        register_webhook(bot, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET or None, WEBHOOK_WORKERS * 5)
+    server = WebhookServer(lambda update: supervisor.route(update, block=False),
+                           WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET or None)
+    try:
+        server.serve_forever()
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    supervisor = Supervisor(WORKERS)
+    if METRICS_PORT:
+        MetricsServer(METRICS_HOST, METRICS_PORT).start()
+    supervisor.start()
+    try:
+        if BOT_MODE == BOT_MODE_WEBHOOK:
+            serve_webhook(supervisor)
+        else:
+            poll(supervisor)
+    except KeyboardInterrupt:
+        logging.info("Остановка супервизора...")
+    finally:
+        supervisor.stop()
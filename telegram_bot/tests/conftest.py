@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+# Модули бота импортируют друг друга по имени, как при запуске из каталога telegram_bot
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import init_database  # noqa: E402
+from migrations import apply_migrations  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Пустая база данных с актуальной схемой во временном каталоге."""
+    manager = init_database(str(tmp_path / "bot.db"))
+    apply_migrations()
+    yield manager
+    manager.close_all()
+
+
+@pytest.fixture
+def users(db):
+    """Три зарегистрированных пользователя с ID 1, 2 и 3."""
+    import repository
+
+    for user_id, name in ((1, "Анна"), (2, "Борис"), (3, "Вера")):
+        repository.add_user(user_id, name, "Тестова", f"user{user_id}", None)
+    return [1, 2, 3]
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """
+    Модуль app.py, импортированный с настройками из временного .env. Модули, зависящие от app
+    (utilities.py, supervisor.py), импортируются в тестах после этой фикстуры.
+    """
+    workdir = tmp_path_factory.mktemp("app")
+    (workdir / ".env").write_text(f"API_TOKEN=123456:TEST\nDATABASE_PATH={workdir / 'bot.db'}\n")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    return app
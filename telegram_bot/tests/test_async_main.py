@@ -0,0 +1,47 @@
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+
+from repository import select_conversation_state
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_async_entry_point_does_not_create_sync_objects(tmp_path):
+    (tmp_path / ".env").write_text(f"API_TOKEN=123456:TEST\nDATABASE_PATH={tmp_path / 'bot.db'}\n")
+    code = ("import sys, async_main; "
+            "print(sorted({'app', 'utilities', 'apscheduler'} & set(sys.modules)))")
+
+    result = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env={**os.environ, 'PYTHONPATH': BOT_DIR},
+                            capture_output=True, text=True, timeout=60, check=True)
+
+    # Импорт не создаёт бот app.py, планировщик и базу данных, не открывает bot.log
+    assert result.stdout.strip() == "[]"
+    assert sorted(os.listdir(tmp_path)) == [".env"]
+
+
+def test_persisted_states_are_stored_outside_event_loop(app, db, monkeypatch):
+    import state_store
+    from async_repository import AsyncStateStore
+
+    writers = []
+    upsert = state_store.upsert_conversation_state
+
+    def recording_upsert(*args):
+        writers.append(threading.current_thread().name)
+        return upsert(*args)
+
+    monkeypatch.setattr(state_store, 'upsert_conversation_state', recording_upsert)
+    store = AsyncStateStore('main_menu', persist=True)
+
+    async def scenario():
+        await store.set(1, {'state': 'editing'})
+        await store.update(1, description="Встреча")
+        return await store.get(1)
+
+    assert asyncio.run(scenario()) == {'state': 'editing', 'description': "Встреча"}
+    # Запись в базу выполнялась в пуле потоков async_repository, а не в потоке цикла событий
+    assert len(writers) == 2 and all(name.startswith("db") for name in writers)
+    assert select_conversation_state(1, 0.0) is not None
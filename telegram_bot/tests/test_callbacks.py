@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+import pytest
+
+from callbacks import (ACTION_CONFIRM_DELETE_SERIES, ACTION_EVENTS_PAGE_NEXT, ACTION_MAIN_MENU, ACTION_SELECT_USER,
+                       ACTIONS, MAX_CALLBACK_DATA_BYTES, CallbackRouter, decode_callback, encode_callback)
+
+
+def test_round_trip_of_every_action():
+    for action in ACTIONS.values():
+        args = tuple(range(7, 7 + len(action.arg_types)))
+        data = encode_callback(action, *args)
+        assert decode_callback(data) == (action, args)
+
+
+def test_encoding_is_compact():
+    data = encode_callback(ACTION_EVENTS_PAGE_NEXT, 1893456000, 10 ** 9)
+    assert data == "1n:vbbc00:gjdgxs"
+    assert len(encode_callback(ACTION_SELECT_USER, 2 ** 63 - 1).encode()) <= MAX_CALLBACK_DATA_BYTES
+
+
+def test_negative_ids_round_trip():
+    # ID групповых чатов отрицательные
+    data = encode_callback(ACTION_SELECT_USER, -100123)
+    assert decode_callback(data) == (ACTION_SELECT_USER, (-100123,))
+
+
+def test_legacy_callback_data_is_decoded():
+    assert decode_callback("select_user_42") == (ACTION_SELECT_USER, (42,))
+    assert decode_callback("main_menu") == (ACTION_MAIN_MENU, ())
+
+
+@pytest.mark.parametrize("data", ["1zz", "1u", "1u:1:2", "unknown_action", ""])
+def test_unknown_callback_data_is_rejected(data):
+    with pytest.raises(ValueError):
+        decode_callback(data)
+
+
+def test_wrong_argument_count_is_rejected():
+    with pytest.raises(ValueError):
+        encode_callback(ACTION_SELECT_USER)
+
+
+def test_router_dispatches_decoded_arguments():
+    router = CallbackRouter()
+    calls = []
+
+    @router.route(ACTION_CONFIRM_DELETE_SERIES)
+    def confirm(call, event_id):
+        calls.append((call.from_user.id, event_id))
+        return "ok"
+
+    call = SimpleNamespace(data=encode_callback(ACTION_CONFIRM_DELETE_SERIES, 123), from_user=SimpleNamespace(id=5))
+    assert router.dispatch(call) == "ok"
+    assert calls == [(5, 123)]
+    # Кнопки без обработчика и нераспознанные данные игнорируются
+    assert router.dispatch(SimpleNamespace(data=encode_callback(ACTION_MAIN_MENU))) is None
+    assert router.dispatch(SimpleNamespace(data="garbage")) is None
+
+
+def test_router_rejects_duplicate_handlers():
+    router = CallbackRouter()
+    router.route(ACTION_MAIN_MENU)(lambda call: None)
+    with pytest.raises(ValueError):
+        router.route(ACTION_MAIN_MENU)(lambda call: None)
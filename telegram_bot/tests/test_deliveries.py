@@ -0,0 +1,79 @@
+import pytest
+
+import repository
+from deliveries import DELIVERY_FAILED, DELIVERY_PENDING, DELIVERY_SENT, DeliveryLedger
+from repository import claim_reminder_deliveries, repo
+from timezones import now_ts
+
+
+@pytest.fixture
+def reminder_id(users):
+    starts_at = now_ts() + 2 * 86400
+    event_id = repository.create_event_with_reminders(1, [2, 3], "Встреча", starts_at, 60, [starts_at - 3600])
+    return repo.get_reminders([event_id])[event_id][0].reminder_id
+
+
+def status(reminder_id, user_id):
+    delivery = repo.get_deliveries([reminder_id]).get((reminder_id, user_id))
+    return (delivery.status, delivery.attempts) if delivery else None
+
+
+def test_claim_returns_each_delivery_once(reminder_id):
+    pairs = [(reminder_id, 1), (reminder_id, 2), (reminder_id, 2)]
+
+    assert claim_reminder_deliveries(pairs, now=100, max_attempts=3) == [(reminder_id, 1), (reminder_id, 2)]
+    assert status(reminder_id, 1) == (DELIVERY_PENDING, 1)
+    # Начатая доставка повторно не захватывается, пока отправитель может быть жив
+    assert claim_reminder_deliveries(pairs, now=101, max_attempts=3) == []
+
+
+def test_pending_delivery_is_retried_only_by_catch_up(reminder_id):
+    claim_reminder_deliveries([(reminder_id, 1)], now=100, max_attempts=3)
+
+    # Доставка, захваченная позже pending_before, может ещё отправляться прежним владельцем аренды
+    assert claim_reminder_deliveries([(reminder_id, 1)], now=150, max_attempts=3, pending_before=100) == []
+    assert claim_reminder_deliveries([(reminder_id, 1)], now=200, max_attempts=3, pending_before=101) == [
+        (reminder_id, 1)]
+    assert status(reminder_id, 1) == (DELIVERY_PENDING, 2)
+
+
+def test_failed_delivery_is_retried_up_to_max_attempts(reminder_id):
+    pair = (reminder_id, 3)
+    for attempt in range(1, 4):
+        assert claim_reminder_deliveries([pair], now=attempt, max_attempts=3) == [pair]
+        repository.update_reminder_deliveries([(DELIVERY_FAILED, None, attempt, *pair)])
+    assert status(*pair) == (DELIVERY_FAILED, 3)
+    assert claim_reminder_deliveries([pair], now=10, max_attempts=3, pending_before=10) == []
+
+
+def test_sent_delivery_is_never_claimed_again(reminder_id):
+    pair = (reminder_id, 2)
+    claim_reminder_deliveries([pair], now=1, max_attempts=3)
+    repository.update_reminder_deliveries([(DELIVERY_SENT, 2, 2, *pair)])
+
+    assert claim_reminder_deliveries([pair], now=3, max_attempts=3, pending_before=3) == []
+
+
+def test_ledger_records_results_in_batches(reminder_id):
+    ledger = DeliveryLedger(max_attempts=2, flush_interval=60)
+    try:
+        assert ledger.claim([(reminder_id, 1), (reminder_id, 2)]) == {(reminder_id, 1), (reminder_id, 2)}
+        ledger.record(reminder_id, 1, sent=True)
+        ledger.record(reminder_id, 2, sent=False)
+        # До записи фоновым потоком результаты хранятся только в памяти
+        assert status(reminder_id, 1) == (DELIVERY_PENDING, 1)
+    finally:
+        ledger.close()
+
+    assert status(reminder_id, 1) == (DELIVERY_SENT, 1)
+    assert status(reminder_id, 2) == (DELIVERY_FAILED, 1)
+    assert repo.get_deliveries([reminder_id])[(reminder_id, 1)].sent_at is not None
+    assert ledger.claim([(reminder_id, 1), (reminder_id, 2)]) == {(reminder_id, 2)}
+
+
+def test_old_deliveries_are_purged(reminder_id):
+    claim_reminder_deliveries([(reminder_id, 1)], now=100, max_attempts=3)
+    claim_reminder_deliveries([(reminder_id, 2)], now=200, max_attempts=3)
+
+    assert repository.delete_old_reminder_deliveries(150) == 1
+    assert status(reminder_id, 1) is None and status(reminder_id, 2) == (DELIVERY_PENDING, 1)
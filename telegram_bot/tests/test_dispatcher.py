@@ -0,0 +1,148 @@
+import threading
+import time
+
+import pytest
+
+import dispatcher
+import repository
+from dispatcher import MAX_IDLE_SECONDS, ReminderDispatcher
+
+
+class FakeClock:
+    """Часы диспетчера: время идёт только во время ожидания на условии."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeCondition:
+    """
+    Условие диспетчера без настоящего ожидания: wait() записывает таймаут и продвигает часы.
+    После stop_after ожиданий диспетчер останавливается.
+    """
+
+    def __init__(self, clock, stop_after):
+        self._lock = threading.RLock()
+        self.clock = clock
+        self.waits = []
+        self.stop_after = stop_after
+        self.dispatcher = None
+
+    def __enter__(self):
+        return self._lock.__enter__()
+
+    def __exit__(self, *exc_info):
+        return self._lock.__exit__(*exc_info)
+
+    def notify(self):
+        pass
+
+    def wait(self, timeout=None):
+        self.waits.append(timeout)
+        self.clock.now += timeout
+        if len(self.waits) >= self.stop_after:
+            self.dispatcher._running = False
+        return False
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock(repository.now_ts())
+    monkeypatch.setattr(dispatcher, 'now_ts', fake)
+    return fake
+
+
+def make_dispatcher(clock, stop_after, shard=None):
+    batches = []
+    reminder_dispatcher = ReminderDispatcher(batches.append, shard=shard)
+    condition = FakeCondition(clock, stop_after)
+    condition.dispatcher = reminder_dispatcher
+    reminder_dispatcher._condition = condition
+    return reminder_dispatcher, condition, batches
+
+
+def run(reminder_dispatcher, since):
+    """Выполняет цикл диспетчера в текущем потоке до остановки FakeCondition."""
+    reminder_dispatcher._watermark = since
+    reminder_dispatcher._running = True
+    reminder_dispatcher._load_next()
+    reminder_dispatcher._run()
+
+
+def add_event(creator_id, participant_id, starts_at, remind_ats):
+    return repository.create_event_with_reminders(creator_id, [participant_id], "Встреча", starts_at, 30, remind_ats)
+
+
+def test_sleeps_until_next_reminder_and_sends_window_in_one_batch(users, clock):
+    start = clock.now
+    first = add_event(1, 2, start + 7200, [start + 10])
+    second = add_event(3, 2, start + 9000, [start + 10, start + 50])
+    reminder_dispatcher, condition, batches = make_dispatcher(clock, stop_after=3)
+
+    run(reminder_dispatcher, start)
+
+    # Сон до ближайшего срока, затем до следующего, затем — не дольше MAX_IDLE_SECONDS
+    assert condition.waits == [10, 40, MAX_IDLE_SECONDS]
+    assert [[(r.event_id, r.remind_at) for r in batch] for batch in batches] == [
+        [(first, start + 10), (second, start + 10)], [(second, start + 50)]]
+
+
+def test_reminders_due_before_start_are_skipped(users, clock):
+    start = clock.now
+    add_event(1, 2, start + 7200, [start - 5, start + 30])
+    reminder_dispatcher, condition, batches = make_dispatcher(clock, stop_after=2)
+
+    run(reminder_dispatcher, start)
+
+    assert [[r.remind_at for r in batch] for batch in batches] == [[start + 30]]
+
+
+def test_reminders_added_while_sleeping_are_picked_up(users, clock):
+    start = clock.now
+    reminder_dispatcher, condition, batches = make_dispatcher(clock, stop_after=3)
+    # Напоминание записано в базу в обход notify(): диспетчер найдёт его после MAX_IDLE_SECONDS
+    add_event(1, 2, start + 7200, [start + MAX_IDLE_SECONDS + 20])
+
+    reminder_dispatcher._watermark = start
+    reminder_dispatcher._running = True
+    reminder_dispatcher._run()
+
+    assert condition.waits[:2] == [MAX_IDLE_SECONDS, 20]
+    assert [[r.remind_at for r in batch] for batch in batches] == [[start + MAX_IDLE_SECONDS + 20]]
+
+
+def test_notify_ignores_processed_times_and_keeps_nearest(users, clock):
+    reminder_dispatcher, _, _ = make_dispatcher(clock, stop_after=1)
+    reminder_dispatcher._watermark = clock.now
+
+    reminder_dispatcher.notify(clock.now - 1)
+    reminder_dispatcher.notify(clock.now + 50)
+    reminder_dispatcher.notify(clock.now + 20)
+
+    assert sorted(reminder_dispatcher._heap) == [clock.now + 20, clock.now + 50]
+    assert reminder_dispatcher._heap[0] == clock.now + 20
+
+
+def test_shard_dispatches_only_its_creators(users, clock):
+    start = clock.now
+    add_event(1, 2, start + 7200, [start + 10])
+    mine = add_event(2, 3, start + 9000, [start + 10])
+    reminder_dispatcher, _, batches = make_dispatcher(clock, stop_after=2, shard=(0, 2))
+
+    run(reminder_dispatcher, start)
+
+    assert [[r.event_id for r in batch] for batch in batches] == [[mine]]
+
+
+def test_stop_wakes_sleeping_thread(users):
+    reminder_dispatcher = ReminderDispatcher(lambda reminders: None)
+    reminder_dispatcher.start()
+    started = time.monotonic()
+
+    reminder_dispatcher.stop()
+
+    assert time.monotonic() - started < 1
+    assert not reminder_dispatcher._thread.is_alive()
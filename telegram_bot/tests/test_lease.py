@@ -0,0 +1,73 @@
+import time
+
+from lease import Lease
+from repository import acquire_lease, release_lease
+
+
+class Callbacks:
+    def __init__(self):
+        self.events = []
+
+    def acquired(self):
+        self.events.append('acquired')
+
+    def lost(self):
+        self.events.append('lost')
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_acquire_lease_respects_other_owner_until_expiry(db):
+    assert acquire_lease('reminders', 'a', now=0, ttl=10)
+    assert acquire_lease('reminders', 'a', now=5, ttl=10)
+    assert not acquire_lease('reminders', 'b', now=14, ttl=10)
+    assert acquire_lease('reminders', 'b', now=16, ttl=10)
+    assert not acquire_lease('reminders', 'a', now=17, ttl=10)
+
+    # Освободить аренду может только её владелец
+    release_lease('reminders', 'a')
+    assert not acquire_lease('reminders', 'a', now=18, ttl=10)
+    release_lease('reminders', 'b')
+    assert acquire_lease('reminders', 'a', now=18, ttl=10)
+
+
+def test_only_one_replica_holds_the_lease(db):
+    first, second = Callbacks(), Callbacks()
+    lease_a = Lease('reminders', first.acquired, first.lost, ttl=2, renew_interval=0.05)
+    lease_b = Lease('reminders', second.acquired, second.lost, ttl=2, renew_interval=0.05)
+    lease_a.start()
+    lease_b.start()
+    try:
+        assert lease_a.is_held() and not lease_b.is_held()
+        time.sleep(0.2)
+        assert lease_a.is_held() and not lease_b.is_held()
+
+        # После остановки владельца аренду сразу получает другая реплика
+        lease_a.stop()
+        assert first.events == ['acquired', 'lost']
+        assert wait_until(lease_b.is_held)
+        assert second.events == ['acquired']
+    finally:
+        lease_a.stop()
+        lease_b.stop()
+    assert second.events == ['acquired', 'lost']
+
+
+def test_lease_is_not_held_after_last_renewal_expires(db):
+    callbacks = Callbacks()
+    lease = Lease('reminders', callbacks.acquired, callbacks.lost, ttl=0.2, renew_interval=60)
+    lease.start()
+    try:
+        assert lease.is_held()
+        # Продления не было: после ttl процесс не считает аренду своей, даже не узнав о потере
+        time.sleep(0.3)
+        assert not lease.is_held()
+    finally:
+        lease.stop()
@@ -0,0 +1,137 @@
+import re
+import sqlite3
+import urllib.error
+import urllib.request
+
+import pytest
+
+import repository
+from metrics import CONTENT_TYPE, REGISTRY, Counter, Gauge, Histogram, MetricsServer, Registry
+from user_cache import UserCache
+
+_NAME = r"[a-zA-Z_:][a-zA-Z0-9_:]*"
+_LABEL = rf'[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\[\\"n])*"'
+_SAMPLE = re.compile(rf"^({_NAME})(?:\{{{_LABEL}(?:,{_LABEL})*\}})? (-?[0-9.e+-]+|\+Inf|-Inf|NaN)$")
+_HEADER = re.compile(rf"^# (HELP|TYPE) ({_NAME}) (.+)$")
+
+
+def parse_exposition(text):
+    """
+    Проверяет текстовый формат Prometheus 0.0.4 и возвращает {(имя, строка меток): значение}.
+    Каждая выборка должна следовать за объявлением TYPE своей метрики.
+    """
+    assert text.endswith('\n')
+    samples, types = {}, {}
+    for line in text.splitlines():
+        header = _HEADER.match(line)
+        if header:
+            kind, name, value = header.groups()
+            if kind == 'TYPE':
+                assert value in ('counter', 'gauge', 'histogram') and name not in types
+                types[name] = value
+            continue
+        match = _SAMPLE.match(line)
+        assert match, f"Неверная строка: {line!r}"
+        name = match.group(1)
+        base = re.sub(r"_(bucket|sum|count)$", "", name) if name not in types else name
+        assert base in types, f"Выборка {name} без TYPE"
+        labels = line[len(name):line.rindex(' ')]
+        samples[(name, labels)] = float(match.group(2))
+    return samples
+
+
+def test_render_is_valid_exposition_format():
+    registry = Registry()
+    requests = registry.register(Counter('test_requests_total', "Запросы.", ('path',)))
+    latency = registry.register(Histogram('test_latency_seconds', "Время.", ('path',), buckets=(0.1, 1.0)))
+    depth = registry.register(Gauge('test_depth', "Длина очереди.", ('queue',)))
+    requests.inc(path='/a"b\\c\nd')
+    requests.inc(2, path='/x')
+    latency.observe(0.05, path='/x')
+    latency.observe(0.5, path='/x')
+    latency.observe(5, path='/x')
+    depth.set_function(lambda: 3, queue='outbound')
+    depth.set_function(lambda: 1 / 0, queue='broken')
+
+    samples = parse_exposition(registry.render())
+
+    assert samples[('test_requests_total', '{path="/a\\"b\\\\c\\nd"}')] == 1
+    assert samples[('test_requests_total', '{path="/x"}')] == 2
+    # Корзины гистограммы накопительные, последняя — +Inf
+    assert [samples[('test_latency_seconds_bucket', f'{{path="/x",le="{le}"}}')] for le in ('0.1', '1.0', '+Inf')] \
+        == [1, 2, 3]
+    assert samples[('test_latency_seconds_count', '{path="/x"}')] == 3
+    assert samples[('test_latency_seconds_sum', '{path="/x"}')] == pytest.approx(5.55)
+    # Ошибка функции датчика не ломает ответ: выборка просто пропускается
+    assert samples[('test_depth', '{queue="outbound"}')] == 3
+    assert ('test_depth', '{queue="broken"}') not in samples
+
+
+def test_metric_rejects_wrong_labels():
+    counter = Counter('test_total', "Счётчик.", ('kind',))
+    with pytest.raises(ValueError):
+        counter.inc(other='x')
+    registry = Registry()
+    registry.register(counter)
+    with pytest.raises(ValueError):
+        registry.register(Counter('test_total', "Повтор."))
+
+
+def query_samples(query):
+    samples = parse_exposition(REGISTRY.render())
+    labels = f'{{query="{query}"}}'
+    return (samples.get(('bot_db_query_duration_seconds_count', labels), 0),
+            samples.get(('bot_db_query_errors_total', labels), 0))
+
+
+def test_timed_query_updates_histogram_and_errors(db):
+    before = query_samples('add_user')
+
+    repository.add_user(1, "Анна", None, "anna", None)
+    with pytest.raises(sqlite3.IntegrityError):
+        repository.add_user(1, "Анна", None, "anna", None)
+
+    assert query_samples('add_user') == (before[0] + 2, before[1] + 1)
+
+
+def test_timed_generator_is_measured_when_exhausted(db):
+    before = query_samples('select_events_with_reminders')
+
+    rows = repository.select_events_with_reminders()
+    assert query_samples('select_events_with_reminders') == before
+    list(rows)
+
+    assert query_samples('select_events_with_reminders')[0] == before[0] + 1
+
+
+def cache_samples():
+    samples = parse_exposition(REGISTRY.render())
+    return tuple(samples.get(('bot_user_cache_lookups_total', f'{{result="{result}"}}'), 0)
+                 for result in ('hit', 'miss'))
+
+
+def test_user_cache_lookups_are_counted(users):
+    cache = UserCache(repository.select_users_fnu)
+    before = cache_samples()
+
+    cache.get_many([1, 2])
+    cache.get_many([1, 2, 3])
+
+    assert cache_samples() == (before[0] + 2, before[1] + 3)
+
+
+def test_metrics_server_serves_registry():
+    registry = Registry()
+    registry.register(Counter('test_served_total', "Счётчик.")).inc()
+    server = MetricsServer('127.0.0.1', 0, registry)
+    server.start()
+    try:
+        host, port = server._server.server_address[:2]
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=5) as response:
+            assert response.headers['Content-Type'] == CONTENT_TYPE
+            assert parse_exposition(response.read().decode('utf-8')) == {('test_served_total', ''): 1}
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"http://{host}:{port}/other", timeout=5)
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
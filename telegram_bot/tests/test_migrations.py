@@ -0,0 +1,82 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import migrations
+from database import get_connection, init_database
+from migrations import MIGRATIONS, apply_migrations, get_schema_version
+
+
+def test_migrations_reach_latest_version(db):
+    assert get_schema_version(get_connection()) == MIGRATIONS[-1][0]
+
+
+def test_apply_migrations_is_idempotent(db):
+    latest = MIGRATIONS[-1][0]
+    assert apply_migrations() == latest
+    assert get_connection().execute("SELECT COUNT(*) FROM schema_version").fetchone()[0] == len(MIGRATIONS)
+
+
+def test_lookup_indexes_exist(db):
+    indexes = {name for (name,) in get_connection().execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert {'idx_events_creator_starts', 'idx_event_participants_user_starts', 'idx_reminders_event',
+            'idx_reminders_remind_at', 'idx_event_series_next'} <= indexes
+
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    """База данных со схемой версии 6, где время событий хранилось текстом по Москве."""
+    manager = init_database(str(tmp_path / "legacy.db"))
+    with monkeypatch.context() as patch:
+        patch.setattr(migrations, 'MIGRATIONS', [m for m in MIGRATIONS if m[0] <= 6])
+        assert apply_migrations() == 6
+    yield get_connection()
+    manager.close_all()
+
+
+def test_migration_7_converts_moscow_time_to_utc(legacy_db):
+    legacy_db.executemany("INSERT INTO users (user_id, first_name) VALUES (?, ?)", [(1, "Анна"), (2, "Борис")])
+    legacy_db.execute("""
+        INSERT INTO events (event_id, creator_id, participant_id, description, event_datetime, duration_minutes, event_end)
+        VALUES (5, 1, 2, 'Встреча', '2030-01-01T12:00:00', 90, '2030-01-01T13:30:00')
+    """)
+    legacy_db.execute("INSERT INTO reminders (reminder_id, event_id, reminder_time) VALUES (7, 5, '2030-01-01T11:45:00')")
+    legacy_db.commit()
+
+    apply_migrations()
+
+    # Москва — UTC+3 круглый год: 12:00 по Москве = 09:00 UTC
+    starts_at = int(datetime(2030, 1, 1, 9, 0, tzinfo=timezone.utc).timestamp())
+    assert legacy_db.execute("SELECT event_id, starts_at, ends_at, duration_minutes FROM events").fetchall() == [
+        (5, starts_at, starts_at + 90 * 60, 90)]
+    assert legacy_db.execute("SELECT reminder_id, event_id, remind_at FROM reminders").fetchall() == [
+        (7, 5, starts_at - 15 * 60)]
+    assert legacy_db.execute("SELECT timezone FROM users WHERE user_id=1").fetchone() == ('Europe/Moscow',)
+
+
+def test_migration_7_rebuilds_indexes(legacy_db):
+    apply_migrations()
+
+    def index_columns(name):
+        return [row[2] for row in legacy_db.execute(f"PRAGMA index_info({name})")]
+
+    assert index_columns('idx_events_creator_starts') == ['creator_id', 'starts_at']
+    assert index_columns('idx_reminders_event') == ['event_id']
+    assert index_columns('idx_reminders_remind_at') == ['remind_at']
+    # Индексы по текстовым столбцам удалены вместе со старыми таблицами
+    indexes = {name for (name,) in legacy_db.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert not indexes & {'idx_events_creator_datetime', 'idx_events_participant_datetime', 'idx_reminders_time'}
+
+
+def test_migration_7_keeps_autoincrement_counters(legacy_db):
+    legacy_db.execute("INSERT INTO users (user_id, first_name) VALUES (1, 'Анна')")
+    legacy_db.execute("""
+        INSERT INTO events (event_id, creator_id, participant_id, description, event_datetime)
+        VALUES (40, 1, 1, 'Удалённое', '2030-01-01T12:00:00')
+    """)
+    legacy_db.execute("DELETE FROM events")
+    legacy_db.commit()
+
+    apply_migrations()
+
+    assert legacy_db.execute("SELECT seq FROM sqlite_sequence WHERE name='events'").fetchone() == (40,)
@@ -0,0 +1,229 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from telebot import asyncio_helper
+from telebot.apihelper import ApiTelegramException
+
+import async_outbound
+import outbound
+from async_outbound import AsyncOutboundQueue
+from outbound import PRIORITY_INTERACTIVE, PRIORITY_REMINDER, MessageCancelled, OutboundQueue, TokenBucket
+
+
+def too_many_requests(exception_type, retry_after):
+    return exception_type('sendMessage', None, {'error_code': 429, 'description': 'Too Many Requests',
+                                                'parameters': {'retry_after': retry_after}})
+
+
+class FakeBot:
+    """Записывает отправленные сообщения; failures[text] — исключения, которые поднимут первые попытки."""
+
+    def __init__(self, failures=None):
+        self.sent = []
+        self.calls = 0
+        self.failures = failures or {}
+        self._lock = threading.Lock()
+
+    def _attempt(self, chat_id, text):
+        with self._lock:
+            self.calls += 1
+            failures = self.failures.get(text)
+            if failures:
+                raise failures.pop(0)
+            self.sent.append((chat_id, text, time.monotonic()))
+        return text
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._attempt(chat_id, text)
+
+
+class AsyncFakeBot(FakeBot):
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0)
+        return self._attempt(chat_id, text)
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(outbound, 'RETRY_BACKOFF_SECONDS', 0.01)
+    monkeypatch.setattr(async_outbound, 'RETRY_BACKOFF_SECONDS', 0.01)
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2, capacity=3, now=0)
+    for _ in range(3):
+        assert bucket.wait_time(0) == 0
+        bucket.consume()
+    assert bucket.wait_time(0) == pytest.approx(0.5)
+    assert bucket.wait_time(0.5) == 0
+    # Запас не превышает capacity даже после долгого простоя
+    bucket.wait_time(100)
+    assert bucket.tokens == 3
+
+
+def test_token_bucket_block_delays_next_token():
+    bucket = TokenBucket(rate=1, capacity=3, now=0)
+    bucket.block(5, now=0)
+    assert bucket.wait_time(0) == pytest.approx(5)
+    assert bucket.wait_time(5) == 0
+
+
+def test_queue_limits_messages_per_chat():
+    bot = FakeBot()
+    queue = OutboundQueue(bot, global_rate=1000, chat_rate=5, chat_burst=2)
+    try:
+        futures = queue.send_messages([(1, f"m{i}") for i in range(4)] + [(2, "other")])
+        for future in futures:
+            future.result(timeout=5)
+    finally:
+        queue.close()
+
+    chat = [(text, at) for chat_id, text, at in bot.sent if chat_id == 1]
+    assert [text for text, _ in chat] == ["m0", "m1", "m2", "m3"]
+    # Два сообщения уходят сразу, следующие — не чаще пяти в секунду
+    assert chat[3][1] - chat[0][1] >= 0.35
+
+
+def test_queue_sends_interactive_messages_before_reminders():
+    bot = FakeBot()
+    queue = OutboundQueue(bot, global_rate=10, chat_rate=1000)
+    try:
+        reminders = queue.send_messages([(chat_id, f"reminder {chat_id}") for chat_id in range(5)], PRIORITY_REMINDER)
+        reply = queue.send_message(100, "reply", PRIORITY_INTERACTIVE, wait=False)
+        for future in [*reminders, reply]:
+            future.result(timeout=5)
+    finally:
+        queue.close()
+
+    order = [text for _, text, _ in bot.sent]
+    assert order.index("reply") < 3
+
+
+def test_queue_waits_retry_after_on_429():
+    bot = FakeBot({"limited": [too_many_requests(ApiTelegramException, 0.2)]})
+    queue = OutboundQueue(bot, global_rate=1000, chat_rate=1000)
+    try:
+        started = time.monotonic()
+        assert queue.send_message(1, "limited") == "limited"
+    finally:
+        queue.close()
+    assert time.monotonic() - started >= 0.2
+    assert bot.calls == 2
+
+
+def test_queue_retries_network_errors():
+    bot = FakeBot({"flaky": [ConnectionError("reset"), TimeoutError("slow")]})
+    queue = OutboundQueue(bot, global_rate=1000, chat_rate=1000)
+    try:
+        assert queue.send_message(1, "flaky") == "flaky"
+    finally:
+        queue.close()
+    assert bot.calls == 3
+
+
+def test_queue_gives_up_after_max_attempts():
+    bot = FakeBot({"down": [ConnectionError("down")] * outbound.MAX_ATTEMPTS})
+    queue = OutboundQueue(bot, global_rate=1000, chat_rate=1000)
+    try:
+        with pytest.raises(ConnectionError):
+            queue.send_message(1, "down")
+    finally:
+        queue.close()
+    assert bot.calls == outbound.MAX_ATTEMPTS
+
+
+def test_queue_does_not_retry_programming_errors():
+    bot = FakeBot({"bug": [TypeError("bad argument")]})
+    queue = OutboundQueue(bot, global_rate=1000, chat_rate=1000)
+    try:
+        with pytest.raises(TypeError):
+            queue.send_message(1, "bug")
+        assert queue.send_message(1, "next") == "next"
+    finally:
+        queue.close()
+    assert bot.calls == 2
+
+
+def test_cancel_drops_queued_messages_of_priority():
+    release = threading.Event()
+
+    class BlockedBot(FakeBot):
+        def send_message(self, chat_id, text, **kwargs):
+            with self._lock:
+                self.started = getattr(self, 'started', 0) + 1
+            release.wait(5)
+            return super().send_message(chat_id, text, **kwargs)
+
+    bot = BlockedBot({"r1": [ConnectionError("reset")]})
+    queue = OutboundQueue(bot, global_rate=1000, chat_rate=1000)
+    try:
+        first, second = queue.send_messages([(1, "r1"), (2, "r2")], PRIORITY_REMINDER)
+        while getattr(bot, 'started', 0) < 2:
+            time.sleep(0.01)
+        reply = queue.send_message(1, "reply", wait=False)
+        queued = queue.send_messages([(1, "r1 later"), (2, "r2 later")], PRIORITY_REMINDER)
+
+        assert queue.cancel(PRIORITY_REMINDER) == 2
+        assert all(isinstance(future.exception(timeout=0), MessageCancelled) for future in queued)
+        release.set()
+        # Начатые отправки завершаются, но снятое сообщение после сетевой ошибки не повторяется
+        assert second.result(timeout=5) == "r2" and reply.result(timeout=5) == "reply"
+        assert isinstance(first.exception(timeout=5), MessageCancelled)
+    finally:
+        queue.close()
+    assert sorted(text for _, text, _ in bot.sent) == ["r2", "reply"]
+    assert bot.calls == 3
+
+
+def test_async_queue_limits_messages_per_chat():
+    bot = AsyncFakeBot()
+    queue = AsyncOutboundQueue(bot, global_rate=1000, chat_rate=5, chat_burst=2)
+
+    results = asyncio.run(queue.send_messages([(1, f"m{i}") for i in range(4)] + [(2, "other")]))
+
+    assert results == ["m0", "m1", "m2", "m3", "other"]
+    chat = [(text, at) for chat_id, text, at in bot.sent if chat_id == 1]
+    assert [text for text, _ in chat] == ["m0", "m1", "m2", "m3"]
+    assert chat[3][1] - chat[0][1] >= 0.35
+    assert queue.depth() == 0
+
+
+def test_async_queue_retries_and_reports_failures():
+    bot = AsyncFakeBot({
+        "limited": [too_many_requests(asyncio_helper.ApiTelegramException, 0.2)],
+        "flaky": [asyncio_helper.RequestTimeout("timeout")],
+        "bug": [TypeError("bad argument")],
+    })
+    queue = AsyncOutboundQueue(bot, global_rate=1000, chat_rate=1000)
+
+    started = time.monotonic()
+    results = asyncio.run(queue.send_messages([(1, "limited"), (2, "flaky"), (3, "bug")]))
+
+    assert results[:2] == ["limited", "flaky"]
+    assert isinstance(results[2], TypeError)
+    assert time.monotonic() - started >= 0.2
+    assert bot.calls == 5
+
+
+def test_handler_replies_do_not_wait_for_delivery(app, monkeypatch):
+    import utilities
+
+    release = threading.Event()
+
+    class BlockedBot(FakeBot):
+        def send_message(self, chat_id, text, **kwargs):
+            release.wait(5)
+            return super().send_message(chat_id, text, **kwargs)
+
+    queue = OutboundQueue(BlockedBot(), global_rate=1000, chat_rate=1000)
+    monkeypatch.setattr(utilities, 'outbound_queue', queue)
+    try:
+        # Обработчик получает Future сразу, пока Telegram ещё не ответил
+        future = utilities.send_message(1, "reply")
+        assert not future.done()
+        release.set()
+        assert future.result(timeout=5) == "reply"
+    finally:
+        queue.close()
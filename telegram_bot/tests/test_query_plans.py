@@ -0,0 +1,17 @@
+import query_plans
+from metrics import TIMED_QUERIES
+from query_plans import QUERY_PROBES, check_query_plans
+
+
+def test_every_timed_query_has_probe():
+    assert TIMED_QUERIES and TIMED_QUERIES <= QUERY_PROBES.keys()
+
+
+def test_repository_queries_use_indexes():
+    assert check_query_plans() == []
+
+
+def test_timed_query_without_probe_is_reported(monkeypatch):
+    monkeypatch.setattr(query_plans, 'TIMED_QUERIES', TIMED_QUERIES | {'select_unprobed'})
+
+    assert check_query_plans() == [('select_unprobed', None, None)]
@@ -0,0 +1,124 @@
+from datetime import datetime
+
+import pytest
+
+import repository
+from database import get_connection
+from recurrence import (FREQUENCY_DAILY, FREQUENCY_MONTHLY, FREQUENCY_WEEKLY, Recurrence, next_occurrence,
+                        occurrence_start, split_recurrence)
+from timezones import format_ts, local_to_ts, now_ts
+
+MOSCOW = 'Europe/Moscow'
+BERLIN = 'Europe/Berlin'
+DAY = 86400
+
+
+def test_split_recurrence_with_count():
+    rest, recurrence = split_recurrence("01.02.2027 10:00 30 еженедельно 4", MOSCOW)
+    assert rest == "01.02.2027 10:00 30"
+    assert recurrence == Recurrence(FREQUENCY_WEEKLY, None, 4)
+
+
+def test_split_recurrence_until_includes_whole_day():
+    _, recurrence = split_recurrence("01.02.2027 10:00 daily до 15.02.2027", MOSCOW)
+    assert recurrence.frequency == FREQUENCY_DAILY
+    assert recurrence.until_at == local_to_ts(datetime(2027, 2, 16), MOSCOW) - 1
+
+
+def test_split_recurrence_without_rule():
+    assert split_recurrence("01.02.2027 10:00", MOSCOW) == ("01.02.2027 10:00", None)
+
+
+@pytest.mark.parametrize("text", ["01.02.2027 10:00 ежедневно 0", "01.02.2027 10:00 ежедневно завтра",
+                                  "01.02.2027 10:00 ежедневно до 31.02.2027"])
+def test_split_recurrence_rejects_bad_rule(text):
+    with pytest.raises(ValueError):
+        split_recurrence(text, MOSCOW)
+
+
+def test_monthly_occurrence_clamps_to_month_end():
+    first = local_to_ts(datetime(2027, 1, 31, 9, 0), MOSCOW)
+    starts = [format_ts(occurrence_start(first, MOSCOW, FREQUENCY_MONTHLY, i), MOSCOW) for i in range(4)]
+    assert starts == ["31.01.2027 09:00", "28.02.2027 09:00", "31.03.2027 09:00", "30.04.2027 09:00"]
+
+
+def test_weekly_occurrence_keeps_local_time_across_dst():
+    first = local_to_ts(datetime(2026, 10, 19, 10, 0), BERLIN)
+    second = occurrence_start(first, BERLIN, FREQUENCY_WEEKLY, 1)
+    assert format_ts(second, BERLIN) == "26.10.2026 10:00"
+    assert second - first == 7 * DAY + 3600
+
+
+def test_next_occurrence_stops_at_count_and_until():
+    first = local_to_ts(datetime(2027, 1, 1, 9, 0), MOSCOW)
+    assert next_occurrence(first, MOSCOW, FREQUENCY_DAILY, None, 3, 2) == first + 2 * DAY
+    assert next_occurrence(first, MOSCOW, FREQUENCY_DAILY, None, 3, 3) is None
+    assert next_occurrence(first, MOSCOW, FREQUENCY_DAILY, first + DAY, None, 1) == first + DAY
+    assert next_occurrence(first, MOSCOW, FREQUENCY_DAILY, first + DAY, None, 2) is None
+
+
+@pytest.fixture
+def series_start():
+    """Начало первого вхождения серии через двое суток, выровненное по часу."""
+    return (now_ts() // 3600 + 48) * 3600
+
+
+def event_starts():
+    return [starts_at for (starts_at,) in get_connection().execute(
+        "SELECT starts_at FROM events ORDER BY starts_at")]
+
+
+def test_series_expands_lazily_up_to_horizon(users, series_start):
+    recurrence = Recurrence(FREQUENCY_DAILY, None, 10)
+    first_id = repository.create_event_series(1, [2, 3], "Планёрка", series_start, 30, MOSCOW, recurrence,
+                                              series_start + 2 * DAY)
+
+    assert event_starts() == [series_start + i * DAY for i in range(3)]
+    assert repository.get_event_data(first_id)[3] == series_start
+    assert repository.repo.get_participants([first_id]) == {first_id: [2, 3]}
+
+    horizon = series_start + 5 * DAY
+    created = repository.expand_event_series(horizon)
+    assert len(created) == 3
+    # Повторный вызов с тем же горизонтом ничего не создаёт
+    assert repository.expand_event_series(horizon) == []
+    assert repository.expand_event_series(series_start + 100 * DAY) != []
+    assert len(event_starts()) == 10
+
+
+def test_series_skips_conflicting_occurrence(users, series_start):
+    repository.create_event(3, [2], "Занято", series_start + DAY)
+
+    repository.create_event_series(1, [2], "Планёрка", series_start, 60, MOSCOW,
+                                   Recurrence(FREQUENCY_DAILY, None, 3), series_start + 3 * DAY)
+
+    # Второе вхождение пересекается с событием участника 2 и пропускается
+    assert event_starts() == [series_start, series_start + DAY, series_start + 2 * DAY]
+    assert get_connection().execute("SELECT COUNT(*) FROM events WHERE series_id IS NOT NULL").fetchone()[0] == 2
+
+
+def test_delete_series_keeps_earlier_occurrences(users, series_start):
+    repository.create_event_series(1, [2], "Планёрка", series_start, 30, MOSCOW,
+                                   Recurrence(FREQUENCY_WEEKLY, None, None), series_start + 3 * 7 * DAY)
+    second_id = get_connection().execute(
+        "SELECT event_id FROM events ORDER BY starts_at LIMIT 1 OFFSET 1").fetchone()[0]
+
+    deleted = repository.delete_event_series(second_id)
+
+    assert len(deleted) == 3
+    assert event_starts() == [series_start]
+    until_at, next_starts_at = get_connection().execute(
+        "SELECT until_at, next_starts_at FROM event_series").fetchone()
+    assert (until_at, next_starts_at) == (series_start + 7 * DAY - 1, None)
+    # Закончившаяся серия больше не разворачивается
+    assert repository.expand_event_series(series_start + 100 * DAY) == []
+
+
+def test_delete_series_from_first_occurrence_removes_series(users, series_start):
+    first_id = repository.create_event_series(1, [2], "Планёрка", series_start, 30, MOSCOW,
+                                              Recurrence(FREQUENCY_DAILY, None, 3), series_start + 3 * DAY)
+
+    repository.delete_event_series(first_id)
+
+    for table in ("events", "reminders", "event_series", "series_participants"):
+        assert get_connection().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == 0
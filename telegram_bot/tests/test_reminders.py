@@ -0,0 +1,109 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+import deliveries
+import repository
+from deliveries import DELIVERY_PENDING, DELIVERY_SENT, DeliveryLedger
+from outbound import MessageCancelled, OutboundQueue
+from timezones import now_ts
+
+HOUR = 3600
+
+
+class FakeQueue:
+    """Очередь исходящих сообщений, сразу завершающая каждое сообщение успехом."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_messages(self, messages, priority, **kwargs):
+        futures = []
+        for chat_id, text in messages:
+            self.sent.append((chat_id, text))
+            future = Future()
+            future.set_result(None)
+            futures.append(future)
+        return futures
+
+
+@pytest.fixture
+def utilities(app, db, monkeypatch):
+    import utilities
+
+    monkeypatch.setattr(utilities, 'outbound_queue', FakeQueue())
+    monkeypatch.setattr(utilities.reminder_lease, 'is_held', lambda: True)
+    return utilities
+
+
+@pytest.fixture
+def reminders(users):
+    starts_at = (now_ts() // HOUR + 48) * HOUR
+    repository.create_event_with_reminders(1, [2, 3], "Встреча", starts_at, 60, [starts_at - HOUR])
+    return repository.select_due_reminders(0, starts_at)
+
+
+def test_reminder_is_rendered_for_creator_and_every_participant(utilities, reminders):
+    messages = utilities.render_reminder_messages(reminders)
+
+    assert [chat_id for _, chat_id, _ in messages] == [1, 2, 3]
+    assert all("@user2, @user3" in text for _, _, text in messages)
+
+
+def test_each_recipient_gets_one_delivery(utilities, reminders):
+    utilities.send_reminders(reminders)
+    # Повторная выборка тех же напоминаний (например, после перезапуска) ничего не отправляет
+    utilities.send_reminders(reminders)
+
+    assert sorted(chat_id for chat_id, _ in utilities.outbound_queue.sent) == [1, 2, 3]
+
+
+def test_reminders_are_not_sent_without_lease(utilities, reminders, monkeypatch):
+    monkeypatch.setattr(utilities.reminder_lease, 'is_held', lambda: False)
+
+    assert utilities.send_reminders(reminders) == []
+    assert utilities.outbound_queue.sent == []
+
+
+def test_lease_handover_leaves_queued_reminders_to_new_owner(utilities, reminders, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    class BlockedBot:
+        def send_message(self, chat_id, text, **kwargs):
+            started.set()
+            release.wait(5)
+            return text
+
+    # Общий лимит пропускает только первое сообщение, остальные ждут в очереди
+    queue = OutboundQueue(BlockedBot(), global_rate=0.1, chat_rate=1000)
+    ledger = DeliveryLedger(flush_interval=60, pending_retry=utilities.REMINDER_PENDING_RETRY_SECONDS)
+    monkeypatch.setattr(utilities, 'outbound_queue', queue)
+    monkeypatch.setattr(utilities, 'delivery_ledger', ledger)
+    try:
+        futures = utilities.send_reminders(reminders)
+        assert started.wait(5)
+        monkeypatch.setattr(utilities.reminder_lease, 'is_held', lambda: False)
+        utilities.stop_reminder_delivery()
+        release.set()
+        assert futures[0].result(timeout=5)
+        assert all(isinstance(future.exception(timeout=5), MessageCancelled) for future in futures[1:])
+    finally:
+        queue.close()
+        ledger.close()
+
+    reminder_id = reminders[0].reminder_id
+    pairs = [(reminder_id, user_id) for user_id in (1, 2, 3)]
+    found = repository.repo.get_deliveries([reminder_id])
+    assert [found[pair].status for pair in pairs] == [DELIVERY_SENT, DELIVERY_PENDING, DELIVERY_PENDING]
+
+    # Сразу после смены владельца догоняющая рассылка не трогает только что начатые доставки,
+    # а после REMINDER_PENDING_RETRY_SECONDS забирает снятые с очереди
+    new_owner = DeliveryLedger(pending_retry=utilities.REMINDER_PENDING_RETRY_SECONDS)
+    try:
+        assert new_owner.claim(pairs, retry_pending=True) == set()
+        later = now_ts() + utilities.REMINDER_PENDING_RETRY_SECONDS + 1
+        monkeypatch.setattr(deliveries, 'now_ts', lambda: later)
+        assert new_owner.claim(pairs, retry_pending=True) == set(pairs[1:])
+    finally:
+        new_owner.close()
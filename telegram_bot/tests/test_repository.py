@@ -0,0 +1,205 @@
+import pytest
+
+import repository
+from database import get_connection, transaction
+from repository import repo
+from timezones import now_ts
+
+HOUR = 3600
+
+
+@pytest.fixture
+def starts_at():
+    """Начало события через двое суток, выровненное по часу."""
+    return (now_ts() // HOUR + 48) * HOUR
+
+
+def count(table):
+    return get_connection().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_create_event_with_reminders(users, starts_at):
+    event_id = repository.create_event_with_reminders(1, [3, 2], "Встреча", starts_at, 30,
+                                                      [starts_at - HOUR, starts_at - 2 * HOUR])
+
+    event = repo.get_event(event_id)
+    assert (event.creator_id, event.participant_id, event.starts_at, event.duration_minutes) == (1, 3, starts_at, 30)
+    assert repo.get_participants([event_id]) == {event_id: [3, 2]}
+    assert [r.remind_at for r in repo.get_reminders([event_id])[event_id]] == [starts_at - 2 * HOUR,
+                                                                              starts_at - HOUR]
+
+
+def test_conflicting_event_is_not_created(users, starts_at):
+    repository.create_event_with_reminders(1, [2], "Первое", starts_at, 60, [starts_at - HOUR])
+
+    # Участник 2 занят первые 60 минут, пересечение проверяется и для участников
+    assert repository.create_event_with_reminders(3, [2], "Второе", starts_at + 30 * 60, 60, [starts_at]) is None
+    assert count("events") == 1 and count("reminders") == 1
+    # Событие, начинающееся ровно в момент окончания первого, не пересекается с ним
+    assert repository.create_event_with_reminders(3, [2], "Третье", starts_at + HOUR, 60, []) is not None
+
+
+def test_update_rejects_conflict_and_keeps_reminders(users, starts_at):
+    first = repository.create_event_with_reminders(1, [2], "Первое", starts_at, 60, [starts_at - HOUR])
+    second = repository.create_event_with_reminders(1, [3], "Второе", starts_at + 2 * HOUR, 60,
+                                                    [starts_at + HOUR])
+
+    assert not repository.update_event_with_reminders((1, 3), "Второе", starts_at, second, 60, [starts_at - 1])
+    assert repo.get_event(second).starts_at == starts_at + 2 * HOUR
+    assert [r.remind_at for r in repo.get_reminders([second])[second]] == [starts_at + HOUR]
+
+    assert repository.update_event_with_reminders((1, 2), "Первое", starts_at + 4 * HOUR, first, 60,
+                                                  [starts_at + 3 * HOUR])
+    assert repo.get_event(first).starts_at == starts_at + 4 * HOUR
+    assert [r.remind_at for r in repo.get_reminders([first])[first]] == [starts_at + 3 * HOUR]
+
+
+def test_transaction_rolls_back_on_error(users, starts_at):
+    with pytest.raises(RuntimeError):
+        with transaction():
+            event_id = repository.create_event(1, [2], "Откатится", starts_at)
+            repository.create_reminders(event_id, starts_at - HOUR)
+            raise RuntimeError("сбой")
+
+    assert count("events") == 0 and count("event_participants") == 0 and count("reminders") == 0
+
+
+def test_delete_event_with_reminders(users, starts_at):
+    event_id = repository.create_event_with_reminders(1, [2, 3], "Удалить", starts_at, 60, [starts_at - HOUR])
+
+    repository.delete_event_with_reminders(event_id)
+
+    assert count("events") == 0 and count("event_participants") == 0 and count("reminders") == 0
+
+
+def test_events_page_keyset_pagination(users, starts_at):
+    event_ids = [repository.create_event(1 if i % 2 else 2, [3], f"Событие {i}", starts_at + i * 2 * HOUR)
+                 for i in range(5)]
+
+    first = repository.select_events_page(3, 2)
+    assert [row[0] for row in first] == event_ids[:2]
+    second = repository.select_events_page(3, 2, (first[-1][2], first[-1][0]))
+    assert [row[0] for row in second] == event_ids[2:4]
+    last = repository.select_events_page(3, 2, (second[-1][2], second[-1][0]))
+    assert [row[0] for row in last] == event_ids[4:]
+    back = repository.select_events_page(3, 2, (second[0][2], second[0][0]), backward=True)
+    assert [row[0] for row in back] == event_ids[:2]
+
+    # Создатель видит свои события, число участников берётся из event_participants
+    assert [row[0] for row in repository.select_events_page(1, 10)] == event_ids[1::2]
+    assert {row[-1] for row in first} == {1}
+
+
+def test_repository_batches_large_in_lists(users, starts_at):
+    event_ids = [repository.create_event(1, [2], "Пачка", starts_at + i * 2 * HOUR)
+                 for i in range(repository.SQL_IN_BATCH_SIZE + 3)]
+
+    events = repo.get_events(event_ids + [event_ids[0], 10 ** 9])
+
+    assert set(events) == set(event_ids)
+    assert events[event_ids[-1]].description == "Пачка"
+
+
+def test_conflict_is_checked_for_every_participant(users, starts_at):
+    repository.add_user(4, "Гриша", "Тестов", "user4", None)
+    repository.create_event_with_reminders(1, [2, 3], "Первое", starts_at, 60, [])
+
+    # Второй участник занят, хотя событие создавал не он
+    assert repository.create_event_with_reminders(4, [3], "Второе", starts_at + 30 * 60, 60, []) is None
+    # Создатель нового события занят как участник чужого
+    assert repository.create_event_with_reminders(3, [4], "Третье", starts_at + 30 * 60, 60, []) is None
+    # При изменении события пересечение тоже проверяется для участников, а не только для создателя
+    fourth = repository.create_event_with_reminders(4, [1], "Четвёртое", starts_at + 2 * HOUR, 60, [])
+    assert not repository.update_event_with_reminders((4, 2), "Четвёртое", starts_at, fourth, 60, [])
+    assert count("events") == 2
+
+
+def test_events_page_merges_created_and_joined_events(users, starts_at):
+    # Пользователь 2 — создатель одних событий и участник других, часть из них начинается одновременно
+    event_ids = []
+    for i in range(7):
+        creator_id, participant_ids = (2, [3]) if i % 3 == 0 else (1 if i % 2 else 3, [2])
+        event_ids.append(repository.create_event(creator_id, participant_ids, f"Событие {i}",
+                                                 starts_at + (i // 2) * 2 * HOUR))
+    expected = sorted(event_ids, key=lambda event_id: (repo.get_event(event_id).starts_at, event_id))
+
+    pages, cursor = [], None
+    while True:
+        page = repository.select_events_page(2, 3, cursor)
+        if not page:
+            break
+        pages.append([row[0] for row in page])
+        cursor = (page[-1][2], page[-1][0])
+    assert [event_id for page in pages for event_id in page] == expected
+    assert [len(page) for page in pages] == [3, 3, 1]
+
+    # Обратно от последней страницы — те же страницы без пропусков и повторов
+    pages_back, cursor = [], (repo.get_event(expected[-1]).starts_at, expected[-1])
+    while True:
+        page = repository.select_events_page(2, 3, cursor, backward=True)
+        if not page:
+            break
+        pages_back.insert(0, [row[0] for row in page])
+        cursor = (page[0][2], page[0][0])
+    assert [event_id for page in pages_back for event_id in page] == expected[:-1]
+
+
+def test_due_reminder_lists_each_participant_once(users, starts_at):
+    event_id = repository.create_event_with_reminders(1, [3, 2], "Встреча", starts_at, 60,
+                                                      [starts_at - HOUR, starts_at - 2 * HOUR])
+
+    reminders = repository.select_due_reminders(starts_at - 3 * HOUR, starts_at)
+
+    assert [(r.event_id, r.remind_at) for r in reminders] == [(event_id, starts_at - 2 * HOUR),
+                                                              (event_id, starts_at - HOUR)]
+    for reminder in reminders:
+        assert reminder.creator_id == 1
+        assert [recipient.user_id for recipient in reminder.participants] == [3, 2]
+
+
+def all_pages(limit, **kwargs):
+    """Проходит справочник пользователей постранично вперёд и возвращает страницы ID."""
+    pages, cursor = [], None
+    while True:
+        page = repository.select_users_page(limit, cursor, **kwargs)
+        if not page:
+            return pages
+        pages.append([user.user_id for user in page])
+        cursor = page[-1].user_id
+
+
+def test_users_page_prefix_ignores_case(db):
+    for user_id, first_name, last_name, username in (
+            (10, "Ёлка", None, "spruce"), (11, "Иван", "Ёлкин", "IVAN_ELK"), (12, "Straße", None, "STRASSE_fan"),
+            (13, "Боб", None, "ёлкапалка"), (14, "ЁЛКИН", "Пётр", None)):
+        repository.add_user(user_id, first_name, last_name, username, None)
+
+    def search(prefix):
+        return [user.user_id for user in repository.select_users_page(10, prefix=prefix)]
+
+    # Совпадения по имени и по username сливаются в один список по ключу сортировки
+    assert search("ЁЛ") == [10, 13, 14]
+    assert search("ivan") == [11]
+    assert search("Иван ё") == [11]
+    # casefold: «ß» совпадает с «ss»; пользователь, совпавший и именем, и username, выводится один раз
+    assert search("STRASSE") == [12]
+    assert search("нет такого") == []
+
+
+def test_users_page_keyset_boundaries(db):
+    # Одинаковые имена упорядочены по user_id
+    for user_id in (5, 3, 4, 1, 2, 6):
+        repository.add_user(user_id, "Анна", None, f"anna{user_id}", None)
+    repository.add_user(7, "Борис", None, "ann_fan", None)
+
+    assert all_pages(3) == [[1, 2, 3], [4, 5, 6], [7]]
+    assert all_pages(7) == [[1, 2, 3, 4, 5, 6, 7]]
+    assert all_pages(3, exclude_user_id=4) == [[1, 2, 3], [5, 6, 7]]
+    # По username: "ann_fan" < "anna1"
+    assert all_pages(2, prefix="ann") == [[7, 1], [2, 3], [4, 5], [6]]
+    # Назад от первой строки страницы — предыдущая страница, от самой первой — пусто
+    assert [u.user_id for u in repository.select_users_page(3, 4, backward=True)] == [1, 2, 3]
+    assert [u.user_id for u in repository.select_users_page(2, 2, backward=True, prefix="ann")] == [7, 1]
+    assert repository.select_users_page(3, 1, backward=True) == []
+    # Курсор удалённого пользователя возвращает к первой странице
+    assert [u.user_id for u in repository.select_users_page(3, 99)] == [1, 2, 3]
@@ -0,0 +1,92 @@
+from types import SimpleNamespace
+
+import pytest
+
+import state_store
+from repository import select_conversation_state
+from state_store import StateStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Подменяет время хранилища: тест сам сдвигает clock.now."""
+    fake = SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(state_store, 'time', SimpleNamespace(time=lambda: fake.now))
+    return fake
+
+
+def test_idle_state_is_not_stored(clock):
+    store = StateStore('main_menu')
+    store.set(1, {'state': 'waiting_for_description', 'participant_id': 2})
+    store.update(1, description="Встреча")
+
+    assert store.get(1) == {'state': 'waiting_for_description', 'participant_id': 2, 'description': "Встреча"}
+    store.set(1, {'state': 'main_menu'})
+    assert store.get(1) is None and len(store) == 0
+
+
+def test_get_returns_copy(clock):
+    store = StateStore('main_menu')
+    store.set(1, {'state': 'editing'})
+    store.get(1)['state'] = 'changed'
+
+    assert store.get(1) == {'state': 'editing'}
+
+
+def test_state_expires_after_ttl_of_inactivity(clock):
+    store = StateStore('main_menu', ttl=10)
+    store.set(1, {'state': 'editing'})
+    store.set(2, {'state': 'editing'})
+
+    clock.now += 8
+    assert store.get(1) == {'state': 'editing'}
+    # Обращение к первому пользователю продлило его диалог, второй устарел
+    clock.now += 5
+    assert store.get(1) == {'state': 'editing'}
+    assert store.get(2) is None
+    assert len(store) == 1
+
+
+def test_least_recently_used_state_is_evicted(clock):
+    store = StateStore('main_menu', max_size=2)
+    store.set(1, {'state': 'a'})
+    clock.now += 1
+    store.set(2, {'state': 'b'})
+    clock.now += 1
+    store.get(1)
+    clock.now += 1
+    store.set(3, {'state': 'c'})
+
+    assert len(store) == 2
+    assert store.get(2) is None
+    assert store.get(1) == {'state': 'a'} and store.get(3) == {'state': 'c'}
+
+
+def test_persisted_state_is_restored_by_new_store(db, clock):
+    store = StateStore('main_menu', ttl=100, persist=True)
+    store.set(1, {'state': 'waiting_for_time', 'description': "Созвон"})
+    store.set(2, {'state': 'editing'})
+    store.clear(2)
+
+    # Новый экземпляр — как после перезапуска бота: в памяти ничего нет
+    restarted = StateStore('main_menu', ttl=100, persist=True)
+    assert len(restarted) == 0
+    assert restarted.get(1) == {'state': 'waiting_for_time', 'description': "Созвон"}
+    assert restarted.get(2) is None
+    assert select_conversation_state(2, 0) is None
+
+
+def test_persisted_state_expires_after_ttl(db, clock):
+    StateStore('main_menu', ttl=100, persist=True).set(1, {'state': 'editing'})
+
+    clock.now += 101
+    assert StateStore('main_menu', ttl=100, persist=True).get(1) is None
+
+
+def test_evicted_state_is_reloaded_from_database(db, clock):
+    store = StateStore('main_menu', max_size=1, persist=True)
+    store.set(1, {'state': 'a'})
+    store.set(2, {'state': 'b'})
+
+    assert len(store) == 1
+    assert store.get(1) == {'state': 'a'}
@@ -0,0 +1,97 @@
+import time
+
+import pytest
+
+import repository
+from timezones import now_ts
+
+HOUR = 3600
+
+
+@pytest.fixture
+def supervisor(app):
+    import supervisor
+
+    return supervisor
+
+
+class FakeProcess:
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.exitcode = None if alive else 1
+
+    def is_alive(self):
+        return self.alive
+
+    def join(self):
+        pass
+
+
+def message(update_id, user_id):
+    return {'update_id': update_id, 'message': {'message_id': 1, 'from': {'id': user_id}, 'text': "/start"}}
+
+
+def test_update_user_id(supervisor):
+    assert supervisor.update_user_id(message(1, 42)) == 42
+    assert supervisor.update_user_id({'update_id': 2, 'callback_query': {'id': "1", 'from': {'id': 7}}}) == 7
+    # Пост канала без отправителя попадает в процесс 0
+    assert supervisor.update_user_id({'update_id': 3, 'channel_post': {'message_id': 1}}) == 0
+
+
+def test_updates_are_routed_by_user_id(supervisor):
+    workers = supervisor.Supervisor(3)
+    for update_id, user_id in enumerate([7, 9, 10, 7, 5]):
+        assert workers.route(message(update_id, user_id))
+
+    # Каждое обновление — в процесс user_id % WORKERS, обновления пользователя — по порядку
+    expected = [[(1, 9)], [(0, 7), (2, 10), (3, 7)], [(4, 5)]]
+    for updates, routed in zip(workers._queues, expected):
+        received = [updates.get(timeout=5) for _ in routed]
+        assert [(update['update_id'], update['message']['from']['id']) for update in received] == routed
+        assert updates.empty()
+
+
+def test_route_without_block_rejects_update_when_queue_is_full(supervisor):
+    workers = supervisor.Supervisor(1, queue_size=1)
+
+    assert workers.route(message(1, 1), block=False)
+    assert not workers.route(message(2, 1), block=False)
+    assert workers._queues[0].get(timeout=5)['update_id'] == 1
+
+
+def test_reminders_are_split_by_creator_like_updates(supervisor, users):
+    repository.add_user(4, "Гриша", "Тестов", "user4", None)
+    starts_at = (now_ts() // HOUR + 48) * HOUR
+    for creator_id in (1, 2, 3, 4):
+        repository.create_event_with_reminders(creator_id, [5 - creator_id], "Встреча", starts_at + creator_id * HOUR,
+                                               30, [starts_at])
+
+    shards = [repository.select_due_reminders(0, starts_at, shard=(index, 3)) for index in range(3)]
+
+    # Напоминание рассылает процесс, получающий обновления создателя события
+    for index, reminders in enumerate(shards):
+        assert all(supervisor.shard_of(reminder.creator_id, 3) == index for reminder in reminders)
+    assert sorted(reminder.creator_id for reminders in shards for reminder in reminders) == [1, 2, 3, 4]
+
+
+def test_dead_worker_is_restarted(supervisor, monkeypatch):
+    monkeypatch.setattr(supervisor, 'WORKER_CHECK_INTERVAL_SECONDS', 0.01)
+    workers = supervisor.Supervisor(2)
+    spawned = []
+
+    def spawn(index):
+        spawned.append(index)
+        workers._processes[index] = FakeProcess()
+
+    monkeypatch.setattr(workers, '_spawn', spawn)
+    workers._processes = [FakeProcess(), FakeProcess(alive=False)]
+    workers._monitor.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not spawned and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        workers.stop()
+
+    assert spawned == [1]
+    assert all(process.is_alive() for process in workers._processes)
@@ -0,0 +1,91 @@
+import html
+import io
+
+import pytest
+
+import repository
+from repository import repo
+from timezones import now_ts
+from transfer import export_csv, export_ics, import_events, iter_events, parse_csv, parse_ics
+
+HOUR = 3600
+
+
+@pytest.fixture
+def starts_at():
+    return (now_ts() // HOUR + 48) * HOUR
+
+
+def snapshot():
+    """События без event_id: после импорта ID назначаются заново."""
+    return [event[1:] for event in iter_events()]
+
+
+def delete_all_events():
+    for event in list(iter_events()):
+        repository.delete_event_with_reminders(event[0])
+
+
+@pytest.mark.parametrize("export, parse", [(export_csv, parse_csv), (export_ics, parse_ics)])
+def test_export_import_round_trip(users, starts_at, export, parse):
+    # Спецсимволы CSV, iCalendar и HTML и строка длиннее лимита строки iCalendar
+    description = "Обсуждение <плана>; бюджет, \"итоги\" & планы\nвторая строка" + " длинное описание" * 5
+    # Бот хранит описания с экранированием HTML
+    repository.create_event_with_reminders(1, [3, 2], html.escape(description), starts_at, 45,
+                                           [starts_at - HOUR, starts_at - 15 * 60])
+    repository.create_event_with_reminders(2, [1], "Созвон", starts_at + 2 * HOUR, 30, [starts_at])
+    before = snapshot()
+    out = io.StringIO(newline='')
+    assert export(out) == 2
+
+    delete_all_events()
+    stats = import_events(parse(io.StringIO(out.getvalue(), newline='')))
+
+    assert stats == {'imported': 2, 'reminders': 3, 'conflicts': 0, 'unknown_users': 0, 'invalid': 0}
+    assert snapshot() == before
+    assert before[0][2] == description
+
+
+def test_import_rejects_overlaps_within_batch(users, starts_at):
+    records = [
+        (1, (2,), "Первое", starts_at, 60, []),
+        # Участник 2 занят первым событием того же пакета
+        (3, (2,), "Пересекается", starts_at + 30 * 60, 60, []),
+        (3, (2,), "Следом", starts_at + HOUR, 60, []),
+        (2, (1, 3), "Занят создатель", starts_at + 90 * 60, 60, []),
+    ]
+
+    stats = import_events(records, batch_size=10)
+
+    assert (stats['imported'], stats['conflicts']) == (2, 2)
+    assert [event[3] for event in iter_events()] == ["Первое", "Следом"]
+
+
+def test_import_checks_existing_events_and_users(users, starts_at):
+    repository.create_event_with_reminders(1, [2], "Существующее", starts_at, 60, [])
+    records = [
+        (3, (2,), "Пересекается", starts_at, 60, []),
+        (3, (99,), "Неизвестный участник", starts_at, 60, []),
+        None,
+    ]
+
+    stats = import_events(records)
+
+    assert stats == {'imported': 0, 'reminders': 0, 'conflicts': 1, 'unknown_users': 1, 'invalid': 1}
+
+
+def test_imported_ids_follow_deleted_events(users, starts_at):
+    first = repository.create_event_with_reminders(1, [2], "Первое", starts_at, 60, [])
+    second = repository.create_event_with_reminders(1, [2], "Второе", starts_at + 2 * HOUR, 60, [])
+    repository.delete_event_with_reminders(second)
+
+    import_events([(1, (3,), "Импорт", starts_at + 4 * HOUR, 60, None),
+                   (3, (2,), "Импорт", starts_at + 6 * HOUR, 60, None)], batch_size=1)
+    created = repository.create_event_with_reminders(2, [1], "После импорта", starts_at + 8 * HOUR, 60, [])
+
+    # ID удалённого события не выдаётся повторно ни импортом, ни созданием через бота
+    event_ids = [event[0] for event in iter_events()]
+    assert event_ids == [first, second + 1, second + 2, second + 3]
+    assert created == second + 3
+    # Стандартные напоминания созданы для импортированных событий
+    assert repo.get_reminders([second + 1])[second + 1]
@@ -0,0 +1,74 @@
+import http.client
+import json
+import threading
+
+import pytest
+
+from webhook import MAX_BODY_BYTES, WebhookServer
+
+SECRET = "s3cret"
+
+
+@pytest.fixture(scope="module")
+def webhook_server():
+    """Webhook-сервер на свободном порту; принятые обновления складываются в server.updates."""
+    updates = []
+    webhook = WebhookServer(lambda update: updates.append(update) or True, "127.0.0.1", 0, "/webhook",
+                            secret_token=SECRET)
+    webhook.updates = updates
+    thread = threading.Thread(target=webhook.serve_forever, daemon=True)
+    thread.start()
+    yield webhook
+    webhook.shutdown()
+    thread.join()
+
+
+@pytest.fixture
+def server(webhook_server):
+    webhook_server.updates.clear()
+    return webhook_server
+
+
+def post(server, body, headers=None, secret=SECRET):
+    conn = http.client.HTTPConnection(*server._server.server_address[:2], timeout=5)
+    headers = dict(headers or {})
+    if secret is not None:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+    if 'Content-Length' not in headers:
+        headers['Content-Length'] = str(len(body))
+    try:
+        conn.putrequest("POST", "/webhook", skip_accept_encoding=True)
+        for name, value in headers.items():
+            conn.putheader(name, value)
+        conn.endheaders(body)
+        return conn.getresponse().status
+    finally:
+        conn.close()
+
+
+def test_update_is_accepted(server):
+    assert post(server, json.dumps({'update_id': 1}).encode()) == 200
+    assert server.updates == [{'update_id': 1}]
+
+
+@pytest.mark.parametrize('secret', [None, "", "s3cre", "s3cret!", "sécret"])
+def test_wrong_secret_is_rejected(server, secret):
+    assert post(server, b'{"update_id": 1}', secret=secret) == 403
+    assert server.updates == []
+
+
+@pytest.mark.parametrize('length', ["abc", "-1", "1.5"])
+def test_bad_content_length_is_rejected(server, length):
+    assert post(server, b'{"update_id": 1}', {'Content-Length': length}) == 400
+    assert server.updates == []
+
+
+def test_oversized_body_is_not_read(server):
+    assert post(server, b'{}', {'Content-Length': str(MAX_BODY_BYTES + 1)}) == 413
+    assert server.updates == []
+
+
+@pytest.mark.parametrize('body', [b'not json', b'[1, 2]'])
+def test_malformed_update_is_rejected(server, body):
+    assert post(server, body) == 400
+    assert server.updates == []
@@ -0,0 +1,58 @@
+import time
+from datetime import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# ==============================
+# Время событий и часовые пояса
+# ==============================
+# В базе данных моменты времени хранятся целым числом секунд от 1970-01-01 UTC, поэтому
+# сравнения и выборки по диапазону не зависят от часового пояса сервера. В местное время
+# пользователя (users.timezone) время переводится только при вводе и выводе.
+
+# Часовой пояс пользователей, не выбравших свой, и всех событий, созданных до миграции 7
+DEFAULT_TIMEZONE = 'Europe/Moscow'
+# Формат ввода и вывода даты и времени
+DATETIME_FORMAT = '%d.%m.%Y %H:%M'
+
+
+@lru_cache(maxsize=None)
+def get_zone(name):
+    """Возвращает ZoneInfo по имени часового пояса IANA (например, Europe/Moscow)."""
+    return ZoneInfo(name)
+
+
+def is_valid_timezone(name):
+    """Проверяет, что name — известное имя часового пояса IANA."""
+    try:
+        get_zone(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def now_ts():
+    """Текущий момент в секундах UTC."""
+    return int(time.time())
+
+
+def local_to_ts(local_datetime, timezone_name):
+    """Переводит наивное местное время пояса timezone_name в секунды UTC."""
+    return int(local_datetime.replace(tzinfo=get_zone(timezone_name)).timestamp())
+
+
+def ts_to_local(ts, timezone_name):
+    """Переводит секунды UTC в местное время пояса timezone_name (datetime с tzinfo)."""
+    return datetime.fromtimestamp(ts, get_zone(timezone_name))
+
+
+def format_ts(ts, timezone_name, fmt=DATETIME_FORMAT):
+    """Форматирует момент ts как местное время пояса timezone_name."""
+    return ts_to_local(ts, timezone_name).strftime(fmt)
+
+
+def iso_local_to_ts(text, timezone_name):
+    """Переводит наивную строку ISO 8601 в секунды UTC (для переноса данных в миграциях); None остаётся None."""
+    if text is None:
+        return None
+    return local_to_ts(datetime.fromisoformat(text), timezone_name)
@@ -0,0 +1,371 @@
+import argparse
+import csv
+import html
+import itertools
+import logging
+import re
+import sys
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from database import init_database, transaction
+from migrations import apply_migrations
+from repository import (DEFAULT_EVENT_DURATION_MINUTES, MAX_EVENT_DURATION_MINUTES, MAX_EVENT_PARTICIPANTS,
+                        repo, select_events_with_reminders, select_conflicting_event,
+                        select_last_event_id_assigned, select_users_fnu, insert_events_many, insert_reminders_many,
+                        standard_reminder_times)
+from timezones import DEFAULT_TIMEZONE, is_valid_timezone, local_to_ts, now_ts
+
+# ==============================
+# Импорт и экспорт событий (CSV и iCalendar)
+# ==============================
+# Экспорт читает события пачками через fetchmany, импорт пишет их пачками через
+# executemany, поэтому расход памяти не зависит от количества событий.
+#
+#   python transfer.py export events.csv
+#   python transfer.py export events.ics
+#   python transfer.py import events.csv
+#
+# Описания в базе хранятся с экранированием HTML; в файлах они записываются как обычный текст.
+# Участники события записываются в CSV в колонку participant_id через ";" в порядке выбора,
+# в iCalendar — отдельными строками X-BOT-PARTICIPANT-ID.
+# Время экспортируется в UTC (в CSV — ISO 8601 со смещением +00:00, в iCalendar — с суффиксом Z);
+# время без часового пояса в импортируемом файле считается местным временем пояса --timezone.
+
+# Количество событий в одной транзакции импорта
+IMPORT_BATCH_SIZE = 1000
+# Количество строк, читаемых из базы за одно обращение при экспорте
+EXPORT_BATCH_SIZE = 1000
+
+CSV_FIELDS = ['event_id', 'creator_id', 'participant_id', 'description', 'event_datetime', 'duration_minutes',
+              'reminders']
+# Разделитель моментов напоминаний в колонке reminders
+REMINDERS_SEPARATOR = ';'
+# Разделитель участников в колонке participant_id
+PARTICIPANTS_SEPARATOR = ';'
+
+ICS_PRODID = "-//Calendar Bot//Events export//RU"
+ICS_DATETIME_FORMAT = "%Y%m%dT%H%M%S"
+# Максимальная длина строки iCalendar в байтах (RFC 5545, 3.1)
+ICS_LINE_LIMIT = 75
+_ICS_DURATION = re.compile(r"^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+
+
+# ==============================
+# Экспорт
+# ==============================
+
+def _utc(ts):
+    return datetime.fromtimestamp(ts, timezone.utc)
+
+
+def iter_events():
+    """
+    Выдаёт события с напоминаниями: (event_id, creator_id, [участники], описание, начало,
+    длительность, [напоминания]). Участники загружаются одним запросом на пачку событий.
+    """
+    events = itertools.groupby(select_events_with_reminders(EXPORT_BATCH_SIZE), key=lambda row: row[0])
+    while True:
+        # Строки одного события: по одной на напоминание
+        batch = [list(rows) for _, rows in itertools.islice(events, EXPORT_BATCH_SIZE)]
+        if not batch:
+            return
+        participants = repo.get_participants([rows[0][0] for rows in batch])
+        for rows in batch:
+            event_id, creator_id, participant_id, description, starts_at, duration_minutes, _ = rows[0]
+            reminders = [row[6] for row in rows if row[6] is not None]
+            yield (event_id, creator_id, participants.get(event_id, [participant_id]), html.unescape(description),
+                   starts_at, duration_minutes, reminders)
+
+
+def export_csv(out):
+    """Записывает все события в CSV и возвращает их количество."""
+    writer = csv.writer(out)
+    writer.writerow(CSV_FIELDS)
+    count = 0
+    for event_id, creator_id, participant_ids, description, starts_at, duration_minutes, reminders in iter_events():
+        writer.writerow([event_id, creator_id, PARTICIPANTS_SEPARATOR.join(map(str, participant_ids)), description,
+                         _utc(starts_at).isoformat(),
+                         duration_minutes, REMINDERS_SEPARATOR.join(_utc(r).isoformat() for r in reminders)])
+        count += 1
+    return count
+
+
+def _ics_escape(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _ics_unescape(text):
+    return re.sub(r"\\([\\;,nN])", lambda m: '\n' if m.group(1) in 'nN' else m.group(1), text)
+
+
+def _ics_line(line):
+    """Переносит строку iCalendar так, чтобы каждая часть занимала не более ICS_LINE_LIMIT байт."""
+    if len(line) * 4 <= ICS_LINE_LIMIT or len(line.encode('utf-8')) <= ICS_LINE_LIMIT:
+        return line + '\r\n'
+    parts, current, size = [], '', 0
+    for char in line:
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > ICS_LINE_LIMIT:
+            parts.append(current)
+            current, size = ' ', 1
+        current += char
+        size += char_size
+    parts.append(current)
+    return '\r\n'.join(parts) + '\r\n'
+
+
+def export_ics(out):
+    """
+    Записывает все события в формате iCalendar и возвращает их количество. Время записывается
+    в UTC, напоминания — компонентами VALARM относительно начала.
+    """
+    stamp = datetime.now(timezone.utc).strftime(ICS_DATETIME_FORMAT) + 'Z'
+    out.write(_ics_line("BEGIN:VCALENDAR") + _ics_line("VERSION:2.0") + _ics_line(f"PRODID:{ICS_PRODID}"))
+    count = 0
+    for event_id, creator_id, participant_ids, description, starts_at, duration_minutes, reminders in iter_events():
+        lines = [
+            "BEGIN:VEVENT",
+            f"UID:event-{event_id}@calendar-bot",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{_utc(starts_at).strftime(ICS_DATETIME_FORMAT)}Z",
+            f"DURATION:PT{duration_minutes}M",
+            f"SUMMARY:{_ics_escape(description)}",
+            f"X-BOT-CREATOR-ID:{creator_id}",
+        ]
+        lines += [f"X-BOT-PARTICIPANT-ID:{participant_id}" for participant_id in participant_ids]
+        for remind_at in reminders:
+            minutes_before = (starts_at - remind_at) // 60
+            lines += ["BEGIN:VALARM", "ACTION:DISPLAY", f"DESCRIPTION:{_ics_escape(description)}",
+                      f"TRIGGER:-PT{minutes_before}M", "END:VALARM"]
+        lines.append("END:VEVENT")
+        out.write(''.join(_ics_line(line) for line in lines))
+        count += 1
+    out.write(_ics_line("END:VCALENDAR"))
+    return count
+
+
+# ==============================
+# Импорт
+# ==============================
+# Разборщики выдают записи (creator_id, (участники), описание, начало, длительность,
+# напоминания или None) либо None для строки, которую не удалось разобрать. Начало и
+# напоминания — секунды UTC.
+
+def _parse_iso(text, timezone_name):
+    """Переводит строку ISO 8601 в секунды UTC; время без смещения — местное время пояса timezone_name."""
+    value = datetime.fromisoformat(text)
+    if value.tzinfo is None:
+        return local_to_ts(value, timezone_name)
+    return int(value.timestamp())
+
+
+def _make_record(creator_id, participant_ids, description, starts_at, duration_minutes, reminders):
+    participant_ids = tuple(dict.fromkeys(int(participant_id) for participant_id in participant_ids))
+    if not participant_ids:
+        raise ValueError("не указаны участники")
+    if len(participant_ids) > MAX_EVENT_PARTICIPANTS:
+        raise ValueError(f"участников больше {MAX_EVENT_PARTICIPANTS}")
+    if not description.strip():
+        raise ValueError("пустое описание")
+    if not 0 < duration_minutes <= MAX_EVENT_DURATION_MINUTES:
+        raise ValueError(f"длительность должна быть от 1 до {MAX_EVENT_DURATION_MINUTES} минут")
+    return (int(creator_id), participant_ids, html.escape(description.strip()), starts_at,
+            duration_minutes, reminders)
+
+
+def parse_csv(source, timezone_name=DEFAULT_TIMEZONE):
+    """Разбирает CSV в формате export_csv; колонки event_id, duration_minutes и reminders необязательны."""
+    for line_number, row in enumerate(csv.DictReader(source), start=2):
+        try:
+            reminders = row.get('reminders')
+            yield _make_record(
+                row['creator_id'], [p for p in row['participant_id'].split(PARTICIPANTS_SEPARATOR) if p.strip()],
+                row['description'] or '',
+                _parse_iso(row['event_datetime'], timezone_name),
+                int(row.get('duration_minutes') or DEFAULT_EVENT_DURATION_MINUTES),
+                [_parse_iso(r, timezone_name) for r in reminders.split(REMINDERS_SEPARATOR) if r] if reminders else None
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning(f"Строка {line_number}: пропущена ({e}).")
+            yield None
+
+
+def _ics_lines(source):
+    """Выдаёт логические строки iCalendar, склеивая перенесённые продолжения."""
+    pending = None
+    for raw in source:
+        raw = raw.rstrip('\r\n')
+        if raw[:1] in (' ', '\t') and pending is not None:
+            pending += raw[1:]
+            continue
+        if pending is not None:
+            yield pending
+        pending = raw
+    if pending:
+        yield pending
+
+
+def _ics_duration(value):
+    match = _ICS_DURATION.match(value)
+    if not match:
+        raise ValueError(f"неверная длительность {value!r}")
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                         minutes=int(minutes or 0), seconds=int(seconds or 0))
+    return -duration if sign == '-' else duration
+
+
+def _ics_datetime(value, params, timezone_name):
+    """
+    Переводит DATE-TIME iCalendar в секунды UTC: с суффиксом Z — UTC, с параметром TZID — время
+    этого пояса, без них — местное время пояса timezone_name.
+    """
+    if value.endswith('Z'):
+        return int(datetime.strptime(value[:-1], ICS_DATETIME_FORMAT).replace(tzinfo=timezone.utc).timestamp())
+    tzid = params.get('TZID', timezone_name)
+    if not is_valid_timezone(tzid):
+        raise ValueError(f"неизвестный часовой пояс {tzid!r}")
+    return local_to_ts(datetime.strptime(value, ICS_DATETIME_FORMAT), tzid)
+
+
+def _ics_record(properties, params, triggers, participant_ids, timezone_name):
+    start = _ics_datetime(properties['DTSTART'], params.get('DTSTART', {}), timezone_name)
+    if 'DURATION' in properties:
+        duration_seconds = int(_ics_duration(properties['DURATION']).total_seconds())
+    elif 'DTEND' in properties:
+        duration_seconds = _ics_datetime(properties['DTEND'], params.get('DTEND', {}), timezone_name) - start
+    else:
+        duration_seconds = DEFAULT_EVENT_DURATION_MINUTES * 60
+    reminders = [start + int(_ics_duration(trigger).total_seconds()) for trigger in triggers] if triggers else None
+    return _make_record(properties['X-BOT-CREATOR-ID'], participant_ids,
+                        _ics_unescape(properties.get('SUMMARY', '')), start,
+                        duration_seconds // 60, reminders)
+
+
+def parse_ics(source, timezone_name=DEFAULT_TIMEZONE):
+    """Разбирает iCalendar в формате export_ics: события без X-BOT-CREATOR-ID и X-BOT-PARTICIPANT-ID пропускаются."""
+    properties, params, triggers, participant_ids, in_event, in_alarm = {}, {}, [], [], False, False
+    for line in _ics_lines(source):
+        name, _, value = line.partition(':')
+        name, *raw_params = name.split(';')
+        name = name.upper()
+        if name == 'BEGIN' and value == 'VEVENT':
+            properties, params, triggers, participant_ids, in_event = {}, {}, [], [], True
+        elif name == 'BEGIN' and value == 'VALARM':
+            in_alarm = True
+        elif name == 'END' and value == 'VALARM':
+            in_alarm = False
+        elif name == 'END' and value == 'VEVENT':
+            in_event = False
+            try:
+                yield _ics_record(properties, params, triggers, participant_ids, timezone_name)
+            except (KeyError, ValueError) as e:
+                logging.warning(f"Событие {properties.get('UID', '?')}: пропущено ({e}).")
+                yield None
+        elif in_alarm and name == 'TRIGGER':
+            triggers.append(value)
+        elif in_event and name == 'X-BOT-PARTICIPANT-ID':
+            # Единственное повторяющееся свойство: по строке на участника
+            participant_ids.append(value)
+        elif in_event and not in_alarm:
+            properties[name] = value
+            if raw_params:
+                params[name] = dict(param.partition('=')[::2] for param in raw_params)
+
+
+def _overlaps(intervals, start, end):
+    return any(other_start < end and start < other_end for other_start, other_end in intervals)
+
+
+def import_events(records, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Записывает события и их напоминания пачками по batch_size, каждая пачка — одна транзакция.
+    События неизвестных пользователей и пересекающиеся с уже существующими пропускаются.
+    Если у события не указаны напоминания, создаются стандартные. Возвращает счётчики.
+    """
+    stats = {'imported': 0, 'reminders': 0, 'conflicts': 0, 'unknown_users': 0, 'invalid': 0}
+    now = now_ts()
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return stats
+        valid = [record for record in batch if record is not None]
+        stats['invalid'] += len(batch) - len(valid)
+
+        with transaction():
+            user_ids = {user_id for record in valid for user_id in (record[0], *record[1])}
+            known_users = {row[0] for row in select_users_fnu(user_ids)}
+            # Явные ID назначаются внутри IMMEDIATE-транзакции, поэтому не пересекаются с чужими вставками.
+            # Отсчёт идёт от счётчика AUTOINCREMENT, а не от MAX(event_id): ID удалённых событий
+            # не выдаются повторно, и кнопки и напоминания старых событий не указывают на новые.
+            next_event_id = select_last_event_id_assigned()
+            # Пересечения внутри пачки проверяются в памяти: её события ещё не записаны
+            batch_intervals = defaultdict(list)
+            events, reminders = [], []
+            for creator_id, participant_ids, description, starts_at, duration_minutes, remind_ats in valid:
+                members = (creator_id, *participant_ids)
+                if not known_users.issuperset(members):
+                    stats['unknown_users'] += 1
+                    continue
+                ends_at = starts_at + duration_minutes * 60
+                if any(_overlaps(batch_intervals[user_id], starts_at, ends_at) for user_id in members) or \
+                        select_conflicting_event(members, starts_at, duration_minutes):
+                    stats['conflicts'] += 1
+                    continue
+                next_event_id += 1
+                events.append((next_event_id, creator_id, participant_ids, description, starts_at,
+                               duration_minutes))
+                for user_id in set(members):
+                    batch_intervals[user_id].append((starts_at, ends_at))
+                if remind_ats is None:
+                    remind_ats = standard_reminder_times(starts_at)
+                reminders.extend((next_event_id, t) for t in remind_ats if t > now)
+            insert_events_many(events)
+            insert_reminders_many(reminders)
+        stats['imported'] += len(events)
+        stats['reminders'] += len(reminders)
+        logging.info(f"Импортировано событий: {stats['imported']}")
+
+
+def _detect_format(path, fmt):
+    if fmt:
+        return fmt
+    return 'ics' if path.lower().endswith(('.ics', '.ical')) else 'csv'
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    parser = argparse.ArgumentParser(description="Импорт и экспорт событий бота в CSV и iCalendar.")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="Файл для экспорта или импорта ('-' — стандартный вывод или ввод)")
+    parser.add_argument("--format", choices=["csv", "ics"], help="Формат файла (по умолчанию — по расширению)")
+    parser.add_argument("--database", default="bot_database.db", help="Путь к файлу базы данных")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE,
+                        help="Количество событий в одной транзакции импорта")
+    parser.add_argument("--timezone", default=DEFAULT_TIMEZONE,
+                        help="Часовой пояс для времени без смещения в импортируемом файле")
+    args = parser.parse_args()
+    if not is_valid_timezone(args.timezone):
+        parser.error(f"неизвестный часовой пояс {args.timezone}")
+
+    init_database(args.database)
+    apply_migrations()
+    file_format = _detect_format(args.path, args.format)
+
+    if args.command == "export":
+        # newline='' — CSV и iCalendar сами задают окончания строк
+        out = sys.stdout if args.path == '-' else open(args.path, 'w', encoding='utf-8', newline='')
+        with out:
+            exported = export_ics(out) if file_format == 'ics' else export_csv(out)
+        logging.info(f"Экспортировано событий: {exported}")
+    else:
+        source = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8', newline='')
+        with source:
+            records = parse_ics(source, args.timezone) if file_format == 'ics' else parse_csv(source, args.timezone)
+            result = import_events(records, args.batch_size)
+        logging.info(
+            f"Импорт завершён: событий {result['imported']}, напоминаний {result['reminders']}, "
+            f"пересечений {result['conflicts']}, неизвестных пользователей {result['unknown_users']}, "
+            f"ошибок разбора {result['invalid']}.")
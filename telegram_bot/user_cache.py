@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import observe_user_cache_lookups
+
+# ==============================
+# Кэш данных пользователей
+# ==============================
+
+# Сколько пользователей хранится в кэше и как долго запись считается актуальной
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL_SECONDS = 600
+
+
+class UserCache:
+    """
+    LRU-кэш данных пользователей (first_name, last_name, username, timezone) по user_id.
+
+    Промахи догружаются из базы данных одним запросом на весь набор идентификаторов.
+    Записи устаревают через ttl секунд, поэтому изменения, сделанные другим процессом,
+    видны не позже чем через ttl. Отсутствующие в базе пользователи не кэшируются.
+    """
+
+    def __init__(self, loader, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS):
+        self._loader = loader  # Принимает список user_id, возвращает строки (user_id, first_name, last_name, username, timezone)
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()  # user_id -> (момент устаревания, (first_name, last_name, username, timezone))
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Возвращает (first_name, last_name, username, timezone) пользователя или None."""
+        return self.get_many([user_id]).get(user_id)
+
+    def get_many(self, user_ids):
+        """Возвращает словарь user_id -> (first_name, last_name, username, timezone), догружая промахи одним запросом."""
+        found, missing = self.lookup(user_ids)
+        if missing:
+            rows = self._loader(missing)
+            self.put_many(rows)
+            for user_id, *profile in rows:
+                found[user_id] = tuple(profile)
+        return found
+
+    def lookup(self, user_ids):
+        """Ищет пользователей только в кэше и возвращает (найденные, список отсутствующих user_id)."""
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for user_id in dict.fromkeys(user_ids):
+                entry = self._entries.get(user_id)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(user_id)
+                    found[user_id] = entry[1]
+                else:
+                    missing.append(user_id)
+        # Доля попаданий видна в метрике bot_user_cache_lookups_total
+        observe_user_cache_lookups(len(found), len(missing))
+        return found, missing
+
+    def put_many(self, rows):
+        """Кладёт в кэш строки (user_id, first_name, last_name, username, timezone)."""
+        expires = time.monotonic() + self._ttl
+        with self._lock:
+            for user_id, *profile in rows:
+                self._entries[user_id] = (expires, tuple(profile))
+                self._entries.move_to_end(user_id)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Удаляет пользователя из кэша, например после изменения его профиля."""
+        with self._lock:
+            self._entries.pop(user_id, None)
@@ -1,112 +1,280 @@
-import html
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 
 from telebot import types
 
 from app import *
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
 from apscheduler.triggers.date import DateTrigger
-from telebot.apihelper import ApiException
+from apscheduler.triggers.interval import IntervalTrigger
+from deliveries import DeliveryLedger
+from dispatcher import ReminderDispatcher
+from lease import Lease
+from metrics import observe_reminder_lateness, set_queue_depth_function
+from outbound import MessageCancelled, OutboundQueue, PRIORITY_INTERACTIVE, PRIORITY_REMINDER
+from rendering import *
+from timezones import DEFAULT_TIMEZONE, format_ts, is_valid_timezone, now_ts
 # ==============================
 # Функции-утилиты
 # ==============================
+# Функции синхронного варианта бота (main.py), работающие с его очередью сообщений,
+# кэшами и планировщиком; формирование сообщений и клавиатур — в rendering.py.
 
-def escape_html_text(text):
-    """Экранирует специальные символы HTML."""
-    return html.escape(text)
+# Префикс ID задач планировщика, рассылающих напоминания; за ним следует срок в секундах UTC
+REMINDER_JOB_PREFIX = 'reminders_'
+# Задача владельца аренды в режиме scheduler, добавляющая задачи для напоминаний других реплик
+REMINDER_SYNC_JOB_ID = 'reminder_sync'
+REMINDER_SYNC_SECONDS = 60
+# Повторный проход догоняющей рассылки, когда незавершённые доставки прежнего владельца аренды
+# становятся брошенными (REMINDER_PENDING_RETRY_SECONDS после получения аренды)
+REMINDER_CATCHUP_JOB_ID = 'reminder_catchup'
+
+
+# Все исходящие сообщения проходят через общую очередь с учётом лимитов Telegram
+outbound_queue = OutboundQueue(bot, global_rate=OUTBOUND_GLOBAL_RATE, chat_rate=OUTBOUND_CHAT_RATE)
+set_queue_depth_function('outbound', outbound_queue.depth)
+set_queue_depth_function('scheduler_jobs', lambda: len(scheduler.get_jobs()))
+
+
+def send_message(chat_id, text, priority=PRIORITY_INTERACTIVE, wait=False, **kwargs):
+    """
+    Отправляет сообщение через очередь исходящих сообщений с учётом лимитов Telegram.
+    Обработчик не ждёт отправки: сообщения одного чата уходят по порядку, а ошибку отправки
+    очередь записывает в лог. wait=True дожидается отправки и возвращает сообщение Telegram.
+    """
+    return outbound_queue.send_message(chat_id, text, priority, wait, **kwargs)
+
+
+def user_timezone(user_id):
+    """Возвращает часовой пояс пользователя, используя кэш пользователей."""
+    return profile_timezone(user_cache.get(user_id))
+
+
+def user_search_prefix(user_id, screen_state):
+    """Возвращает поисковый запрос, введённый пользователем на экране screen_state, или None."""
+    return search_prefix(user_states.get(user_id, {}), screen_state)
 
 
 def schedule_notifications(event_id):
     """Планирует все напоминания для события."""
-    cursor.execute("SELECT creator_id, participant_id, description, event_datetime FROM events WHERE event_id=?",
-                   (event_id,))
-    event = cursor.fetchone()
+    event = repo.get_event(event_id)
     if not event:
         logging.error(f"Событие с ID {event_id} не найдено.")
         return
-    creator_id, participant_id, description, event_datetime_str = event
-    event_datetime = datetime.fromisoformat(event_datetime_str)
 
     # Получение всех напоминаний для события
-    cursor.execute("SELECT reminder_time FROM reminders WHERE event_id=?", (event_id,))
-    reminders = cursor.fetchall()
+    reminders = repo.get_reminders([event_id]).get(event_id, [])
 
+    now = now_ts()
     for reminder in reminders:
-        reminder_time_str = reminder[0]
-        reminder_time = datetime.fromisoformat(reminder_time_str)
-        if reminder_time > datetime.now():
-            job_id = f"reminder_{event_id}_{reminder_time.timestamp()}"
-            if not scheduler.get_job(job_id):
-                scheduler.add_job(
-                    send_reminder,
-                    trigger=DateTrigger(run_date=reminder_time),
-                    args=[creator_id, participant_id, description, event_id, event_datetime_str],
-                    id=job_id,
-                    replace_existing=True
-                )
-                logging.info(f"Запланировано напоминание для события {event_id} на {reminder_time.isoformat()}.")
-
-
-def send_reminder(creator_id, participant_id, description, event_id, event_datetime_str):
-    """Отправляет напоминание о событии."""
+        if reminder.remind_at > now:
+            if REMINDER_MODE == REMINDER_MODE_DISPATCHER:
+                # Напоминание уже в таблице reminders, диспетчеру достаточно узнать его срок
+                reminder_dispatcher.notify(reminder.remind_at)
+                continue
+            if not reminder_lease.is_held():
+                # Задачу добавит владелец аренды при ближайшей синхронизации (sync_reminder_jobs)
+                continue
+            if schedule_reminder_job(reminder.remind_at):
+                logging.info(f"Запланирована рассылка напоминаний на {reminder.remind_at} (событие {event_id}).")
+
+
+def schedule_reminder_job(remind_at):
+    """
+    Добавляет задачу планировщика, рассылающую все напоминания со сроком remind_at, если её ещё нет.
+    Задача одна на момент срабатывания и хранит только его: данные событий читаются из базы
+    при срабатывании, поэтому удалённые и перенесённые напоминания отменять не нужно.
+    Возвращает True, если задача добавлена.
+    """
+    job_id = f"{REMINDER_JOB_PREFIX}{remind_at}"
+    if scheduler.get_job(job_id):
+        return False
+    scheduler.add_job(
+        send_due_reminders,
+        trigger=DateTrigger(run_date=datetime.fromtimestamp(remind_at, timezone.utc)),
+        args=[remind_at],
+        id=job_id,
+        replace_existing=True
+    )
+    return True
+
+
+def restore_reminder_jobs(after=None):
+    """
+    Восстанавливает задачи планировщика для всех напоминаний из таблицы reminders со сроком
+    позже after (по умолчанию — текущего момента).
+    При запуске бота вызывается до scheduler.start(): добавленные до запуска задачи
+    планировщик регистрирует одним проходом при старте, без пробуждения на каждую задачу.
+    """
+    restored = 0
+    for remind_at in select_pending_reminder_times(now_ts() if after is None else after, shard=REMINDER_SHARD):
+        schedule_reminder_job(remind_at)
+        restored += 1
+    logging.info(f"Восстановлено {restored} задач рассылки напоминаний.")
+    return restored
+
+
+def sync_reminder_jobs():
+    """
+    Задача владельца аренды: добавляет задачи для напоминаний ближайших двух интервалов
+    синхронизации, в том числе записанных другими репликами. Читается только начало индекса remind_at.
+    """
+    now = now_ts()
+    for remind_at in select_pending_reminder_times(now, shard=REMINDER_SHARD):
+        if remind_at > now + 2 * REMINDER_SYNC_SECONDS:
+            break
+        schedule_reminder_job(remind_at)
+
+
+def expand_series_occurrences():
+    """
+    Задача владельца аренды: создаёт вхождения повторяющихся событий, попавшие в горизонт
+    SERIES_HORIZON_DAYS, и планирует их напоминания.
+    """
     try:
-        # Получение информации о пользователях
-        cursor.execute("SELECT username FROM users WHERE user_id=?", (creator_id,))
-        creator = cursor.fetchone()
-        creator_username = f"@{escape_html_text(creator[0])}" if creator and creator[
-            0] != "No Username" else "No Username"
-
-        cursor.execute("SELECT username FROM users WHERE user_id=?", (participant_id,))
-        participant = cursor.fetchone()
-        participant_username = f"@{escape_html_text(participant[0])}" if participant and participant[
-            0] != "No Username" else "No Username"
-
-        # Формирование сообщения с никнеймами
-        reminder_text = (
-            f"⏰ Напоминание о событии:\n\n"
-            f"<b>Описание:</b> {escape_html_text(description)}\n"
-            f"<b>Дата и время:</b> {datetime.fromisoformat(event_datetime_str).strftime('%d.%m.%Y %H:%M')}\n"
-            f"<b>Создатель:</b> {creator_username}\n"
-            f"<b>Участник:</b> {participant_username}"
-        )
-        # Отправка напоминания создателю
-        bot.send_message(
-            creator_id,
-            reminder_text,
-            parse_mode="HTML",
-            disable_web_page_preview=True
-        )
-        logging.info(f"Отправлено напоминание создателю {creator_id} о событии {event_id}.")
-
-        # Отправка напоминания участнику
-        bot.send_message(
-            participant_id,
-            reminder_text,
-            parse_mode="HTML",
-            disable_web_page_preview=True
-        )
-        logging.info(f"Отправлено напоминание участнику {participant_id} о событии {event_id}.")
+        event_ids = expand_event_series(series_horizon())
     except Exception as e:
-        logging.error(f"Ошибка при отправке напоминания для события {event_id}: {e}")
+        logging.error(f"Ошибка при создании вхождений повторяющихся событий: {e}")
+        return
+    for event_id in event_ids:
+        schedule_notifications(event_id)
+    if event_ids:
+        logging.info(f"Создано {len(event_ids)} вхождений повторяющихся событий.")
 
 
-def main_menu_keyboard():
-    """Создаёт главное меню с inline-кнопками."""
-    markup = types.InlineKeyboardMarkup(row_width=1)
-    my_events_btn = types.InlineKeyboardButton("📅 Мои события", callback_data="my_events")
-    create_event_btn = types.InlineKeyboardButton("➕ Создать новое событие", callback_data="create_event")
-    list_users_btn = types.InlineKeyboardButton("👥 Просмотреть пользователей", callback_data="list_users")
-    markup.add(my_events_btn, create_event_btn, list_users_btn)
-    return markup
+def start_reminder_delivery():
+    """
+    Запускает рассылку напоминаний при получении аренды (см. lease.py): новые напоминания
+    рассылает диспетчер или планировщик, а пропущенные за время простоя — догоняющая
+    рассылка в отдельном потоке, чтобы не задерживать продление аренды. Доставки, которые
+    прежний владелец начал незадолго до потери аренды, подбирает второй проход через
+    REMINDER_PENDING_RETRY_SECONDS.
+    """
+    now = now_ts()
+    if REMINDER_MODE == REMINDER_MODE_DISPATCHER:
+        reminder_dispatcher.start(now)
+    else:
+        restore_reminder_jobs(now)
+        scheduler.add_job(sync_reminder_jobs, trigger=IntervalTrigger(seconds=REMINDER_SYNC_SECONDS),
+                          id=REMINDER_SYNC_JOB_ID, replace_existing=True)
+    # Вхождения серий, горизонт которых сдвинулся, пока аренда была у другой реплики, создаются сразу
+    scheduler.add_job(expand_series_occurrences, trigger=IntervalTrigger(seconds=SERIES_EXPANSION_SECONDS),
+                      id=SERIES_EXPANSION_JOB_ID, replace_existing=True,
+                      next_run_time=datetime.now(timezone.utc))
+    threading.Thread(target=catch_up_reminders, args=(now,), name="reminder-catchup", daemon=True).start()
+    scheduler.add_job(catch_up_reminders, trigger=DateTrigger(
+                          run_date=datetime.fromtimestamp(now + REMINDER_PENDING_RETRY_SECONDS, timezone.utc)),
+                      args=[now], id=REMINDER_CATCHUP_JOB_ID, replace_existing=True)
 
 
-def back_to_main_menu_keyboard():
-    """Создаёт кнопку для возврата в главное меню."""
-    markup = types.InlineKeyboardMarkup(row_width=1)
-    main_menu_btn = types.InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")
-    markup.add(main_menu_btn)
-    return markup
+def catch_up_reminders(until):
+    """
+    Рассылает напоминания со сроком за REMINDER_CATCHUP_SECONDS до момента until, которые
+    не были доставлены: бот был остановлен, прежний владелец аренды упал или Telegram не
+    принял сообщение. Журнал доставки пропускает уже доставленные. Интервал делится на
+    части, которые выбираются и отправляются параллельно REMINDER_CATCHUP_WORKERS потоками.
+    Напоминания о событиях, которые уже начались, не отправляются.
+    """
+    if REMINDER_CATCHUP_SECONDS <= 0:
+        return
+    since = until - REMINDER_CATCHUP_SECONDS
+    step = -(-REMINDER_CATCHUP_SECONDS // REMINDER_CATCHUP_WORKERS)
+    windows = [(start, min(start + step, until)) for start in range(since, until, step)]
 
+    def catch_up_window(window):
+        reminders = select_due_reminders(*window, shard=REMINDER_SHARD)
+        now = now_ts()
+        futures = send_reminders([r for r in reminders if r.starts_at > now], retry_pending=True)
+        wait(futures)
+        return len(futures)
+
+    try:
+        with ThreadPoolExecutor(max_workers=REMINDER_CATCHUP_WORKERS, thread_name_prefix="reminder-catchup") as pool:
+            sent = sum(pool.map(catch_up_window, windows))
+    except Exception as e:
+        logging.error(f"Ошибка догоняющей рассылки напоминаний: {e}")
+        return
+    if sent:
+        logging.info(f"Догоняющая рассылка отправила {sent} пропущенных сообщений напоминаний.")
+
+
+def stop_reminder_delivery():
+    """
+    Останавливает рассылку напоминаний при потере аренды. Напоминания, поставленные в очередь
+    исходящих сообщений, но ещё не отправленные, снимаются с неё: их доставки остаются
+    незавершёнными и достаются новому владельцу аренды.
+    """
+    for job_id in (SERIES_EXPANSION_JOB_ID, REMINDER_CATCHUP_JOB_ID):
+        if scheduler.get_job(job_id):
+            scheduler.remove_job(job_id)
+    if REMINDER_MODE == REMINDER_MODE_DISPATCHER:
+        reminder_dispatcher.stop()
+    else:
+        for job in scheduler.get_jobs():
+            if job.id.startswith(REMINDER_JOB_PREFIX) or job.id == REMINDER_SYNC_JOB_ID:
+                scheduler.remove_job(job.id)
+    cancelled = outbound_queue.cancel(PRIORITY_REMINDER)
+    if cancelled:
+        logging.warning(f"Снято с очереди {cancelled} сообщений напоминаний, их разошлёт новый владелец аренды.")
+
+
+def observe_reminder_job(event):
+    """Слушатель планировщика: записывает в метрики опоздание выполненной задачи напоминания."""
+    if event.job_id.startswith(REMINDER_JOB_PREFIX):
+        observe_reminder_lateness(event.scheduled_run_time.timestamp())
+
+
+scheduler.add_listener(observe_reminder_job, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
 
 
+def send_reminders(reminders, retry_pending=False):
+    """
+    Ставит в очередь исходящих сообщений напоминания пачки DueReminder создателям и участникам.
+    Отправляются только доставки, захваченные в журнале (deliveries.py): уже доставленные
+    повторно не отправляются. Возвращает список Future поставленных сообщений.
+    """
+    if not reminders:
+        return []
+    if not reminder_lease.is_held():
+        # Аренда истекла во время выборки: напоминания разошлёт новый владелец
+        logging.warning(f"Аренда рассылки потеряна, {len(reminders)} напоминаний оставлены новому владельцу.")
+        return []
+    try:
+        messages = render_reminder_messages(reminders)
+        claimed = delivery_ledger.claim([(reminder_id, chat_id) for reminder_id, chat_id, _ in messages],
+                                        retry_pending)
+        messages = claimed_reminder_messages(messages, claimed)
+        # Напоминания ставятся в очередь одной пачкой и без ожидания отправки
+        futures = outbound_queue.send_messages([(chat_id, text) for _, chat_id, text in messages], PRIORITY_REMINDER,
+                                               parse_mode="HTML", disable_web_page_preview=True)
+        for (reminder_id, chat_id, _), future in zip(messages, futures):
+            future.add_done_callback(lambda f, key=(reminder_id, chat_id): record_delivery(f, *key))
+        logging.info(f"Поставлено в очередь {len(messages)} сообщений по {len(reminders)} напоминаниям.")
+        return futures
+    except Exception as e:
+        logging.error(f"Ошибка при отправке {len(reminders)} напоминаний: {e}")
+        return []
+
+
+def record_delivery(future, reminder_id, chat_id):
+    """Записывает в журнал результат отправки напоминания; снятое с очереди остаётся незавершённым."""
+    if not isinstance(future.exception(), MessageCancelled):
+        delivery_ledger.record(reminder_id, chat_id, future.exception() is None)
+
+
+def send_due_reminders(remind_at):
+    """Задача планировщика: рассылает все напоминания со сроком remind_at."""
+    try:
+        reminders = select_due_reminders(remind_at - 1, remind_at, shard=REMINDER_SHARD)
+    except Exception as e:
+        logging.error(f"Ошибка при выборке напоминаний на {remind_at}: {e}")
+        return
+    send_reminders(reminders)
 
 
+delivery_ledger = DeliveryLedger(pending_retry=REMINDER_PENDING_RETRY_SECONDS)
+# Используется только при REMINDER_MODE=dispatcher
+reminder_dispatcher = ReminderDispatcher(send_reminders, shard=REMINDER_SHARD)
+reminder_lease = Lease(REMINDER_LEASE_NAME, start_reminder_delivery, stop_reminder_delivery,
+                       ttl=REMINDER_LEASE_TTL_SECONDS, renew_interval=REMINDER_LEASE_RENEW_SECONDS)
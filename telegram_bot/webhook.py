@@ -0,0 +1,183 @@
+import hmac
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+# ==============================
+# Приём обновлений через webhook
+# ==============================
+
+# Количество потоков, обрабатывающих обновления
+WEBHOOK_WORKERS = 8
+# Сколько обновлений может ждать обработки в очереди одного потока
+WEBHOOK_QUEUE_SIZE = 1000
+# Максимальный размер тела запроса от Telegram
+MAX_BODY_BYTES = 1024 * 1024
+# Сколько секунд ждать данных от клиента, прежде чем закрыть соединение
+REQUEST_TIMEOUT_SECONDS = 10
+
+
+def _update_key(update):
+    """Возвращает идентификатор чата или пользователя, к которому относится обновление."""
+    for field in ('message', 'edited_message', 'callback_query', 'my_chat_member', 'inline_query'):
+        payload = update.get(field)
+        if not payload:
+            continue
+        chat = payload.get('chat') or (payload.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        if payload.get('from'):
+            return payload['from']['id']
+    return update.get('update_id', 0)
+
+
+def register_webhook(bot, base_url, path, secret_token=None, max_connections=WEBHOOK_WORKERS * 5):
+    """Регистрирует webhook в Telegram; повторная регистрация того же адреса безопасна."""
+    url = base_url.rstrip('/') + path
+    bot.set_webhook(url=url, secret_token=secret_token, max_connections=max_connections)
+    logging.info(f"Webhook зарегистрирован: {url}")
+
+
+class UpdateQueues:
+    """
+    Рабочие потоки, обрабатывающие обновления Telegram обработчиками бота.
+
+    Обновления раскладываются по ограниченным очередям потоков по идентификатору чата:
+    обновления одного пользователя обрабатываются строго по порядку, а разные
+    пользователи — параллельно. Бот должен быть создан с threaded=False, иначе обработчики
+    уйдут в собственный пул потоков telebot в обход очередей.
+    """
+
+    def __init__(self, bot, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE, name="webhook-worker"):
+        self._bot = bot
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._workers = [
+            threading.Thread(target=self._work, args=(q,), name=f"{name}-{i}", daemon=True)
+            for i, q in enumerate(self._queues)
+        ]
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self):
+        """Дожидается обработки уже принятых обновлений и останавливает потоки."""
+        for q in self._queues:
+            q.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def depth(self):
+        """Возвращает количество обновлений, ожидающих обработки."""
+        return sum(q.qsize() for q in self._queues)
+
+    def enqueue(self, update, block=False):
+        """
+        Ставит обновление в очередь его чата. Без block возвращает False, если очередь
+        переполнена; с block ждёт свободного места.
+        """
+        q = self._queues[hash(_update_key(update)) % len(self._queues)]
+        try:
+            q.put(update, block=block)
+        except queue.Full:
+            logging.warning(f"Очередь обновлений переполнена, обновление {update.get('update_id')} отклонено.")
+            return False
+        return True
+
+    def _work(self, q):
+        while True:
+            update = q.get()
+            if update is None:
+                return
+            try:
+                self._bot.process_new_updates([types.Update.de_json(update)])
+            except Exception as e:
+                logging.error(f"Ошибка при обработке обновления {update.get('update_id')}: {e}")
+
+
+class WebhookServer:
+    """
+    HTTP-сервер, принимающий обновления Telegram и передающий их функции enqueue(update).
+
+    enqueue возвращает False, если обновление сейчас не может быть принято (очередь
+    переполнена): сервер отвечает 503, и Telegram повторит доставку позже. В одном
+    процессе это UpdateQueues.enqueue, в supervisor.py — передача процессу-обработчику.
+    """
+
+    def __init__(self, enqueue, host, port, path, secret_token=None):
+        self.enqueue = enqueue
+        self._path = path
+        self._secret_token = secret_token
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+
+    def serve_forever(self):
+        """Принимает запросы до вызова shutdown()."""
+        host, port = self._server.server_address[:2]
+        logging.info(f"Webhook-сервер слушает {host}:{port}{self._path}")
+        self._server.serve_forever()
+
+    def shutdown(self):
+        """Останавливает приём запросов."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Клиент, приславший меньше Content-Length байт, не занимает поток сервера дольше таймаута
+            timeout = REQUEST_TIMEOUT_SECONDS
+
+            def do_POST(self):
+                if self.path != server._path:
+                    self._reply(404)
+                    return
+                if server._secret_token and not self._secret_matches():
+                    self._reply(403)
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    self._reply(400)
+                    return
+                # Тело больше MAX_BODY_BYTES не читается: соединение закрывается вместе с ответом
+                if length > MAX_BODY_BYTES:
+                    self.close_connection = True
+                    self._reply(413)
+                    return
+                try:
+                    update = json.loads(self.rfile.read(length))
+                except ValueError:
+                    self._reply(400)
+                    return
+                if not isinstance(update, dict):
+                    self._reply(400)
+                    return
+                self._reply(200 if server.enqueue(update) else 503)
+
+            def _secret_matches(self):
+                # Сравнение за постоянное время не выдаёт по задержке ответа, сколько символов совпало
+                received = self.headers.get('X-Telegram-Bot-Api-Secret-Token') or ''
+                return hmac.compare_digest(received.encode(), server._secret_token.encode())
+
+            def do_GET(self):
+                # Проверка работоспособности для балансировщика нагрузки
+                self._reply(200 if self.path == '/health' else 404)
+
+            def _reply(self, status):
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                # Журнал каждого запроса не нужен: ошибки пишутся через logging
+                pass
+
+        return Handler